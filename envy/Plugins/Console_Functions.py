@@ -1,4 +1,6 @@
+import datetime
 import logging
+import uuid
 
 from envy.lib.core.console.core import Console
 from envy.lib.network import message as m
@@ -35,6 +37,92 @@ async def send_to_clients(console: Console, classifier: str, function_message: m
     console.send(message)
 
 
+async def list_archived_jobs(console: Console, limit: int = 50) -> None:
+    new_message = FunctionMessage('List archived jobs')
+    new_message.set_target(MessageTarget.SERVER)
+    new_message.set_function('list_archived_jobs')
+    new_message.format_arguments(console.name, limit=limit)
+    console.send(new_message)
+
+
+async def restore_archived_job(console: Console, job_id: int = None) -> None:
+    if not job_id:
+        job_id = int(await console.input('Which job:'))
+
+    new_message = FunctionMessage(f'Restore archived job: {job_id}')
+    new_message.set_target(MessageTarget.SERVER)
+    new_message.set_function('restore_archived_job')
+    new_message.format_arguments(console.name, job_id)
+    console.send(new_message)
+
+
+async def display_archived_jobs(console: Console, jobs: list) -> None:
+    if not jobs:
+        logger.info('Archive is empty')
+        return
+    for job in jobs:
+        finished = datetime.datetime.fromtimestamp(job['finished']).strftime('%Y-%m-%d %H:%M') if job['finished'] else 'unknown'
+        logger.info(f"{job['id']}: {job['name']} ({job['status']}, finished {finished})")
+
+
+async def display_restored_job(console: Console, job_id: int, restored: bool) -> None:
+    if restored:
+        logger.info(f'Restored job {job_id} from the archive')
+    else:
+        logger.warning(f'Job {job_id} is not in the archive')
+
+
+async def set_job_priority(console: Console, job_id: int = None, priority: int = None, weight: float = None) -> None:
+    """
+    Changes the priority and optionally the weight of a job which is already queued, see jobs.fair_share
+    """
+    if not job_id:
+        job_id = int(await console.input('Which job:'))
+    if priority is None:
+        priority = int(await console.input('Priority:'))
+
+    new_message = FunctionMessage(f'Set priority of job {job_id} to {priority}')
+    new_message.set_target(MessageTarget.SERVER)
+    new_message.set_function('set_job_priority')
+    new_message.format_arguments(job_id, priority, weight=weight)
+    console.send(new_message)
+
+
+async def display_job_share(console: Console, job_id: int, priority: int, weight: float) -> None:
+    logger.info(f'Job {job_id} now has priority {priority} and weight {weight}')
+
+
+async def sync_jobs(console: Console, job_ids: list) -> None:
+    logger.info(f'New jobs {", ".join(str(job_id) for job_id in job_ids)}')
+
+
+async def report_duplicates(console: Console, duplicates: list) -> None:
+    for name, job_id, existing_id, policy in duplicates:
+        if policy == 'merge':
+            logger.warning(f'{name} ({job_id}) duplicates job {existing_id} and was merged into it')
+        else:
+            logger.warning(f'{name} ({job_id}) duplicates job {existing_id} and was rejected')
+
+
+async def submit_jobs(console: Console, jobs: list) -> None:
+    """
+    Submits jobs directly to the server, the server replies with submitted_jobs
+    :param jobs: list of job.Job
+    """
+    new_message = FunctionMessage(f'Submit {len(jobs)} jobs')
+    new_message.set_target(MessageTarget.SERVER)
+    new_message.set_function('submit_jobs')
+    new_message.format_arguments(console.name, uuid.uuid4().hex, [new_job.as_dict() for new_job in jobs])
+    console.send(new_message)
+
+
+async def submitted_jobs(console: Console, request_id: str, job_ids: list, error: str = None) -> None:
+    if error:
+        logger.error(f'Failed to submit jobs: {error}')
+        return
+    logger.info(f'Submitted jobs {", ".join(str(job_id) for job_id in job_ids)}')
+
+
 # async def install_maya_plugin(console) -> None:
 #     """
 #     installs the Maya plugin
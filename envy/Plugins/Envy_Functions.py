@@ -112,6 +112,38 @@ async def send_allocation_progress(envy, allocation_id: int, progress: int) -> N
     envy.send(new_message)
 
 
+async def truncate_allocation(envy, allocation_id: int, task_id: int) -> None:
+    """
+    The server asks me to give up the tasks of my allocation from task_id on so an idle client can take them.
+    The plugin finishes the task it is working on and stops after the last task it kept instead of failing the allocation.
+    Plugins without a truncate method keep every task
+    :param envy: reference to the envy instance making the call
+    :param allocation_id: ID of the allocation
+    :param task_id: ID of the first task the server would like back
+    :return: Void
+    """
+    plugin = getattr(envy, 'plugin', None)
+    given_up = None
+    if plugin is not None and plugin.allocation_id == allocation_id and hasattr(plugin, 'truncate'):
+        given_up = plugin.truncate(task_id)
+    await allocation_truncated(envy, allocation_id, given_up)
+
+
+async def allocation_truncated(envy, allocation_id: int, task_id: int = None) -> None:
+    """
+    Tells the server which tasks of my allocation I gave up
+    :param envy: reference to the envy instance making the call
+    :param allocation_id: ID of the allocation
+    :param task_id: ID of the first task I gave up, every task after it is given up too. None if I kept all of them
+    :return: Void
+    """
+    new_message = m.FunctionMessage(f'allocation_truncated(): {allocation_id}')
+    new_message.set_target(MessageTarget.SERVER)
+    new_message.set_function('mark_allocation_as_truncated')
+    new_message.format_arguments(allocation_id, task_id)
+    envy.send(new_message)
+
+
 async def PLUGIN_eHoudini(envy, allocation_data_string: str) -> None:
     """
     The Houdini plugin. Allows for caching and rendering through Houdini.
@@ -124,7 +156,11 @@ async def PLUGIN_eHoudini(envy, allocation_data_string: str) -> None:
     await envy.set_status_working()
     envy.logger.info("eHoudini: Started")
     plugin = p.Plugin(envy, allocation_data_string)
-    await plugin.start()
+    envy.plugin = plugin
+    try:
+        await plugin.start()
+    finally:
+        envy.plugin = None
     await envy.set_status_idle()
     envy.logger.info("eHoudini: Exited")
 
@@ -138,7 +174,11 @@ async def PLUGIN_eMaya(envy, allocation_data: str) -> None:
     allocation_data = json.loads(allocation_data)
     allocation_id = allocation_data['Allocation_Id']
     plugin = maya_render.MayaRender(envy, allocation_data)
-    await plugin.render()
+    envy.plugin = plugin
+    try:
+        await plugin.render()
+    finally:
+        envy.plugin = None
     await finish_task_allocation(envy, allocation_id)
     await envy.set_status_idle()
     envy.logger.info("eMaya: Exited")
@@ -3,6 +3,7 @@ import logging
 import websockets
 
 from envy.lib.core.data import Client, ClientStatus
+from envy.lib.jobs import bundle
 from envy.lib.network.message import Message, FunctionMessage
 from envy.lib.network.message import MessageTarget
 
@@ -29,6 +30,7 @@ async def update_client_state(server, state: dict) -> None:
     client_state.task_id = task_id
     client_state.job_id = job_id
     client_state.status = status
+    server.job_scheduler.client_changed(name)
 
 
 async def send_client_state(server, client: str) -> None:
@@ -41,8 +43,8 @@ async def send_to_console(server, console: str, message: (Message, FunctionMessa
     """
     send a network.message object to a console
     """
-    server.logger.debug(f'sending message: {message} to console: {console}')
-    ws = server.consoles[console]['Socket']
+    logger.debug(f'sending message: {message} to console: {console}')
+    ws = server.consoles[console].socket
     encoded_message = message.encode()
     await ws.send(encoded_message)
 
@@ -149,6 +151,25 @@ async def console_sync_job(server, job_id: int) -> None:
     await send_to_consoles(server, new_message)
 
 
+async def console_sync_jobs(server, job_ids: list) -> None:
+    new_message = FunctionMessage(f'console_sync_jobs() {len(job_ids)} jobs')
+    new_message.set_target(MessageTarget.CONSOLE)
+    new_message.set_function('sync_jobs')
+    new_message.format_arguments(job_ids)
+    await send_to_consoles(server, new_message)
+
+
+async def console_report_duplicates(server, duplicates: list) -> None:
+    """
+    :param duplicates: list of [name, submitted job ID, existing job ID, jobs.enums.DuplicatePolicy value]
+    """
+    new_message = FunctionMessage(f'console_report_duplicates() {len(duplicates)} jobs')
+    new_message.set_target(MessageTarget.CONSOLE)
+    new_message.set_function('report_duplicates')
+    new_message.format_arguments(duplicates)
+    await send_to_consoles(server, new_message)
+
+
 async def console_register_client(server, client: str, client_data: dict) -> None:
     new_message = FunctionMessage(f'console_register_client() {client}')
     new_message.set_target(MessageTarget.CONSOLE)
@@ -165,6 +186,27 @@ async def console_unregister_client(server, client: str) -> None:
     await send_to_consoles(server, new_message)
 
 
+async def truncate_allocation(server, client: str, allocation_id: int, task_id: int) -> None:
+    """
+    Asks a client to give up the frames of its allocation from task_id on once it finished the frame it is working on, see Scheduler.steal_frames
+    :raises RuntimeError: If the message failed to send
+    """
+    new_message = FunctionMessage('truncate_allocation()')
+    new_message.set_target(MessageTarget.CLIENT)
+    new_message.set_function('truncate_allocation')
+    new_message.format_arguments(allocation_id, task_id)
+    await send_to_client(server, client, new_message)
+
+
+async def mark_allocation_as_truncated(server, allocation_id: int, task_id: int = None) -> None:
+    """
+    A client gave up the frames of its allocation from task_id on, they go to the next idle client
+    """
+    if task_id is not None:
+        task_id = int(task_id)
+    await server.job_scheduler.allocation_truncated(int(allocation_id), task_id)
+
+
 async def mark_task_as_failed(server, task_id: int, reason: str) -> None:
     new_message = FunctionMessage('mark_task_as_failed()')
     new_message.set_target(MessageTarget.CONSOLE)
@@ -189,3 +231,71 @@ async def update_allocation_progress(server, allocation_id: int, progress: int)
     new_message.set_function('update_allocation_progress')
     new_message.format_arguments(allocation_id, progress)
     await send_to_consoles(server, new_message)
+
+
+async def set_job_priority(server, job_id: int, priority: int = None, weight: float = None) -> None:
+    """
+    Changes how much of the farm a job gets, see jobs.fair_share
+    """
+    job_node = server.job_scheduler.set_job_share(int(job_id), priority=priority, weight=weight)
+    if job_node is None:
+        return
+
+    new_message = FunctionMessage('display_job_share()')
+    new_message.set_target(MessageTarget.CONSOLE)
+    new_message.set_function('display_job_share')
+    new_message.format_arguments(job_node.name, job_node.priority, job_node.weight)
+    await send_to_consoles(server, new_message)
+
+
+async def list_archived_jobs(server, console: str, limit: int = 50) -> None:
+    """
+    Replies to a console with the most recently archived jobs
+    """
+    archived_jobs = await server._database.get_archived_jobs(server.archive_path, limit)
+    jobs = [{'id': job.id, 'name': job.name, 'status': job.status, 'finished': job.finished} for job in archived_jobs]
+
+    new_message = FunctionMessage('display_archived_jobs()')
+    new_message.set_target(MessageTarget.CONSOLE)
+    new_message.set_function('display_archived_jobs')
+    new_message.format_arguments(jobs)
+    await send_to_console(server, console, new_message)
+
+
+async def restore_archived_job(server, console: str, job_id: int) -> None:
+    """
+    Moves a job from the archive database back into the live database
+    """
+    restored = await server.job_scheduler.db_writer.restore_job(server.archive_path, job_id)
+    if restored:
+        await console_sync_job(server, job_id)
+
+    new_message = FunctionMessage('display_restored_job()')
+    new_message.set_target(MessageTarget.CONSOLE)
+    new_message.set_function('display_restored_job')
+    new_message.format_arguments(job_id, restored)
+    await send_to_console(server, console, new_message)
+
+
+async def submit_jobs(server, console: str, request_id: str, jobs: list) -> None:
+    """
+    Adds jobs sent by a console or DCC session in one transaction and replies with their ids.
+    Jobs dropped into the jobs folder by job.Job.write keep working as a fallback.
+    :param console: name of the connection which receives the reply
+    :param request_id: echoed back in the reply so the caller can match it to its request
+    :param jobs: list of job dicts as made by job.Job.as_dict(), bundles are expanded and get one ID per child
+    """
+    job_ids = []
+    error = None
+    try:
+        new_jobs = [new_job for job_as_dict in jobs for new_job in bundle.jobs_from_dict(job_as_dict, logger=logger)]
+        job_ids = await server.job_scheduler.submit_jobs(new_jobs)
+    except (IndexError, KeyError, TypeError, ValueError, RuntimeError) as e:
+        logger.error(f'Failed to submit jobs from {console}: {e}')
+        error = str(e)
+
+    new_message = FunctionMessage('submitted_jobs()')
+    new_message.set_target(MessageTarget.CONSOLE)
+    new_message.set_function('submitted_jobs')
+    new_message.format_arguments(request_id, job_ids, error)
+    await send_to_console(server, console, new_message)
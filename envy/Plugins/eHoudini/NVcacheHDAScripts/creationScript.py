@@ -0,0 +1,3 @@
+myNode = kwargs['node']
+
+myNode.hdaModule().addDuplicatesParm(myNode)
@@ -18,7 +18,33 @@ import config_bridge as config
 ENVYBINPATH = config.Config.REPOPATH
 sys.path.append(ENVYBINPATH)
 from envy.lib.jobs import job as ej
+from envy.lib.jobs import bundle as eb
 from envy.lib.jobs import Purpose
+from envy.lib.jobs.enums import DuplicatePolicy
+
+
+def addDuplicatesParm(node) -> None:
+    """
+    Adds the allowDuplicates toggle to a node which does not have it yet, called when the node is created
+    """
+    if node.parm('allowDuplicates') is not None:
+        return
+    parm_template_group = node.parmTemplateGroup()
+    parm_template_group.append(hou.ToggleParmTemplate('allowDuplicates', 'Render Again If Already Queued', default_value=False,
+                                                      help='Off merges a job which is still on the farm into the job already there, eg: after submitting twice'))
+    node.setParmTemplateGroup(parm_template_group)
+
+
+def setDuplicatePolicy(node, new_job) -> None:
+    """
+    A job which is still on the farm is merged into the job already there, eg: because it was submitted twice,
+    unless the node's allowDuplicates toggle asks to render it again. Nodes without the toggle merge too
+    """
+    allow_parm = node.parm('allowDuplicates')
+    if allow_parm is not None and allow_parm.eval() == 1:
+        new_job.set_duplicate_policy(DuplicatePolicy.ALLOW)
+    else:
+        new_job.set_duplicate_policy(DuplicatePolicy.MERGE)
 
 
 def createSimulationEnvyJob(node):
@@ -167,6 +193,7 @@ def createSimulationEnvyJob(node):
             environment['$OS'] = dopnet_node.name()
 
     new_job = ej.Job(f'{job_name}_{str(1).zfill(3)}')
+    setDuplicatePolicy(node, new_job)
     new_job.set_meta()
     job_id = new_job.get_id()
     environment['Job_Id'] = job_id
@@ -308,13 +335,10 @@ def createGenericEnvyJobs(myNode):
     if (myNode.parm('descriptiveFileBool').eval() == 1):
         generateDescriptiveFile = True
 
-    # iterate over each job
+    # every job of the multiparm becomes a variant of one bundle so the whole sweep is a single job file
+    variants = []
     envyJobsMultiParm = myNode.parm('jobs')
     for i in range(envyJobsMultiParm.eval()):
-        new_job = ej.Job(f'{job_name}_{str(i + 1).zfill(3)}')
-        new_job.set_meta()
-        environment = {}
-
         job_index = i + 1
         parameter_edits_multiparm = myNode.parm(f'parameterEdits{job_index}')
         button_to_press_parm = myNode.parm(f'targetButton{job_index}')
@@ -325,8 +349,6 @@ def createGenericEnvyJobs(myNode):
             hou.ui.displayMessage(f'Button_to_press is invalid for job #{job_index}')
             return
 
-        environment['Target_Button'] = button_to_press.path()
-
         # check if node is nvcache
         NV_cache = False
         NV_node = None
@@ -352,16 +374,33 @@ def createGenericEnvyJobs(myNode):
         if parameters is None:
             return
 
-        environment['HIP'] = hou.hipFile.path()
-        environment['JOB'] = hou.getenv('JOB')
-        environment['Job_Type'] = 'generic'
+        variants.append((f'{job_name}_{str(job_index).zfill(3)}', parameters, button_to_press.path()))
 
-        new_job.set_environment(environment)
-        new_job.set_parameters(parameters)
-        new_job.set_type('PLUGIN_eHoudini')
-        new_job.set_purpose(Purpose.CACHE)
-        new_job.add_range(1, 1, 1)
-        new_job.write()
+    if not variants:
+        return
+
+    environment = {
+        'HIP': hou.hipFile.path(),
+        'JOB': hou.getenv('JOB'),
+        'Job_Type': 'generic',
+    }
+
+    # the target button only goes into each variant if the jobs press different buttons, otherwise every job shares the environment
+    target_buttons = set(target_button for _, _, target_button in variants)
+    if len(target_buttons) == 1:
+        environment['Target_Button'] = target_buttons.pop()
+
+    envy_bundle = eb.Bundle(job_name)
+    setDuplicatePolicy(myNode, envy_bundle)
+    envy_bundle.set_meta()
+    envy_bundle.set_environment(environment)
+    envy_bundle.set_type('PLUGIN_eHoudini')
+    envy_bundle.set_purpose(Purpose.CACHE)
+    envy_bundle.add_range(1, 1, 1)
+    for variant_name, parameters, target_button in variants:
+        variant_environment = None if 'Target_Button' in environment else {'Target_Button': target_button}
+        envy_bundle.add_variant(name=variant_name, parameters=parameters, environment=variant_environment)
+    envy_bundle.write()
 
 
 def duplicateJob(myNode, parm, multiParmIndex):
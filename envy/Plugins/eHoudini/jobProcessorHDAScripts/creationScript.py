@@ -14,4 +14,5 @@ import config_bridge as config
 
 
 JOBPATH = os.path.join(config.Config.ENVYPATH, 'Jobs', 'Jobs')
-myNode.parm('jobOutputPath').set(JOBPATH)
\ No newline at end of file
+myNode.parm('jobOutputPath').set(JOBPATH)
+myNode.hdaModule().addDuplicatesParm(myNode)
@@ -18,10 +18,38 @@ import config_bridge as config
 ENVYBINPATH = config.Config.REPOPATH
 sys.path.append(ENVYBINPATH)
 from envy.lib.jobs import job as ej
+from envy.lib.jobs import bundle as eb
+from envy.lib.jobs import dependencies
+from envy.lib.jobs import submit as envy_submit
+from envy.lib.jobs.enums import DependencyMode, DuplicatePolicy
 from envy.lib.jobs import Purpose
 
 
-def createSimulationEnvyJob(node):
+def addDuplicatesParm(node) -> None:
+    """
+    Adds the allowDuplicates toggle to a node which does not have it yet, called when the node is created
+    """
+    if node.parm('allowDuplicates') is not None:
+        return
+    parm_template_group = node.parmTemplateGroup()
+    parm_template_group.append(hou.ToggleParmTemplate('allowDuplicates', 'Render Again If Already Queued', default_value=False,
+                                                      help='Off merges a job which is still on the farm into the job already there, eg: after submitting twice'))
+    node.setParmTemplateGroup(parm_template_group)
+
+
+def setDuplicatePolicy(node, new_job) -> None:
+    """
+    A job which is still on the farm is merged into the job already there, eg: because it was submitted twice,
+    unless the node's allowDuplicates toggle asks to render it again. Nodes without the toggle merge too
+    """
+    allow_parm = node.parm('allowDuplicates')
+    if allow_parm is not None and allow_parm.eval() == 1:
+        new_job.set_duplicate_policy(DuplicatePolicy.ALLOW)
+    else:
+        new_job.set_duplicate_policy(DuplicatePolicy.MERGE)
+
+
+def confirmSave() -> bool:
     selection = hou.ui.displayCustomConfirmation('Save Hip File? \n(Otherwise hWedge could not work as intended)',
                                                  buttons=('Save and continue', 'Continue without saving', 'Cancel'),
                                                  suppress=hou.confirmType.BackgroundSave,
@@ -30,10 +58,14 @@ def createSimulationEnvyJob(node):
     if selection == 0:
         hou.hipFile.save()
 
-    elif selection == 1:
-        pass
+    return selection != 2
 
-    elif selection == 2:
+
+def createSimulationEnvyJob(node, submit: bool = True):
+    """
+    With submit set to False the job is only built and returned so it can be chained to other jobs, see submitSimulationAndRender
+    """
+    if submit and not confirmSave():
         return
 
     is_simulation = node.parm('isSimulation').eval()
@@ -167,6 +199,7 @@ def createSimulationEnvyJob(node):
             environment['$OS'] = dopnet_node.name()
 
     new_job = ej.Job(f'{job_name}_{str(1).zfill(3)}')
+    setDuplicatePolicy(node, new_job)
     new_job.set_meta()
     job_id = new_job.get_id()
     environment['Job_Id'] = job_id
@@ -178,7 +211,6 @@ def createSimulationEnvyJob(node):
         new_job.set_purpose(Purpose.SIMULATION)
         new_job.add_range(start_frame, end_frame, 1)
         new_job.set_allocation((end_frame + 1) - start_frame)
-        new_job.write()
 
     else:
         new_job.set_environment(environment)
@@ -187,7 +219,10 @@ def createSimulationEnvyJob(node):
         new_job.set_purpose(Purpose.CACHE)
         new_job.add_range(start_frame, end_frame, 1)
         new_job.set_allocation(node.parm('allocationSize').eval())
-        new_job.write()
+
+    if not submit:
+        return new_job
+    new_job.write()
 
 
 def dictFromParameterEdits(node, parameter_edits_multiparm: hou.parm, parm_namespace: str,
@@ -279,19 +314,11 @@ def setRenderParametersFromNode(node):
         return
 
 
-def writeRenderJob(node):
-    selection = hou.ui.displayCustomConfirmation('Save Hip File? \n(Otherwise hWedge could not work as intended)',
-                                                 buttons=('Save and continue', 'Continue without saving', 'Cancel'),
-                                                 suppress=hou.confirmType.BackgroundSave,
-                                                 default_choice=0,
-                                                 close_choice=2)
-    if selection == 0:
-        hou.hipFile.save()
-
-    elif selection == 1:
-        pass
-
-    elif selection == 2:
+def writeRenderJob(node, submit: bool = True):
+    """
+    With submit set to False the job is only built and returned so it can be chained to other jobs, see submitSimulationAndRender
+    """
+    if submit and not confirmSave():
         return
 
     job_name = node.parm('jobName').eval()
@@ -348,14 +375,41 @@ def writeRenderJob(node):
     environment['Version'] = {allocation_size_parm.path(): 1}
 
     new_job = ej.Job(f'{job_name}_{str(1).zfill(3)}')
+    setDuplicatePolicy(node, new_job)
     new_job.set_environment(environment)
     new_job.set_type('PLUGIN_eHoudini')
     new_job.set_purpose(Purpose.CACHE)
     new_job.add_range(start_frame, end_frame, 1)
     new_job.set_allocation(allocation_size)
+    if not submit:
+        return new_job
     new_job.write()
 
 
+def submitSimulationAndRender(node):
+    """
+    Submits the simulation or cache of this node together with its render.
+    Every render allocation waits on the farm until the cache wrote the frames it renders,
+    so rendering starts while the rest of the cache is still being written.
+    """
+    if not confirmSave():
+        return
+
+    cache_job = createSimulationEnvyJob(node, submit=False)
+    if cache_job is None:
+        return
+    render_job = writeRenderJob(node, submit=False)
+    if render_job is None:
+        return
+    render_job.set_name(f'{render_job.name}_render')
+    dependencies.chain([cache_job, render_job], mode=DependencyMode.FRAME)
+
+    try:
+        envy_submit.submit_jobs([cache_job, render_job])
+    except RuntimeError as e:
+        hou.ui.displayMessage(f'Failed to submit jobs to Envy: {e}')
+
+
 def setSimulationParametersFromNode(node):
     cache_node_parm = node.parm('simulation_cacheNode')
     cache_node = cache_node_parm.eval()
@@ -463,13 +517,10 @@ def createGenericEnvyJobs(node):
     if (node.parm('descriptiveFileBool').eval() == 1):
         generateDescriptiveFile = True
 
-    # iterate over each job
+    # every job of the multiparm becomes a variant of one bundle so the whole sweep is a single job file
+    variants = []
     envyJobsMultiParm = node.parm('jobs')
     for i in range(envyJobsMultiParm.eval()):
-        new_job = ej.Job(f'{job_name}_{str(i + 1).zfill(3)}')
-        new_job.set_meta()
-        environment = {}
-
         job_index = i + 1
         parameter_edits_multiparm = node.parm(f'parameterEdits{job_index}')
         button_to_press_parm = node.parm(f'targetButton{job_index}')
@@ -480,8 +531,6 @@ def createGenericEnvyJobs(node):
             hou.ui.displayMessage(f'Button_to_press is invalid for job #{job_index}')
             return
 
-        environment['Target_Button'] = button_to_press.path()
-
         # check if node is nvcache
         NV_cache = False
         NV_node = None
@@ -507,16 +556,33 @@ def createGenericEnvyJobs(node):
         if parameters is None:
             return
 
-        environment['HIP'] = hou.hipFile.path()
-        environment['JOB'] = hou.getenv('JOB')
-        environment['Job_Type'] = 'generic'
+        variants.append((f'{job_name}_{str(job_index).zfill(3)}', parameters, button_to_press.path()))
 
-        new_job.set_environment(environment)
-        new_job.set_parameters(parameters)
-        new_job.set_type('PLUGIN_eHoudini')
-        new_job.set_purpose(Purpose.CACHE)
-        new_job.add_range(1, 1, 1)
-        new_job.write()
+    if not variants:
+        return
+
+    environment = {
+        'HIP': hou.hipFile.path(),
+        'JOB': hou.getenv('JOB'),
+        'Job_Type': 'generic',
+    }
+
+    # the target button only goes into each variant if the jobs press different buttons, otherwise every job shares the environment
+    target_buttons = set(target_button for _, _, target_button in variants)
+    if len(target_buttons) == 1:
+        environment['Target_Button'] = target_buttons.pop()
+
+    envy_bundle = eb.Bundle(job_name)
+    setDuplicatePolicy(node, envy_bundle)
+    envy_bundle.set_meta()
+    envy_bundle.set_environment(environment)
+    envy_bundle.set_type('PLUGIN_eHoudini')
+    envy_bundle.set_purpose(Purpose.CACHE)
+    envy_bundle.add_range(1, 1, 1)
+    for variant_name, parameters, target_button in variants:
+        variant_environment = None if 'Target_Button' in environment else {'Target_Button': target_button}
+        envy_bundle.add_variant(name=variant_name, parameters=parameters, environment=variant_environment)
+    envy_bundle.write()
 
 
 def duplicateJob(myNode, parm, multiParmIndex):
@@ -36,6 +36,7 @@ class Plugin:
         self.ignore_counter = 0
         self.return_code = None
         self.user_terminated = False
+        self.truncated = False
         self.progress_buffer = 0
 
         self.failed = False
@@ -158,11 +159,32 @@ class Plugin:
             return
 
         if self.user_terminated is False:
-            if self.hython_process.returncode == 0:
+            if self.hython_process.returncode == 0 or (self.truncated is True and len(self.task_list) == 0):
                 await NV.finish_task_allocation(self.envy, self.allocation_id)
             else:
                 await NV.fail_task_allocation(self.envy, self.allocation_id, str(self.hython_process.returncode))
 
+    def truncate(self, task_id: int) -> int | None:
+        """
+        Gives up the tasks from task_id on, hython is stopped once the last task before them finished, see parse_line.
+        The task being worked on and the one after it are always kept, hython may already have started the next task
+        before its FINISHED line was read. Simulations keep every task since each frame needs the one before it
+        :param task_id: ID of the first task the server would like back
+        :return: ID of the first task given up or None if every task is kept
+        """
+        if self.job_type in ('simulation', 'resumable_simulation') or self.failed is True:
+            return None
+        keep = 2
+        while keep < len(self.task_list) and int(self.task_list[keep]) < int(task_id):
+            keep += 1
+        if keep >= len(self.task_list):
+            return None
+        given_up = int(self.task_list[keep])
+        self.logger.info(f'eHoudini: giving up {len(self.task_list) - keep} tasks from task {given_up} on')
+        self.task_list = self.task_list[:keep]
+        self.truncated = True
+        return given_up
+
     def terminate_process(self, timeout: float = 10) -> bool:
         self.logger.info('eHoudini: Terminating houdini process')
         if self.hython_process is None:
@@ -271,6 +293,11 @@ class Plugin:
                 self.logger.debug(f'Finished repeated frame')
                 return True
 
+            if self.truncated is True and len(self.task_list) <= 1 and self.hython_process.returncode is None:
+                # hython starts the first task given up right after this line, stop it before it gets to write anything
+                self.logger.info('eHoudini: finished the last task kept, stopping houdini process')
+                self.hython_process.terminate()
+
             if len(self.task_list) > 0:
                 await NV.finish_task(self.envy, self.task_list.pop(0))
 
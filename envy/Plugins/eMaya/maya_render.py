@@ -37,6 +37,7 @@ class MayaRender(object):
         self.task_list = list(self.tasks)
 
         self.environment = allocation_data['Environment']
+        self.parameters = allocation_data.get('Parameters') or {}
 
         self.maya_file = None
         self.project_path = None
@@ -59,6 +60,7 @@ class MayaRender(object):
         self.render_subprocess = None
         self.vray_is_rendering = False
         self.user_terminated = False
+        self.truncated = False
         self.coroutines = []
 
     @staticmethod
@@ -100,9 +102,11 @@ class MayaRender(object):
         self.use_tiled_rendering = self.environment['use_tiled_rendering']
 
         if self.use_tiled_rendering:
-            self.tile_bound_min = self.environment['tile_bound_min']
-            self.tile_bound_max = self.environment['tile_bound_max']
-            self.image_output_prefix = self.environment['image_output_prefix']
+            # tiles exported as a bundle keep their bounds in the parameters, older jobs keep them in the environment
+            tile_settings = {**self.environment, **self.parameters}
+            self.tile_bound_min = tile_settings['tile_bound_min']
+            self.tile_bound_max = tile_settings['tile_bound_max']
+            self.image_output_prefix = tile_settings['image_output_prefix']
 
         self.logger.info(f'{MayaRender.PLUGIN_NAME}: Settings from Job read successfully.')
 
@@ -251,8 +255,13 @@ class MayaRender(object):
                     self.logger.info(f'eMaya: {log_line}')
 
                 if 'FINISHED' in log_line:
+                    if self.truncated and len(self.task_list) <= 1 and self.render_subprocess.returncode is None:
+                        # Render.exe starts the first frame given up right after this line, stop it before it gets to write anything
+                        self.logger.info(f'{MayaRender.PLUGIN_NAME}: Finished the last frame kept, stopping render subprocess.')
+                        self.render_subprocess.terminate()
                     if len(self.task_list) > 0:
                         await NV.finish_task(self.envy, self.task_list.pop(0))
+                    if len(self.task_list) > 0:
                         await NV.start_task(self.envy, self.task_list[0])
 
             else:
@@ -325,7 +334,10 @@ class MayaRender(object):
 
         self.logger.info(f'Exit code {exit_code}')
 
-        if not self.user_terminated:
+        if self.truncated and len(self.task_list) == 0:
+            await NV.finish_task_allocation(self.envy, self.allocation_id)
+            self.logger.info(f'{MayaRender.PLUGIN_NAME}: Render completed the frames it kept.')
+        elif not self.user_terminated:
             if exit_code == 0:
                 await NV.finish_task_allocation(self.envy, self.allocation_id)
                 self.logger.info(f'{MayaRender.PLUGIN_NAME}: Render completed.')
@@ -342,6 +354,23 @@ class MayaRender(object):
 
         self.envy.logger.info(f'{MayaRender.PLUGIN_NAME}: Closing {MayaRender.PLUGIN_NAME}.')
 
+    def truncate(self, task_id: int) -> int | None:
+        """Gives up the tasks from task_id on, the frame being rendered and the one after it are always kept
+        since Render.exe may already have started the next frame before its FINISHED line was read.
+        Returns the ID of the first task given up or None if every task is kept."""
+        keep = 2
+        while keep < len(self.task_list) and int(self.task_list[keep]) < int(task_id):
+            keep += 1
+        if keep >= len(self.task_list):
+            return None
+
+        given_up = int(self.task_list[keep])
+        self.logger.info(f'{MayaRender.PLUGIN_NAME}: Giving up {len(self.task_list) - keep} frames from task {given_up} on.')
+        self.number_of_tasks -= len(self.task_list) - keep
+        self.task_list = self.task_list[:keep]
+        self.truncated = True
+        return given_up
+
     def eval_return_code(self, code):
         if code == 3221225786:  # Manual interrupt code (ctrl + c)
             self.logger.error(f'{MayaRender.PLUGIN_NAME}: Code {code} interrupt event.')
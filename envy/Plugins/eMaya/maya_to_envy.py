@@ -50,6 +50,8 @@ class MayaToEnvy(object):
         self.image_output_prefix = ''
 
         self.auto_save_maya_file = True
+        # a double submit or a submit rewritten after a crash is merged into the job still on the farm unless the user wants it rendered again
+        self.allow_duplicates = False
 
     def check_file_nodes_paths(self) -> list:
         """Checks the file nodes paths."""
@@ -97,8 +99,14 @@ class MayaToEnvy(object):
 
         return invalid_paths
 
-    def export_to_envy(self, camera: str, render_layer: str, tile_idx: int) -> None:
-        """Exports to envy."""
+    def export_to_envy(self, camera: str, render_layer: str, tile_idx: int, submit: bool = True, tiles: list = None):
+        """Exports to envy.
+
+        Returns the job or None if exporting failed. With submit set to False the job is only built
+        so several of them can be sent to the server together with envy.lib.jobs.submit.submit_jobs.
+        With tiled rendering and a list of (min, max) tile bounds every tile becomes a variant of one
+        bundle which the server expands into a job per tile, tile_idx is ignored in that case.
+        """
         if not self.check_paths():
             om.MGlobal.displayError(f'[{self.CLASS_NAME}] Export to Envy failed. Paths not found.')
             return
@@ -135,18 +143,25 @@ class MayaToEnvy(object):
             return
 
         from envy.lib.jobs import Purpose
+        from envy.lib.jobs.enums import DuplicatePolicy
+        import envy.lib.jobs.bundle as bundle
         import envy.lib.jobs.job as job
 
         maya_file_name = Path(self.get_maya_file()).stem
         camera_short_name = cmds.ls(camera, shortNames=True)[0].replace(':', '')
         render_layer_short_name = render_layer.replace(':', '')
+        job_name = f'{maya_file_name}_{camera_short_name}_{render_layer_short_name}'
 
-        render_job = job.Job(f'{maya_file_name}_{camera_short_name}_{render_layer_short_name}_{str(tile_idx).zfill(3)}')
+        if self.tiled_rendering and tiles:
+            render_job = bundle.Bundle(job_name)
+        else:
+            render_job = job.Job(f'{job_name}_{str(tile_idx).zfill(3)}')
         render_job.add_range(self.start_frame, self.end_frame, 1)
         render_job.set_meta()
         render_job.set_allocation(self.allocation)
         render_job.set_purpose(Purpose.RENDER)
         render_job.set_type('PLUGIN_eMaya')
+        render_job.set_duplicate_policy(DuplicatePolicy.ALLOW if self.allow_duplicates else DuplicatePolicy.MERGE)
 
         environment = {
             'maya_file': self.get_maya_file(),
@@ -158,14 +173,29 @@ class MayaToEnvy(object):
             'use_tiled_rendering': False
         }
 
-        if self.tiled_rendering:
+        if self.tiled_rendering and tiles:
+            # the tiles only differ in their bounds and output prefix so those go into the parameters and every tile shares the environment
+            environment['use_tiled_rendering'] = True
+            for tile_idx, (tile_bound_min, tile_bound_max) in enumerate(tiles):
+                render_job.add_variant(
+                    name=f'{job_name}_{str(tile_idx).zfill(3)}',
+                    parameters={
+                        'tile_bound_min': tile_bound_min,
+                        'tile_bound_max': tile_bound_max,
+                        'image_output_prefix': self.image_output_prefix.replace('$TILEINDEX', str(tile_idx).zfill(3)),
+                    })
+        elif self.tiled_rendering:
             environment['use_tiled_rendering'] = True
             environment['tile_bound_min'] = self.tile_bound_min
             environment['tile_bound_max'] = self.tile_bound_max
             environment['image_output_prefix'] = self.image_output_prefix.replace('$TILEINDEX', str(tile_idx).zfill(3))
 
         render_job.set_environment(environment)
-        render_job.write()
+        if not submit:
+            return render_job
+
+        from envy.lib.jobs import submit as envy_submit
+        envy_submit.submit_jobs([render_job])
 
         om.MGlobal.displayInfo(f'[{self.CLASS_NAME}] Exporting to Envy...\n'
                                f'\tmaya_file: {self.get_maya_file()}\n'
@@ -179,6 +209,8 @@ class MayaToEnvy(object):
 
         om.MGlobal.displayInfo(f'[{self.CLASS_NAME}] Exported job to envy.')
 
+        return render_job
+
     @staticmethod
     def is_a_valid_file(file: str) -> bool:
         """Checks if is a valid file."""
@@ -325,6 +357,10 @@ class MayaToEnvy(object):
         """Sets the auto sava Maya file."""
         self.auto_save_maya_file = save
 
+    def set_allow_duplicates(self, allow: bool) -> None:
+        """Sets whether a job which is still on the farm is rendered again instead of merged into it."""
+        self.allow_duplicates = allow
+
     def set_end_frame(self, frame: int) -> None:
         """Sets the end frame."""
         self.end_frame = frame
@@ -73,6 +73,7 @@ class EnvyUI(QtWidgets.QDialog):
         self.batch_size_spin_box = None
         self.auto_save_file_check_box = None
         self.increment_and_save_check_box = None
+        self.allow_duplicates_check_box = None
         self.use_tiled_rendering_check_box = None
         self.tiles_x_spin_box = None
         self.tiles_y_spin_box = None
@@ -161,6 +162,9 @@ class EnvyUI(QtWidgets.QDialog):
         self.increment_and_save_check_box = QtWidgets.QCheckBox('Increment and Save')
         self.increment_and_save_check_box.setChecked(True)
 
+        # Allow duplicates QCheckBox, off merges a job which is still on the farm into the job already there.
+        self.allow_duplicates_check_box = QtWidgets.QCheckBox('Render Again If Already Queued')
+
         # Use tiled rendering QCheckBox.
         self.use_tiled_rendering_check_box = QtWidgets.QCheckBox('Use Tiled Rendering')
 
@@ -241,7 +245,7 @@ class EnvyUI(QtWidgets.QDialog):
 
         # Advanced settings MFrameLayout.
         advanced_settings_frame_layout = frame_layout.MFrameLayout('Advanced Settings', main_right_widget)
-        advanced_settings_frame_layout.set_height(120)
+        advanced_settings_frame_layout.set_height(140)
         advanced_settings_main_v_box_layout.addWidget(advanced_settings_frame_layout)
 
         # Save file QGroupBox.
@@ -254,6 +258,7 @@ class EnvyUI(QtWidgets.QDialog):
         save_file_form_layout = QtWidgets.QFormLayout()
         save_file_form_layout.addWidget(self.auto_save_file_check_box)
         save_file_form_layout.addWidget(self.increment_and_save_check_box)
+        save_file_form_layout.addWidget(self.allow_duplicates_check_box)
         save_file_form_layout.setContentsMargins(112, 4, 4, 4)
         save_file_form_layout.setSpacing(4)
         save_file_group_box.setLayout(save_file_form_layout)
@@ -310,8 +315,10 @@ class EnvyUI(QtWidgets.QDialog):
     def export_to_envy_push_button_clicked(self):
         """Sets the Maya scene to Envy."""
         jobs_exported = 0
+        render_jobs = []
         use_tiled_rendering = self.use_tiled_rendering_check_box.isChecked()
         auto_save_file = self.auto_save_file_check_box.isChecked()
+        allow_duplicates = self.allow_duplicates_check_box.isChecked()
 
         for render_layer_widget in self.get_render_layers_items():  # FOR EACH LAYER
             if render_layer_widget.is_renderable():
@@ -365,28 +372,46 @@ class EnvyUI(QtWidgets.QDialog):
                             divisions_y = self.tiles_y_spin_box.value()
                             divisions = self.compute_min_and_max_from_number_of_divisions(divisions_x, divisions_y)
 
-                            for i, min_max_pair in enumerate(divisions):
-                                envy = maya_to_envy.MayaToEnvy()
-                                envy.set_auto_save_maya_file(auto_save_file)
-                                envy.set_tiled_rendering_settings(
-                                    min_bound=min_max_pair[0],
-                                    max_bound=min_max_pair[1],
-                                    image_output_prefix=image_output_prefix)
-                                envy.set_start_frame(start_frame)
-                                envy.set_end_frame(end_frame)
-                                envy.set_allocation(self.batch_size_spin_box.value())
-                                envy.export_to_envy(camera_name, render_layer_name, i)
+                            # every tile goes into one bundle which the server expands into a job per tile
+                            envy = maya_to_envy.MayaToEnvy()
+                            envy.set_auto_save_maya_file(auto_save_file)
+                            envy.set_allow_duplicates(allow_duplicates)
+                            envy.set_tiled_rendering_settings(image_output_prefix=image_output_prefix)
+                            envy.set_start_frame(start_frame)
+                            envy.set_end_frame(end_frame)
+                            envy.set_allocation(self.batch_size_spin_box.value())
+                            render_job = envy.export_to_envy(camera_name, render_layer_name, 0, submit=False, tiles=divisions)
 
-                                jobs_exported += 1
+                            if render_job is not None:
+                                render_jobs.append(render_job)
+                                jobs_exported += render_job.count()
                         else:
                             envy = maya_to_envy.MayaToEnvy()
                             envy.set_auto_save_maya_file(auto_save_file)
+                            envy.set_allow_duplicates(allow_duplicates)
                             envy.set_start_frame(start_frame)
                             envy.set_end_frame(end_frame)
                             envy.set_allocation(self.batch_size_spin_box.value())
-                            envy.export_to_envy(camera_name, render_layer_name, 0)
+                            render_job = envy.export_to_envy(camera_name, render_layer_name, 0, submit=False)
+
+                            if render_job is not None:
+                                render_jobs.append(render_job)
+                                jobs_exported += 1
+
+        if render_jobs:
+            # every camera, layer and tile goes to the server in one round trip
+            from envy.lib.jobs import submit as envy_submit
+
+            try:
+                job_ids = envy_submit.submit_jobs(render_jobs)
+            except RuntimeError as e:
+                om.MGlobal.displayError(f'Failed to submit jobs to Envy: {e}')
+                return
 
-                            jobs_exported += 1
+            if job_ids is None:
+                om.MGlobal.displayWarning(f'Envy server not reachable, wrote {len(render_jobs)} job files instead.')
+            else:
+                om.MGlobal.displayInfo(f'Submitted {len(job_ids)} jobs to Envy.')
 
         if not jobs_exported:
             message = 'No jobs exported.'
@@ -1,3 +1,4 @@
+import asyncio
 import socket
 import os
 import subprocess
@@ -5,6 +6,8 @@ import logging
 import sys
 
 from envy.Plugins import Envy_Functions  # noqa
+from envy.lib.db import lease
+from envy.lib.db.utils import get_shared_database_path
 from envy.lib.core.taskrunner import TaskRunner
 from envy.lib.core.message_handler import MessageHandler
 from envy.lib.core.client.websocket_client import WebsocketClient
@@ -35,6 +38,7 @@ class Client:
         self.status: ClientStatus = ClientStatus.IDLE
         self.job_id: int | None = None
         self.task_id: int | None = None
+        self._server_process: subprocess.Popen | None = None
 
     @property
     def connected(self):
@@ -66,11 +70,25 @@ class Client:
         logger.debug(f'Sending {message}.')
         self._websocket_client.send_queue().put(message)
 
-    def on_disconnect(self) -> None:
-        """A callback to be run when the client disconnects from the server."""
+    async def on_disconnect(self) -> None:
+        """
+        A callback to be run when the client disconnects from the server.
+        Watches the servers lease and only launches a server if this client takes the lease over once it expired.
+        Every other client backs off and connects to whoever won.
+        """
+        logger.debug(f'Running on disconnect callback...')
+        if self._server_process is not None and self._server_process.poll() is None:
+            # the server this client launched is still starting up
+            await asyncio.sleep(lease.POLL_INTERVAL)
+            return
+
+        election = lease.Election(get_shared_database_path(), socket.gethostbyname(self.name))
+        current, won = await election.run()
+        if not won:
+            logger.debug(f'Server is {current.server} (lease {current.token})')
+            return
 
         # Get path of server executable.
-        logger.debug(f'Running on disconnect callback...')
         my_dir = os.path.dirname(__file__)
         dir_pieces = my_dir.split(os.path.sep)
         dir_pieces.pop()
@@ -78,9 +96,9 @@ class Client:
         server_path = os.path.join(server_dir, 'server', 'core.py')
 
         # Launch with venv interpreter.
-        logger.info(f'Launching server...')
+        logger.info(f'Won lease {current.token}, launching server...')
         interpreter_path = sys.executable
-        process = subprocess.Popen([interpreter_path, server_path])
+        self._server_process = subprocess.Popen([interpreter_path, server_path, '--lease-token', str(current.token)])
 
 
 def main() -> None:
@@ -1,5 +1,4 @@
 import asyncio
-import json
 import logging
 import queue
 import typing
@@ -7,13 +6,16 @@ import typing
 import websockets
 
 from envy.lib.core.taskrunner import TaskRunner
+from envy.lib.db import lease
 from envy.lib.db.utils import get_server_ip
+from envy.lib.network import codec
 from envy.lib.network.message import Message, build_from_message_dict, MessageTarget
 from envy.lib.network.types import ConnectionType
 from envy.lib.utils.utils import get_hash
 
 PORT = 3720
 TIMEOUT = 5
+PING_INTERVAL = 1
 
 logger = logging.getLogger(__name__)
 
@@ -43,7 +45,7 @@ class WebsocketClient:
     async def start(self) -> None:
         while True:
             if self.disconnection_callback:
-                self.disconnection_callback()
+                await self.disconnection_callback()
             server_ip = get_server_ip()
             try:
                 await self.connect(server_ip)
@@ -54,8 +56,7 @@ class WebsocketClient:
             self.connected = True
             logger.info('Connected!')
             logger.debug(f'{server_ip=}')
-            while self.websocket.open:
-                await asyncio.sleep(0.5)
+            await self.websocket.wait_closed()
 
             self.connected = False
             logger.error(f'Lost connection with server.')
@@ -89,7 +90,8 @@ class WebsocketClient:
             'task': state.task_id,
         }
 
-        websocket = await websockets.connect(uri, extra_headers=headers, timeout=TIMEOUT)
+        # a server which died without closing the connection is noticed after at most ping_interval + ping_timeout
+        websocket = await websockets.connect(uri, extra_headers=headers, timeout=TIMEOUT, ping_interval=PING_INTERVAL, ping_timeout=lease.LEASE_DURATION)
         self.websocket = websocket
 
     async def disconnect(self) -> None:
@@ -116,13 +118,10 @@ class WebsocketClient:
 
         async for m in self.websocket:
             try:
-                json.loads(m)
-            except json.JSONDecodeError as e:
+                m = codec.decode(m)
+            except codec.DecodeError as e:
                 logger.warning(f'Failed to parse message {e}')
                 continue
-            except TypeError as e:
-                logger.error(f'{e}')
-                continue
 
             try:
                 message_object = build_from_message_dict(m)
@@ -1,4 +1,3 @@
-import json
 import queue
 import typing
 
@@ -9,6 +8,7 @@ import socket
 import logging
 
 from envy.lib.core.taskrunner import TaskRunner
+from envy.lib.network import codec
 from envy.lib.network.types import ConnectionType
 from envy.lib.network.message import Message, build_from_message_dict, MessageTarget
 from envy.lib.utils.utils import get_hash
@@ -111,13 +111,10 @@ class WebsocketConsole:
 
         async for m in self.websocket:
             try:
-                json.loads(m)
-            except json.JSONDecodeError as e:
+                m = codec.decode(m)
+            except codec.DecodeError as e:
                 logger.warning(f'Failed to parse message {e}')
                 continue
-            except TypeError as e:
-                logger.error(f'{e}')
-                continue
 
             try:
                 message_object = build_from_message_dict(m)
@@ -59,6 +59,8 @@ class Envy:
         # ------------------ job attributes -------------------------
         self.job = None
         self.status = Status.IDLE
+        # the plugin working on the current allocation, see Envy_Functions.truncate_allocation
+        self.plugin = None
 
         safe_exit.register(self.exit_function)
 
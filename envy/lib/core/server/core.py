@@ -1,24 +1,33 @@
 from __future__ import annotations
 
+import argparse
 import asyncio
 import logging
 import os
 import sys
+import time
 
 import envy
 from envy.lib.core import taskrunner
 from envy.lib.core.server.server_message_handler import ServerMessageHandler
 from envy.lib.core.server.websocket_server import WebsocketServer
-from envy.lib.db import db
+from envy.lib.db.async_db import AsyncDB
+from envy.lib.db import lease
+from envy.lib.db.journal import Journal
+from envy.lib.db.replica import Replica, restore
+from envy.lib.jobs.scheduler import Scheduler
+from envy.lib.utils.config import Config
 from envy.lib.utils.logger import ANSIFormatter
 
-LOCK_INTERVAL = 5
-
 logger = logging.getLogger(__name__)
 
 
 class Server:
-    def __init__(self):
+    def __init__(self, lease_token: int = None):
+        """
+        :param lease_token: fencing token of a lease a client already won for this machine, see db.lease.
+            Without one the server runs its own election before it starts.
+        """
 
         # Init task runner.
         self.task_runner = taskrunner.TaskRunner()
@@ -37,27 +46,69 @@ class Server:
         self._init_database()
 
         # Init values.
+        self.lease_token = lease_token
+        self.lease_acquired: float | None = None
         self.clients = self.websocket_server.clients()
         self.consoles = self.websocket_server.consoles()
 
+        # Init scheduler.
+        self.job_scheduler = Scheduler(self, self._database, journal=self._journal)
+        self.websocket_server.on_client_change = self.job_scheduler.client_changed
+        self.replica = Replica(self._database, self.job_scheduler.db_writer, self.snapshot_path, interval=Config.SNAPSHOTINTERVAL)
+
     def _init_database(self):
+        """
+        The working database lives on local disk, the share only holds the server lock, the journal and the latest snapshot.
+        Every candidate only prepares the lease in the shared database, the local database is opened once the lease is won, see _restore_database
+        """
         path = os.path.join(os.path.dirname(envy.__file__), 'Jobs')
+        local_path = os.path.join(Config.TEMP, 'Envy')
         database = 'Envy_Database.db'
 
-        if not os.path.isdir(path):
-            os.makedirs(path)
+        for directory in (path, local_path):
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+
+        self.archive_path = os.path.join(path, 'Envy_Archive.db')
+        self.snapshot_path = os.path.join(path, 'Envy_Snapshot.db')
+
+        # the server table stays in the shared database so clients can still find the server through it
+        self.lock_path = os.path.join(path, database)
+        self._lock_database = AsyncDB(self.lock_path)
+        self._lock_database.call(self._lock_database.db.prepare_lock)
 
-        self._database = db.DB(os.path.join(path, database))
-        self._database.start()
+        self._database = AsyncDB(os.path.join(local_path, database), wal=True)
+        self._journal = Journal(os.path.join(path, 'Envy_Database.journal'))
+
+    def _restore_database(self):
+        """
+        Restores the snapshot into the local database and opens it, the scheduler replays the journal on top of it when it starts.
+        Only the server holding the lease may do this, a candidate which lost the election would restore a snapshot the server is still writing
+        """
+        # before replication the shared database held everything, it is the only copy there is until the first snapshot
+        restored = restore(self._database.db_path, self.snapshot_path, legacy_path=self.lock_path)
+        if restored is None:
+            logger.info('No snapshot found, starting with an empty database')
+        self._database.call(self._database.db.start)
 
     def acquire_lock(self) -> bool:
         ip = self.websocket_server.ip
+        if self.lease_token is None:
+            election = lease.Election(self.lock_path, ip, jitter=0)
+            current, won = self.task_runner.event_loop.run_until_complete(election.run())
+            if not won:
+                logger.debug(f'Lease is held by {current.server}')
+                return False
+            self.lease_token = current.token
+
         try:
-            self._database.acquire_lock(ip)
-        except IOError:
+            self._lock_database.call(self._lock_database.db.acquire_lock, ip, self.lease_token)
+        except IOError as e:
+            logger.debug(e)
             return False
 
-        logger.info('Acquired database lock')
+        self.lease_acquired = time.monotonic()
+        logger.info(f'Acquired database lock (lease {self.lease_token})')
         self.task_runner.create_task(self.maintain_lock(), 'maintain_lock')
         return True
 
@@ -68,8 +119,12 @@ class Server:
             logger.error('Server already exists.')
             self.stop()
             return
+        self._restore_database()
         self.task_runner.create_task(self.websocket_server.start(), 'websocket_server')
         self.task_runner.create_task(self.message_handler.start(), 'message_handler')
+        self.task_runner.create_task(self.job_scheduler.start(), 'job_scheduler')
+        self.task_runner.create_task(self.maintain_archive(), 'maintain_archive')
+        self.task_runner.create_task(self.replica.start(), 'replica')
         self.task_runner.start()
 
     def stop(self):
@@ -80,10 +135,32 @@ class Server:
         sys.exit(0)
 
     async def maintain_lock(self):
+        """
+        Renews the lease until another server takes it over.
+        Losing the lease ends the server, whoever holds the newer token is the server from then on.
+        """
         ip = self.websocket_server.ip
         while True:
-            self._database.maintain_lock(ip)
-            await asyncio.sleep(LOCK_INTERVAL)
+            try:
+                await self._lock_database.maintain_lock(ip, self.lease_token)
+            except lease.LeaseLost:
+                logger.error(f'Lease {self.lease_token} was taken over by another server, stopping')
+                raise
+            await asyncio.sleep(lease.RENEW_INTERVAL)
+
+    async def maintain_archive(self):
+        """
+        Periodically moves old finished jobs into the archive database and gives the freed pages back
+        so the live database and with it failover startup stays small.
+        """
+        while True:
+            # through the writer so the jobs leaving the live database are journaled like the archive on the share is written
+            while await self.job_scheduler.db_writer.archive_jobs(self.archive_path, Config.ARCHIVEAGE):
+                await asyncio.sleep(0)
+            freed = await self._database.incremental_vacuum()
+            if freed:
+                logger.debug(f'Freed {freed} database pages')
+            await asyncio.sleep(Config.ARCHIVEINTERVAL)
 
 
 def main() -> None:
@@ -94,7 +171,11 @@ def main() -> None:
     root_logger.addHandler(handler)
     logging.getLogger('websockets').setLevel(logging.INFO)
 
-    server = Server()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lease-token', type=int, default=None, help='fencing token of a lease won by the client which launched this server')
+    args = parser.parse_args()
+
+    server = Server(lease_token=args.lease_token)
     server.start()
 
 
@@ -1,15 +1,14 @@
 import asyncio
-import json
 import logging
 import queue
 import socket
 import typing
-from json import JSONDecodeError
 
 import websockets
 from websockets.server import WebSocketServerProtocol
 
 from envy.lib.core.data import Client, ClientStatus, Console
+from envy.lib.network import codec
 from envy.lib.network import message as envy_message
 from envy.lib.utils.utils import get_hash
 
@@ -28,6 +27,8 @@ class WebsocketServer:
         self._key = get_hash()
         self._message_queue = queue.Queue()
         self._clients: dict[str, Client] = {}
+        # called with the client's name after it connected or disconnected
+        self.on_client_change: typing.Callable[[str], None] | None = None
         self._consoles: dict[str, Console] = {}
 
     def get_output_queue(self):
@@ -79,8 +80,10 @@ class WebsocketServer:
         if websocket.path == '/client':
             if not self.register_client(connection_ip, websocket, headers):
                 return
+            self._client_changed(connection_name)
             await self.client_consumer(connection_name)
             self.unregister_client(connection_name)
+            self._client_changed(connection_name)
 
         if websocket.path == '/console':
             if not self.register_console(connection_name, connection_ip, websocket):
@@ -117,6 +120,10 @@ class WebsocketServer:
         logger.info(f'Registered client: {name}')
         return True
 
+    def _client_changed(self, client_name: str) -> None:
+        if self.on_client_change is not None:
+            self.on_client_change(client_name)
+
     def register_console(self, console: str, ip: str, websocket: WebSocketServerProtocol) -> bool:
         self._consoles[console] = Console(ip=ip, socket=websocket)
         logger.info(f'Registered console: {console}')
@@ -175,8 +182,8 @@ class WebsocketServer:
 
     def _handle_message(self, message: str):
         try:
-            message_as_dict = json.loads(message)
-        except JSONDecodeError as e:
+            message_as_dict = codec.decode(message)
+        except codec.DecodeError as e:
             logger.warning(f'Failed to decode message: {e}')
             return
 
@@ -10,6 +10,7 @@ import sys
 import websockets
 
 import envy.lib.network.message as m
+from envy.lib.network import codec
 from envy.lib.jobs import scheduler
 from envy.lib.jobs.enums import Status
 from envy.lib.network.messagepurpose import MessagePurpose
@@ -126,14 +127,14 @@ class Server:
         try:
             async for message in websocket:
                 try:
-                    deserialized_message = json.loads(message)
+                    deserialized_message = codec.decode(message)
                     message_object = m.build_from_message_dict(deserialized_message)
                     logger.info(f"Console {console} sent message: ({message_object})")
                     status = await self.console_consumer(message_object)
                     if not status:
                         logger.warning(f'unknown message received ({message_object}) -> {message_object.as_dict()}')
                         continue
-                except json.JSONDecodeError as e:
+                except codec.DecodeError as e:
                     logger.error(f'Failed to decode message: {e}')
                 except Exception as e:
                     logger.error(f'Unexpected error while processing message: {e}')
@@ -150,7 +151,7 @@ class Server:
         client_ip = websocket.remote_address[0]
         try:
             async for message in websocket:
-                deserialized_message = json.loads(message)
+                deserialized_message = codec.decode(message)
                 message_object = m.build_from_message_dict(deserialized_message)
                 logger.debug(f"Client {client} sent message: ({message_object})")
                 status = await self.client_consumer(message_object)  # will return True or False if the message was acted upon
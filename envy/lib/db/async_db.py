@@ -0,0 +1,101 @@
+"""
+async_db.py: an awaitable facade over db.DB which keeps every sqlite call off the event loop
+"""
+
+from __future__ import annotations
+
+import asyncio
+import functools
+import logging
+import typing
+from concurrent.futures import ThreadPoolExecutor
+
+from envy.lib.db import db
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncDB:
+    def __init__(self, path: str, wal: bool = False):
+        """
+        Owns a DB object and a single worker thread. The sqlite connection is opened on that thread and never touched by any other.
+        Every public DB method is available as a coroutine eg: await async_db.get_job_values(job_id)
+        :param path: path to the sqlite database file
+        :param wal: passed through to db.DB
+        """
+        self.db = db.DB(path, wal=wal)
+        self.db_path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='envy_db')
+
+    def __getattr__(self, name: str) -> typing.Callable[..., typing.Awaitable]:
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        attribute = getattr(self.db, name)
+        if not callable(attribute):
+            raise AttributeError(f'{name} is not a DB method')
+
+        @functools.wraps(attribute)
+        async def wrapper(*args, **kwargs):
+            return await self.run(attribute, *args, **kwargs)
+
+        return wrapper
+
+    async def start(self) -> None:
+        await self.run(self.db.start)
+
+    async def stop(self) -> None:
+        await self.run(self.db.disconnect)
+        self._executor.shutdown(wait=True)
+
+    def call(self, function: typing.Callable, *args, **kwargs) -> any:
+        """
+        Runs function on the database thread and blocks until it returns.
+        Only meant for code which runs before the event loop is started.
+        """
+        return self._executor.submit(function, *args, **kwargs).result()
+
+    async def run(self, function: typing.Callable, *args, **kwargs) -> any:
+        """
+        Runs function on the database thread.
+        The call is shielded so cancelling the awaiting coroutine never interrupts a statement half way through,
+        the work still completes on the database thread and only the result is dropped.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, functools.partial(function, *args, **kwargs))
+        return await asyncio.shield(future)
+
+    async def read_many(self, calls: typing.Iterable[tuple[str, tuple]]) -> list:
+        """
+        Runs several read methods in one trip to the database thread
+        eg: await async_db.read_many([('get_job_values', (job_id,)), ('get_allocation_ids', (job_id,))])
+        :param calls: iterable of (DB method name, args)
+        :return: list of results in the same order as calls
+        """
+        calls = list(calls)
+
+        def read(database: db.DB) -> list:
+            return [getattr(database, name)(*args) for name, args in calls]
+
+        return await self.run(read, self.db)
+
+    async def transaction(self, function: typing.Callable[[db.DB], any]) -> any:
+        """
+        Runs function(db) inside a single write transaction on the database thread.
+        Everything function does is committed together or rolled back if it raises.
+        Like run() the transaction is shielded from cancellation so it can never be left open.
+        :param function: callable which receives the DB object
+        :return: whatever function returned
+        """
+
+        def run_transaction(database: db.DB) -> any:
+            database.cursor.execute('BEGIN IMMEDIATE')
+            try:
+                result = function(database)
+            except BaseException:
+                database.connection.rollback()
+                raise
+            database.connection.commit()
+            return result
+
+        return await self.run(run_transaction, self.db)
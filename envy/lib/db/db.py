@@ -1,26 +1,45 @@
+import contextlib
+import hashlib
 import json
 import logging
 import os
 import sqlite3
+import time
+import typing
 
 import envy
+from envy.lib.db import lease, migrations, rows, schema, statements
 from envy.lib.jobs import job as j
-from envy.lib.jobs.enums import Status
+from envy.lib.jobs.frame_range import FrameRange
+from envy.lib.jobs.enums import DuplicatePolicy, Status
+from envy.lib.utils import ids
 from envy.lib.utils import utils as eutils
 
 logger = logging.getLogger(__name__)
 
 
 class DB:
-    def __init__(self, path: str):
+    def __init__(self, path: str, wal: bool = False):
+        """
+        :param path: path to the sqlite database file
+        :param wal: use write ahead logging with synchronous=NORMAL. Only enable this when every connection lives on the same machine
+        """
         self.connection = None
         self.cursor = None
         self.db_path = path
+        self.wal = wal
+        self._archives_ready = set()
+        # changes of whole rows collected while capture_changes runs a method, None otherwise
+        self._changes = None
 
     def connect(self) -> None:
         logger.debug(f'connecting...')
-        self.connection = sqlite3.connect(self.db_path, timeout=10)
+        # large enough to keep every statement in statements.py compiled
+        self.connection = sqlite3.connect(self.db_path, timeout=10, cached_statements=256)
         self.connection.execute("PRAGMA foreign_keys = 1")
+        if self.wal:
+            self.connection.execute("PRAGMA journal_mode = WAL")
+            self.connection.execute("PRAGMA synchronous = NORMAL")
         self.cursor = self.connection.cursor()
         logger.debug('connected to database')
 
@@ -29,352 +48,803 @@ class DB:
 
     def configure_db(self):
         logger.info('configuring database')
-
-        self.cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS server(
-            Id INTEGER PRIMARY KEY CHECK (Id = 1),
-            server TEXT UNIQUE,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-            """
-        )
-
-        self.cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS jobs
-            (Id INTEGER PRIMARY KEY,
-            Name TEXT NOT NULL,
-            Allocation_Ids TEXT,
-            Purpose TEXT,
-            Metadata TEXT, 
-            Type TEXT, 
-            Environment TEXT,
-            Parameters TEXT,
-            Range TEXT, 
-            Status TEXT, 
-            Dependencies TEXT,
-            Allocation INTEGER,
-            Info Text)
-            """
-        )
-
-        self.cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS allocations
-            (Id INTEGER PRIMARY KEY AUTOINCREMENT,
-            Job_Id INTEGER,
-            Task_Ids TEXT,
-            Computer TEXT,
-            Status TEXT,
-            Info TEXT,
-            FOREIGN KEY(Job_Id) REFERENCES jobs(Id))
-            """
-        )
-
-        self.cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS tasks
-            (Id INTEGER PRIMARY KEY AUTOINCREMENT, 
-            Job_Id INTEGER,
-            Allocation_Id INTEGER,
-            Frame INTEGER, 
-            Status TEXT, 
-            Computer TEXT,
-            FOREIGN KEY(Allocation_Id) REFERENCES allocations(Id))
-            """
-        )
+        migrations.migrate(self.connection)
 
     def start(self):
         self.connect()
         self.configure_db()
 
-    def acquire_lock(self, ip):
+    def prepare_lock(self) -> None:
+        """
+        Connects to the shared database which only holds the lease without migrating it,
+        every server candidate opens it before one of them won the election. See db.lease.prepare
+        """
+        self.connect()
+        lease.prepare(self.connection)
+
+    def acquire_lock(self, ip: str, token: int) -> None:
         """
-        Acquires the database lock.
-        :raises IOError: If the lock could not be acquired.
+        Starts holding a lease which was won by db.lease.Election
+        :param ip: address the lease was won for
+        :param token: fencing token of the lease
+        :raises IOError: If the lease has been taken over since it was won
         """
         try:
-            self.cursor.execute('INSERT INTO server (Id, server) VALUES (1, ?) ON CONFLICT(Id) DO UPDATE SET server=?, timestamp=CURRENT_TIMESTAMP', (ip, ip))
-        except sqlite3.Error as e:
+            lease.renew(self.connection, ip, token)
+        except (sqlite3.Error, lease.LeaseLost) as e:
             raise IOError(f'Failed to acquire database lock: {e}')
 
-    def maintain_lock(self, ip) -> None:
-        self.cursor.execute('UPDATE server SET timestamp=CURRENT_TIMESTAMP WHERE server=?', (ip,))
-        self.connection.commit()
+    def maintain_lock(self, ip: str, token: int) -> None:
+        """
+        Renews the lease
+        :raises db.lease.LeaseLost: If another server took the lease over
+        """
+        lease.renew(self.connection, ip, token)
 
-    def add_job(self, job: j.Job) -> int | None:
+    def add_job(self, job: j.Job, compact: bool = True) -> int | None:
         """
         Adds a job to the database including creating allocation and task entries.
+        The job, its allocations and its tasks are written in a single transaction so either the whole job lands in the database or nothing does.
         :param job: The Job object to add
+        :param compact: store each allocation as a frame range instead of one task row per frame, see _insert_job
         :return: (int) The new jobs ID or None if adding the job failed
         """
         logger.debug(f'DB: Adding Job {job}')
-        job_id = self.create_job_entry(job)
 
-        if job_id < 0:
+        try:
+            self.cursor.execute('BEGIN IMMEDIATE')
+            job_id = self._insert_job(job, compact=compact)
+            changes = self._jobs_changed([job_id])
+            self.connection.commit()
+        except sqlite3.Error as e:
+            self.connection.rollback()
+            logger.error(f'Failed to create job {job} for reason: {e}')
             return None
 
-        frame_list = job.range_as_list()
-        allocation = job.get_allocation()
-        allocations = eutils.split_list(frame_list, allocation)
-        allocation_ids = []
-        for alloc in allocations:
-            allocation_id = self.create_allocation_entry(job, job_id)
-            if allocation_id < 0:
-                return None
+        self._record_changes(changes)
+        return job_id
 
-            allocation_ids.append(allocation_id)
+    def add_jobs(self, jobs: typing.Sequence[j.Job], compact: bool = True, window: float = None) -> list[int] | None:
+        """
+        Adds several jobs in one transaction, either all of them land in the database or none do.
+        With a window every job is first compared against the fingerprints of unfinished jobs added within the last window seconds,
+        including the jobs earlier in the same call. A duplicate is not added, instead its position holds the ID of the job it duplicates
+        and if its policy is DuplicatePolicy.MERGE its metadata is merged into that job. Jobs with DuplicatePolicy.ALLOW are always added.
+        :param jobs: the Job objects to add
+        :param compact: see add_job
+        :param window: seconds a fingerprint is remembered, None adds every job without looking for duplicates
+        :return: (list) the job IDs in the same order as jobs or None if adding the jobs failed.
+            An ID which differs from the job's own ID means the job was a duplicate.
+        """
+        logger.debug(f'DB: Adding {len(jobs)} Jobs')
 
-            task_ids = []
-            for frame in alloc:
-                task_id = self.create_task_entry(job, job_id, allocation_id, frame)
+        try:
+            self.cursor.execute('BEGIN IMMEDIATE')
+            if window is None:
+                job_ids = [self._insert_job(job, compact=compact) for job in jobs]
+            else:
+                now = time.time()
+                self.cursor.execute(statements.PRUNE_FINGERPRINTS, (now - window,))
+                job_ids = []
+                # jobs depending on a duplicate wait for the job it duplicates instead since the duplicate is never added
+                duplicates = {}
+                for job in jobs:
+                    if duplicates:
+                        self._redirect_dependencies(job, duplicates)
+                    job_id = self._insert_unique_job(job, now - window, compact=compact)
+                    if job_id != job.get_id():
+                        duplicates[job.get_id()] = job_id
+                    job_ids.append(job_id)
+            added = [job_id for job, job_id in zip(jobs, job_ids) if job_id == job.get_id()]
+            # duplicates which were merged changed the metadata of the job they duplicate
+            changes = self._jobs_changed(added, merged=set(job_ids) - set(added))
+            self.connection.commit()
+        except sqlite3.Error as e:
+            self.connection.rollback()
+            logger.error(f'Failed to create jobs {", ".join(str(job) for job in jobs)} for reason: {e}')
+            return None
 
-                if task_id < 0:
-                    return None
+        self._record_changes(changes)
+        return job_ids
 
-                task_ids.append(task_id)
+    def _insert_unique_job(self, job: j.Job, since: float, compact: bool = True) -> int:
+        """
+        Inserts a job unless an unfinished job with the same fingerprint was added after since.
+        Must be called inside a write transaction.
+        :return: (int) the new job's ID or the ID of the job it duplicates
+        """
+        if job.get_duplicate_policy() == DuplicatePolicy.ALLOW:
+            return self._insert_job(job, compact=compact)
+
+        self.cursor.execute(statements.FIND_FINGERPRINT, (job.fingerprint(), since))
+        duplicate = self.cursor.fetchone()
+        if duplicate is None:
+            return self._insert_job(job, compact=compact)
+
+        existing_id = duplicate[0]
+        logger.info(f'DB: {job} ({job.get_id()}) duplicates job {existing_id}, policy {job.get_duplicate_policy()}')
+        if job.get_duplicate_policy() == DuplicatePolicy.MERGE:
+            self._merge_metadata(existing_id, job)
+        return existing_id
+
+    @staticmethod
+    def _redirect_dependencies(job: j.Job, duplicates: dict[int, int]) -> None:
+        for dependency in job.get_dependencies() or ():
+            if isinstance(dependency, dict) and dependency.get('Id') in duplicates:
+                dependency['Id'] = duplicates[dependency['Id']]
+
+    def _merge_metadata(self, job_id: int, duplicate: j.Job) -> None:
+        """
+        Records a merged duplicate on the job it duplicates, its contributors are added and its ID is listed under 'Merged'
+        """
+        metadata = json.loads(self.get_job_value(job_id, 'Metadata') or '{}')
+        contributors = metadata.setdefault('Contributors', [])
+        for contributor in duplicate.get_meta().get('Contributors', []):
+            if contributor not in contributors:
+                contributors.append(contributor)
+        metadata.setdefault('Merged', []).append(duplicate.get_id())
+        self.cursor.execute(statements.get(statements.UPDATE_VALUE, 'jobs', 'Metadata'), (json.dumps(metadata), job_id))
+
+    def _insert_job(self, job: j.Job, compact: bool = True) -> int:
+        """
+        Inserts a job with all of its allocations and tasks using executemany.
+        Allocation and task ids come from utils.ids rather than being read back from lastrowid one row at a time.
+        A compact allocation stores its frames as a FrameRange and reserves one task id per frame starting at Task_Base.
+        Task rows for those frames are only written once a frame changes state, see _materialize_tasks.
+        Must be called inside a write transaction so nobody else can claim the same ids.
+        :param job: The Job object to insert
+        :param compact: write compact allocations instead of one task row per frame
+        :return: (int) The jobs ID
+        """
+        sqlite_job = job.as_sqlite_compliant()
+        job_id = job.get_id()
+
+        frame_range = job.get_frame_range()
+        allocations = frame_range.chunks(job.get_allocation())
 
-            task_ids = json.dumps(task_ids)
-            self.set_allocation_value(allocation_id, 'Task_Ids', task_ids)
+        # one block of ids per job so all allocations or tasks of a job are a single range of the primary key
+        allocation_id = ids.reserve(-(-len(frame_range) // job.get_allocation()))
+        task_id = ids.reserve(len(frame_range))
 
-        allocation_ids = json.dumps(allocation_ids)
-        self.set_job_value(job_id, 'Allocation_Ids', allocation_ids)
+        allocation_rows = []
+        task_rows = []
+        for alloc in allocations:
+            if compact:
+                allocation_rows.append((allocation_id, job_id, '', Status.PENDING, '', alloc.encode(), task_id))
+            else:
+                task_ids = list(range(task_id, task_id + len(alloc)))
+                task_rows.extend((new_task_id, job_id, allocation_id, frame, Status.PENDING, None) for new_task_id, frame in zip(task_ids, alloc))
+                allocation_rows.append((allocation_id, job_id, '', Status.PENDING, '', None, None))
+            allocation_id += 1
+            task_id += len(alloc)
+
+        logger.debug(f'DB: Creating Job Entry {job_id} with {len(allocation_rows)} allocations and {len(task_rows)} tasks')
+        self.cursor.execute(
+            "INSERT INTO jobs (Id, Name, Purpose, Metadata, Type, Environment_Id, Parameters, Range, Status, Dependencies, Allocation, Info, Priority, Weight) "
+            "VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                job_id,
+                sqlite_job['Name'],
+                sqlite_job['Purpose'],
+                sqlite_job['Metadata'],
+                sqlite_job['Type'],
+                self._environment_id(sqlite_job['Environment']),
+                sqlite_job['Parameters'],
+                sqlite_job['Range'],
+                Status.PENDING,
+                sqlite_job['Dependencies'],
+                sqlite_job['Allocation'],
+                '',
+                sqlite_job['Priority'],
+                sqlite_job['Weight'],
+            ),
+        )
+        self.cursor.executemany("INSERT INTO allocations (Id, Job_Id, Computer, Status, Info, Frames, Task_Base) VALUES(?, ?, ?, ?, ?, ?, ?)", allocation_rows)
+        self.cursor.executemany("INSERT INTO tasks (Id, Job_Id, Allocation_Id, Frame, Status, Computer) VALUES(?, ?, ?, ?, ?, ?)", task_rows)
+        self.cursor.execute(statements.INSERT_FINGERPRINT, (job_id, job.fingerprint(), time.time()))
         return job_id
 
-    def create_job_entry(self, job: j.Job) -> int:
-        sqlite_job = job.as_sqlite_compliant()
-        name = sqlite_job['Name']
-        job_id = job.get_id()
-        purpose = sqlite_job['Purpose']
-        metadata = sqlite_job['Metadata']
-        job_type = sqlite_job['Type']
-        environment = sqlite_job['Environment']
-        parameters = sqlite_job['Parameters']
-        frame_range = sqlite_job['Range']
-        dependencies = sqlite_job['Dependencies']
-        allocation = sqlite_job['Allocation']
-
-        logger.debug(f'DB: sqlite_job -> {sqlite_job} - ID -> {job_id}')
-
-        # create job
+    def capture_changes(self, name: str, *args, **kwargs) -> tuple[any, list]:
+        """
+        Calls a method which adds, rebuilds or removes rows, eg: add_jobs, and collects the rows it changed so they can be journaled.
+        Column updates are journaled one value at a time by writer.DBWriter, these changes carry whole rows, see writer.DBWriter.run_journaled
+        :param name: name of the method
+        :return: (tuple) what the method returned, list of (kind, table, column, values) for journal.Journal.append_change
+        """
+        self._changes = []
         try:
-            logger.debug(f'DB: Creating Job Entry')
-            self.cursor.execute(
-                "INSERT INTO jobs VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                (
-                    job_id,
-                    name,
-                    '',
-                    purpose,
-                    metadata,
-                    job_type,
-                    environment,
-                    parameters,
-                    frame_range,
-                    Status.PENDING,
-                    dependencies,
-                    allocation,
-                    '',
-                ),
-            )
-            self.connection.commit()
-            return job_id
-        except Exception as e:
-            logger.error(f'Failed to create job {job} for reason: {e}')
-            return -1
+            return getattr(self, name)(*args, **kwargs), self._changes
+        finally:
+            self._changes = None
 
-    def create_allocation_entry(self, job: j.Job, job_id: int) -> int:
+    def _rows_changed(self, table: str, column: str, values: typing.Iterable) -> list[tuple]:
+        """
+        Reads the rows whose column is one of values while capture_changes runs, must be called inside the transaction which changed them
+        :return: list of changes to pass to _record_changes once the transaction committed
+        """
+        values = list(values)
+        if self._changes is None or not values:
+            return []
+        statement = statements.get(statements.SELECT_JOURNALED, table, column)
+        changed = []
+        for chunk in eutils.split_list(values, 500):
+            self.cursor.execute(f'{statement} ({", ".join("?" * len(chunk))})', chunk)
+            changed.extend(self.cursor.fetchall())
+        return [('rows', table, None, changed)] if changed else []
+
+    def _rows_removed(self, table: str, column: str, values: typing.Iterable) -> list[tuple]:
+        values = list(values)
+        if self._changes is None or not values:
+            return []
+        return [('delete', table, column, values)]
+
+    def _jobs_changed(self, job_ids: typing.Iterable[int], merged: typing.Iterable[int] = ()) -> list[tuple]:
+        """
+        Collects new jobs with their environments, allocations, tasks and fingerprints, parents before children so foreign keys hold when they are replayed
+        :param job_ids: jobs which were added
+        :param merged: existing jobs whose row changed
+        """
+        job_ids = list(job_ids)
+        if self._changes is None or not job_ids and not merged:
+            return []
+        environment_ids = set()
+        for chunk in eutils.split_list(job_ids, 500):
+            self.cursor.execute(f'SELECT Environment_Id FROM jobs WHERE Environment_Id IS NOT NULL AND Id IN ({", ".join("?" * len(chunk))})', chunk)
+            environment_ids.update(row[0] for row in self.cursor.fetchall())
+        changes = self._rows_changed('environments', 'Id', environment_ids)
+        changes += self._rows_changed('jobs', 'Id', [*job_ids, *merged])
+        changes += self._rows_changed('allocations', 'Job_Id', job_ids)
+        changes += self._rows_changed('tasks', 'Job_Id', job_ids)
+        changes += self._rows_changed('fingerprints', 'Job_Id', job_ids)
+        return changes
+
+    def _record_changes(self, changes: list[tuple]) -> None:
+        if self._changes is not None:
+            self._changes.extend(changes)
+
+    def apply_changes(self, changes: list[tuple], checkpoint: int = None) -> int:
+        """
+        Replays changes read from the journal in order in a single transaction, see journal.Journal.replay.
+        Every change can be applied again without harm since the database may already hold some of them
+        :param changes: list of (kind, table, column, values). 'update' holds a batch of column updates like apply_updates takes,
+            'rows' whole rows which are written over existing ones and 'delete' the values of column whose rows are deleted
+        :param checkpoint: journal sequence number the changes include, stored in the same transaction
+        :return: (int) number of rows written or deleted
+        :raises sqlite3.Error: If the transaction failed. Nothing is written in that case.
+        :raises ValueError: If a table or column is not part of the schema
+        """
         try:
-            self.cursor.execute("INSERT INTO allocations VALUES(?, ?, ?, ?, ?, ?)", (None, job_id, '', '', Status.PENDING, ''))
+            self.cursor.execute('BEGIN IMMEDIATE')
+            count = 0
+            for kind, table, column, values in changes:
+                if kind == 'update':
+                    self._write_updates(values)
+                elif kind == 'rows':
+                    self.cursor.executemany(statements.get(statements.UPSERT_ROWS, table), values)
+                elif kind == 'delete':
+                    statement = statements.get(statements.DELETE_ROWS, table, column)
+                    for chunk in eutils.split_list(values, 500):
+                        self.cursor.execute(f'{statement} ({", ".join("?" * len(chunk))})', chunk)
+                else:
+                    raise ValueError(f'unknown change {kind}')
+                count += len(values)
+            if checkpoint is not None:
+                self.cursor.execute(statements.SET_CHECKPOINT, (checkpoint,))
             self.connection.commit()
-            return self.cursor.lastrowid
-        except Exception as e:
-            logger.error(f'Failed to create allocation {job} for reason: {e}')
-            return -1
+        except (sqlite3.Error, ValueError):
+            self.connection.rollback()
+            raise
 
-    def create_task_entry(self, job: j.Job, job_id: int, allocation_id: int, frame: int):
-        sqlite_job = job.as_sqlite_compliant()
-        purpose = sqlite_job['Purpose']
-        job_type = sqlite_job['Type']
-        environment = sqlite_job['Environment']
-        parameters = sqlite_job['Parameters']
+        return count
+
+    def rechunk_allocations(self, allocation_ids: typing.Sequence[int], sizes: typing.Sequence[int]) -> list[rows.AllocationRow] | None:
+        """
+        Replaces pending compact allocations of one job with new allocations holding sizes frames each, see jobs.chunking.
+        Frames keep their task ids since a compact allocation only stores where its block of task ids starts,
+        so the allocations are rebuilt in runs whose blocks follow each other and task rows which already exist are moved to their new allocation.
+        :param allocation_ids: the allocations to replace, every one of them must be pending and compact
+        :param sizes: frames per new allocation in order, they must add up to the frames of allocation_ids.
+            An allocation which would span two runs is cut in two where the first run ends
+        :return: (list) the new AllocationRows in order or None if the allocations could not be replaced, in which case nothing changed
+        """
+        logger.debug(f'DB: Rechunking {len(allocation_ids)} allocations into {len(sizes)}')
         try:
-            self.cursor.execute("INSERT INTO tasks VALUES(?, ?, ?, ?, ?, ?)", (None, job_id, allocation_id, frame, Status.PENDING, None))
+            self.cursor.execute('BEGIN IMMEDIATE')
+            old = []
+            for chunk in eutils.split_list(list(allocation_ids), 500):
+                self.cursor.execute(f'{statements.SELECT_ALLOCATIONS} ({", ".join("?" * len(chunk))})', chunk)
+                old.extend(rows.AllocationRow(*row) for row in self.cursor.fetchall())
+            if len(old) != len(set(allocation_ids)) or len({allocation.job_id for allocation in old}) > 1:
+                raise ValueError('allocations are missing or belong to different jobs')
+            if any(allocation.status != Status.PENDING or allocation.frames is None for allocation in old):
+                raise ValueError('only pending compact allocations can be rechunked')
+
+            # runs of allocations whose blocks of task ids follow each other, a run can be cut up anywhere without renumbering a task
+            runs = []
+            next_task = None
+            for allocation in sorted(old, key=lambda allocation: allocation.task_base):
+                frames = FrameRange.decode(allocation.frames)
+                if allocation.task_base != next_task:
+                    runs.append((allocation.task_base, []))
+                runs[-1][1].append(frames)
+                next_task = allocation.task_base + len(frames)
+            runs = [(task_base, FrameRange.concatenate(ranges)) for task_base, ranges in runs]
+            if sum(sizes) != sum(len(frames) for _, frames in runs) or any(size < 1 for size in sizes):
+                raise ValueError(f'sizes add up to {sum(sizes)} frames')
+
+            job_id = old[0].job_id
+            allocation_id = ids.reserve(len(sizes) + len(runs) - 1)
+            new_rows = []
+            moves = []
+            sizes = iter(sizes)
+            wanted = 0
+            for task_base, frames in runs:
+                start = 0
+                while start < len(frames):
+                    if wanted == 0:
+                        wanted = next(sizes)
+                    stop = min(start + wanted, len(frames))
+                    wanted -= stop - start
+                    new_rows.append(rows.AllocationRow(allocation_id, job_id, '', Status.PENDING, '', frames[start:stop].encode(), task_base + start))
+                    moves.append((allocation_id, task_base + start, task_base + stop - 1))
+                    allocation_id += 1
+                    start = stop
+
+            self.cursor.executemany(statements.INSERT_ALLOCATION, [row.as_tuple() for row in new_rows])
+            self.cursor.executemany(statements.MOVE_TASKS, moves)
+            self.cursor.executemany(statements.DELETE_ALLOCATION, [(allocation.id,) for allocation in old])
+            new_ids = [row.id for row in new_rows]
+            changes = self._rows_changed('allocations', 'Id', new_ids)
+            changes += self._rows_changed('tasks', 'Allocation_Id', new_ids)
+            changes += self._rows_removed('allocations', 'Id', [allocation.id for allocation in old])
             self.connection.commit()
-            return self.cursor.lastrowid
-        except Exception as e:
-            logger.error(f'Failed to create task {job} for reason: {e}')
-            return -1
-
-    def set_task_value(self, task_id: int, column: str, value: any) -> None:
+        except (sqlite3.Error, ValueError) as e:
+            self.connection.rollback()
+            logger.error(f'Failed to rechunk allocations {", ".join(str(allocation_id) for allocation_id in allocation_ids)} for reason: {e}')
+            return None
+        self._record_changes(changes)
+        return new_rows
 
-        query = f"""
-        UPDATE tasks
-        SET {column} = ?
-        WHERE Id = ?
+    def split_allocation(self, allocation_id: int, index: int) -> rows.AllocationRow | None:
         """
-        self.cursor.execute(query, (value, task_id))
-        self.connection.commit()
-
-    def set_job_value(self, job_id: int, column: str, value: any) -> None:
+        Moves the frames of a compact allocation from index on into a new pending allocation, eg: the frames a client gave up so an idle client gets them.
+        The frames keep their task ids, the block of task ids of the new allocation starts where its frames were in the old one.
+        The caller makes sure none of the frames which move have started
+        :param allocation_id: ID of the compact allocation
+        :param index: the first frame which moves, the allocation keeps every frame before it
+        :return: the AllocationRow of the new allocation or None if the allocation could not be split, in which case nothing changed
+        """
+        logger.debug(f'DB: Splitting allocation {allocation_id} at frame {index}')
+        try:
+            self.cursor.execute('BEGIN IMMEDIATE')
+            self.cursor.execute(f'{statements.SELECT_ALLOCATIONS} (?)', (allocation_id,))
+            result = self.cursor.fetchone()
+            if result is None:
+                raise ValueError('allocation does not exist')
+            allocation = rows.AllocationRow(*result)
+            if allocation.frames is None:
+                raise ValueError('only compact allocations can be split')
+            frames = FrameRange.decode(allocation.frames)
+            if not 0 < index < len(frames):
+                raise ValueError(f'cannot split {len(frames)} frames at {index}')
+
+            new_row = rows.AllocationRow(ids.reserve(1), allocation.job_id, '', Status.PENDING, '', frames[index:].encode(), allocation.task_base + index)
+            self.cursor.execute(statements.INSERT_ALLOCATION, new_row.as_tuple())
+            self.cursor.execute(statements.get(statements.UPDATE_VALUE, 'allocations', 'Frames'), (frames[:index].encode(), allocation_id))
+            self.cursor.execute(statements.MOVE_TASKS, (new_row.id, new_row.task_base, allocation.task_base + len(frames) - 1))
+            changes = self._rows_changed('allocations', 'Id', [allocation_id, new_row.id])
+            changes += self._rows_changed('tasks', 'Allocation_Id', [new_row.id])
+            self.connection.commit()
+        except (sqlite3.Error, ValueError) as e:
+            self.connection.rollback()
+            logger.error(f'Failed to split allocation {allocation_id} for reason: {e}')
+            return None
+        self._record_changes(changes)
+        return new_row
 
-        query = f"""
-        UPDATE jobs
-        SET {column} = ?
-        WHERE Id = ?
+    def _environment_id(self, environment: str) -> int:
         """
-        self.cursor.execute(query, (value, job_id))
-        self.connection.commit()
+        Stores an environment once no matter how many jobs use it, eg: every job expanded from a bundle.
+        Must be called inside a write transaction.
+        :param environment: the environment as json
+        :return: (int) ID of the row in environments
+        """
+        environment_hash = hashlib.sha256(environment.encode()).hexdigest()
+        self.cursor.execute(statements.INSERT_ENVIRONMENT, (environment_hash, environment))
+        self.cursor.execute(statements.SELECT_ENVIRONMENT_ID, (environment_hash,))
+        return self.cursor.fetchone()[0]
 
-    def set_allocation_value(self, allocation_id: int, column: str, value: any) -> None:
+    def _find_compact_allocation(self, task_id: int) -> rows.AllocationRow | None:
+        """
+        :return: the compact allocation whose reserved block of task ids contains task_id or None
+        """
+        self.cursor.execute(statements.COMPACT_ALLOCATION_OF_TASK, (task_id,))
+        result = self.cursor.fetchone()
+        if result is None:
+            return None
+        allocation = rows.AllocationRow(*result)
+        if task_id - allocation.task_base >= len(FrameRange.decode(allocation.frames)):
+            return None
+        return allocation
 
-        query = f"""
-                UPDATE allocations
-                SET {column} = ?
-                WHERE Id = ?
-                """
-        self.cursor.execute(query, (value, allocation_id))
-        self.connection.commit()
+    def _virtual_task(self, task_id: int) -> rows.TaskRow | None:
+        """
+        Builds the row of a frame in a compact allocation which has not been written to the tasks table yet
+        :return: TaskRow or None if task_id does not belong to a compact allocation
+        """
+        allocation = self._find_compact_allocation(task_id)
+        if allocation is None:
+            return None
+        return self._default_task(allocation, FrameRange.decode(allocation.frames), task_id)
 
-    def get_task_value(self, task_id: int, column: str) -> any:
+    @staticmethod
+    def _default_task(allocation: rows.AllocationRow, frames: FrameRange, task_id: int) -> rows.TaskRow:
+        status = Status.DONE if allocation.status == Status.DONE else Status.PENDING
+        return rows.TaskRow(task_id, allocation.job_id, allocation.id, frames[task_id - allocation.task_base], status, None)
 
-        query = f"""
-        SELECT {column}
-        FROM tasks
-        WHERE Id = ?
+    def _materialize_tasks(self, task_ids: typing.Iterable[int]) -> None:
         """
-        self.cursor.execute(query, (task_id,))
-        result = self.cursor.fetchone()
+        Writes a task row for every frame of a compact allocation in task_ids which does not have one yet so it can be updated.
+        Must be called inside a write transaction.
+        """
+        task_ids = set(task_ids)
+        existing = set()
+        for chunk in eutils.split_list(list(task_ids), 500):
+            self.cursor.execute(f'SELECT Id FROM tasks WHERE Id IN ({", ".join("?" * len(chunk))})', chunk)
+            existing.update(row[0] for row in self.cursor.fetchall())
+
+        new_rows = []
+        allocation = frames = None
+        for task_id in sorted(task_ids - existing):
+            if allocation is None or not 0 <= task_id - allocation.task_base < len(frames):
+                allocation = self._find_compact_allocation(task_id)
+                if allocation is None:
+                    continue
+                frames = FrameRange.decode(allocation.frames)
+            new_rows.append(self._default_task(allocation, frames, task_id).as_tuple())
+        self.cursor.executemany(statements.INSERT_TASK, new_rows)
+
+    def set_value(self, table: str, row_id: int, column: str, value: any) -> None:
+        """
+        Updates a single column of a single row and commits
+        :raises ValueError: If the table or column is not part of the schema
+        """
+        statement = statements.get(statements.UPDATE_VALUE, table, column)
+        if table == 'tasks':
+            self._materialize_tasks((row_id,))
+        self.cursor.execute(statement, (value, row_id))
+        self.connection.commit()
 
-        if result is not None:
+    def set_task_value(self, task_id: int, column: str, value: any) -> None:
+        self.set_value('tasks', task_id, column, value)
 
-            return result[0]
+    def set_job_value(self, job_id: int, column: str, value: any) -> None:
+        self.set_value('jobs', job_id, column, value)
 
-        else:
+    def set_allocation_value(self, allocation_id: int, column: str, value: any) -> None:
+        self.set_value('allocations', allocation_id, column, value)
 
-            raise IndexError('Column does not exist')
+    def apply_updates(self, updates: dict, checkpoint: int = None) -> int:
+        """
+        Applies many row updates in a single transaction.
+        Rows updating the same set of columns are grouped into one executemany call.
+        Tasks are written first so an allocation finishing in the same batch as its last frame sees that frame as done.
+        :param updates: {(table, row_id): {column: value}}
+        :param checkpoint: journal sequence number the updates include, stored in the same transaction
+        :return: (int) number of rows written
+        :raises sqlite3.Error: If the transaction failed. Nothing is written in that case.
+        :raises ValueError: If a table or column is not part of the schema
+        """
+        try:
+            self.cursor.execute('BEGIN IMMEDIATE')
+            self._write_updates(updates)
+            if checkpoint is not None:
+                self.cursor.execute(statements.SET_CHECKPOINT, (checkpoint,))
+            self.connection.commit()
+        except (sqlite3.Error, ValueError):
+            self.connection.rollback()
+            raise
 
-    def get_task_values(self, task_id: int) -> tuple:
+        return len(updates)
 
-        query = f"""
-        SELECT *
-        FROM tasks
-        WHERE Id = ?
+    def _write_updates(self, updates: dict) -> None:
+        """
+        Must be called inside a write transaction, see apply_updates
+        :raises ValueError: If a table or column is not part of the schema
+        """
+        groups = {}
+        for (table, row_id), values in updates.items():
+            for column in values:
+                schema.validate_column(table, column)
+            groups.setdefault((table, tuple(values)), []).append((*values.values(), row_id))
+
+        self._materialize_tasks(row_id for table, row_id in updates if table == 'tasks')
+        for (table, columns), parameters in sorted(groups.items(), key=lambda group: group[0][0] != 'tasks'):
+            assignments = ', '.join(f'{column} = ?' for column in columns)
+            self.cursor.executemany(f'UPDATE {table} SET {assignments} WHERE Id = ?', parameters)
+
+    def get_checkpoint(self) -> int:
         """
-        self.cursor.execute(query, (task_id,))
+        :return: (int) last journal sequence number folded into the database, 0 if there is none
+        """
+        self.cursor.execute('SELECT Sequence FROM journal WHERE Id = 1')
         result = self.cursor.fetchone()
+        return 0 if result is None else result[0]
 
-        if result is not None:
-
-            return result
-        else:
-
-            raise IndexError('Column does not exist')
-
-    def get_allocation_value(self, allocation_id: int, column: str) -> any:
-
-        query = f"""
-        SELECT {column}
-        FROM allocations
-        WHERE Id = ?
+    def get_value(self, table: str, row_id: int, column: str) -> any:
+        """
+        Reads a single column of a single row
+        :raises ValueError: If the table or column is not part of the schema
+        :raises IndexError: If the row does not exist
         """
-        self.cursor.execute(query, (allocation_id,))
+        self.cursor.execute(statements.get(statements.SELECT_VALUE, table, column), (row_id,))
         result = self.cursor.fetchone()
-        if result is not None:
-            return result[0]
-        else:
-
-            raise IndexError('Column does not exist')
+        if result is None:
+            return getattr(self.get_row(table, row_id), column.lower())
+        return result[0]
 
-    def get_allocation_values(self, allocation_id: int) -> tuple:
-
-        query = f"""
-        SELECT *
-        FROM allocations
-        WHERE Id = ?
+    def get_row(self, table: str, row_id: int) -> rows.Row:
+        """
+        Reads a whole row in one query
+        :param table: name of the table
+        :param row_id: Id of the row
+        :return: JobRow, AllocationRow or TaskRow depending on the table
+        :raises IndexError: If the row does not exist
         """
-        self.cursor.execute(query, (allocation_id,))
+        self.cursor.execute(statements.get(statements.SELECT_ROW, table), (row_id,))
         result = self.cursor.fetchone()
-
         if result is not None:
-            return result
-        else:
+            return rows.ROW_TYPES[table](*result)
 
-            raise IndexError('Column does not exist')
+        task = self._virtual_task(row_id) if table == 'tasks' else None
+        if task is None:
+            raise IndexError(f'{table} row {row_id} does not exist')
+        return task
 
-    def get_job_value(self, job_id: int, column: str) -> any:
+    def get_task_value(self, task_id: int, column: str) -> any:
+        return self.get_value('tasks', task_id, column)
 
-        query = f"""
-        SELECT {column}
-        FROM jobs
-        WHERE Id = ?
-        """
-        self.cursor.execute(query, (job_id,))
-        result = self.cursor.fetchone()
+    def get_task_values(self, task_id: int) -> tuple:
+        return self.get_row('tasks', task_id).as_tuple()
 
-        if result is not None:
+    def get_allocation_value(self, allocation_id: int, column: str) -> any:
+        return self.get_value('allocations', allocation_id, column)
 
-            return result[0]
-        else:
+    def get_allocation_values(self, allocation_id: int) -> tuple:
+        return self.get_row('allocations', allocation_id).as_tuple()
 
-            raise IndexError('Column does not exist')
+    def get_job_value(self, job_id: int, column: str) -> any:
+        return self.get_value('jobs', job_id, column)
 
     def get_job_values(self, job_id: int) -> tuple:
+        return self.get_row('jobs', job_id).as_tuple()
 
-        query = f"""
-        SELECT *
-        FROM jobs
-        WHERE Id = ?
-        """
-        self.cursor.execute(query, (job_id,))
-        result = self.cursor.fetchone()
-
-        if result is not None:
-
-            return result
-        else:
+    def get_job(self, job_id: int) -> rows.JobRow:
+        return self.get_row('jobs', job_id)
 
-            raise IndexError('Column does not exist')
+    def get_allocation(self, allocation_id: int) -> rows.AllocationRow:
+        return self.get_row('allocations', allocation_id)
 
-    def get_ids_by_value(self, table: str, column: str, value: any) -> tuple:
+    def get_task(self, task_id: int) -> rows.TaskRow:
+        return self.get_row('tasks', task_id)
 
-        query = f"""
-        SELECT Id
-        FROM {table}
-        WHERE {column} = ?
+    def get_ids_by_value(self, table: str, column: str, value: any) -> list:
         """
-        self.cursor.execute(query, (value,))
-        result = self.cursor.fetchall()
+        Frames of compact allocations without a task row are not included
+        :return: list of 1-tuples of every Id where column equals value
+        :raises ValueError: If the table or column is not part of the schema
+        """
+        self.cursor.execute(statements.get(statements.SELECT_IDS_BY_VALUE, table, column), (value,))
+        return self.cursor.fetchall()
 
-        if result is not None:
+    def get_job_statuses(self, job_ids: typing.Iterable[int]) -> dict[int, str]:
+        """
+        :param job_ids: ids of jobs
+        :return: (dict) job id -> status of every job in job_ids which is in the database
+        """
+        statuses = {}
+        for chunk in eutils.split_list(list(job_ids), 500):
+            self.cursor.execute(f'SELECT Id, Status FROM jobs WHERE Id IN ({", ".join("?" * len(chunk))})', chunk)
+            statuses.update(self.cursor.fetchall())
+        return statuses
 
-            return result
-        else:
+    def get_allocation_ids(self, job_id: int) -> list:
+        return [allocation.id for allocation in self.get_allocations(job_id)]
 
-            raise IndexError('Column does not exist')
+    def get_task_ids(self, allocation_id: int) -> list:
+        return [task.id for task in self.get_tasks(allocation_id)]
 
-    def get_allocation_ids(self, job_id: int) -> list:
+    def get_allocations(self, job_id: int) -> list[rows.AllocationRow]:
+        """
+        Reads every allocation of a job in one query
+        :param job_id: ID of the job
+        :return: list of AllocationRow ordered by Id
+        """
+        self.cursor.execute(statements.ALLOCATIONS_OF_JOB, (job_id,))
+        return [rows.AllocationRow(*row) for row in self.cursor.fetchall()]
 
-        query = f"""
-        SELECT Allocation_Ids
-        FROM jobs
-        WHERE Id = ?
+    def get_tasks(self, allocation_id: int) -> list[rows.TaskRow]:
         """
-        self.cursor.execute(query, (job_id,))
-        result = self.cursor.fetchone()
-        if isinstance(result, tuple):
-            result = result[0]
-        return json.loads(result)
+        Reads every task of an allocation in one query.
+        Frames of a compact allocation which were never written get a row built from the allocation.
+        :param allocation_id: ID of the allocation
+        :return: list of TaskRow ordered by Id
+        """
+        self.cursor.execute(statements.TASKS_OF_ALLOCATION, (allocation_id,))
+        tasks = [rows.TaskRow(*row) for row in self.cursor.fetchall()]
+        allocation = self.get_allocation(allocation_id)
+        if allocation.frames is None:
+            return tasks
+
+        stored = {task.id: task for task in tasks}
+        frames = FrameRange.decode(allocation.frames)
+        task_ids = range(allocation.task_base, allocation.task_base + len(frames))
+        return [stored.get(task_id) or self._default_task(allocation, frames, task_id) for task_id in task_ids]
+
+    def get_job_tasks(self, job_id: int) -> list[rows.TaskRow]:
+        """
+        Reads every task row of a job in one query.
+        Compact allocations only have rows for frames which changed state.
+        :param job_id: ID of the job
+        :return: list of TaskRow ordered by allocation then Id
+        """
+        self.cursor.execute(statements.TASKS_OF_JOB, (job_id,))
+        return [rows.TaskRow(*row) for row in self.cursor.fetchall()]
 
-    def get_task_ids(self, allocation_id: int) -> list:
+    def get_job_tree(self, job_id: int) -> tuple:
+        """
+        Reads a job together with all of its allocations and tasks in three queries regardless of the size of the job.
+        Compact allocations only list the frames which changed state, the rest are described by AllocationRow.frames.
+        :param job_id: ID of the job
+        :return: (JobRow, [(AllocationRow, [TaskRow, ...]), ...])
+        :raises IndexError: If the job does not exist
+        """
+        job = self.get_job(job_id)
+        allocations = self.get_allocations(job_id)
+        tasks = {allocation.id: [] for allocation in allocations}
+        for task in self.get_job_tasks(job_id):
+            tasks[task.allocation_id].append(task)
+        return job, [(allocation, tasks[allocation.id]) for allocation in allocations]
+
+    def count_frames(self, job_id: int) -> dict[int, dict[str, int]]:
+        """
+        Counts the frames of every allocation of a job by status.
+        Compact allocations are counted from their frame range and the few task rows they have so no per-frame rows are read.
+        :param job_id: ID of the job
+        :return: {allocation_id: {status: number of frames}}
+        """
+        allocations = self.get_allocations(job_id)
+        written = {allocation.id: {} for allocation in allocations}
+        self.cursor.execute(statements.COUNT_TASKS_BY_STATUS, (job_id,))
+        for allocation_id, status, count in self.cursor.fetchall():
+            written[allocation_id][status] = count
+
+        counts = {}
+        for allocation in allocations:
+            allocation_counts = written[allocation.id]
+            if allocation.frames is not None:
+                total = len(FrameRange.decode(allocation.frames))
+                if allocation.status == Status.DONE:
+                    allocation_counts = {Status.DONE.value: total}
+                else:
+                    pending = total - sum(allocation_counts.values())
+                    allocation_counts[Status.PENDING.value] = allocation_counts.get(Status.PENDING.value, 0) + pending
+            counts[allocation.id] = allocation_counts
+        return counts
+
+    @contextlib.contextmanager
+    def _attach_archive(self, archive_path: str):
+        """
+        Attaches the archive database as schema 'archive' for the duration of the block.
+        The archive is created or migrated the first time it is used.
+        :param archive_path: path to the archive sqlite file
+        """
+        if archive_path not in self._archives_ready:
+            archive_connection = sqlite3.connect(archive_path, timeout=10)
+            try:
+                migrations.migrate(archive_connection)
+            finally:
+                archive_connection.close()
+            self._archives_ready.add(archive_path)
+
+        self.cursor.execute('ATTACH DATABASE ? AS archive', (archive_path,))
+        try:
+            self.cursor.execute('CREATE TEMP TABLE IF NOT EXISTS archive_batch (Id INTEGER PRIMARY KEY)')
+            yield
+        finally:
+            self.cursor.execute('DROP TABLE IF EXISTS temp.archive_batch')
+            self.cursor.execute('DETACH DATABASE archive')
 
-        query = f"""
-                SELECT Task_Ids
-                FROM allocations
-                WHERE Id = ?
-                """
-        self.cursor.execute(query, (allocation_id,))
-        result = self.cursor.fetchone()[0]
+    def _move_batch(self, source: str, destination: str) -> list[int]:
+        """
+        Moves the jobs listed in temp.archive_batch with all of their allocations and tasks from source to destination,
+        replacing any copy of them destination already holds. Must be called inside a write transaction.
+        """
+        job_ids = [row[0] for row in self.cursor.execute('SELECT Id FROM temp.archive_batch ORDER BY Id').fetchall()]
+        if job_ids:
+            for statement in statements.ARCHIVE_DROP[destination] + statements.ARCHIVE_MOVE[(source, destination)]:
+                self.cursor.execute(statement)
+        self.cursor.execute('DELETE FROM temp.archive_batch')
+        return job_ids
+
+    def archive_jobs(self, archive_path: str, older_than: float, limit: int = 500) -> list[int]:
+        """
+        Moves done and failed jobs which finished more than older_than seconds ago, with their allocations and tasks, into the archive database.
+        Both databases are changed in one transaction so a job is never in both or neither. The delete from the live database only reaches the journal
+        after the commit though, so a failover in between leaves the job live as well, archiving it again replaces the archived copy.
+        :param archive_path: path to the archive sqlite file
+        :param older_than: minimum age in seconds since the job finished
+        :param limit: maximum number of jobs to move in one call which keeps the write lock short
+        :return: list of archived job ids
+        """
+        with self._attach_archive(archive_path):
+            try:
+                self.cursor.execute('BEGIN IMMEDIATE')
+                self.cursor.execute(statements.ARCHIVE_SELECT_FINISHED, (time.time() - older_than, limit))
+                job_ids = self._move_batch('main', 'archive')
+                self.connection.commit()
+            except sqlite3.Error:
+                self.connection.rollback()
+                raise
+
+        # children first like _move_batch deletes them
+        self._record_changes(self._rows_removed('tasks', 'Job_Id', job_ids) + self._rows_removed('allocations', 'Job_Id', job_ids) + self._rows_removed('jobs', 'Id', job_ids))
+        if job_ids:
+            logger.info(f'DB: Archived {len(job_ids)} jobs')
+        return job_ids
+
+    def restore_job(self, archive_path: str, job_id: int) -> bool:
+        """
+        Moves a job with its allocations and tasks from the archive database back into the live database.
+        The job counts as finishing now so it is not archived again straight away.
+        A job which is still live because a failover lost its archiving, see archive_jobs, keeps its live rows and only the archived copy is dropped.
+        :param archive_path: path to the archive sqlite file
+        :param job_id: ID of the archived job
+        :return: (bool) False if the job is not in the archive
+        """
+        with self._attach_archive(archive_path):
+            try:
+                self.cursor.execute('BEGIN IMMEDIATE')
+                self.cursor.execute('INSERT INTO temp.archive_batch (Id) SELECT Id FROM archive.jobs WHERE Id = ?', (job_id,))
+                if self.cursor.execute('SELECT 1 FROM main.jobs WHERE Id = ?', (job_id,)).fetchone() is not None:
+                    dropped = self.cursor.execute('SELECT COUNT(*) FROM temp.archive_batch').fetchone()[0] > 0
+                    for statement in statements.ARCHIVE_DROP['archive']:
+                        self.cursor.execute(statement)
+                    self.cursor.execute('DELETE FROM temp.archive_batch')
+                    self.connection.commit()
+                    if dropped:
+                        logger.warning(f'DB: Job {job_id} was archived but still live, dropped the archived copy')
+                    return dropped
+                restored = self._move_batch('archive', 'main')
+                self.cursor.execute(statements.get(statements.UPDATE_VALUE, 'jobs', 'Finished'), (time.time(), job_id))
+                changes = self._jobs_changed(restored)
+                self.connection.commit()
+            except sqlite3.Error:
+                self.connection.rollback()
+                raise
+
+        self._record_changes(changes)
+        if restored:
+            logger.info(f'DB: Restored job {job_id} from archive')
+        return bool(restored)
+
+    def get_archived_jobs(self, archive_path: str, limit: int = 100) -> list[rows.JobRow]:
+        """
+        :param archive_path: path to the archive sqlite file
+        :param limit: maximum number of jobs to return
+        :return: list of JobRow, most recently finished first
+        """
+        with self._attach_archive(archive_path):
+            self.cursor.execute(statements.ARCHIVE_LIST, (limit,))
+            return [rows.JobRow(*row) for row in self.cursor.fetchall()]
 
-        return json.loads(result)
+    def incremental_vacuum(self, pages: int = 0) -> int:
+        """
+        Hands free pages back to the file system without the full rewrite VACUUM does
+        :param pages: maximum number of pages to free, 0 frees all of them
+        :return: (int) number of pages freed
+        """
+        free_pages = self.cursor.execute('PRAGMA freelist_count').fetchone()[0]
+        self.cursor.execute(f'PRAGMA incremental_vacuum({int(pages)})').fetchall()
+        self.connection.commit()
+        return free_pages - self.cursor.execute('PRAGMA freelist_count').fetchone()[0]
@@ -0,0 +1,221 @@
+"""
+journal.py: append-only log of database mutations which is written before anything reaches sqlite
+"""
+
+from __future__ import annotations
+
+import asyncio
+import glob
+import json
+import logging
+import os
+import struct
+import typing
+import zlib
+
+logger = logging.getLogger(__name__)
+
+SYNC_INTERVAL = 0.05
+
+# length of the payload, crc32 of the payload, sequence number
+HEADER = struct.Struct('<IIQ')
+
+
+def encode_record(sequence: int, table: str, row_id: int, column: str, value: any) -> bytes:
+    return _encode(sequence, (table, row_id, column, value))
+
+
+def encode_change(sequence: int, kind: str, table: str, column: str | None, values: list) -> bytes:
+    """
+    Encodes a change which adds, rebuilds or removes whole rows, see db.DB.capture_changes
+    :param kind: 'rows' to write the rows in values, 'delete' to delete the rows whose column is one of values
+    """
+    return _encode(sequence, {'kind': kind, 'table': table, 'column': column, 'values': values})
+
+
+def _encode(sequence: int, record: tuple | dict) -> bytes:
+    payload = json.dumps(record, separators=(',', ':')).encode('utf-8')
+    return HEADER.pack(len(payload), zlib.crc32(payload), sequence) + payload
+
+
+def read_records(path: str) -> typing.Iterator[tuple[int, list | dict]]:
+    """
+    Reads every complete record of a journal segment.
+    Reading stops at the first torn or corrupt record, which can only be the tail written while the server died.
+    :param path: path to the segment
+    :return: iterator of (sequence, record). A column update is a list of [table, row_id, column, value], a change of whole rows a dict, see encode_change
+    """
+    with open(path, 'rb') as segment:
+        data = segment.read()
+
+    position = 0
+    while position + HEADER.size <= len(data):
+        length, checksum, sequence = HEADER.unpack_from(data, position)
+        payload = data[position + HEADER.size : position + HEADER.size + length]
+        if len(payload) < length or zlib.crc32(payload) != checksum:
+            logger.warning(f'Journal: discarding torn record {sequence} at byte {position} of {path}')
+            return
+        yield sequence, json.loads(payload)
+        position += HEADER.size + length
+
+
+class Journal:
+    def __init__(self, path: str, sync_interval: float = SYNC_INTERVAL):
+        """
+        Length prefixed binary journal split into numbered segments eg: Envy_Database.journal.000003.
+        Appends are buffered in memory and written with one write and fsync every sync_interval seconds.
+        The checkpointer rotates to a new segment, folds the closed ones into sqlite, then deletes them.
+        :param path: base path of the segment files
+        :param sync_interval: maximum time in seconds an appended record waits before it is durable
+        """
+        self.path = path
+        self.sync_interval = sync_interval
+        self.sequence = 0
+        self.running = False
+
+        self._segment = 0
+        self._buffer = bytearray()
+        self._lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+
+    def segments(self) -> list[tuple[int, str]]:
+        """
+        :return: sorted list of (segment number, path) of every segment on disk
+        """
+        found = []
+        for path in glob.glob(f'{glob.escape(self.path)}.*'):
+            suffix = path.rsplit('.', 1)[-1]
+            if suffix.isdigit():
+                found.append((int(suffix), path))
+        return sorted(found)
+
+    def segment_path(self, number: int) -> str:
+        return f'{self.path}.{number:06d}'
+
+    def open(self, sequence: int) -> None:
+        """
+        Starts appending to a segment after every existing one
+        :param sequence: last sequence number already used, new records continue from here
+        """
+        existing = self.segments()
+        self._segment = existing[-1][0] + 1 if existing else 1
+        self.sequence = sequence
+        logger.debug(f'Journal: appending to {self.segment_path(self._segment)} from sequence {sequence + 1}')
+
+    def append(self, table: str, row_id: int, column: str, value: any) -> int:
+        """
+        Queues a mutation. It is durable once the next sync finished, see sync()
+        :return: (int) sequence number of the record
+        """
+        self.sequence += 1
+        self._buffer += encode_record(self.sequence, table, row_id, column, value)
+        return self.sequence
+
+    def append_change(self, kind: str, table: str, column: str | None, values: list) -> int:
+        """
+        Queues a change of whole rows, see encode_change. It is durable once the next sync finished
+        :return: (int) sequence number of the record
+        """
+        self.sequence += 1
+        self._buffer += encode_change(self.sequence, kind, table, column, values)
+        return self.sequence
+
+    async def sync(self) -> None:
+        """
+        Writes and fsyncs every record appended before this call without waiting for the next sync interval
+        """
+        async with self._lock:
+            await self._write_buffer()
+
+    async def rotate(self) -> int:
+        """
+        Writes out the buffer and switches to a new segment
+        :return: (int) number of the last closed segment, everything up to it may be deleted once checkpointed
+        """
+        async with self._lock:
+            await self._write_buffer()
+            closed = self._segment
+            self._segment += 1
+            return closed
+
+    def remove_segments(self, through: int) -> None:
+        for number, path in self.segments():
+            if number > through:
+                break
+            os.remove(path)
+
+    async def start(self) -> None:
+        logger.debug('Journal: Started')
+        self.running = True
+        try:
+            while self.running:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=self.sync_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+                async with self._lock:
+                    try:
+                        await self._write_buffer()
+                    except OSError:
+                        # the records stay buffered and are retried on the next sync
+                        continue
+        finally:
+            async with self._lock:
+                await self._write_buffer()
+
+    def stop(self) -> None:
+        self.running = False
+        self._wake.set()
+
+    async def _write_buffer(self) -> None:
+        """
+        Must be called while holding self._lock
+        :raises OSError: If writing failed, the records are put back into the buffer
+        """
+        if not self._buffer:
+            return
+        data = bytes(self._buffer)
+        self._buffer.clear()
+
+        try:
+            await asyncio.to_thread(self._append_to_segment, self.segment_path(self._segment), data)
+        except OSError as e:
+            logger.error(f'Journal: failed to write {len(data)} bytes: {e}')
+            self._buffer[:0] = data
+            raise
+
+    @staticmethod
+    def _append_to_segment(path: str, data: bytes) -> None:
+        with open(path, 'ab') as segment:
+            segment.write(data)
+            segment.flush()
+            os.fsync(segment.fileno())
+
+    def replay(self, checkpoint: int) -> tuple[list, int, int]:
+        """
+        Reads every record on disk newer than checkpoint.
+        Column updates in a row are merged into one batch, changes of whole rows stay in between them so everything replays in the order it happened
+        :param checkpoint: last sequence number already folded into sqlite
+        :return: (list of changes for db.DB.apply_changes, last sequence number, last segment number).
+            A batch of column updates is ('update', None, None, {(table, row_id): {column: value}})
+        """
+        changes = []
+        sequence = checkpoint
+        last_segment = 0
+        for number, path in self.segments():
+            last_segment = number
+            for record_sequence, record in read_records(path):
+                if record_sequence <= checkpoint:
+                    continue
+                if record_sequence <= sequence:
+                    logger.warning(f'Journal: sequence {record_sequence} in {path} is out of order')
+                sequence = max(sequence, record_sequence)
+                if isinstance(record, dict):
+                    changes.append((record['kind'], record['table'], record['column'], record['values']))
+                    continue
+                table, row_id, column, value = record
+                if not changes or changes[-1][0] != 'update':
+                    changes.append(('update', None, None, {}))
+                changes[-1][3].setdefault((table, row_id), {})[column] = value
+        return changes, sequence, last_segment
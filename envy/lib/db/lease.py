@@ -0,0 +1,141 @@
+"""
+lease.py: the server lock. Whoever holds the lease in the server table of the shared database is the server.
+The holder renews the lease every RENEW_INTERVAL seconds by bumping Heartbeat.
+Everybody else judges expiry with their own clock, a lease whose row has not changed for LEASE_DURATION seconds is expired,
+so no two machines ever have to agree on the time.
+Taking over is a compare and swap against the row the candidate watched expire and bumps Token,
+which fences off a holder that was only paused: its next renewal no longer matches and it has to stop.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import dataclasses
+import logging
+import random
+import sqlite3
+import time
+
+from envy.lib.db import migrations, schema
+
+logger = logging.getLogger(__name__)
+
+LEASE_DURATION = 3.0
+RENEW_INTERVAL = 0.5
+POLL_INTERVAL = 0.25
+# spreads the candidates out so the first one to take over is usually seen by the rest before they try
+ELECTION_JITTER = 1.0
+
+
+class LeaseLost(Exception):
+    pass
+
+
+@dataclasses.dataclass(frozen=True)
+class Lease:
+    server: str | None
+    token: int
+    heartbeat: int
+
+
+def prepare(connection: sqlite3.Connection) -> None:
+    """
+    Makes sure the server table exists with its lease columns.
+    Candidates need it before any server got to migrate the shared database.
+    """
+    connection.execute(schema.SERVER_TABLE)
+    existing = migrations.columns(connection, 'server')
+    for column in ('Token', 'Heartbeat'):
+        if column not in existing:
+            connection.execute(f'ALTER TABLE server ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0')
+    connection.commit()
+
+
+def read(connection: sqlite3.Connection) -> Lease:
+    row = connection.execute('SELECT server, Token, Heartbeat FROM server WHERE Id = 1').fetchone()
+    if row is None:
+        return Lease(None, 0, 0)
+    return Lease(*row)
+
+
+def take_over(connection: sqlite3.Connection, ip: str, observed: Lease) -> int | None:
+    """
+    Takes the lease if it still looks exactly like observed
+    :param connection: connection to the shared database
+    :param ip: address of the new holder
+    :param observed: the lease the caller watched expire
+    :return: (int) the new fencing token or None if somebody else changed the lease first
+    """
+    token = observed.token + 1
+    if observed.server is None:
+        cursor = connection.execute('INSERT INTO server (Id, server, Token, Heartbeat) VALUES (1, ?, ?, 0) ON CONFLICT(Id) DO NOTHING', (ip, token))
+    else:
+        cursor = connection.execute(
+            'UPDATE server SET server = ?, Token = ?, Heartbeat = 0, timestamp = CURRENT_TIMESTAMP WHERE Id = 1 AND Token = ? AND Heartbeat = ?',
+            (ip, token, observed.token, observed.heartbeat),
+        )
+    connection.commit()
+    return token if cursor.rowcount == 1 else None
+
+
+def renew(connection: sqlite3.Connection, ip: str, token: int) -> None:
+    """
+    :raises LeaseLost: If the lease is no longer held by ip with token
+    """
+    cursor = connection.execute(
+        'UPDATE server SET Heartbeat = Heartbeat + 1, timestamp = CURRENT_TIMESTAMP WHERE Id = 1 AND Token = ? AND server = ?',
+        (token, ip),
+    )
+    connection.commit()
+    if cursor.rowcount != 1:
+        raise LeaseLost(f'lease {token} is no longer held by {ip}')
+
+
+class Election:
+    def __init__(self, path: str, ip: str, duration: float = LEASE_DURATION, poll_interval: float = POLL_INTERVAL, jitter: float = ELECTION_JITTER):
+        """
+        One round of watching the lease until it either proves to be alive or expires and this candidate tries to take it over.
+        :param path: path to the shared database holding the server table
+        :param ip: address this candidate would serve from
+        :param duration: seconds without a change after which the lease counts as expired
+        :param poll_interval: seconds between reads of the lease
+        :param jitter: up to this many extra seconds are waited before taking over
+        """
+        self.path = path
+        self.ip = ip
+        self.duration = duration
+        self.poll_interval = poll_interval
+        self.jitter = jitter
+
+    async def run(self) -> tuple[Lease, bool]:
+        """
+        Returns as soon as the lease changes, which means its holder is alive or somebody else just took it over,
+        or once this candidate took over an expired lease.
+        A candidate that loses simply gets the current lease back and should connect to its holder.
+        :return: (the current lease, True if this candidate now holds it)
+        """
+        await self._call(prepare)
+        observed = await self._call(read)
+        if observed.server is not None:
+            deadline = time.monotonic() + self.duration + random.uniform(0, self.jitter)
+            while time.monotonic() < deadline:
+                await asyncio.sleep(self.poll_interval)
+                current = await self._call(read)
+                if current != observed:
+                    return current, False
+
+        logger.info(f'Lease {observed.token} held by {observed.server} expired, taking over')
+        token = await self._call(take_over, self.ip, observed)
+        if token is None:
+            current = await self._call(read)
+            logger.info(f'Lost the election to {current.server}')
+            return current, False
+        return Lease(self.ip, token, 0), True
+
+    async def _call(self, function, *args) -> any:
+        return await asyncio.to_thread(self._run, function, *args)
+
+    def _run(self, function, *args) -> any:
+        with contextlib.closing(sqlite3.connect(self.path, timeout=10)) as connection:
+            return function(connection, *args)
@@ -0,0 +1,232 @@
+"""
+migrations.py: upgrades existing envy databases in place to the current schema version
+"""
+
+import json
+import logging
+import sqlite3
+
+from envy.lib.db import schema
+
+logger = logging.getLogger(__name__)
+
+
+def get_version(connection: sqlite3.Connection) -> int:
+    return connection.execute('PRAGMA user_version').fetchone()[0]
+
+
+def table_exists(connection: sqlite3.Connection, table: str) -> bool:
+    result = connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+    return result is not None
+
+
+def columns(connection: sqlite3.Connection, table: str) -> list:
+    return [row[1] for row in connection.execute(f'PRAGMA table_info({table})')]
+
+
+def sequence(connection: sqlite3.Connection, table: str) -> int:
+    result = connection.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,)).fetchone()
+    return 0 if result is None else result[0]
+
+
+def decode_ids(value: str | None) -> list:
+    if not value:
+        return []
+    try:
+        return [int(i) for i in json.loads(value)]
+    except (ValueError, TypeError):
+        return []
+
+
+def migrate_to_1(connection: sqlite3.Connection) -> None:
+    """
+    Version 0 stored jobs.Allocation_Ids and allocations.Task_Ids as json lists.
+    Version 1 drops those columns, relies on the Job_Id / Allocation_Id foreign keys and adds indexes.
+    Any missing foreign key is back filled from the json lists before they are dropped.
+    """
+    for table in ('jobs', 'allocations', 'tasks'):
+        connection.execute(f'ALTER TABLE {table} RENAME TO {table}_v0')
+
+    allocation_sequence = sequence(connection, 'allocations_v0')
+    task_sequence = sequence(connection, 'tasks_v0')
+
+    # back fill foreign keys which only exist inside the json lists
+    job_rows = connection.execute('SELECT Id, Allocation_Ids FROM jobs_v0').fetchall()
+    connection.executemany(
+        'UPDATE allocations_v0 SET Job_Id = ? WHERE Id = ? AND Job_Id IS NULL',
+        [(job_id, allocation_id) for job_id, allocation_ids in job_rows for allocation_id in decode_ids(allocation_ids)],
+    )
+    allocation_rows = connection.execute('SELECT Id, Job_Id, Task_Ids FROM allocations_v0').fetchall()
+    connection.executemany(
+        'UPDATE tasks_v0 SET Allocation_Id = ?, Job_Id = COALESCE(Job_Id, ?) WHERE Id = ? AND Allocation_Id IS NULL',
+        [(allocation_id, job_id, task_id) for allocation_id, job_id, task_ids in allocation_rows for task_id in decode_ids(task_ids)],
+    )
+
+    schema.create(connection.cursor())
+
+    job_columns = 'Id, Name, Purpose, Metadata, Type, Environment, Parameters, Range, Status, Dependencies, Allocation, Info'
+    connection.execute(f'INSERT INTO jobs ({job_columns}) SELECT {job_columns} FROM jobs_v0')
+    connection.execute(
+        'INSERT INTO allocations (Id, Job_Id, Computer, Status, Info) SELECT Id, Job_Id, Computer, Status, Info FROM allocations_v0 WHERE Job_Id IN (SELECT Id FROM jobs)'
+    )
+    connection.execute(
+        'INSERT INTO tasks (Id, Job_Id, Allocation_Id, Frame, Status, Computer) '
+        'SELECT Id, Job_Id, Allocation_Id, Frame, Status, Computer FROM tasks_v0 WHERE Allocation_Id IN (SELECT Id FROM allocations)'
+    )
+
+    dropped_allocations = connection.execute('SELECT COUNT(*) FROM allocations_v0').fetchone()[0] - connection.execute('SELECT COUNT(*) FROM allocations').fetchone()[0]
+    dropped_tasks = connection.execute('SELECT COUNT(*) FROM tasks_v0').fetchone()[0] - connection.execute('SELECT COUNT(*) FROM tasks').fetchone()[0]
+    if dropped_allocations or dropped_tasks:
+        logger.warning(f'Migration: discarded {dropped_allocations} orphaned allocations and {dropped_tasks} orphaned tasks')
+
+    for table in ('tasks', 'allocations', 'jobs'):
+        connection.execute(f'DROP TABLE {table}_v0')
+
+    # keep AUTOINCREMENT from ever handing out an id which was used before the migration
+    connection.execute('UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?', (allocation_sequence, 'allocations'))
+    connection.execute('UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?', (task_sequence, 'tasks'))
+
+
+def migrate_to_2(connection: sqlite3.Connection) -> None:
+    """
+    Version 2 adds jobs.Finished which the archiver uses to tell how long ago a job finished.
+    Jobs which are already finished count as finishing at the time of the migration.
+    """
+    if 'Finished' not in columns(connection, 'jobs'):
+        connection.execute('ALTER TABLE jobs ADD COLUMN Finished REAL')
+    connection.execute(f"UPDATE jobs SET Finished = {schema.NOW} WHERE Status IN ('done', 'failed') AND Finished IS NULL")
+
+
+def migrate_to_3(connection: sqlite3.Connection) -> None:
+    """
+    Version 3 lets an allocation store its frames as a range starting at a reserved block of task ids.
+    Existing allocations keep one row per task and leave both columns empty.
+    """
+    existing = columns(connection, 'allocations')
+    for column, column_type in (('Frames', 'TEXT'), ('Task_Base', 'INTEGER')):
+        if column not in existing:
+            connection.execute(f'ALTER TABLE allocations ADD COLUMN {column} {column_type}')
+
+
+def migrate_to_4(connection: sqlite3.Connection) -> None:
+    """
+    Version 4 adds the journal table which records how much of the journal has been checkpointed
+    """
+    connection.execute(schema.JOURNAL_TABLE)
+
+
+def migrate_to_5(connection: sqlite3.Connection) -> None:
+    """
+    Version 5 turns the server row into a lease, see db.lease.
+    Token is the fencing token which goes up every time the lease changes hands and Heartbeat goes up every time the holder renews it.
+    """
+    connection.execute(schema.SERVER_TABLE)
+    existing = columns(connection, 'server')
+    for column in ('Token', 'Heartbeat'):
+        if column not in existing:
+            connection.execute(f'ALTER TABLE server ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0')
+
+
+def migrate_to_6(connection: sqlite3.Connection) -> None:
+    """
+    Version 6 adds the fingerprints table which finds duplicate submissions.
+    Jobs added before it existed have no fingerprint so they are never treated as duplicated.
+    """
+    connection.execute(schema.FINGERPRINTS_TABLE)
+    for statement in schema.INDEXES:
+        if 'fingerprints' in statement:
+            connection.execute(statement)
+
+
+def migrate_to_7(connection: sqlite3.Connection) -> None:
+    """
+    Version 7 adds the environments table so jobs expanded from a bundle store their shared environment once.
+    Existing jobs keep their environment in jobs.Environment.
+    """
+    connection.execute(schema.ENVIRONMENTS_TABLE)
+    if 'Environment_Id' not in columns(connection, 'jobs'):
+        connection.execute('ALTER TABLE jobs ADD COLUMN Environment_Id INTEGER REFERENCES environments(Id)')
+
+
+def migrate_to_8(connection: sqlite3.Connection) -> None:
+    """
+    Version 8 adds jobs.Priority and jobs.Weight which the scheduler shares the farm by, see jobs.fair_share.
+    Existing jobs get the defaults so they are all treated the same.
+    """
+    existing = columns(connection, 'jobs')
+    for column, definition in (('Priority', 'INTEGER NOT NULL DEFAULT 0'), ('Weight', 'REAL NOT NULL DEFAULT 1')):
+        if column not in existing:
+            connection.execute(f'ALTER TABLE jobs ADD COLUMN {column} {definition}')
+
+
+MIGRATIONS = {
+    1: migrate_to_1,
+    2: migrate_to_2,
+    3: migrate_to_3,
+    4: migrate_to_4,
+    5: migrate_to_5,
+    6: migrate_to_6,
+    7: migrate_to_7,
+    8: migrate_to_8,
+}
+
+
+def enable_incremental_vacuum(connection: sqlite3.Connection) -> None:
+    """
+    Switches the database to auto_vacuum = INCREMENTAL so pages freed by the archiver can be handed back with PRAGMA incremental_vacuum.
+    Changing the mode of an existing database needs one full VACUUM, after that this is a no-op.
+    """
+    if connection.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+        return
+    logger.info('Enabling incremental vacuum')
+    connection.commit()
+    connection.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    connection.execute('VACUUM')
+
+
+def migrate(connection: sqlite3.Connection) -> None:
+    """
+    Brings the database up to schema.SCHEMA_VERSION.
+    A fresh database simply gets the current schema, an existing one runs every migration it is missing.
+    Each migration runs in its own transaction with foreign key enforcement disabled so tables can be rebuilt.
+    :param connection: sqlite3 connection to migrate
+    :return: Void
+    :raises sqlite3.Error: If a migration failed. The database is left at the last completed version.
+    """
+    version = get_version(connection)
+
+    if not table_exists(connection, 'jobs'):
+        # only takes effect before the first table is created, which is what makes it free here
+        connection.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        schema.create(connection.cursor())
+        connection.execute(f'PRAGMA user_version = {schema.SCHEMA_VERSION}')
+        connection.commit()
+        return
+
+    # databases created before versioning existed report version 0 even if they are already up-to-date
+    if version == 0 and 'Allocation_Ids' not in columns(connection, 'jobs'):
+        version = 1
+
+    connection.commit()
+    connection.execute('PRAGMA foreign_keys = 0')
+    try:
+        for target in range(version + 1, schema.SCHEMA_VERSION + 1):
+            logger.info(f'Migrating database to version {target}')
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                MIGRATIONS[target](connection)
+                violations = connection.execute('PRAGMA foreign_key_check').fetchall()
+                if violations:
+                    raise sqlite3.IntegrityError(f'foreign key violations after migration: {violations[:10]}')
+                connection.execute(f'PRAGMA user_version = {target}')
+                connection.commit()
+            except sqlite3.Error:
+                connection.rollback()
+                raise
+        schema.create(connection.cursor())
+        connection.execute(f'PRAGMA user_version = {schema.SCHEMA_VERSION}')
+        connection.commit()
+    finally:
+        connection.execute('PRAGMA foreign_keys = 1')
+
+    enable_incremental_vacuum(connection)
@@ -0,0 +1,175 @@
+"""
+replica.py: keeps a consistent copy of the servers local database on the share so another server can take over from it
+"""
+
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import logging
+import os
+import shutil
+import sqlite3
+import time
+
+from envy.lib.db import db as database_module
+from envy.lib.db import migrations
+from envy.lib.db.async_db import AsyncDB
+from envy.lib.db.writer import DBWriter
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_INTERVAL = 30.0
+
+
+@dataclasses.dataclass
+class SnapshotMetrics:
+    snapshots: int = 0
+    failed_snapshots: int = 0
+    last_size: int = 0
+    last_backup_time: float = 0.0
+    last_copy_time: float = 0.0
+    max_backup_time: float = 0.0
+    max_copy_time: float = 0.0
+
+    def record_snapshot(self, size: int, backup_time: float, copy_time: float) -> None:
+        self.snapshots += 1
+        self.last_size = size
+        self.last_backup_time = backup_time
+        self.last_copy_time = copy_time
+        self.max_backup_time = max(self.max_backup_time, backup_time)
+        self.max_copy_time = max(self.max_copy_time, copy_time)
+
+
+def backup(source: sqlite3.Connection, path: str) -> None:
+    """
+    Writes a consistent copy of source to path using the sqlite backup api
+    :param source: connection to copy
+    :param path: file to write, replaced if it exists
+    """
+    for stale in (path, f'{path}-wal', f'{path}-shm'):
+        if os.path.exists(stale):
+            os.remove(stale)
+    destination = sqlite3.connect(path)
+    try:
+        source.backup(destination)
+    finally:
+        destination.close()
+
+
+def _has_jobs(path: str) -> bool:
+    """
+    :return: (bool) True if path is a database with a jobs table, the shared database of a farm set up after replication only holds the lease
+    """
+    if not os.path.isfile(path):
+        return False
+    connection = sqlite3.connect(f'file:{path}?mode=ro', uri=True, timeout=10)
+    try:
+        return migrations.table_exists(connection, 'jobs')
+    finally:
+        connection.close()
+
+
+def restore(local_path: str, snapshot_path: str, legacy_path: str = None) -> str | None:
+    """
+    Replaces the local working database with the newest copy on the share.
+    That is the snapshot if one exists, otherwise a database from before replication existed at legacy_path.
+    The journal on the share is replayed on top of it later by DBWriter.recover().
+    :param local_path: the servers working database
+    :param snapshot_path: snapshot written by Replica
+    :param legacy_path: shared database used before replication, only read when there is no snapshot
+    :return: path of the file which was restored or None if the server starts with an empty database
+    """
+    source_path = None
+    if os.path.isfile(snapshot_path):
+        source_path = snapshot_path
+    elif legacy_path is not None and _has_jobs(legacy_path):
+        source_path = legacy_path
+
+    os.makedirs(os.path.dirname(local_path), exist_ok=True)
+    if source_path is None:
+        for stale in (local_path, f'{local_path}-wal', f'{local_path}-shm'):
+            if os.path.exists(stale):
+                os.remove(stale)
+        return None
+
+    logger.info(f'Replica: restoring {local_path} from {source_path}')
+    source = sqlite3.connect(f'file:{source_path}?mode=ro', uri=True, timeout=10)
+    try:
+        backup(source, local_path)
+    finally:
+        source.close()
+    return source_path
+
+
+class Replica:
+    def __init__(self, database: AsyncDB, writer: DBWriter, snapshot_path: str, interval: float = SNAPSHOT_INTERVAL):
+        """
+        Periodically copies the local database to snapshot_path on the share.
+        A snapshot is taken right after a checkpoint so it contains every journal segment up to DBWriter.checkpointed_segment,
+        which are deleted once the snapshot is in place. The journal on the share therefore only ever holds what the last snapshot is missing,
+        including rows which were added, rebuilt or removed since, see DBWriter.run_journaled.
+        :param database: the servers AsyncDB
+        :param writer: the DBWriter checkpointing the journal into database
+        :param snapshot_path: where the snapshot is written
+        :param interval: seconds between snapshots
+        """
+        self.database = database
+        self.writer = writer
+        self.snapshot_path = snapshot_path
+        self.interval = interval
+        self.metrics = SnapshotMetrics()
+        self.running = False
+
+        self.writer.retain_segments = True
+
+    async def snapshot(self) -> None:
+        """
+        Writes one snapshot. The backup runs on the database thread into a local file so the database is only busy
+        for as long as a local copy takes, the slow copy to the share happens on another thread.
+        """
+        await self.writer.flush()
+        segment = self.writer.checkpointed_segment
+
+        local_copy = f'{self.database.db_path}.snapshot'
+        start = time.perf_counter()
+        await self.database.run(self._backup, self.database.db, local_copy)
+        backup_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        await asyncio.to_thread(self._copy_to_share, local_copy, self.snapshot_path)
+        copy_time = time.perf_counter() - start
+
+        size = os.path.getsize(self.snapshot_path)
+        self.metrics.record_snapshot(size, backup_time, copy_time)
+        logger.debug(f'Replica: wrote {size // 1024}KB snapshot (backup {backup_time * 1000:.1f}ms, copy {copy_time * 1000:.1f}ms)')
+
+        if self.writer.journal is not None:
+            await asyncio.to_thread(self.writer.journal.remove_segments, segment)
+
+    async def start(self) -> None:
+        logger.debug('Replica: Started')
+        self.running = True
+        while self.running:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.snapshot()
+            except (OSError, sqlite3.Error) as e:
+                self.metrics.failed_snapshots += 1
+                logger.error(f'Replica: failed to write snapshot: {e}')
+
+    def stop(self) -> None:
+        self.running = False
+
+    @staticmethod
+    def _backup(database: database_module.DB, path: str) -> None:
+        backup(database.connection, path)
+
+    @staticmethod
+    def _copy_to_share(source: str, destination: str) -> None:
+        # copy next to the destination first so a reader never sees half a snapshot
+        temporary = f'{destination}.tmp'
+        shutil.copyfile(source, temporary)
+        with open(temporary, 'rb+') as snapshot:
+            os.fsync(snapshot.fileno())
+        os.replace(temporary, destination)
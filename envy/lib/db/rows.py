@@ -0,0 +1,74 @@
+"""
+rows.py: lightweight row objects returned by the bulk read api of db.DB
+"""
+
+from __future__ import annotations
+
+from envy.lib.db import schema
+
+
+class Row:
+    """
+    Base class for a single database row. Attributes are the lower cased column names of the table.
+    Rows still index and unpack like the tuples sqlite returns so older code reading values by position keeps working.
+    """
+
+    __slots__ = ()
+    table = None
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values, strict=True):
+            setattr(self, name, value)
+
+    def __getitem__(self, index: int | slice) -> any:
+        return self.as_tuple()[index]
+
+    def __iter__(self):
+        return iter(self.as_tuple())
+
+    def __len__(self) -> int:
+        return len(self.__slots__)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, Row):
+            return self.table == other.table and self.as_tuple() == other.as_tuple()
+        if isinstance(other, tuple):
+            return self.as_tuple() == other
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        # hashes like the tuple it equals so rows and tuples can be mixed in sets and as dict keys
+        return hash(self.as_tuple())
+
+    def __repr__(self) -> str:
+        values = ', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)
+        return f'{self.__class__.__name__}({values})'
+
+    def as_tuple(self) -> tuple:
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    @classmethod
+    def columns(cls) -> tuple:
+        return schema.COLUMNS[cls.table]
+
+
+def _slots(table: str) -> tuple:
+    return tuple(column.lower() for column in schema.COLUMNS[table])
+
+
+class JobRow(Row):
+    __slots__ = _slots('jobs')
+    table = 'jobs'
+
+
+class AllocationRow(Row):
+    __slots__ = _slots('allocations')
+    table = 'allocations'
+
+
+class TaskRow(Row):
+    __slots__ = _slots('tasks')
+    table = 'tasks'
+
+
+ROW_TYPES = {row_type.table: row_type for row_type in (JobRow, AllocationRow, TaskRow)}
@@ -0,0 +1,180 @@
+"""
+schema.py: table and index definitions for the envy database
+"""
+
+SCHEMA_VERSION = 8
+
+SERVER_TABLE = """
+    CREATE TABLE IF NOT EXISTS server(
+    Id INTEGER PRIMARY KEY CHECK (Id = 1),
+    server TEXT UNIQUE,
+    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+    Token INTEGER NOT NULL DEFAULT 0,
+    Heartbeat INTEGER NOT NULL DEFAULT 0
+    )
+    """
+
+JOBS_TABLE = """
+    CREATE TABLE IF NOT EXISTS jobs
+    (Id INTEGER PRIMARY KEY,
+    Name TEXT NOT NULL,
+    Purpose TEXT,
+    Metadata TEXT,
+    Type TEXT,
+    Environment TEXT,
+    Parameters TEXT,
+    Range TEXT,
+    Status TEXT,
+    Dependencies TEXT,
+    Allocation INTEGER,
+    Info TEXT,
+    Finished REAL,
+    Environment_Id INTEGER,
+    Priority INTEGER NOT NULL DEFAULT 0,
+    Weight REAL NOT NULL DEFAULT 1,
+    FOREIGN KEY(Environment_Id) REFERENCES environments(Id))
+    """
+
+# environments shared by many jobs are stored once, jobs which reference one leave jobs.Environment empty
+ENVIRONMENTS_TABLE = """
+    CREATE TABLE IF NOT EXISTS environments(
+    Id INTEGER PRIMARY KEY,
+    Hash TEXT NOT NULL UNIQUE,
+    Environment TEXT NOT NULL
+    )
+    """
+
+ALLOCATIONS_TABLE = """
+    CREATE TABLE IF NOT EXISTS allocations
+    (Id INTEGER PRIMARY KEY AUTOINCREMENT,
+    Job_Id INTEGER NOT NULL,
+    Computer TEXT,
+    Status TEXT,
+    Info TEXT,
+    Frames TEXT,
+    Task_Base INTEGER,
+    FOREIGN KEY(Job_Id) REFERENCES jobs(Id))
+    """
+
+TASKS_TABLE = """
+    CREATE TABLE IF NOT EXISTS tasks
+    (Id INTEGER PRIMARY KEY AUTOINCREMENT,
+    Job_Id INTEGER NOT NULL,
+    Allocation_Id INTEGER NOT NULL,
+    Frame INTEGER,
+    Status TEXT,
+    Computer TEXT,
+    FOREIGN KEY(Job_Id) REFERENCES jobs(Id),
+    FOREIGN KEY(Allocation_Id) REFERENCES allocations(Id))
+    """
+
+# last journal sequence number folded into the tables, see journal.py
+JOURNAL_TABLE = """
+    CREATE TABLE IF NOT EXISTS journal(
+    Id INTEGER PRIMARY KEY CHECK (Id = 1),
+    Sequence INTEGER NOT NULL
+    )
+    """
+
+# content hash of every job added recently, see job.Job.fingerprint and DB.add_jobs
+FINGERPRINTS_TABLE = """
+    CREATE TABLE IF NOT EXISTS fingerprints(
+    Job_Id INTEGER PRIMARY KEY,
+    Fingerprint TEXT NOT NULL,
+    Created REAL NOT NULL
+    )
+    """
+
+COLUMNS = {
+    'jobs': (
+        'Id',
+        'Name',
+        'Purpose',
+        'Metadata',
+        'Type',
+        'Environment',
+        'Parameters',
+        'Range',
+        'Status',
+        'Dependencies',
+        'Allocation',
+        'Info',
+        'Finished',
+        'Environment_Id',
+        'Priority',
+        'Weight',
+    ),
+    'allocations': ('Id', 'Job_Id', 'Computer', 'Status', 'Info', 'Frames', 'Task_Base'),
+    'tasks': ('Id', 'Job_Id', 'Allocation_Id', 'Frame', 'Status', 'Computer'),
+}
+
+# primary key and columns of every table whose rows are journaled whole when they are added, rebuilt or removed, see db.DB.capture_changes
+JOURNALED_TABLES = {
+    'environments': ('Id', ('Id', 'Hash', 'Environment')),
+    'jobs': ('Id', COLUMNS['jobs']),
+    'allocations': ('Id', COLUMNS['allocations']),
+    'tasks': ('Id', COLUMNS['tasks']),
+    'fingerprints': ('Job_Id', ('Job_Id', 'Fingerprint', 'Created')),
+}
+
+TABLES = (SERVER_TABLE, ENVIRONMENTS_TABLE, JOBS_TABLE, ALLOCATIONS_TABLE, TASKS_TABLE, JOURNAL_TABLE, FINGERPRINTS_TABLE)
+
+INDEXES = (
+    'CREATE INDEX IF NOT EXISTS tasks_allocation_status ON tasks(Allocation_Id, Status)',
+    'CREATE INDEX IF NOT EXISTS tasks_job ON tasks(Job_Id)',
+    'CREATE INDEX IF NOT EXISTS allocations_job_status ON allocations(Job_Id, Status)',
+    'CREATE INDEX IF NOT EXISTS jobs_status ON jobs(Status)',
+    'CREATE INDEX IF NOT EXISTS allocations_task_base ON allocations(Task_Base) WHERE Task_Base IS NOT NULL',
+    'CREATE INDEX IF NOT EXISTS fingerprints_fingerprint ON fingerprints(Fingerprint, Created)',
+    'CREATE INDEX IF NOT EXISTS fingerprints_created ON fingerprints(Created)',
+)
+
+# unix time as a float, works on sqlite versions older than unixepoch()
+NOW = "((julianday('now') - 2440587.5) * 86400.0)"
+
+# stamps jobs.Finished whenever a job becomes done or failed so the archiver knows how old it is
+TRIGGERS = (
+    f"""
+    CREATE TRIGGER IF NOT EXISTS jobs_finished AFTER UPDATE OF Status ON jobs
+    WHEN NEW.Status IS NOT OLD.Status
+    BEGIN
+        UPDATE jobs
+        SET Finished = CASE WHEN NEW.Status IN ('done', 'failed') THEN COALESCE(OLD.Finished, {NOW}) ELSE NULL END
+        WHERE Id = NEW.Id;
+    END
+    """,
+    # a compact allocation which is done implies every frame is done so the per-frame rows are no longer needed
+    """
+    CREATE TRIGGER IF NOT EXISTS allocations_collapse AFTER UPDATE OF Status ON allocations
+    WHEN NEW.Status = 'done' AND NEW.Frames IS NOT NULL
+    BEGIN
+        DELETE FROM tasks WHERE Allocation_Id = NEW.Id AND Status = 'done';
+    END
+    """,
+)
+
+
+def create(cursor) -> None:
+    """
+    Creates every table, index and trigger of the current schema version if they do not exist yet
+    :param cursor: sqlite3 cursor to execute on
+    :return: Void
+    """
+    for statement in TABLES:
+        cursor.execute(statement)
+    for statement in INDEXES:
+        cursor.execute(statement)
+    for statement in TRIGGERS:
+        cursor.execute(statement)
+
+
+def validate_column(table: str, column: str) -> None:
+    """
+    Makes sure a table and column name are part of the schema before they get formatted into sql
+    :param table: name of the table
+    :param column: name of the column
+    :return: Void
+    :raises ValueError: If the table or column does not exist
+    """
+    if column not in COLUMNS.get(table, ()):
+        raise ValueError(f'{table}.{column} is not a valid column')
@@ -0,0 +1,143 @@
+"""
+statements.py: every sql statement the read and write helpers of db.DB use, built once from the schema.
+Table and column names never come from callers directly, they are only used as keys into these caches
+so anything that is not part of the schema is rejected before it gets anywhere near sql.
+"""
+
+from __future__ import annotations
+
+from envy.lib.db import schema
+
+
+def _select_columns(table: str) -> str:
+    return ', '.join(schema.COLUMNS[table])
+
+
+def _environment(database: str = 'main') -> str:
+    # a job either holds its environment or references a shared one, see db.DB._environment_id
+    return f'COALESCE(jobs.Environment, (SELECT environments.Environment FROM {database}.environments WHERE environments.Id = jobs.Environment_Id))'
+
+
+def _select_job_columns(database: str = 'main') -> str:
+    return ', '.join(_environment(database) if column == 'Environment' else column for column in schema.COLUMNS['jobs'])
+
+
+SELECT_ROW = {table: f'SELECT {_select_columns(table)} FROM {table} WHERE Id = ?' for table in schema.COLUMNS}
+SELECT_ROW['jobs'] = f'SELECT {_select_job_columns()} FROM jobs WHERE Id = ?'
+
+SELECT_VALUE = {(table, column): f'SELECT {column} FROM {table} WHERE Id = ?' for table, columns in schema.COLUMNS.items() for column in columns}
+SELECT_VALUE[('jobs', 'Environment')] = f'SELECT {_environment()} FROM jobs WHERE Id = ?'
+
+SELECT_IDS_BY_VALUE = {(table, column): f'SELECT Id FROM {table} WHERE {column} = ?' for table, columns in schema.COLUMNS.items() for column in columns}
+
+UPDATE_VALUE = {(table, column): f'UPDATE {table} SET {column} = ? WHERE Id = ?' for table, columns in schema.COLUMNS.items() for column in columns}
+
+ALLOCATIONS_OF_JOB = f'SELECT {_select_columns("allocations")} FROM allocations WHERE Job_Id = ? ORDER BY Id'
+
+TASKS_OF_ALLOCATION = f'SELECT {_select_columns("tasks")} FROM tasks WHERE Allocation_Id = ? ORDER BY Id'
+
+TASKS_OF_JOB = f'SELECT {_select_columns("tasks")} FROM tasks WHERE Job_Id = ? ORDER BY Allocation_Id, Id'
+
+
+def get(cache: dict, table: str, column: str = None) -> str:
+    """
+    Looks up a prepared statement
+    :param cache: one of the statement dicts of this module
+    :param table: name of the table
+    :param column: name of the column if the statement is per column
+    :return: (str) the sql statement
+    :raises ValueError: If the table or column is not part of the schema
+    """
+    key = table if column is None else (table, column)
+    try:
+        return cache[key]
+    except KeyError:
+        raise ValueError(f'{table}.{column} is not a valid column' if column is not None else f'{table} is not a valid table') from None
+
+
+def _copy(table: str, source: str, destination: str, batch_column: str) -> str:
+    return (
+        f'INSERT INTO {destination}.{table} ({_select_columns(table)}) '
+        f'SELECT {_select_columns(table)} FROM {source}.{table} WHERE {batch_column} IN (SELECT Id FROM temp.archive_batch)'
+    )
+
+
+def _copy_jobs(source: str, destination: str) -> str:
+    # shared environments are written into the job itself so each database stands on its own
+    select_columns = ', '.join(_environment(source) if column == 'Environment' else 'NULL' if column == 'Environment_Id' else column for column in schema.COLUMNS['jobs'])
+    return f'INSERT INTO {destination}.jobs ({_select_columns("jobs")}) SELECT {select_columns} FROM {source}.jobs WHERE Id IN (SELECT Id FROM temp.archive_batch)'
+
+
+def _delete(table: str, source: str, batch_column: str) -> str:
+    return f'DELETE FROM {source}.{table} WHERE {batch_column} IN (SELECT Id FROM temp.archive_batch)'
+
+
+# jobs are moved parent first and deleted child first so foreign keys hold in both databases the whole time
+ARCHIVE_MOVE = {
+    (source, destination): (
+        _copy_jobs(source, destination),
+        _copy('allocations', source, destination, 'Job_Id'),
+        _copy('tasks', source, destination, 'Job_Id'),
+        _delete('tasks', source, 'Job_Id'),
+        _delete('allocations', source, 'Job_Id'),
+        _delete('jobs', source, 'Id'),
+    )
+    for source, destination in (('main', 'archive'), ('archive', 'main'))
+}
+
+# a job can be live and archived at once when a failover lost the delete of an archive batch, the copy being replaced is dropped first
+ARCHIVE_DROP = {
+    schema_name: tuple(_delete(table, schema_name, batch_column) for table, batch_column in (('tasks', 'Job_Id'), ('allocations', 'Job_Id'), ('jobs', 'Id')))
+    for schema_name in ('main', 'archive')
+}
+
+ARCHIVE_SELECT_FINISHED = "INSERT INTO temp.archive_batch (Id) SELECT Id FROM main.jobs WHERE Status IN ('done', 'failed') AND Finished < ? ORDER BY Finished LIMIT ?"
+
+ARCHIVE_LIST = f'SELECT {_select_job_columns("archive")} FROM archive.jobs ORDER BY Finished DESC LIMIT ?'
+
+COMPACT_ALLOCATION_OF_TASK = f'SELECT {_select_columns("allocations")} FROM allocations WHERE Task_Base <= ? AND Task_Base IS NOT NULL ORDER BY Task_Base DESC LIMIT 1'
+
+SELECT_ALLOCATIONS = f'SELECT {_select_columns("allocations")} FROM allocations WHERE Id IN'
+
+INSERT_ALLOCATION = f'INSERT INTO allocations ({_select_columns("allocations")}) VALUES ({", ".join("?" * len(schema.COLUMNS["allocations"]))})'
+
+DELETE_ALLOCATION = 'DELETE FROM allocations WHERE Id = ?'
+
+# task rows of a compact allocation which was rechunked follow their block of task ids to the allocation which holds it now
+MOVE_TASKS = 'UPDATE tasks SET Allocation_Id = ? WHERE Id BETWEEN ? AND ?'
+
+INSERT_TASK = f'INSERT INTO tasks ({_select_columns("tasks")}) VALUES ({", ".join("?" * len(schema.COLUMNS["tasks"]))})'
+
+COUNT_TASKS_BY_STATUS = 'SELECT Allocation_Id, Status, COUNT(*) FROM tasks WHERE Job_Id = ? GROUP BY Allocation_Id, Status'
+
+SET_CHECKPOINT = 'INSERT INTO journal (Id, Sequence) VALUES (1, ?) ON CONFLICT(Id) DO UPDATE SET Sequence = MAX(Sequence, excluded.Sequence)'
+
+INSERT_FINGERPRINT = 'INSERT OR REPLACE INTO fingerprints (Job_Id, Fingerprint, Created) VALUES (?, ?, ?)'
+
+# only jobs which are still in the database and not finished yet count as duplicates, re-submitting finished work renders it again
+FIND_FINGERPRINT = (
+    'SELECT fingerprints.Job_Id FROM fingerprints JOIN jobs ON jobs.Id = fingerprints.Job_Id '
+    "WHERE fingerprints.Fingerprint = ? AND fingerprints.Created >= ? AND jobs.Status NOT IN ('done', 'failed') "
+    'ORDER BY fingerprints.Created DESC LIMIT 1'
+)
+
+PRUNE_FINGERPRINTS = 'DELETE FROM fingerprints WHERE Created < ?'
+
+INSERT_ENVIRONMENT = 'INSERT OR IGNORE INTO environments (Hash, Environment) VALUES (?, ?)'
+
+SELECT_ENVIRONMENT_ID = 'SELECT Id FROM environments WHERE Hash = ?'
+
+
+def _upsert(table: str) -> str:
+    key, columns = schema.JOURNALED_TABLES[table]
+    assignments = ', '.join(f'{column} = excluded.{column}' for column in columns if column != key)
+    # an upsert rather than INSERT OR REPLACE which would delete the row first and with it every row referencing it
+    return f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))}) ON CONFLICT({key}) DO UPDATE SET {assignments}'
+
+
+# whole rows of a change written to the journal and replayed from it, see db.DB.capture_changes
+SELECT_JOURNALED = {(table, column): f'SELECT {", ".join(columns)} FROM {table} WHERE {column} IN' for table, (_, columns) in schema.JOURNALED_TABLES.items() for column in columns}
+
+UPSERT_ROWS = {table: _upsert(table) for table in schema.JOURNALED_TABLES}
+
+DELETE_ROWS = {(table, column): f'DELETE FROM {table} WHERE {column} IN' for table, (_, columns) in schema.JOURNALED_TABLES.items() for column in columns}
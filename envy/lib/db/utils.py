@@ -2,15 +2,19 @@ import sqlite3
 import os
 import envy
 
+from envy.lib.db import lease
 
-def get_server_ip() -> str:
-    path = os.path.join(os.path.dirname(envy.__file__), 'Jobs')
-    database = 'Envy_Database.db'
-    database_path = os.path.join(path, database)
+
+def get_shared_database_path() -> str:
+    return os.path.join(os.path.dirname(envy.__file__), 'Jobs', 'Envy_Database.db')
+
+
+def get_server_ip() -> str | None:
+    database_path = get_shared_database_path()
     con = sqlite3.connect(f'file:{database_path}?mode=ro', uri=True, timeout=5)
-    cursor = con.cursor()
-    query = "SELECT server FROM server"
-    cursor.execute(query)
-    result = cursor.fetchone()[0]
+    try:
+        result = lease.read(con).server
+    finally:
+        con.close()
 
     return result
@@ -0,0 +1,275 @@
+"""
+writer.py: batches database mutations so bursts of status updates become a handful of commits
+"""
+
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import inspect
+import logging
+import time
+
+from envy.lib.db import schema
+from envy.lib.db.journal import Journal
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 0.25
+CHECKPOINT_INTERVAL = 5.0
+MAX_BATCH_SIZE = 500
+
+
+@dataclasses.dataclass
+class WriterMetrics:
+    mutations: int = 0
+    rows_written: int = 0
+    batches: int = 0
+    failed_batches: int = 0
+    last_batch_size: int = 0
+    max_batch_size: int = 0
+    last_commit_latency: float = 0.0
+    max_commit_latency: float = 0.0
+    total_commit_latency: float = 0.0
+
+    @property
+    def average_batch_size(self) -> float:
+        if self.batches == 0:
+            return 0.0
+        return self.rows_written / self.batches
+
+    @property
+    def average_commit_latency(self) -> float:
+        if self.batches == 0:
+            return 0.0
+        return self.total_commit_latency / self.batches
+
+    def record_batch(self, size: int, latency: float) -> None:
+        self.batches += 1
+        self.rows_written += size
+        self.last_batch_size = size
+        self.max_batch_size = max(self.max_batch_size, size)
+        self.last_commit_latency = latency
+        self.max_commit_latency = max(self.max_commit_latency, latency)
+        self.total_commit_latency += latency
+
+
+class DBWriter:
+    def __init__(self, db, flush_interval: float = FLUSH_INTERVAL, max_batch_size: int = MAX_BATCH_SIZE, journal: Journal = None):
+        """
+        Collects row updates and applies them to the database in batched transactions.
+        Repeated updates to the same row are merged so only the latest value of each column gets written.
+        Exposes the same set_*_value methods as DB so it can be used in its place by anything that only writes,
+        and the DB methods which add, rebuild or remove rows as coroutines which journal those rows, see run_journaled.
+        While a batch is being committed new mutations keep collecting for the next one.
+        With a journal every mutation is appended to it first which makes it durable after one sequential write,
+        each batch then acts as a checkpoint folding the journal into sqlite. Call recover() before the first mutation.
+        :param db: the DB or AsyncDB object to write to
+        :param flush_interval: maximum time in seconds a mutation waits before it is committed
+        :param max_batch_size: number of pending rows which triggers an early flush
+        :param journal: optional journal.Journal
+        """
+        self.db = db
+        self.journal = journal
+        # when something else, eg: db.replica.Replica, still needs checkpointed segments it deletes them itself
+        self.retain_segments = False
+        self.checkpointed_segment = 0
+        self.flush_interval = flush_interval
+        self.max_batch_size = max_batch_size
+        self.metrics = WriterMetrics()
+        self.running = False
+
+        self._pending: dict[tuple[str, int], dict[str, any]] = {}
+        self._waiters: list[asyncio.Future] = []
+        self._writing = False
+        self._wake = asyncio.Event()
+
+    def set_value(self, table: str, row_id: int, column: str, value: any) -> None:
+        """
+        Queues an update of a single column
+        :raises ValueError: If the table or column is not part of the schema
+        """
+        schema.validate_column(table, column)
+        if self.journal is not None:
+            self.journal.append(table, row_id, column, value)
+        self._pending.setdefault((table, row_id), {})[column] = value
+        self.metrics.mutations += 1
+
+        if len(self._pending) >= self.max_batch_size:
+            self._wake.set()
+
+    def set_task_value(self, task_id: int, column: str, value: any) -> None:
+        self.set_value('tasks', task_id, column, value)
+
+    def set_allocation_value(self, allocation_id: int, column: str, value: any) -> None:
+        self.set_value('allocations', allocation_id, column, value)
+
+    def set_job_value(self, job_id: int, column: str, value: any) -> None:
+        self.set_value('jobs', job_id, column, value)
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    async def flush(self) -> None:
+        """
+        Waits until every mutation queued before this call is committed.
+        :raises sqlite3.Error: If the batch containing those mutations failed to commit
+        """
+        if not self._pending and not self._writing:
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._wake.set()
+        await waiter
+
+    async def recover(self) -> int:
+        """
+        Replays every journal record which was not checkpointed yet, eg: after the server died, then opens the journal for appending.
+        Replay only depends on what is on disk so recovering twice from the same files gives the same database.
+        :return: (int) number of rows replayed
+        """
+        if self.journal is None:
+            return 0
+
+        checkpoint = await self._call(self.db.get_checkpoint)
+        changes, sequence, last_segment = await asyncio.to_thread(self.journal.replay, checkpoint)
+        replayed = 0
+        if changes:
+            replayed = await self._call(self.db.apply_changes, changes, sequence)
+            logger.info(f'Replayed {replayed} rows from the journal ({checkpoint + 1} - {sequence})')
+        self.checkpointed_segment = last_segment
+        if not self.retain_segments:
+            await asyncio.to_thread(self.journal.remove_segments, last_segment)
+        self.journal.open(sequence)
+        return replayed
+
+    async def run_journaled(self, name: str, *args, **kwargs) -> any:
+        """
+        Runs a DB method which adds, rebuilds or removes rows and appends the rows it changed to the journal, see DB.capture_changes.
+        Returns once they are synced so the change survives a failover as soon as the caller acknowledges it,
+        without the rows having to wait for the next snapshot of the whole database, see db.replica.Replica
+        :param name: name of the DB method eg: 'add_jobs'
+        :return: whatever the method returned
+        """
+        if self.journal is None:
+            return await self._call(getattr(self.db, name), *args, **kwargs)
+
+        result, changes = await self._call(self.db.capture_changes, name, *args, **kwargs)
+        if changes:
+            for change in changes:
+                self.journal.append_change(*change)
+            try:
+                await self.journal.sync()
+            except OSError as e:
+                # the records stay buffered and the journal retries them on its next sync
+                logger.error(f'Failed to journal the rows changed by {name}: {e}')
+        return result
+
+    async def add_jobs(self, jobs: list, compact: bool = True, window: float = None) -> list[int] | None:
+        return await self.run_journaled('add_jobs', jobs, compact=compact, window=window)
+
+    async def rechunk_allocations(self, allocation_ids: list[int], sizes: list[int]) -> list | None:
+        return await self.run_journaled('rechunk_allocations', allocation_ids, sizes)
+
+    async def split_allocation(self, allocation_id: int, index: int) -> any:
+        return await self.run_journaled('split_allocation', allocation_id, index)
+
+    async def archive_jobs(self, archive_path: str, older_than: float, limit: int = 500) -> list[int]:
+        return await self.run_journaled('archive_jobs', archive_path, older_than, limit)
+
+    async def restore_job(self, archive_path: str, job_id: int) -> bool:
+        return await self.run_journaled('restore_job', archive_path, job_id)
+
+    async def start(self) -> None:
+        logger.debug('Started')
+        self.running = True
+        journal_task = None
+        if self.journal is not None:
+            journal_task = asyncio.create_task(self.journal.start(), name='journal.start()')
+        try:
+            while self.running:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+                await self._write_batch()
+        finally:
+            await self._write_batch()
+            if journal_task is not None:
+                self.journal.stop()
+                await journal_task
+
+    def stop(self) -> None:
+        self.running = False
+        self._wake.set()
+
+    @staticmethod
+    async def _call(function, *args, **kwargs) -> any:
+        result = function(*args, **kwargs)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    async def _write_batch(self) -> None:
+        waiters = self._waiters
+        self._waiters = []
+
+        if not self._pending:
+            self._resolve(waiters)
+            return
+
+        self._writing = True
+        start = time.perf_counter()
+        closed_segment = sequence = None
+        try:
+            if self.journal is not None:
+                closed_segment = await self.journal.rotate()
+                sequence = self.journal.sequence
+            batch = self._pending
+            self._pending = {}
+        except OSError as e:
+            self._writing = False
+            self.metrics.failed_batches += 1
+            self._resolve(waiters, e)
+            return
+
+        try:
+            size = await self._call(self.db.apply_updates, batch, sequence)
+        except Exception as e:
+            logger.error(f'Failed to write batch of {len(batch)} rows: {e}')
+            self.metrics.failed_batches += 1
+            # keep the failed rows but let anything queued since take precedence
+            for key, values in self._pending.items():
+                batch.setdefault(key, {}).update(values)
+            self._pending = batch
+            self._resolve(waiters, e)
+            return
+        finally:
+            self._writing = False
+
+        if closed_segment is not None:
+            self.checkpointed_segment = closed_segment
+
+        if closed_segment is not None and not self.retain_segments:
+            try:
+                await asyncio.to_thread(self.journal.remove_segments, closed_segment)
+            except OSError as e:
+                # already checkpointed so replaying them is harmless, the next checkpoint removes them
+                logger.warning(f'Failed to remove checkpointed journal segments: {e}')
+
+        latency = time.perf_counter() - start
+        self.metrics.record_batch(size, latency)
+        logger.debug(f'Wrote {size} rows in {latency * 1000:.1f}ms')
+        self._resolve(waiters)
+
+    @staticmethod
+    def _resolve(waiters: list[asyncio.Future], exception: Exception = None) -> None:
+        for waiter in waiters:
+            if waiter.done():
+                continue
+            if exception is None:
+                waiter.set_result(None)
+            else:
+                waiter.set_exception(exception)
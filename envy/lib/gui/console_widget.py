@@ -12,13 +12,12 @@ import logging
 
 class ConsoleWidget(QWidget):
 
-    jobs_sync_job = Signal(
-        float
-    )  # these are floats because ittie bittie 4Byte ints cant hold my raw power. Remember to cast them to int in the slot
+    # ids are 64-bit, see utils.ids. A Signal(int) is 32-bit and a float loses precision past 2**53 so they are passed as python objects
+    jobs_sync_job = Signal(object)
 
-    jobs_finish_job = Signal(float)
-    jobs_finish_allocation = Signal(float)
-    jobs_finish_task = Signal(float)
+    jobs_finish_job = Signal(object)
+    jobs_finish_allocation = Signal(object)
+    jobs_finish_task = Signal(object)
 
     jobs_add_dependency = Signal(str)
 
@@ -7,13 +7,13 @@ class JobTreeController(QObject):
         super().__init__()
         self.model = model
 
-    @Slot(float)
-    def mark_job_as_finished(self, job_id: float) -> None:  # these need to be casted from float to int
+    @Slot(object)
+    def mark_job_as_finished(self, job_id: int) -> None:
         self.model.finish_job(int(job_id))
 
 
-    @Slot(float)
-    def sync_job(self, job_id: float) -> None:
+    @Slot(object)
+    def sync_job(self, job_id: int) -> None:
         self.model.sync_job(int(job_id))
 
     @Slot(tuple)
@@ -22,11 +22,11 @@ class JobTreeController(QObject):
         computer = data_tuple[1]
         self.model.start_task(task_id, computer)
 
-    @Slot(float)
+    @Slot(object)
     def mark_task_as_finished(self, task_id):
         self.model.finish_task(int(task_id))
 
-    @Slot(float)
+    @Slot(object)
     def mark_allocation_as_finished(self, allocation_id):
         self.model.finish_allocation(int(allocation_id))
 
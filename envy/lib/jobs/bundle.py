@@ -0,0 +1,126 @@
+"""
+bundle.py: one job file for many near identical jobs, eg: a wedge sweep, every camera of a shot or every tile of a frame.
+A bundle holds everything its jobs share once and only lists what differs per job.
+The server expands it into child jobs when the bundle is ingested or submitted, see jobs_from_dict.
+"""
+
+from __future__ import annotations
+
+import itertools
+import logging
+import typing
+
+from envy.lib.jobs import job
+from envy.lib.utils import ids
+
+logger = logging.getLogger(__name__)
+
+
+def is_bundle(job_as_dict: dict) -> bool:
+    return 'Variants' in job_as_dict or 'Sweep' in job_as_dict
+
+
+class Bundle(job.Job):
+    def __init__(self, name: str):
+        """
+        A job template plus the variations of it which should become jobs.
+        Adds the attributes:
+        variants: (list of dict) per job overrides, each may contain Name, Parameters and Environment
+        sweep: (dict) parameter -> list of values, every combination becomes a job
+        When both are set every variant is combined with every combination of the sweep.
+        :param name: (str) name of the bundle, children are named {name}_001, {name}_002, ... unless their variant names them
+        """
+        super().__init__(name)
+        self.variants = []
+        self.sweep = {}
+
+    def add_variant(self, parameters: dict = None, environment: dict = None, name: str = None) -> None:
+        """
+        :param parameters: parameters which override or extend the bundle's parameters
+        :param environment: environment keys which override the bundle's environment. Children with overrides no longer share the environment so keep these rare.
+        :param name: name of the child job
+        """
+        variant = {}
+        if name is not None:
+            variant['Name'] = str(name)
+        if parameters:
+            variant['Parameters'] = parameters
+        if environment:
+            variant['Environment'] = environment
+        self.variants.append(variant)
+
+    def get_variants(self) -> list:
+        return self.variants
+
+    def set_sweep(self, sweep: dict) -> None:
+        self.sweep = {parameter: list(values) for parameter, values in sweep.items()}
+
+    def get_sweep(self) -> dict:
+        return self.sweep
+
+    def count(self) -> int:
+        """
+        :return: (int) number of jobs the bundle expands into
+        """
+        combinations = 1
+        for values in self.sweep.values():
+            combinations *= len(values)
+        return max(len(self.variants), 1) * combinations
+
+    def expand(self) -> typing.Iterator[job.Job]:
+        """
+        Yields the child jobs one at a time.
+        Children reference the bundle's environment dict instead of a copy of it so the database stores it once.
+        Children get ascending ids from utils.ids when the bundle is expanded and Metadata['Bundle'] points back at the bundle.
+        """
+        child_ids = ids.next_ids(self.count())
+        index = 0
+        for variant in self.variants or [{}]:
+            for combination in itertools.product(*self.sweep.values()):
+                index += 1
+                yield self._child(index, child_ids[index - 1], variant, dict(zip(self.sweep, combination)))
+
+    def _child(self, index: int, child_id: int, variant: dict, sweep_values: dict) -> job.Job:
+        child = job.Job(variant.get('Name', f'{self.name}_{str(index).zfill(3)}'))
+        child.set_purpose(self.purpose)
+        child.set_type(self.type)
+        child.set_range(self.range)
+        child.set_allocation(self.allocation)
+        child.set_dependencies(self.dependencies)
+        child.set_duplicate_policy(self.duplicate_policy)
+        child.set_priority(self.priority)
+        child.set_weight(self.weight)
+        child.metadata = {**self.metadata, 'Bundle': self.get_id()}
+        child.set_id(child_id)
+
+        environment = self.environment or {}
+        if 'Environment' in variant:
+            environment = {**environment, **variant['Environment']}
+        child.set_environment(environment)
+        child.set_parameters({**(self.parameters or {}), **variant.get('Parameters', {}), **sweep_values})
+        return child
+
+    def as_dict(self) -> dict:
+        return_dict = super().as_dict()
+        return_dict['Variants'] = self.variants
+        return_dict['Sweep'] = self.sweep
+        return return_dict
+
+
+def bundle_from_dict(bundle_as_dict: dict, logger: logging.Logger = logger) -> Bundle:
+    new_bundle = job.job_from_dict(bundle_as_dict, logger=logger, job_class=Bundle)
+    for variant in bundle_as_dict.get('Variants') or []:
+        new_bundle.add_variant(parameters=variant.get('Parameters'), environment=variant.get('Environment'), name=variant.get('Name'))
+    new_bundle.set_sweep(bundle_as_dict.get('Sweep') or {})
+    return new_bundle
+
+
+def jobs_from_dict(job_as_dict: dict, logger: logging.Logger = logger) -> list[job.Job]:
+    """
+    Builds the jobs a job file or submitted job dict stands for
+    :param job_as_dict: a job or a bundle as made by as_dict()
+    :return: (list) the job itself or every child of the bundle
+    """
+    if is_bundle(job_as_dict):
+        return list(bundle_from_dict(job_as_dict, logger=logger).expand())
+    return [job.job_from_dict(job_as_dict, logger=logger)]
@@ -0,0 +1,210 @@
+"""
+chunking.py: sizes allocations from what their frames actually cost instead of the allocation size a job was submitted with.
+An allocation costs the time the client needs to start the job, eg: opening the hip file, plus the time of every frame in it.
+Too few frames per allocation pay the startup over and over, too many leave a few clients grinding at the end of a job while the rest idle.
+Whatever the sizes, the last allocations of a job can still outlast everything else, their unstarted frames are handed to idle clients, see steal_size.
+"""
+
+from __future__ import annotations
+
+import dataclasses
+import math
+import typing
+
+# wall time an allocation should take
+TARGET_SECONDS = 15 * 60
+# weight of a new measurement against everything measured before for the same job or scene
+SMOOTHING = 0.3
+# pending allocations are only rebuilt once their count is this far off the plan so a few noisy measurements do not rebuild them every time
+REBUILD_RATIO = 1.25
+
+
+@dataclasses.dataclass
+class FrameCost:
+    """
+    What an allocation of a job costs, startup once per allocation and per_frame for every frame in it, in seconds.
+    Until an allocation finished two frames the startup is unknown and counted as part of per_frame
+    """
+
+    startup: float
+    per_frame: float
+    samples: int = 1
+    startup_known: bool = True
+
+    def allocation_seconds(self, frames: int) -> float:
+        return self.startup + self.per_frame * frames
+
+
+class CostModel:
+    def __init__(self, target_seconds: float = TARGET_SECONDS, smoothing: float = SMOOTHING):
+        """
+        The measured cost of the jobs on the farm, remembered per job and per scene so a resubmitted scene starts with a good allocation size
+        :param target_seconds: wall time an allocation should take
+        :param smoothing: weight of a new measurement
+        """
+        self.target_seconds = target_seconds
+        self.smoothing = smoothing
+        self.costs: dict[typing.Hashable, FrameCost] = {}
+
+    def observe(self, keys: typing.Iterable[typing.Hashable], startup: float | None, per_frame: float) -> None:
+        """
+        Records one measured allocation
+        :param keys: what the measurement is remembered under eg: the job id and scene_key of the job
+        :param startup: seconds until the first frame started or None if it could not be told apart from the frames
+        :param per_frame: seconds per frame
+        """
+        for key in keys:
+            if key is None:
+                continue
+            cost = self.costs.get(key)
+            if cost is None or (startup is not None and not cost.startup_known):
+                # a measurement which tells the startup apart replaces the guesses made without it
+                self.costs[key] = FrameCost(startup or 0.0, per_frame, startup_known=startup is not None)
+                continue
+            if startup is not None:
+                cost.startup += self.smoothing * (startup - cost.startup)
+            cost.per_frame += self.smoothing * (per_frame - cost.per_frame)
+            cost.samples += 1
+
+    def get(self, *keys: typing.Hashable) -> FrameCost | None:
+        """
+        :return: the cost stored under the first of keys which has been measured or None
+        """
+        for key in keys:
+            cost = self.costs.get(key)
+            if cost is not None:
+                return cost
+        return None
+
+    def discard(self, key: typing.Hashable) -> None:
+        self.costs.pop(key, None)
+
+    def allocation_size(self, cost: FrameCost) -> int:
+        """
+        :return: (int) the number of frames which fill target_seconds after paying the startup once
+        """
+        if cost.per_frame <= 0:
+            return 1
+        return max(int((self.target_seconds - cost.startup) // cost.per_frame), 1)
+
+    @staticmethod
+    def minimum_size(cost: FrameCost) -> int:
+        """
+        :return: (int) the fewest frames an allocation should hold so its frames take at least as long as its startup
+        """
+        if cost.per_frame <= 0:
+            return 1
+        return max(math.ceil(cost.startup / cost.per_frame), 1)
+
+
+class AllocationTimer:
+    def __init__(self):
+        """
+        Times running allocations from the moment they are sent to a client until their last frame finished
+        """
+        # allocation id -> (start time, finish time of every frame so far)
+        self._running: dict[int, tuple[float, list[float]]] = {}
+
+    def start(self, allocation_id: int, now: float) -> None:
+        self._running[allocation_id] = (now, [])
+
+    def finish_frame(self, allocation_id: int, now: float) -> None:
+        running = self._running.get(allocation_id)
+        if running is not None:
+            running[1].append(now)
+
+    def finish(self, allocation_id: int, now: float, frames: int, known: FrameCost | None = None) -> tuple[float | None, float] | None:
+        """
+        Works out what an allocation cost.
+        The time between two finished frames is the cost of a frame and whatever came before the first one is the startup.
+        Without two finished frames the startup is only known if the cost of a frame is, see known
+        :param allocation_id: ID of the allocation
+        :param now: time the allocation finished
+        :param frames: number of frames the allocation had
+        :param known: what the job was measured to cost so far
+        :return: (startup or None, seconds per frame) or None if the allocation was not timed
+        """
+        running = self._running.pop(allocation_id, None)
+        if running is None or frames < 1:
+            return None
+        started, finished = running
+        if len(finished) >= 2:
+            per_frame = (finished[-1] - finished[0]) / (len(finished) - 1)
+            return max(finished[0] - started - per_frame, 0.0), per_frame
+        elapsed = now - started
+        if known is not None:
+            startup = min(max(known.startup, 0.0), elapsed)
+            return startup, (elapsed - startup) / frames
+        return None, elapsed / frames
+
+    def discard(self, allocation_id: int) -> None:
+        """
+        Stops timing an allocation which failed or was reset, it did not run to the end so it says nothing about its cost
+        """
+        self._running.pop(allocation_id, None)
+
+    def __contains__(self, allocation_id: int) -> bool:
+        return allocation_id in self._running
+
+
+def plan(frames: int, size: int, clients: int, minimum: int = 1) -> list[int]:
+    """
+    Splits the remaining frames of a job into allocations of size frames which get smaller toward the end of the job.
+    An allocation never holds more than its share of what is left, the remaining frames divided by the clients,
+    so the last allocations of a job finish at about the same time instead of one client running a full size allocation on its own.
+    :param frames: number of frames left to split
+    :param size: frames per allocation, see CostModel.allocation_size
+    :param clients: number of clients which can work on the job
+    :param minimum: allocations never get smaller than this toward the end, see CostModel.minimum_size
+    :return: (list) frames per allocation in dispatch order
+    """
+    sizes = []
+    clients = max(clients, 1)
+    size = max(size, 1)
+    minimum = min(max(minimum, 1), size)
+    while frames > 0:
+        chunk = min(size, max(math.ceil(frames / clients), minimum), frames)
+        sizes.append(chunk)
+        frames -= chunk
+    return sizes
+
+
+def needs_rebuild(current: typing.Sequence[int], planned: typing.Sequence[int], ratio: float = REBUILD_RATIO) -> bool:
+    """
+    :param current: frames per pending allocation now
+    :param planned: frames per allocation the plan asks for
+    :return: (bool) True if the pending allocations are far enough from the plan to be rebuilt
+    """
+    if len(current) == len(planned):
+        return False
+    fewer, more = sorted((len(current), len(planned)))
+    return fewer == 0 or more / fewer >= ratio
+
+
+def steal_size(remaining: int, cost: FrameCost | None = None) -> int:
+    """
+    How many frames a client which is still busy with an allocation should hand to an idle client.
+    The idle client pays the startup before its first frame so the frames are split where both clients finish at about the same time
+    :param remaining: frames of the allocation after the ones the client keeps, see Scheduler.steal_frames
+    :param cost: what the job was measured to cost or None if it was not measured yet
+    :return: (int) frames to take from the end of the allocation, 0 if splitting it would not finish it sooner
+    """
+    startup = 0.0
+    if cost is not None and cost.startup_known and cost.per_frame > 0:
+        startup = cost.startup / cost.per_frame
+    return max(int((remaining - startup) // 2), 0)
+
+
+def scene_key(job_type: str, purpose: str, environment: dict | None) -> tuple | None:
+    """
+    :return: what jobs working on the same part of the same scene have in common or None if the environment names no scene
+        eg: ('PLUGIN_eHoudini', 'cache', 'Z:/shot.hip', '/obj/geo/cache/execute')
+    """
+    if not isinstance(environment, dict):
+        return None
+    # eHoudini jobs name the hip file and the button which runs them, eMaya jobs the scene and what is rendered from it
+    scene = environment.get('HIP') or environment.get('maya_file')
+    if not scene:
+        return None
+    detail = environment.get('Target_Button') or f'{environment.get("render_layer") or ""} {environment.get("camera") or ""}'.strip()
+    return str(job_type), str(purpose), str(scene), str(detail)
@@ -0,0 +1,311 @@
+"""
+dependencies.py: job to job dependencies, a job is only dispatched once every job it depends on is done
+or with frame dependencies an allocation is dispatched once the frames it covers are done in the jobs it depends on
+"""
+
+from __future__ import annotations
+
+import logging
+import typing
+
+from envy.lib.jobs.enums import DependencyMode
+from envy.lib.jobs.frame_range import Frame
+from envy.lib.network import codec
+
+logger = logging.getLogger(__name__)
+
+
+def _entries(dependencies) -> list:
+    if isinstance(dependencies, (str, bytes)):
+        try:
+            dependencies = codec.JSON.loads(dependencies)
+        except codec.DecodeError:
+            logger.warning(f'Cannot read dependencies {dependencies!r}')
+            return []
+    return list(dependencies or ())
+
+
+def parent_ids(dependencies) -> list[int]:
+    """
+    Reads the jobs a job depends on out of Job.dependencies or the Dependencies column
+    :param dependencies: json text or a list of {'Id': job id, 'Name': job name} as made by Job.add_dependency
+    :return: (list) job ids, dependencies without an id are ignored
+    """
+    result = []
+    for dependency in _entries(dependencies):
+        value = dependency.get('Id') if isinstance(dependency, dict) else dependency
+        try:
+            result.append(int(value))
+        except (TypeError, ValueError):
+            continue
+    return result
+
+
+def frame_windows(dependencies) -> dict[int, int]:
+    """
+    :param dependencies: see parent_ids
+    :return: (dict) job id -> window of the jobs which are depended on frame by frame, see Job.add_dependency
+    """
+    result = {}
+    for dependency in _entries(dependencies):
+        if not isinstance(dependency, dict) or dependency.get('Mode') != DependencyMode.FRAME:
+            continue
+        try:
+            result[int(dependency['Id'])] = max(int(dependency.get('Window') or 0), 0)
+        except (KeyError, TypeError, ValueError):
+            continue
+    return result
+
+
+def chain(jobs: typing.Sequence, mode: DependencyMode = DependencyMode.JOB, window: int = 0) -> None:
+    """
+    Makes every job wait for the one before it eg: chain([cache, simulation, render])
+    :param jobs: job.Job objects in the order they have to run
+    :param mode: see Job.add_dependency
+    :param window: see Job.add_dependency
+    """
+    for parent, child in zip(jobs, jobs[1:]):
+        child.add_dependency(parent, mode=mode, window=window)
+
+
+def find_cycles(jobs: typing.Iterable, known_parents: typing.Callable[[int], typing.Iterable[int]] = None) -> set[int]:
+    """
+    Finds the jobs which can never run because they are part of a dependency cycle or depend on a job which is
+    :param jobs: job.Job objects about to be added
+    :param known_parents: returns the parents of a job which is not in jobs, eg: JobTreeItemModel.job_parents
+    :return: (set) ids of the jobs which must be rejected
+    """
+    parents = {new_job.get_id(): parent_ids(new_job.get_dependencies()) for new_job in jobs}
+
+    def parents_of(job_id: int) -> typing.Iterable[int]:
+        if job_id in parents:
+            return parents[job_id]
+        return known_parents(job_id) if known_parents is not None else ()
+
+    # iterative depth first search, a job reached again while it is still on the path closes a cycle
+    visiting, blocked, clear = set(), set(), set()
+    for root in parents:
+        if root in clear or root in blocked:
+            continue
+        stack = [(root, iter(parents_of(root)))]
+        visiting.add(root)
+        while stack:
+            job_id, remaining = stack[-1]
+            parent = next(remaining, None)
+            if parent is None:
+                stack.pop()
+                visiting.discard(job_id)
+                if job_id not in blocked:
+                    clear.add(job_id)
+                continue
+            if parent in visiting or parent in blocked:
+                # everything on the path from the parent down to here can never run
+                blocked.update(node for node, _ in stack)
+                continue
+            if parent in clear:
+                continue
+            visiting.add(parent)
+            stack.append((parent, iter(parents_of(parent))))
+    return blocked & parents.keys()
+
+
+def topological_order(items: typing.Sequence, job_id: typing.Callable, dependencies: typing.Callable) -> list:
+    """
+    Orders items so a job comes after every job of items it depends on, otherwise keeping their order
+    :param items: anything describing a job eg: the results of DB.get_job_tree
+    :param job_id: returns the id of an item
+    :param dependencies: returns the dependencies of an item
+    :return: (list) items in dependency order, items in a cycle come last in their original order
+    """
+    by_id = {job_id(item): item for item in items}
+    ordered = []
+    placed = set()
+    for item in items:
+        stack = [item]
+        while stack:
+            current = stack[-1]
+            current_id = job_id(current)
+            if current_id in placed:
+                stack.pop()
+                continue
+            missing = [by_id[parent] for parent in parent_ids(dependencies(current)) if parent in by_id and parent not in placed and by_id[parent] not in stack]
+            if missing:
+                stack.extend(missing)
+                continue
+            stack.pop()
+            placed.add(current_id)
+            ordered.append(current)
+    return ordered
+
+
+def needed_frames(frames: typing.Iterable[Frame], parents: dict[int, tuple[int, typing.Container[Frame]]]) -> typing.Iterator[tuple[int, Frame]]:
+    """
+    :param frames: the frames of an allocation
+    :param parents: parent job id -> (window, frames of the parent which are not done yet)
+    :return: (iterator) (parent job id, frame) of every unfinished parent frame the allocation waits for, see Job.add_dependency
+    """
+    for frame in frames:
+        for parent, (window, pending) in parents.items():
+            for offset in range(-window, window + 1):
+                if frame + offset in pending:
+                    yield parent, frame + offset
+
+
+class DependencyGraph:
+    def __init__(self):
+        """
+        The jobs which are waiting on other jobs.
+        Only edges to unfinished parents are kept so a finished job costs nothing no matter how many jobs depended on it.
+        """
+        # job id -> ids of the parents it is still waiting for
+        self._waiting: dict[int, set[int]] = {}
+        # parent id -> ids of the jobs waiting for it
+        self._children: dict[int, set[int]] = {}
+
+    def add(self, job_id: int, parents: typing.Iterable[int]) -> bool:
+        """
+        :param job_id: ID of the job
+        :param parents: ids of the unfinished jobs it depends on
+        :return: (bool) True if the job has to wait
+        """
+        parents = set(parents) - {job_id}
+        if not parents:
+            return False
+        self._waiting[job_id] = parents
+        for parent in parents:
+            self._children.setdefault(parent, set()).add(job_id)
+        return True
+
+    def finish(self, job_id: int) -> list[int]:
+        """
+        :return: (list) ids of the jobs which were only waiting for job_id and can run now
+        """
+        self.discard(job_id)
+        released = []
+        for child in sorted(self._children.pop(job_id, ())):
+            parents = self._waiting.get(child)
+            if parents is None:
+                continue
+            parents.discard(job_id)
+            if not parents:
+                del self._waiting[child]
+                released.append(child)
+        return released
+
+    def discard(self, job_id: int) -> None:
+        """
+        Forgets what a job was waiting for eg: because it was cancelled, jobs waiting for it keep waiting
+        """
+        for parent in self._waiting.pop(job_id, ()):
+            children = self._children.get(parent)
+            if children is not None:
+                children.discard(job_id)
+                if not children:
+                    del self._children[parent]
+
+    def is_waiting(self, job_id: int) -> bool:
+        return job_id in self._waiting
+
+    def parents(self, job_id: int) -> set[int]:
+        """
+        :return: (set) the unfinished jobs job_id is waiting for
+        """
+        return set(self._waiting.get(job_id, ()))
+
+    def children(self, job_id: int) -> set[int]:
+        """
+        :return: (set) the jobs which are waiting for job_id
+        """
+        return set(self._children.get(job_id, ()))
+
+    def __len__(self) -> int:
+        return len(self._waiting)
+
+
+class FrameDependencies:
+    def __init__(self):
+        """
+        The allocations which are waiting for single frames of other jobs.
+        Every frame an allocation needs is one entry so finishing a frame costs as much as the number of allocations waiting for it.
+        """
+        # parent job id -> frame -> ids of the allocations waiting for that frame
+        self._frames: dict[int, dict[Frame, set[int]]] = {}
+        # allocation id -> (parent job id, frame) it is still waiting for
+        self._waiting: dict[int, set[tuple[int, Frame]]] = {}
+
+    def add(self, allocation_id: int, frames: typing.Iterable[tuple[int, Frame]]) -> bool:
+        """
+        :param allocation_id: ID of the allocation
+        :param frames: (parent job id, frame) of every frame the allocation needs which is not done yet
+        :return: (bool) True if the allocation has to wait
+        """
+        self.discard(allocation_id)
+        frames = set(frames)
+        if not frames:
+            return False
+        self._waiting[allocation_id] = frames
+        for parent, frame in frames:
+            self._frames.setdefault(parent, {}).setdefault(frame, set()).add(allocation_id)
+        return True
+
+    def finish_frame(self, job_id: int, frame: Frame) -> list[int]:
+        """
+        :return: (list) ids of the allocations which were only waiting for this frame and can run now
+        """
+        job_frames = self._frames.get(job_id)
+        if job_frames is None:
+            return []
+        allocations = job_frames.pop(frame, ())
+        if not job_frames:
+            del self._frames[job_id]
+        return self._release(allocations, (job_id, frame))
+
+    def finish_job(self, job_id: int) -> list[int]:
+        """
+        Stops waiting for every frame of a job eg: because it finished with frames which failed
+        :return: (list) ids of the allocations which can run now
+        """
+        released = []
+        for frame, allocations in self._frames.pop(job_id, {}).items():
+            released.extend(self._release(allocations, (job_id, frame)))
+        return sorted(released)
+
+    def _release(self, allocations: typing.Iterable[int], key: tuple[int, Frame]) -> list[int]:
+        released = []
+        for allocation_id in sorted(allocations):
+            frames = self._waiting.get(allocation_id)
+            if frames is None:
+                continue
+            frames.discard(key)
+            if not frames:
+                del self._waiting[allocation_id]
+                released.append(allocation_id)
+        return released
+
+    def discard(self, allocation_id: int) -> None:
+        """
+        Forgets the frames an allocation was waiting for eg: because it was removed from the tree
+        """
+        for parent, frame in self._waiting.pop(allocation_id, ()):
+            job_frames = self._frames.get(parent)
+            if job_frames is None:
+                continue
+            allocations = job_frames.get(frame)
+            if allocations is not None:
+                allocations.discard(allocation_id)
+                if not allocations:
+                    del job_frames[frame]
+            if not job_frames:
+                del self._frames[parent]
+
+    def is_waiting(self, allocation_id: int) -> bool:
+        return allocation_id in self._waiting
+
+    def frames(self, allocation_id: int) -> set[tuple[int, Frame]]:
+        """
+        :return: (set) (parent job id, frame) the allocation is still waiting for
+        """
+        return set(self._waiting.get(allocation_id, ()))
+
+    def __len__(self) -> int:
+        return len(self._waiting)
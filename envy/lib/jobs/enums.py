@@ -21,6 +21,39 @@ class Purpose(str, Enum):
         return self.value
 
 
+class DuplicatePolicy(str, Enum):
+    """
+    What happens when a job is submitted while an identical job is still in the database
+    REJECT drops the new job, MERGE folds it into the existing job and ALLOW adds it anyway
+    """
+
+    REJECT = 'reject'
+    MERGE = 'merge'
+    ALLOW = 'allow'
+
+    def __str__(self):
+        return self.value
+
+    def __format__(self, format_spec):
+        return self.value
+
+
+class DependencyMode(str, Enum):
+    """
+    How a job waits for a job it depends on
+    JOB waits until the whole job is done, FRAME lets each allocation start as soon as the frames it covers are done upstream
+    """
+
+    JOB = 'job'
+    FRAME = 'frame'
+
+    def __str__(self):
+        return self.value
+
+    def __format__(self, format_spec):
+        return self.value
+
+
 class Status(str, Enum):
     PENDING = 'pending'
     INPROGRESS = 'inprogress'
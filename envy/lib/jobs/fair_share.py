@@ -0,0 +1,233 @@
+"""
+fair_share.py: decides which pending allocation goes out next so one big job cannot hold every node until it drains
+"""
+
+from __future__ import annotations
+
+import dataclasses
+import heapq
+import time
+import typing
+
+from envy.lib.jobs.ready_queue import MIN_COMPACT_SIZE, ReadyQueue
+
+# a job which has nothing running and has not been handed an allocation for this long ranks one priority higher, and one more for every further interval
+AGING_INTERVAL = 600
+# how often waiting jobs are aged
+AGING_CHECK_INTERVAL = 30
+
+
+@dataclasses.dataclass
+class JobShare:
+    job_id: int
+    owner: str
+    priority: int
+    weight: float
+    served: float
+    aged: int = 0
+    running: int = 0
+    version: int = 0
+    ready: ReadyQueue = dataclasses.field(default_factory=ReadyQueue)
+
+
+@dataclasses.dataclass
+class OwnerShare:
+    running: int = 0
+    jobs: set = dataclasses.field(default_factory=set)
+    heap: list = dataclasses.field(default_factory=list)
+
+
+class FairSharePolicy:
+    def __init__(self, job_tree, aging_interval: float = AGING_INTERVAL, clock: typing.Callable[[], float] = time.monotonic):
+        """
+        Takes the place of the tree's ReadyQueue, see JobTreeItemModel.set_ready_queue.
+        Jobs with a pending allocation are ranked by
+        1. priority, plus one for every aging_interval a job with nothing running has been waiting so nothing starves
+        2. the number of allocations the job's owner has running, every owner gets an equal share of the farm
+        3. the number of allocations the job has running divided by its weight
+        4. submission order
+        and the first one gives up its oldest pending allocation.
+        Every owner keeps a heap of its jobs so a pick costs O(owners + log jobs) instead of a pass over every job.
+        :param job_tree: jobTreeAbstractItemModel.JobTreeItemModel, job nodes carry owner, priority and weight
+        :param aging_interval: seconds a job waits before it ranks one priority higher
+        :param clock: returns the current time in seconds
+        """
+        self.job_tree = job_tree
+        self.aging_interval = aging_interval
+        self.clock = clock
+        self._shares: dict[int, JobShare] = {}
+        self._owners: dict[str, OwnerShare] = {}
+        self._queued: dict[int, int] = {}
+        self._running: dict[int, int] = {}
+        self._next_aging = clock() + AGING_CHECK_INTERVAL
+
+    def _share(self, job_node) -> JobShare:
+        share = self._shares.get(job_node.name)
+        if share is None:
+            priority = getattr(job_node, 'priority', 0) or 0
+            share = JobShare(
+                job_id=job_node.name,
+                owner=getattr(job_node, 'owner', '') or '',
+                priority=priority,
+                weight=getattr(job_node, 'weight', 1) or 1,
+                served=self.clock(),
+                aged=priority,
+            )
+            self._shares[share.job_id] = share
+            self._owners.setdefault(share.owner, OwnerShare()).jobs.add(share.job_id)
+        return share
+
+    def _release(self, share: JobShare) -> None:
+        # a job with nothing queued or running is forgotten, it comes back if one of its allocations is reset
+        if share.running > 0 or share.ready:
+            return
+        del self._shares[share.job_id]
+        owner = self._owners[share.owner]
+        owner.jobs.discard(share.job_id)
+        if not owner.jobs and owner.running == 0:
+            del self._owners[share.owner]
+
+    def _touch(self, share: JobShare) -> None:
+        """
+        Files the job under its current rank, whatever it was filed under before is left behind and skipped once it reaches the top
+        """
+        share.version += 1
+        if not share.ready:
+            return
+        owner = self._owners[share.owner]
+        heapq.heappush(owner.heap, (-share.aged, share.running / share.weight, share.job_id, share.version))
+        if len(owner.heap) > MIN_COMPACT_SIZE and len(owner.heap) > 2 * len(owner.jobs):
+            owner.heap = [entry for entry in owner.heap if self._is_current(entry)]
+            heapq.heapify(owner.heap)
+
+    def _is_current(self, entry: tuple) -> bool:
+        share = self._shares.get(entry[2])
+        return share is not None and share.version == entry[3] and bool(share.ready)
+
+    def _age(self) -> None:
+        now = self.clock()
+        if now < self._next_aging:
+            return
+        self._next_aging = now + AGING_CHECK_INTERVAL
+        for share in self._shares.values():
+            # a job with allocations running is being served, only one which gets nothing is starving
+            if share.running > 0:
+                continue
+            aged = share.priority + int((now - share.served) // self.aging_interval)
+            if aged != share.aged:
+                share.aged = aged
+                self._touch(share)
+
+    def push(self, allocation_id: int, priority: int = 0) -> None:
+        """
+        Queues a pending allocation of a job in the tree.
+        An allocation which was running, eg: one which was reset, stops counting towards its job's share
+        :param allocation_id: ID of the allocation
+        :param priority: unused, the job's priority applies to all of its allocations
+        """
+        if allocation_id in self._running:
+            self.discard(allocation_id)
+        if allocation_id in self._queued:
+            return
+        allocation = self.job_tree.allocations.get(allocation_id)
+        if allocation is None:
+            return
+        share = self._share(allocation.parent)
+        was_empty = not share.ready
+        share.ready.push(allocation_id)
+        self._queued[allocation_id] = share.job_id
+        if was_empty:
+            if share.running == 0:
+                share.served = self.clock()
+            self._touch(share)
+
+    def start(self, allocation_id: int) -> None:
+        """
+        Counts an allocation which was just sent to a client towards its job's and owner's share
+        """
+        job_id = self._queued.pop(allocation_id, None)
+        if job_id is None:
+            return
+        share = self._shares[job_id]
+        share.ready.discard(allocation_id)
+        self._running[allocation_id] = job_id
+        share.running += 1
+        self._owners[share.owner].running += 1
+        share.served = self.clock()
+        share.aged = share.priority
+        self._touch(share)
+
+    def discard(self, allocation_id: int) -> bool:
+        """
+        Forgets an allocation which is done, failed or was removed from the tree
+        :return: (bool) True if the allocation was queued or running
+        """
+        job_id = self._queued.pop(allocation_id, None)
+        if job_id is not None:
+            share = self._shares[job_id]
+            share.ready.discard(allocation_id)
+            self._release(share)
+            return True
+
+        job_id = self._running.pop(allocation_id, None)
+        if job_id is None:
+            return False
+        share = self._shares[job_id]
+        share.running -= 1
+        owner = self._owners[share.owner]
+        owner.running -= 1
+        self._touch(share)
+        self._release(share)
+        return True
+
+    def update_job(self, job_id: int, priority: int | None = None, weight: float | None = None) -> None:
+        """
+        Changes the priority or weight of a job which is already queued, eg: from the console
+        """
+        share = self._shares.get(job_id)
+        if share is None:
+            return
+        if priority is not None:
+            share.aged += priority - share.priority
+            share.priority = priority
+        if weight is not None and weight > 0:
+            share.weight = weight
+        self._touch(share)
+
+    def peek(self) -> int | None:
+        """
+        :return: ID of the allocation which should be dispatched next or None if nothing is queued
+        """
+        self._age()
+        best = None
+        for owner in self._owners.values():
+            heap = owner.heap
+            while heap and not self._is_current(heap[0]):
+                heapq.heappop(heap)
+            if not heap:
+                continue
+            negative_priority, usage, job_id, _ = heap[0]
+            rank = (negative_priority, owner.running, usage, job_id)
+            if best is None or rank < best:
+                best = rank
+        if best is None:
+            return None
+        return self._shares[best[3]].ready.peek()
+
+    def running(self, owner: str | None = None) -> int:
+        """
+        :return: (int) number of running allocations, of one owner if given
+        """
+        if owner is None:
+            return len(self._running)
+        owner_share = self._owners.get(owner)
+        return 0 if owner_share is None else owner_share.running
+
+    def __len__(self) -> int:
+        return len(self._queued)
+
+    def __bool__(self) -> bool:
+        return len(self._queued) > 0
+
+    def __contains__(self, allocation_id: int) -> bool:
+        return allocation_id in self._queued
@@ -0,0 +1,316 @@
+"""
+frame_range.py: run-length encoded frame lists so a range of frames costs the same no matter how many frames it covers
+"""
+
+from __future__ import annotations
+
+import bisect
+import heapq
+import math
+import re
+import typing
+
+Frame = typing.Union[int, float]
+
+# frames closer than this are the same frame, float steps like 0.1 never add up exactly
+EPSILON = 1e-6
+
+# start, optional -end and optional :step. Either end of a segment may be negative eg: -10--1:1
+SEGMENT_PATTERN = re.compile(r'^(-?\d+(?:\.\d*)?)(?:-(-?\d+(?:\.\d*)?))?(?::(\d+(?:\.\d*)?))?$')
+
+
+def _number(value) -> Frame:
+    """
+    :return: value as an int if it is a whole number otherwise as a float rounded to EPSILON
+    """
+    if isinstance(value, int):
+        return value
+    value = float(value)
+    if math.isclose(value, round(value), abs_tol=EPSILON):
+        return int(round(value))
+    return round(value, 6)
+
+
+class FrameRange:
+    def __init__(self, segments: typing.Iterable[tuple[Frame, Frame, Frame]] = ()):
+        """
+        An ordered list of frames stored as (start, end, step) segments with an inclusive end.
+        Frames may be negative or fractional eg: 1-2:0.25 for substeps.
+        Length, indexing, slicing and lookups are answered arithmetically from the segments without building the frame list
+        so a range costs the same memory whether it covers ten frames or a million.
+        :param segments: iterable of (start, end, step)
+        """
+        self.segments: list[tuple[Frame, Frame, Frame]] = []
+        self._offsets: list[int] = []
+        self._length = 0
+        for start, end, step in segments:
+            self._append(_number(start), _number(end), _number(step))
+
+    def _append(self, start: Frame, end: Frame, step: Frame) -> None:
+        if step <= 0:
+            raise ValueError(f'invalid step {step}')
+        if end < start:
+            raise ValueError(f'invalid segment {start}-{end}')
+        count = self._count((start, end, step))
+        end = start + (count - 1) * step
+        self.segments.append((start, _number(end) if isinstance(end, float) else end, step))
+        self._offsets.append(self._length)
+        self._length += count
+
+    @staticmethod
+    def _count(segment: tuple[Frame, Frame, Frame]) -> int:
+        start, end, step = segment
+        if type(start) is int and type(end) is int and type(step) is int:
+            return (end - start) // step + 1
+        return math.floor((end - start) / step + EPSILON) + 1
+
+    @classmethod
+    def from_frames(cls, frames: typing.Iterable[Frame]) -> FrameRange:
+        """
+        Builds a FrameRange from a list of frames by merging every run with a constant step into one segment.
+        Only the segments are kept so frames can be a generator of any length.
+        :param frames: ordered frames
+        :return: FrameRange
+        """
+        segments = []
+        start = end = step = None
+        for frame in frames:
+            frame = _number(frame)
+            if start is None:
+                start = end = frame
+            elif step is None and frame > end:
+                step = _number(frame - end)
+                end = frame
+            elif step is not None and math.isclose(frame - end, step, abs_tol=EPSILON):
+                end = frame
+            else:
+                segments.append((start, end, step or 1))
+                start = end = frame
+                step = None
+        if start is not None:
+            segments.append((start, end, step or 1))
+        return cls(segments)
+
+    @classmethod
+    def concatenate(cls, ranges: typing.Iterable[FrameRange]) -> FrameRange:
+        """
+        Joins ranges one after the other, a segment which carries on where the one before it ended is merged into it eg: 1-10:1 and 11-20:1 become 1-20:1
+        :param ranges: FrameRanges in order
+        :return: FrameRange
+        """
+        segments = []
+        for frame_range in ranges:
+            for start, end, step in frame_range.segments:
+                if segments:
+                    previous_start, previous_end, previous_step = segments[-1]
+                    if math.isclose(previous_step, step, abs_tol=EPSILON) and math.isclose(start - previous_end, step, abs_tol=EPSILON):
+                        segments[-1] = (previous_start, end, previous_step)
+                        continue
+                segments.append((start, end, step))
+        return cls(segments)
+
+    @classmethod
+    def decode(cls, value: str | None) -> FrameRange:
+        """
+        Reads the 'start-end:step' segments Job.range is written in, separated by spaces or commas.
+        A segment may be a single frame eg: '5', and frames may be negative or fractional eg: '-10--1:1' or '1-2:0.5'
+        :param value: encoded FrameRange
+        :return: FrameRange
+        :raises ValueError: If a segment cannot be read
+        """
+        segments = []
+        for segment in (value or '').replace(',', ' ').split():
+            match = SEGMENT_PATTERN.match(segment)
+            if match is None:
+                raise ValueError(f'invalid frame range segment {segment!r}')
+            start, end, step = match.groups()
+            segments.append((start, end or start, step or 1))
+        return cls(segments)
+
+    def encode(self) -> str:
+        return ' '.join(f'{start}-{end}:{step}' for start, end, step in self.segments)
+
+    @property
+    def first(self) -> Frame:
+        return self.segments[0][0]
+
+    @property
+    def last(self) -> Frame:
+        return self.segments[-1][1]
+
+    def index(self, frame: Frame) -> int:
+        """
+        :return: the position of frame within the range
+        :raises ValueError: If the frame is not part of the range
+        """
+        for offset, segment in zip(self._offsets, self.segments):
+            start, end, step = segment
+            if start - EPSILON <= frame <= end + EPSILON:
+                position = (frame - start) / step
+                if math.isclose(position, round(position), abs_tol=EPSILON):
+                    return offset + round(position)
+        raise ValueError(f'{frame} is not in range')
+
+    def chunks(self, size: int) -> typing.Iterator[FrameRange]:
+        """
+        Splits the range into consecutive pieces of size frames, the last one may be shorter.
+        Each piece is sliced from the segments so the cost grows with the number of chunks, not the number of frames.
+        :param size: frames per chunk eg: the allocation size of a job
+        """
+        if size < 1:
+            raise ValueError(f'invalid chunk size {size}')
+        for index in range(0, self._length, size):
+            yield self._slice(index, min(index + size, self._length))
+
+    def _slice(self, start_index: int, stop_index: int) -> FrameRange:
+        result = FrameRange()
+        if start_index >= stop_index:
+            return result
+        segment_index = bisect.bisect_right(self._offsets, start_index) - 1
+        while segment_index < len(self.segments) and self._offsets[segment_index] < stop_index:
+            segment = self.segments[segment_index]
+            start, _, step = segment
+            offset = self._offsets[segment_index]
+            first = max(start_index - offset, 0)
+            last = min(stop_index - offset, self._count(segment)) - 1
+            first, last = start + first * step, start + last * step
+            if isinstance(first, float) or isinstance(last, float):
+                first, last = _number(first), _number(last)
+            result._append(first, last, step)
+            segment_index += 1
+        return result
+
+    def sorted_frames(self) -> typing.Iterator[Frame]:
+        """
+        Yields every frame once in ascending order even if the segments overlap or are out of order
+        """
+        previous = None
+        for frame in heapq.merge(*(self._iterate_segment(segment) for segment in self.segments)):
+            if previous is None or not math.isclose(frame, previous, abs_tol=EPSILON):
+                yield frame
+            previous = frame
+
+    def _intervals(self) -> list[tuple[int, int]] | None:
+        """
+        :return: the frames as sorted and merged (start, end) intervals or None if a segment has a step other than 1
+        """
+        if any(step != 1 or not isinstance(start, int) for start, _, step in self.segments):
+            return None
+        intervals = []
+        for start, end, _ in sorted(self.segments):
+            if intervals and start <= intervals[-1][1] + 1:
+                intervals[-1] = (intervals[-1][0], max(intervals[-1][1], end))
+            else:
+                intervals.append((start, end))
+        return intervals
+
+    def _combine(self, other: FrameRange, keep: typing.Callable[[bool, bool], bool]) -> FrameRange:
+        """
+        Builds a set operation from keep(in self, in other).
+        Ranges made of whole step 1 segments, which every job range is, are combined interval by interval in O(segments).
+        Anything else is merged frame by frame which still only keeps the resulting segments in memory.
+        """
+        if not isinstance(other, FrameRange):
+            other = FrameRange.from_frames(sorted(other))
+
+        intervals, other_intervals = self._intervals(), other._intervals()
+        if intervals is not None and other_intervals is not None:
+            bounds = sorted({start for start, _ in intervals + other_intervals} | {end + 1 for _, end in intervals + other_intervals})
+            segments = []
+            for low, high in zip(bounds, bounds[1:]):
+                if keep(_covers(intervals, low), _covers(other_intervals, low)):
+                    if segments and segments[-1][1] == low - 1:
+                        segments[-1] = (segments[-1][0], high - 1, 1)
+                    else:
+                        segments.append((low, high - 1, 1))
+            return FrameRange(segments)
+
+        def frames() -> typing.Iterator[Frame]:
+            mine, theirs = self.sorted_frames(), other.sorted_frames()
+            frame, other_frame = next(mine, None), next(theirs, None)
+            while frame is not None or other_frame is not None:
+                if other_frame is None or (frame is not None and frame < other_frame - EPSILON):
+                    if keep(True, False):
+                        yield frame
+                    frame = next(mine, None)
+                elif frame is None or other_frame < frame - EPSILON:
+                    if keep(False, True):
+                        yield other_frame
+                    other_frame = next(theirs, None)
+                else:
+                    if keep(True, True):
+                        yield frame
+                    frame, other_frame = next(mine, None), next(theirs, None)
+
+        return FrameRange.from_frames(frames())
+
+    def union(self, other: FrameRange) -> FrameRange:
+        return self._combine(other, lambda mine, theirs: mine or theirs)
+
+    def intersection(self, other: FrameRange) -> FrameRange:
+        return self._combine(other, lambda mine, theirs: mine and theirs)
+
+    def difference(self, other: FrameRange) -> FrameRange:
+        """
+        eg: the frames of a job which are still missing: job_range - done_frames
+        """
+        return self._combine(other, lambda mine, theirs: mine and not theirs)
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+
+    @staticmethod
+    def _iterate_segment(segment: tuple[Frame, Frame, Frame]) -> typing.Iterator[Frame]:
+        start, end, step = segment
+        if isinstance(start, int) and isinstance(step, int):
+            return iter(range(start, end + 1, step))
+        return (_number(start + i * step) for i in range(FrameRange._count(segment)))
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __bool__(self) -> bool:
+        return self._length > 0
+
+    def __getitem__(self, index: int | slice) -> Frame | FrameRange:
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._length)
+            if step != 1:
+                raise ValueError('FrameRange slices must be contiguous')
+            return self._slice(start, stop)
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError('frame index out of range')
+        segment = bisect.bisect_right(self._offsets, index) - 1
+        start, _, step = self.segments[segment]
+        frame = start + (index - self._offsets[segment]) * step
+        return _number(frame) if isinstance(frame, float) else frame
+
+    def __iter__(self) -> typing.Iterator[Frame]:
+        for segment in self.segments:
+            yield from self._iterate_segment(segment)
+
+    def __contains__(self, frame: Frame) -> bool:
+        try:
+            self.index(frame)
+        except (ValueError, TypeError):
+            return False
+        return True
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, FrameRange):
+            return NotImplemented
+        return self.segments == other.segments
+
+    def __str__(self) -> str:
+        return self.encode()
+
+    def __repr__(self) -> str:
+        return f'FrameRange({self.encode()!r})'
+
+
+def _covers(intervals: list[tuple[int, int]], frame: int) -> bool:
+    position = bisect.bisect_right(intervals, (frame, math.inf)) - 1
+    return position >= 0 and intervals[position][0] <= frame <= intervals[position][1]
@@ -1,71 +1,173 @@
 import asyncio
+import concurrent.futures
 import json
 import logging
 import os
 
-import envy
 import envy.lib.jobs.job as job
+from envy.lib.jobs import bundle
+from envy.lib.utils import watcher
 
 logger = logging.getLogger(__name__)
 
+INGEST_WORKERS = 4
+# larger batches barely shorten a backlog but every batch is handed back to the event loop at once, see tests/benchmark_ingest_batch.py
+MAX_BATCH_SIZE = 50
+# job files which can never be ingested are moved here so the watcher's rescans stop reporting them
+REJECTED_FOLDER = 'rejected'
+
+
+def is_job_file(name: str) -> bool:
+    # Job.write writes to a hidden .tmp file first and only renames it to .json once it is complete
+    return name.upper().endswith('.JSON') and not name.startswith('.')
+
 
 class Ingestor:
-    def __init__(self, scheduler):
+    def __init__(self, scheduler, path: str = job.JOBS_PATH, workers: int = INGEST_WORKERS, dedup_window: float = None):
+        """
+        :param scheduler: the scheduler which is told about every ingested job
+        :param path: directory to watch for job files
+        :param workers: number of threads which read job files
+        :param dedup_window: seconds within which a resubmitted job counts as a duplicate, see DB.add_jobs. None ingests every job
+        """
         self.running = False
-        self.path = os.path.join(envy.__file__, 'Jobs', 'Jobs')
+        self.path = path
         self.db = None
         self.scheduler = scheduler
+        self.watcher = None
+        self.dedup_window = dedup_window
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='envy_ingestor')
 
     def set_db(self, db):
         logger.debug(f'Set Database -> {db}')
         self.db = db
 
-    async def add_to_db(self, job_to_add: job.Job) -> int:
-        logger.debug(f'adding {job_to_add} to database')
-        new_job_id = self.db.add_job(job_to_add)
-        if new_job_id is None:
-            raise Exception('Failed to create job database may be corrupted now')
-        return new_job_id
-
     async def start(self):
+        """
+        Ingests every job file as soon as the watcher reports it and wakes the scheduler so the job is dispatched right away.
+        """
         logger.debug('Started jobs.ingester.Ingestor')
-        self.running = True
-        while self.running:
-            await asyncio.sleep(2)  # let other coroutines run
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
 
-            new_jobs = await self.check_for_new_jobs()  # check for new jobs
+        self.running = True
+        self.watcher = watcher.create_watcher(self.path)
+        try:
+            while self.running:
+                new_jobs = [name for name in await self.watcher.changes() if is_job_file(name)]
+                if len(new_jobs) == 0:
+                    continue
+
+                logger.info(f'New jobs found {new_jobs}')
+                for i in range(0, len(new_jobs), MAX_BATCH_SIZE):
+                    try:
+                        await self.ingest(new_jobs[i : i + MAX_BATCH_SIZE])
+                    except Exception as e:
+                        logger.error(f'ingester: Failed to ingest jobs -> {e}')
+                self.scheduler.wake()
+        finally:
+            self.watcher.close()
+
+    def stop(self):
+        self.running = False
 
-            if len(new_jobs) == 0:  # if there are no new jobs then continue on
+    async def ingest(self, file_names: list[str]) -> list[int]:
+        """
+        Ingests a batch of job files.
+        The files are read, validated and bundles expanded concurrently on the ingestor's thread pool, the jobs are added in one transaction
+        and the scheduler settles them with a single call. Files which fail to load or insert, or hold a job in a dependency cycle, are logged and moved to
+        the REJECTED_FOLDER. Files which could not be read are left in place so they are tried again.
+        :param file_names: names of job files in the jobs folder
+        :return: (list) what Scheduler.settle_jobs returned for the ingested jobs
+        """
+        loop = asyncio.get_running_loop()
+        job_paths = [os.path.join(self.path, file_name) for file_name in file_names]
+        results = await asyncio.gather(*(loop.run_in_executor(self._executor, self.load_job, job_path) for job_path in job_paths), return_exceptions=True)
+
+        loaded = []
+        rejected_paths = []
+        for job_path, result in zip(job_paths, results):
+            if isinstance(result, Exception):
+                logger.error(f'ingester: Failed to load {job_path} -> {result}')
+                if not isinstance(result, OSError):
+                    rejected_paths.append(job_path)
+            elif result is not None:
+                loaded.append((job_path, result))
+        if len(loaded) == 0:
+            await self.reject(rejected_paths)
+            return []
+
+        blocked = self.scheduler.find_blocked_jobs([new_job for _, file_jobs in loaded for new_job in file_jobs])
+        if blocked:
+            for job_path, file_jobs in loaded:
+                if any(new_job.get_id() in blocked for new_job in file_jobs):
+                    logger.error(f'ingester: {job_path} is part of a dependency cycle and would never run')
+                    rejected_paths.append(job_path)
+            loaded = [(job_path, file_jobs) for job_path, file_jobs in loaded if not any(new_job.get_id() in blocked for new_job in file_jobs)]
+            if len(loaded) == 0:
+                await self.reject(rejected_paths)
+                return []
+
+        new_jobs = [new_job for _, file_jobs in loaded for new_job in file_jobs]
+        logger.debug(f'ingester: adding {len(new_jobs)} jobs from {len(loaded)} files to database')
+        job_ids = await self.db.add_jobs(new_jobs, window=self.dedup_window)
+        if job_ids is None:
+            # one bad file rolls back the whole batch, add the files one at a time so the rest still get in
+            job_ids = []
+            for job_path, file_jobs in loaded:
+                file_job_ids = await self.db.add_jobs(file_jobs, window=self.dedup_window)
+                job_ids.extend([None] * len(file_jobs) if file_job_ids is None else file_job_ids)
+
+        ingested_paths = []
+        ingested_jobs = []
+        ingested_ids = []
+        job_id_iterator = iter(job_ids)
+        for job_path, file_jobs in loaded:
+            file_job_ids = [next(job_id_iterator) for _ in file_jobs]
+            if None in file_job_ids:
+                logger.error(f'ingester: Failed to add the jobs from {job_path} to the database')
+                rejected_paths.append(job_path)
                 continue
-
-            logger.info(f'New jobs found {new_jobs}')
-            for envy_job in new_jobs:
-                try:
-                    await self.ingest(envy_job)
-                    os.remove(os.path.join(self.path, envy_job))
-                except Exception as e:
-                    logger.error(f'ingester: Failed to ingest job -> {e}')
-
-    async def ingest(self, job_path: str):
-        file, ext = os.path.splitext(job_path)
-        job_path = os.path.join(self.path, job_path)
-        logger.debug(f'ingester: Ingesting Job -> {file}')
-
-        if ext.upper() != '.JSON':
-            logger.warning(f'{job_path} is not a valid job file (not a .json file)')
-            return False
-
-        with open(job_path, 'r') as job_file:
-            job_as_dict = json.load(job_file)
-            job_file.close()
-        logger.debug(f'ingester: Loaded json')
-
-        new_job = job.job_from_dict(job_as_dict, logger=logger)
-        logger.debug(f'ingester: Job Data -> {new_job}')
-
-        new_id = await self.add_to_db(new_job)
-        await self.scheduler.sync_job(new_id)
-
-    async def check_for_new_jobs(self) -> list:
-        new_jobs = os.listdir(self.path)
-        return new_jobs
+            ingested_paths.append(job_path)
+            ingested_jobs.extend(file_jobs)
+            ingested_ids.extend(file_job_ids)
+
+        await asyncio.gather(*(loop.run_in_executor(self._executor, os.remove, job_path) for job_path in ingested_paths))
+        await self.reject(rejected_paths)
+        return await self.scheduler.settle_jobs(ingested_jobs, ingested_ids)
+
+    async def reject(self, job_paths: list[str]) -> None:
+        """
+        Moves job files which can never be ingested to the REJECTED_FOLDER, a file already rejected under the same name is replaced
+        :param job_paths: paths to job files in the jobs folder
+        """
+        if len(job_paths) == 0:
+            return
+        rejected_path = os.path.join(self.path, REJECTED_FOLDER)
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._executor, lambda: os.makedirs(rejected_path, exist_ok=True))
+        except OSError as e:
+            logger.error(f'ingester: Failed to create {rejected_path} -> {e}')
+            return
+
+        for job_path in job_paths:
+            try:
+                await loop.run_in_executor(self._executor, os.replace, job_path, os.path.join(rejected_path, os.path.basename(job_path)))
+            except OSError as e:
+                logger.error(f'ingester: Failed to move {job_path} to {rejected_path} -> {e}')
+            else:
+                logger.warning(f'ingester: moved {job_path} to {rejected_path}')
+
+    @staticmethod
+    def load_job(job_path: str) -> list[job.Job] | None:
+        """
+        Reads and validates a job file and expands it if it is a bundle, runs on the ingestor's thread pool
+        :return: (list) the jobs of the file or None if the file is gone because it was already ingested
+        """
+        try:
+            with open(job_path, 'r') as job_file:
+                job_as_dict = json.load(job_file)
+        except FileNotFoundError:
+            return None
+        return bundle.jobs_from_dict(job_as_dict, logger=logger)
@@ -1,3 +1,7 @@
+from __future__ import annotations
+
+import getpass
+import hashlib
 import json
 import logging
 import os
@@ -5,11 +9,16 @@ import sys
 from datetime import datetime
 
 import envy
-from envy.lib.jobs.enums import Purpose
+from envy.lib.jobs.enums import DependencyMode, DuplicatePolicy, Purpose
+from envy.lib.jobs.frame_range import FrameRange
+from envy.lib.network import codec
+from envy.lib.utils import ids
 from envy.lib.utils.utils import DummyLogger
 
 logger = logging.getLogger(__name__)
 
+JOBS_PATH = os.path.join(os.path.dirname(envy.__file__), 'Jobs', 'Jobs')
+
 
 class Job:
     def __init__(self, name: str):
@@ -20,14 +29,18 @@ class Job:
         purpose: (jobs.enums.Purpose)
         type: (str)
         environment: (dict)
-        dependencies: (list of dict)
+        dependencies: (list of dict) {'Id': job id, 'Name': job name} of every job this job waits for,
+            frame dependencies also hold 'Mode': 'frame' and 'Window', see add_dependency
         parameters: (dict)
+        duplicate_policy: (jobs.enums.DuplicatePolicy) ALLOW unless the submitter asks to merge or reject a job which is still on the farm
+        priority: (int) jobs with a higher priority are dispatched first
+        weight: (float) share of the farm relative to the owner's other jobs, see jobs.fair_share
         :param name: (str) name of job
         """
         self.name = name
         self.purpose = None
         self.type = None
-        self.id = hash(os.getlogin() + name + str(datetime.now())) % (10**10)
+        self.id = ids.next_id()
 
         self.range = ""
 
@@ -36,8 +49,11 @@ class Job:
         self.parameters = {}
 
         self.allocation = 1
+        self.duplicate_policy = DuplicatePolicy.ALLOW
+        self.priority = 0
+        self.weight = 1.0
 
-        self.metadata = {'Creation_Time': datetime.now().strftime('%d-%m-%Y %H-%M-%S'), 'Contributors': []}
+        self.metadata = {'Creation_Time': datetime.now().strftime('%d-%m-%Y %H-%M-%S'), 'Contributors': [], 'Owner': _current_user()}
 
     def set_purpose(self, purpose: Purpose) -> None:
         self.purpose = purpose
@@ -63,13 +79,41 @@ class Job:
     def get_parameters(self) -> dict:
         return self.parameters
 
-    def add_dependency(self) -> None:
-        raise NotImplemented()
-
-    def remove_dependency(self, name: str) -> bool:
+    def add_dependency(self, dependency: Job | int, mode: DependencyMode = DependencyMode.JOB, window: int = 0) -> None:
+        """
+        Keeps this job from being dispatched until another job is done, eg: a render waiting for its cache.
+        Job ids are assigned when a job is created so a whole chain can be built and submitted together.
+        With DependencyMode.FRAME an allocation of this job only waits for the frames it covers,
+        so a render of frames 1-10 starts as soon as frames 1-10 of its cache are written instead of waiting for the whole cache.
+        :param dependency: the job or the ID of the job this job waits for
+        :param mode: wait for the whole job or frame by frame
+        :param window: frame dependencies only, frame f also waits for the frames up to window frames before and after f eg: for motion blur
+        """
+        if isinstance(dependency, Job):
+            entry = {'Id': dependency.get_id(), 'Name': dependency.name}
+        else:
+            entry = {'Id': int(dependency), 'Name': ''}
+        if entry['Id'] == self.get_id():
+            raise ValueError(f'{self.name} cannot depend on itself')
+        if DependencyMode(mode) == DependencyMode.FRAME:
+            if window < 0:
+                raise ValueError(f'invalid window {window}')
+            entry['Mode'] = DependencyMode.FRAME.value
+            entry['Window'] = int(window)
+        if self.dependencies is None:
+            self.dependencies = []
+        if entry['Id'] not in self.get_dependency_ids():
+            self.dependencies.append(entry)
+
+    def get_dependency_ids(self) -> list:
+        return [int(dependency['Id']) for dependency in self.dependencies or () if dependency.get('Id') is not None]
+
+    def remove_dependency(self, name: str | int) -> bool:
+        """
+        :param name: name or ID of the job to stop waiting for
+        """
         for i, dependency in enumerate(self.dependencies):
-            dependency_name = dependency['Name']
-            if dependency_name == name:
+            if dependency.get('Name') == name or dependency.get('Id') == name:
                 self.dependencies.pop(i)
                 return True
         return False
@@ -89,8 +133,46 @@ class Job:
     def get_allocation(self) -> int:
         return self.allocation
 
+    def set_duplicate_policy(self, policy: DuplicatePolicy) -> None:
+        self.duplicate_policy = DuplicatePolicy(policy)
+
+    def get_duplicate_policy(self) -> DuplicatePolicy:
+        return self.duplicate_policy
+
+    def set_priority(self, priority: int) -> None:
+        self.priority = int(priority)
+
+    def get_priority(self) -> int:
+        return self.priority
+
+    def set_weight(self, weight: float) -> None:
+        weight = float(weight)
+        if weight <= 0:
+            raise ValueError(f'invalid weight {weight}')
+        self.weight = weight
+
+    def get_weight(self) -> float:
+        return self.weight
+
+    def get_owner(self) -> str:
+        return self.metadata.get('Owner', '')
+
+    def fingerprint(self) -> str:
+        """
+        Hashes what the job renders, its type, environment, parameters and range.
+        Two submissions of the same work get the same fingerprint no matter their name, id or metadata.
+        :return: (str) hex digest
+        """
+        content = {
+            'Type': self.type,
+            'Environment': self.environment,
+            'Parameters': self.parameters,
+            'Range': ' '.join(self.range.split()),
+        }
+        return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
     def encode(self) -> str:
-        return json.dumps(self.as_dict())
+        return codec.JSON.dumps(self.as_dict())
 
     def as_dict(self) -> dict:
         return_dict = {
@@ -104,6 +186,9 @@ class Job:
             'Parameters': self.parameters,
             'Metadata': self.metadata,
             'Allocation': self.allocation,
+            'Duplicate_Policy': self.duplicate_policy,
+            'Priority': self.priority,
+            'Weight': self.weight,
         }
         return return_dict
 
@@ -145,28 +230,32 @@ class Job:
     def get_id(self) -> int:
         return int(self.id)
 
-    def range_as_list(self) -> list:
-        ranges = self.range.lstrip().split(' ')
-        return_list = []
-        for frame_range in ranges:
-            range_split = frame_range.split('-')
-            start = int(float(range_split[0]))
-            range_split = range_split[1].split(':')
-            end = int(float(range_split[0])) + 1
-            increment = int(float(range_split[1]))
-            return_list.extend(range(start, end, increment))
-        return return_list
-
-    def write(self) -> None:
-        folder_path = os.path.join(envy.__file__, 'Jobs', 'Jobs')
-        json_file_path = os.path.join(folder_path, f'{self.name}_{datetime.today().strftime("%d-%m-%Y_%H-%M-%S")}.json')
+    def get_frame_range(self) -> FrameRange:
+        """
+        :return: (FrameRange) the frames in self.range without building a list of them
+        :raises ValueError: If the range cannot be read
+        """
+        return FrameRange.decode(self.range)
+
+    def write(self, folder_path: str = JOBS_PATH) -> str:
+        """
+        Writes the job to a temporary file and renames it into place so the ingestor never sees a half written job.
+        :param folder_path: directory the ingestor watches
+        :return: (str) path to the job file
+        """
+        file_name = f'{self.name}_{datetime.today().strftime("%d-%m-%Y_%H-%M-%S")}.json'
+        json_file_path = os.path.join(folder_path, file_name)
+        temporary_path = os.path.join(folder_path, f'.{file_name}.{os.getpid()}.tmp')
 
         if not os.path.exists(folder_path):
             os.makedirs(folder_path)
 
-        with open(json_file_path, 'w') as job_file:
+        with open(temporary_path, 'w') as job_file:
             json.dump(self.as_dict(), job_file, indent=4)
-            job_file.close()
+            job_file.flush()
+            os.fsync(job_file.fileno())
+        os.replace(temporary_path, json_file_path)
+        return json_file_path
 
     def as_sqlite_compliant(self):
         return_dict = self.as_dict()
@@ -175,11 +264,13 @@ class Job:
         job_type = return_dict['Type']
         job_id = return_dict['ID']
         job_range = return_dict['Range']
-        environment = json.dumps(return_dict['Environment'])
-        parameters = json.dumps(return_dict['Parameters'])
-        metadata = json.dumps(return_dict['Metadata'])
-        dependencies = json.dumps(return_dict['Dependencies'])
+        environment = codec.JSON.dumps(return_dict['Environment'])
+        parameters = codec.JSON.dumps(return_dict['Parameters'])
+        metadata = codec.JSON.dumps(return_dict['Metadata'])
+        dependencies = codec.JSON.dumps(return_dict['Dependencies'])
         allocation = return_dict['Allocation']
+        priority = return_dict['Priority']
+        weight = return_dict['Weight']
 
         return_dict = {
             'Name': name,
@@ -192,6 +283,8 @@ class Job:
             'Metadata': metadata,
             'Dependencies': dependencies,
             'Allocation': allocation,
+            'Priority': priority,
+            'Weight': weight,
         }
 
         return return_dict
@@ -203,7 +296,14 @@ class Job:
         return self.name
 
 
-def job_from_dict(job_as_dict: dict, logger: logging.Logger = None) -> Job:
+def _current_user() -> str:
+    try:
+        return getpass.getuser()
+    except (KeyError, OSError):
+        return ''
+
+
+def job_from_dict(job_as_dict: dict, logger: logging.Logger = None, job_class: type = Job) -> Job:
 
     logger.debug(f'Building job from {job_as_dict}')
     # validate there is a Name and a Purpose and a Type
@@ -252,7 +352,11 @@ def job_from_dict(job_as_dict: dict, logger: logging.Logger = None) -> Job:
     if 'Parameters' in job_as_dict:
         parameters = job_as_dict['Parameters']
 
-    new_job = Job(name)
+    duplicate_policy = job_as_dict.get('Duplicate_Policy', DuplicatePolicy.ALLOW)
+    priority = job_as_dict.get('Priority', 0)
+    weight = job_as_dict.get('Weight', 1.0)
+
+    new_job = job_class(name)
     new_job.set_purpose(purpose)
     new_job.set_type(job_type)
     new_job.set_environment(environment)
@@ -262,6 +366,9 @@ def job_from_dict(job_as_dict: dict, logger: logging.Logger = None) -> Job:
     new_job.set_range(new_range)
     new_job.set_id(new_id)
     new_job.set_allocation(allocation)
+    new_job.set_duplicate_policy(duplicate_policy)
+    new_job.set_priority(priority)
+    new_job.set_weight(weight)
 
     return new_job
 
@@ -275,10 +382,10 @@ def job_from_sqlite(job_as_sql_tuple: tuple, logger: logging.Logger = None) -> J
         job_as_sql_tuple
     )
 
-    metadata = json.loads(metadata)
-    environment = json.loads(environment)
-    dependencies = json.loads(dependencies)
-    parameters = json.loads(parameters)
+    metadata = codec.JSON.loads(metadata)
+    environment = codec.JSON.loads(environment)
+    dependencies = codec.JSON.loads(dependencies)
+    parameters = codec.JSON.loads(parameters)
 
     new_job = Job(name)
     new_job.set_purpose(purpose)
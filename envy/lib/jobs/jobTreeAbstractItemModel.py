@@ -1,13 +1,17 @@
-import json
+import bisect
 import logging
+import typing
 
-import anytree.resolver
+import anytree
 from PySide6.QtCore import Qt, QAbstractItemModel, QModelIndex
-from anytree import Resolver
 
 import envy.lib.network.message
-from envy.lib.jobs import jobItem
+from envy.lib.jobs import dependencies, jobItem
+from envy.lib.jobs.enums import Purpose
 from envy.lib.jobs.enums import Status as Job_Status
+from envy.lib.jobs.frame_range import FrameRange
+from envy.lib.jobs.ready_queue import ReadyQueue
+from envy.lib.network import codec
 from envy.lib.network.message import MessageTarget
 
 logger = logging.getLogger(__name__)
@@ -19,8 +23,23 @@ class JobTreeItemModel(QAbstractItemModel):
         super(JobTreeItemModel, self).__init__(parent=parent)
         self.root = jobItem.JobItem(name='root', node_type='root', label='root')
         self.db = None
-        self.resolver = Resolver()
+        self.writer = None
         self.number_of_jobs = 0
+
+        # id -> node lookups so nothing has to ask the database where a node lives
+        self.jobs: dict[int, jobItem.JobItem] = {}
+        self.allocations: dict[int, jobItem.JobItem] = {}
+        self.tasks: dict[int, jobItem.JobItem] = {}
+        # sorted (Task_Base, allocation id) of compact allocations so a task id can be traced back to its allocation
+        self.task_blocks: list[tuple[int, int]] = []
+        # environment id -> parsed environment so jobs sharing an environment in the database share one dict here too
+        self.environments: dict[int, dict] = {}
+        # pending allocations in dispatch order, kept up to date by every method which changes an allocation's status
+        self.ready = ReadyQueue()
+        # jobs whose allocations are held back until the jobs they depend on are done
+        self.dependencies = dependencies.DependencyGraph()
+        # allocations which are held back until the frames they cover are done in the jobs they depend on frame by frame
+        self.frame_dependencies = dependencies.FrameDependencies()
         self.read_only = False
         self.skip_complete_allocations = True
         self.skip_complete_tasks = True
@@ -30,6 +49,25 @@ class JobTreeItemModel(QAbstractItemModel):
 
     def set_db(self, db):
         self.db = db
+        if self.writer is None:
+            self.writer = db
+
+    def set_db_writer(self, writer):
+        """
+        Routes every write made by the tree through writer instead of straight to the database
+        :param writer: anything exposing set_task_value, set_allocation_value and set_job_value eg: db.writer.DBWriter
+        """
+        self.writer = writer
+
+    def set_ready_queue(self, queue):
+        """
+        Replaces the queue pending allocations are picked from, eg: with a jobs.fair_share.FairSharePolicy.
+        Allocations which are already pending are moved over in their current order
+        :param queue: anything exposing push, discard, start and peek like jobs.ready_queue.ReadyQueue
+        """
+        for allocation_id in self.ready:
+            queue.push(allocation_id)
+        self.ready = queue
 
     def enable_read_only(self):
         self.read_only = True
@@ -62,20 +100,51 @@ class JobTreeItemModel(QAbstractItemModel):
         return_new_job=False,
     ) -> (list, jobItem.JobItem):
         logger.debug(f'JobTree: syncing job: {job_id} from database to tree')
+        job_tree = self.db.get_job_tree(job_id)
+        return self.insert_job(
+            job_tree,
+            skip_complete_allocations=skip_complete_allocations,
+            skip_complete_tasks=skip_complete_tasks,
+            return_new_job=return_new_job,
+        )
+
+    def insert_job(
+        self,
+        job_tree: tuple,
+        skip_complete_allocations: bool = True,
+        skip_complete_tasks: bool = True,
+        return_new_job=False,
+        finished_jobs: typing.Container[int] = (),
+    ) -> (list, jobItem.JobItem):
+        """
+        Builds the nodes for a job out of data already read from the database so the tree itself never blocks on a query.
+        A job which depends on jobs which are not done yet keeps its allocations out of the ready queue until they are, see finish_job.
+        A job which depends on a job in the tree frame by frame queues each allocation once the frames it covers are done there, see queue_allocation.
+        Jobs it depends on are only known to be done if they are done in the tree or listed in finished_jobs,
+        so insert parents before their children, see dependencies.topological_order
+        :param job_tree: the result of DB.get_job_tree()
+        :param finished_jobs: ids of jobs which are not in the tree and are done
+        :return: list of active allocation ids or the new job node if return_new_job is True
+        """
+        job_row, allocation_rows = job_tree
+        job_id = job_row.id
 
         row = self.root.child_count()
         self.beginInsertRows(self.index_from_item(self.root), row, row)
 
-        job_values = self.db.get_job_values(job_id)
-        job_name = job_values[1]
-        job_purpose = job_values[3]
-        job_type = job_values[5]
-        job_environment = json.loads(job_values[6])
-        job_parameters = json.loads(job_values[7])
-        job_status = job_values[9]
-        job_dependencies = job_values[10]
-        job_allocation = job_values[11]
-        info = job_values[12]
+        job_name = job_row.name
+        job_purpose = job_row.purpose
+        job_type = job_row.type
+        job_environment = self.environments.get(job_row.environment_id)
+        if job_environment is None:
+            job_environment = codec.JSON.loads(job_row.environment)
+            if job_row.environment_id is not None:
+                self.environments[job_row.environment_id] = job_environment
+        job_parameters = codec.JSON.loads(job_row.parameters)
+        job_status = job_row.status
+        job_dependencies = job_row.dependencies
+        job_allocation = job_row.allocation
+        info = job_row.info
 
         new_job = jobItem.JobItem(
             name=job_id,
@@ -94,13 +163,28 @@ class JobTreeItemModel(QAbstractItemModel):
             node_type='Job',
             parent=self.root,
             info=info,
+            owner=self._owner(job_row.metadata),
+            priority=job_row.priority or 0,
+            weight=job_row.weight or 1,
+            frame_parents={},
         )
-        allocation_ids = self.db.get_allocation_ids(job_id)
+        self.jobs[job_id] = new_job
+        parent_frames = None
+        if self.read_only is False:
+            parents = [parent for parent in dependencies.parent_ids(job_dependencies) if not self._is_finished(parent, finished_jobs)]
+            # a job depended on frame by frame which is not in the tree yet has no frames to wait for so the whole job is waited for
+            windows = dependencies.frame_windows(job_dependencies)
+            new_job.frame_parents = {parent: windows[parent] for parent in parents if parent in windows and parent in self.jobs}
+            if self.dependencies.add(job_id, [parent for parent in parents if parent not in new_job.frame_parents]):
+                new_job.info = self._waiting_info(job_id)
+            elif new_job.frame_parents:
+                parent_frames = self._parent_frames(new_job)
         pending_allocations = []
         active_allocations = []
         done_allocations = []
-        for allocation_id in allocation_ids:
-            allocation_status = self.db.get_allocation_value(allocation_id, 'Status')
+        for allocation_row, task_rows in allocation_rows:
+            allocation_id = allocation_row.id
+            allocation_status = allocation_row.status
 
             if (allocation_status == Job_Status.DONE or allocation_status == Job_Status.FAILED) and skip_complete_allocations is True:
                 done_allocations.append(allocation_id)
@@ -112,8 +196,9 @@ class JobTreeItemModel(QAbstractItemModel):
             if allocation_status == Job_Status.PENDING:
                 pending_allocations.append(allocation_id)
 
-            allocation_computer = self.db.get_allocation_value(allocation_id, 'Computer')
-            info = self.db.get_allocation_value(allocation_id, 'Info')
+            allocation_computer = allocation_row.computer
+            info = allocation_row.info
+            frames = FrameRange.decode(allocation_row.frames) if allocation_row.frames is not None else None
 
             new_allocation = jobItem.JobItem(
                 name=allocation_id,
@@ -126,18 +211,25 @@ class JobTreeItemModel(QAbstractItemModel):
                 node_type='Allocation',
                 parent=new_job,
                 info=info,
+                frames=frames,
+                task_base=allocation_row.task_base,
+                finished_tasks=set(),
             )
-
-            task_ids = self.db.get_task_ids(allocation_id)
+            self.allocations[allocation_id] = new_allocation
+            if frames is not None:
+                bisect.insort(self.task_blocks, (allocation_row.task_base, allocation_id))
 
             pending_tasks = []
             active_tasks = []
             done_tasks = []
-            for task_id in task_ids:
-                task_data = self.db.get_task_values(task_id)
-                task_frame = task_data[3]
-                task_status = task_data[4]
-                task_computer = task_data[5]
+            for task_row in task_rows:
+                task_id = task_row.id
+                task_frame = task_row.frame
+                task_status = task_row.status
+                task_computer = task_row.computer
+
+                if task_status == Job_Status.DONE:
+                    new_allocation.finished_tasks.add(task_id)
 
                 if (task_status == Job_Status.DONE or task_status == Job_Status.FAILED) and skip_complete_tasks is True:
                     done_tasks.append(task_id)
@@ -159,22 +251,37 @@ class JobTreeItemModel(QAbstractItemModel):
                     node_type='Task',
                     parent=new_allocation,
                 )
+                self.tasks[task_id] = new_task
             new_allocation.pending_tasks = pending_tasks
             new_allocation.active_tasks = active_tasks
-            try:
-                progress = len(done_tasks) / (len(pending_tasks) + len(active_tasks) + len(done_tasks))
-            except ZeroDivisionError:
-                progress = 0
+            if frames is not None:
+                # frames without a task row are still pending and only get a node once they change state
+                progress = len(new_allocation.finished_tasks) / len(frames)
+            else:
+                try:
+                    progress = len(done_tasks) / (len(pending_tasks) + len(active_tasks) + len(done_tasks))
+                except ZeroDivisionError:
+                    progress = 0
             progress = round(progress, 2)
             new_allocation.progress = progress
 
-            if len(new_allocation.children) < 1:
+            if frames is not None:
+                allocation_done = self.is_allocation_done(new_allocation)
+            else:
+                allocation_done = len(new_allocation.children) < 1
+
+            if allocation_done:
                 done_allocations.append(allocation_id)
-                new_allocation.parent = None
+                self.detach(new_allocation)
                 continue
+            elif frames is not None:
+                new_allocation.label = f'Range: {frames.first}-{frames.last}'
             else:
                 new_allocation.label = f'Range: {new_allocation.children[0].frame}-{new_allocation.children[-1].frame}'
 
+            if allocation_status == Job_Status.PENDING:
+                self.queue_allocation(new_allocation, parent_frames=parent_frames)
+
         new_job.pending_allocations = pending_allocations
         new_job.active_allocations = active_allocations
 
@@ -194,6 +301,283 @@ class JobTreeItemModel(QAbstractItemModel):
 
         return active_allocations
 
+    def _is_finished(self, job_id: int, finished_jobs: typing.Container[int]) -> bool:
+        job_node = self.jobs.get(job_id)
+        if job_node is not None:
+            return job_node.status == Job_Status.DONE
+        return job_id in finished_jobs
+
+    def _waiting_info(self, job_id: int) -> str:
+        return f'Waiting for {", ".join(str(parent) for parent in sorted(self.dependencies.parents(job_id)))}'
+
+    def release_job(self, job_id: int) -> jobItem.JobItem | None:
+        """
+        Queues the pending allocations of a job which was waiting for other jobs
+        :param job_id: ID of the job
+        :return: the job node or None if the job is not in the tree
+        """
+        job_node = self.jobs.get(job_id)
+        if job_node is None:
+            return None
+        logger.info(f'JobTree: Releasing job {job_id}, every job it depends on is done')
+        parent_frames = self._parent_frames(job_node)
+        for allocation_node in job_node.children:
+            if allocation_node.status == Job_Status.PENDING:
+                self.queue_allocation(allocation_node, parent_frames=parent_frames)
+        job_node.info = ''
+        index = self.index_from_item(job_node, column=4)
+        self.dataChanged.emit(index, [Qt.DisplayRole])
+        return job_node
+
+    def queue_allocation(self, allocation_node: jobItem.JobItem, parent_frames: dict | None = None) -> bool:
+        """
+        Queues a pending allocation unless its job or the frames it covers are still waiting for other jobs
+        :param allocation_node: the allocation
+        :param parent_frames: the result of _parent_frames for its job, worked out once when queueing every allocation of a job
+        :return: (bool) True if the allocation was queued
+        """
+        job_node = allocation_node.parent
+        if self.dependencies.is_waiting(job_node.name):
+            return False
+        if getattr(job_node, 'frame_parents', None):
+            if parent_frames is None:
+                parent_frames = self._parent_frames(job_node)
+            needed = dependencies.needed_frames(self.allocation_frames(allocation_node), parent_frames)
+            if self.frame_dependencies.add(allocation_node.name, needed):
+                return False
+        self.ready.push(allocation_node.name)
+        return True
+
+    def _parent_frames(self, job_node: jobItem.JobItem) -> dict:
+        """
+        :return: (dict) parent job id -> (window, unfinished frames) of the jobs job_node depends on frame by frame
+        """
+        return {parent: (window, self.pending_frames(parent)) for parent, window in getattr(job_node, 'frame_parents', {}).items() if parent in self.jobs}
+
+    def pending_frames(self, job_id: int) -> set:
+        """
+        :return: (set) the frames of a job which are not done, failed frames are not pending either
+        """
+        job_node = self.jobs.get(job_id)
+        if job_node is None:
+            return set()
+        frames = set()
+        for allocation_node in job_node.children:
+            frames.update(self.allocation_frames(allocation_node))
+        return frames
+
+    @staticmethod
+    def allocation_frames(allocation_node: jobItem.JobItem) -> list:
+        """
+        :return: (list) the frames of an allocation which are not done
+        """
+        if allocation_node.frames is not None:
+            return [frame for index, frame in enumerate(allocation_node.frames) if allocation_node.task_base + index not in allocation_node.finished_tasks]
+        return [task_node.frame for task_node in allocation_node.children if task_node.status != Job_Status.DONE]
+
+    def _release_frames(self, job_id: int, frames: typing.Iterable) -> None:
+        """
+        Queues the allocations which were only waiting for these frames of job_id
+        """
+        if not self.frame_dependencies:
+            return
+        for frame in frames:
+            self._queue_released(self.frame_dependencies.finish_frame(job_id, frame))
+
+    def _queue_released(self, allocation_ids: typing.Iterable[int]) -> None:
+        for allocation_id in allocation_ids:
+            allocation_node = self.allocations.get(allocation_id)
+            if allocation_node is not None and allocation_node.status == Job_Status.PENDING:
+                self.ready.push(allocation_id)
+
+    def rechunkable_allocations(self, job_id: int) -> list[jobItem.JobItem]:
+        """
+        :return: (list) the compact allocations of a job which have not started and have no frame which changed state, see DB.rechunk_allocations
+        """
+        job_node = self.jobs.get(job_id)
+        if job_node is None:
+            return []
+        return [
+            allocation_node
+            for allocation_node in job_node.children
+            if allocation_node.status == Job_Status.PENDING and allocation_node.frames is not None and not allocation_node.children and not allocation_node.finished_tasks
+        ]
+
+    def hold_allocations(self, allocation_ids: typing.Iterable[int]) -> None:
+        """
+        Keeps pending allocations from being dispatched while they are being rebuilt, see replace_allocations.
+        Allocations which are left in the tree afterward have to be put back with queue_allocation
+        """
+        for allocation_id in allocation_ids:
+            self.ready.discard(allocation_id)
+            self.frame_dependencies.discard(allocation_id)
+
+    def replace_allocations(self, allocation_ids: typing.Sequence[int], allocation_rows: typing.Sequence) -> list[jobItem.JobItem]:
+        """
+        Swaps held allocations for the allocations DB.rechunk_allocations built out of them and queues the new ones
+        :param allocation_ids: the allocations which were rechunked
+        :param allocation_rows: the AllocationRows which replace them
+        :return: (list) the new allocation nodes, empty if the allocations are no longer in the tree eg: because their job was cancelled
+        """
+        old = [self.allocations[allocation_id] for allocation_id in allocation_ids if allocation_id in self.allocations]
+        if not old:
+            return []
+        job_node = old[0].parent
+        for allocation_node in old:
+            self.detach(allocation_node)
+
+        row = len(job_node.children)
+        self.beginInsertRows(self.index_from_item(job_node), row, row + len(allocation_rows) - 1)
+        new_allocations = [self._new_compact_allocation(job_node, allocation_row) for allocation_row in allocation_rows]
+        self.endInsertRows()
+
+        replaced = {allocation_node.name for allocation_node in old}
+        job_node.pending_allocations = [allocation_id for allocation_id in job_node.pending_allocations if allocation_id not in replaced]
+        job_node.pending_allocations.extend(allocation_node.name for allocation_node in new_allocations)
+        parent_frames = self._parent_frames(job_node)
+        for allocation_node in new_allocations:
+            self.queue_allocation(allocation_node, parent_frames=parent_frames)
+        return new_allocations
+
+    def _new_compact_allocation(self, job_node: jobItem.JobItem, allocation_row) -> jobItem.JobItem:
+        """
+        Adds the node of a new pending compact allocation below job_node, the caller wraps it in beginInsertRows and endInsertRows
+        :param allocation_row: the AllocationRow the database wrote for it
+        """
+        frames = FrameRange.decode(allocation_row.frames)
+        new_allocation = jobItem.JobItem(
+            name=allocation_row.id,
+            label=f'Range: {frames.first}-{frames.last}',
+            pending_tasks=[],
+            active_tasks=[],
+            status=Job_Status.PENDING,
+            progress=0,
+            computer=None,
+            node_type='Allocation',
+            parent=job_node,
+            info='',
+            frames=frames,
+            task_base=allocation_row.task_base,
+            finished_tasks=set(),
+        )
+        self.allocations[allocation_row.id] = new_allocation
+        bisect.insort(self.task_blocks, (allocation_row.task_base, allocation_row.id))
+        return new_allocation
+
+    def stealable_allocations(self) -> list[jobItem.JobItem]:
+        """
+        :return: (list) the compact allocations in progress whose unstarted frames could be handed to another client, see split_allocation.
+            A simulation has to run every frame on the same client so its allocations are left alone
+        """
+        return [
+            allocation_node
+            for allocation_node in self.allocations.values()
+            if allocation_node.status == Job_Status.INPROGRESS and allocation_node.frames is not None and allocation_node.parent.purpose != Purpose.SIMULATION
+        ]
+
+    def split_allocation(self, allocation_id: int, allocation_row) -> jobItem.JobItem | None:
+        """
+        Moves the frames DB.split_allocation split off an allocation into a new allocation and queues it.
+        The allocation keeps running on its client with the frames before them
+        :param allocation_id: ID of the allocation which was split
+        :param allocation_row: the AllocationRow of the new allocation
+        :return: the new allocation node or None if the allocation is no longer in the tree eg: because its job was cancelled
+        """
+        allocation_node = self.allocations.get(allocation_id)
+        if allocation_node is None or allocation_node.frames is None:
+            return None
+        job_node = allocation_node.parent
+        index = allocation_row.task_base - allocation_node.task_base
+        allocation_node.frames = allocation_node.frames[:index]
+        allocation_node.label = f'Range: {allocation_node.frames.first}-{allocation_node.frames.last}'
+
+        row = len(job_node.children)
+        self.beginInsertRows(self.index_from_item(job_node), row, row)
+        new_allocation = self._new_compact_allocation(job_node, allocation_row)
+        self.endInsertRows()
+        # frames which changed state before, eg: because the allocation was reset once, move along with their nodes
+        moved = [task_node for task_node in allocation_node.children if task_node.name >= allocation_row.task_base]
+        if moved:
+            allocation_node.children = [task_node for task_node in allocation_node.children if task_node.name < allocation_row.task_base]
+            new_allocation.children = moved
+        finished = {task_id for task_id in allocation_node.finished_tasks if task_id >= allocation_row.task_base}
+        allocation_node.finished_tasks -= finished
+        new_allocation.finished_tasks |= finished
+
+        job_node.pending_allocations.append(new_allocation.name)
+        self.queue_allocation(new_allocation)
+        index = self.index_from_item(allocation_node, column=0)
+        self.dataChanged.emit(index, [Qt.DisplayRole])
+        return new_allocation
+
+    def job_parents(self, job_id: int) -> list[int]:
+        """
+        :return: (list) ids of every job a job in the tree depends on, see dependencies.find_cycles
+        """
+        job_node = self.jobs.get(job_id)
+        if job_node is None:
+            return []
+        return dependencies.parent_ids(job_node.dependencies)
+
+    @staticmethod
+    def _owner(metadata: str | None) -> str:
+        """
+        :return: (str) the user who submitted a job, see job.Job, jobs submitted before owners were recorded belong to ''
+        """
+        try:
+            return codec.JSON.loads(metadata).get('Owner') or ''
+        except (codec.DecodeError, TypeError, AttributeError):
+            return ''
+
+    def set_job_share(self, job_id: int, priority: int | None = None, weight: float | None = None) -> jobItem.JobItem | None:
+        """
+        Changes how much of the farm a job gets, see jobs.fair_share
+        :param job_id: ID of the job
+        :param priority: jobs with a higher priority are dispatched first
+        :param weight: a job with twice the weight of another gets twice as many allocations as long as they share an owner and priority
+        :return: the job node or None if the job is not in the tree
+        """
+        job_node = self.jobs.get(job_id)
+        if job_node is None:
+            logger.warning(f'JobTree: Failed to change the share of job {job_id} - job is not in the tree')
+            return None
+        if priority is not None:
+            job_node.priority = int(priority)
+            if self.read_only is False:
+                self.writer.set_job_value(job_id, 'Priority', job_node.priority)
+        if weight is not None:
+            if weight <= 0:
+                raise ValueError(f'invalid weight {weight}')
+            job_node.weight = float(weight)
+            if self.read_only is False:
+                self.writer.set_job_value(job_id, 'Weight', job_node.weight)
+        if hasattr(self.ready, 'update_job'):
+            self.ready.update_job(job_id, priority=job_node.priority, weight=job_node.weight)
+        return job_node
+
+    def detach(self, node: jobItem.JobItem) -> None:
+        """
+        Removes a node and everything below it from the tree and from the id lookups
+        :param node: the node to remove
+        :return: Void
+        """
+        node.parent = None
+        lookups = {'Job': self.jobs, 'Allocation': self.allocations, 'Task': self.tasks}
+        for item in anytree.PreOrderIter(node):
+            lookup = lookups.get(getattr(item, 'node_type', None))
+            if lookup is not None and lookup.get(item.name) is item:
+                del lookup[item.name]
+                if lookup is self.allocations:
+                    self.ready.discard(item.name)
+                    self.frame_dependencies.discard(item.name)
+                elif lookup is self.jobs:
+                    self.dependencies.discard(item.name)
+            if getattr(item, 'frames', None) is not None:
+                block = (item.task_base, item.name)
+                position = bisect.bisect_left(self.task_blocks, block)
+                if position < len(self.task_blocks) and self.task_blocks[position] == block:
+                    del self.task_blocks[position]
+
     @staticmethod
     def check_if_children_are_done(node: jobItem.JobItem) -> bool:
         for child in node.children:
@@ -201,25 +585,68 @@ class JobTreeItemModel(QAbstractItemModel):
                 return False
         return True
 
-    def finish_task(self, task_id: int) -> (jobItem.JobItem, None):
+    def is_allocation_done(self, allocation_node: jobItem.JobItem) -> bool:
+        """
+        A compact allocation is done once every one of its frames finished, which is counted rather than read from task nodes
+        """
+        if allocation_node.frames is not None:
+            return len(allocation_node.finished_tasks) >= len(allocation_node.frames)
+        return self.check_if_children_are_done(allocation_node)
 
-        job_id = self.db.get_task_value(task_id, 'Job_Id')
-        allocation_id = self.db.get_task_value(task_id, 'Allocation_Id')
-        try:
-            task_node = self.resolver.get(self.root, f'/root/{job_id}/{allocation_id}/{task_id}')
-        except anytree.resolver.ChildResolverError as e:
-            logger.warning(f'Failed to finish task {task_id} - {e}')
+    def materialize_task(self, task_id: int) -> jobItem.JobItem | None:
+        """
+        Creates the node of a frame in a compact allocation the first time that frame changes state
+        :param task_id: ID of the task
+        :return: the new task node or None if the task does not belong to a compact allocation in the tree
+        """
+        position = bisect.bisect_right(self.task_blocks, (task_id, float('inf'))) - 1
+        if position < 0:
+            return None
+        allocation_node = self.allocations.get(self.task_blocks[position][1])
+        if allocation_node is None:
+            return None
+        index = task_id - allocation_node.task_base
+        if index >= len(allocation_node.frames) or task_id in allocation_node.finished_tasks:
+            return None
+
+        frame = allocation_node.frames[index]
+        row = bisect.bisect_left([child.name for child in allocation_node.children], task_id)
+        self.beginInsertRows(self.index_from_item(allocation_node), row, row)
+        task_node = jobItem.JobItem(
+            name=task_id,
+            label=f'Frame: {frame}',
+            frame=frame,
+            status=Job_Status.PENDING,
+            progress='N/A',
+            computer=None,
+            node_type='Task',
+        )
+        children = list(allocation_node.children)
+        children.insert(row, task_node)
+        allocation_node.children = children
+        self.tasks[task_id] = task_node
+        self.endInsertRows()
+        return task_node
+
+    def finish_task(self, task_id: int) -> (jobItem.JobItem, None):
+        task_node = self.get_task(task_id)
+        if task_node is None:
+            logger.warning(f'Failed to finish task {task_id} - task is not in the tree')
             return None
 
         allocation_node = task_node.parent
         task_node.status = Job_Status.DONE
         task_node.progress = 100
         if self.read_only is False:
-            self.db.set_task_value(task_id, 'Status', Job_Status.DONE)
-            task_node.parent = None
+            self.writer.set_task_value(task_id, 'Status', Job_Status.DONE)
+            self.detach(task_node)
+
+        if allocation_node.frames is not None:
+            allocation_node.finished_tasks.add(task_id)
+        self._release_frames(allocation_node.parent.name, [task_node.frame])
 
         logger.info(f'JobTree: {task_node.computer} Finished task {task_id}')
-        if self.check_if_children_are_done(allocation_node) is True:
+        if self.is_allocation_done(allocation_node) is True:
             self.finish_allocation(allocation_node)
 
         index = self.index_from_item(task_node, column=2)
@@ -233,11 +660,11 @@ class JobTreeItemModel(QAbstractItemModel):
             task_node = self.get_task(task_id)
             if task_node is None:
                 return
+        allocation_node = task_node.parent
         if self.read_only is False:
-            self.db.set_task_value(task_id, 'Status', Job_Status.FAILED)
-            task_node.parent = None
+            self.writer.set_task_value(task_node.name, 'Status', Job_Status.FAILED)
+            self.detach(task_node)
 
-        allocation_node = task_node.parent
         task_node.status = Job_Status.FAILED
         task_node.info = reason
         self.fail_allocation(allocation_node, reason)
@@ -255,22 +682,24 @@ class JobTreeItemModel(QAbstractItemModel):
             if allocation_node is None:
                 return
 
+        allocation_id = allocation_node.name
         job_node = allocation_node.parent
         job_node.info = 'Possible Error: one or more ranges have failed'
 
         if self.read_only is False:
-            self.db.set_allocation_value(allocation_id, 'Info', reason)
-            self.db.set_allocation_value(allocation_id, 'Status', Job_Status.FAILED)
-            self.db.set_job_value(job_node.name, 'Info', 'Possible Error: one or more ranges have failed')
-            allocation_node.parent = None
+            self.writer.set_allocation_value(allocation_id, 'Info', reason)
+            self.writer.set_allocation_value(allocation_id, 'Status', Job_Status.FAILED)
+            self.writer.set_job_value(job_node.name, 'Info', 'Possible Error: one or more ranges have failed')
+            self.detach(allocation_node)
 
         allocation_node.status = Job_Status.FAILED
         allocation_node.info = reason
+        self.ready.discard(allocation_id)
 
         logger.info(f'JobTree: {allocation_node.computer} Failed to finish allocation {allocation_id} for reason {reason}')
         index = self.index_from_item(allocation_node, column=2)
         self.dataChanged.emit(index, [Qt.DisplayRole])
-        index = self.index_from_item(allocation_node.parent, column=4)
+        index = self.index_from_item(job_node, column=4)
         self.dataChanged.emit(index, [Qt.DisplayRole])
 
         return allocation_node
@@ -292,11 +721,13 @@ class JobTreeItemModel(QAbstractItemModel):
 
         job_node = allocation.parent
         allocation_id = allocation.name
+        self._release_frames(job_node.name, self.allocation_frames(allocation))
         allocation.status = Job_Status.DONE
         allocation.progress = 100
+        self.ready.discard(allocation_id)
         if self.read_only is False:
-            self.db.set_allocation_value(allocation_id, 'Status', Job_Status.DONE)
-            allocation.parent = None
+            self.writer.set_allocation_value(allocation_id, 'Status', Job_Status.DONE)
+            self.detach(allocation)
 
         logger.debug(f'JobTree: Finished allocation {allocation_id}')
         if self.check_if_children_are_done(job_node) is True:
@@ -309,20 +740,30 @@ class JobTreeItemModel(QAbstractItemModel):
 
     def finish_job(self, job: int | jobItem.JobItem) -> (jobItem.JobItem, None):
         if isinstance(job, int):
-            try:
-                job = self.resolver.get(self.root, f'/root/{job}')
-            except anytree.resolver.ChildResolverError:
-                logger.debug(f'JobTree: Job {job} is already marked as finished')
+            job_id = job
+            job = self.jobs.get(job_id)
+            if job is None:
+                logger.debug(f'JobTree: Job {job_id} is already marked as finished')
                 return None
         job_id = job.name
         job.status = Job_Status.DONE
         job.progress = 100
         if self.read_only is False:
-            self.db.set_job_value(job_id, 'Status', Job_Status.DONE)
-            job.parent = None
+            self.writer.set_job_value(job_id, 'Status', Job_Status.DONE)
+            self.detach(job)
         self.number_of_jobs -= 1
         logger.debug(f'JobTree: Finished Job {job_id}')
 
+        children = self.dependencies.children(job_id)
+        released = self.dependencies.finish(job_id)
+        for child_id in sorted(children):
+            if child_id in released:
+                self.release_job(child_id)
+            elif child_id in self.jobs:
+                self.jobs[child_id].info = self._waiting_info(child_id)
+        # frames which never finished, eg: because they failed, no longer hold anything back
+        self._queue_released(self.frame_dependencies.finish_job(job_id))
+
         index = self.index_from_item(job, column=2)
         self.dataChanged.emit(index, [Qt.DisplayRole])
 
@@ -343,15 +784,13 @@ class JobTreeItemModel(QAbstractItemModel):
 
     def reset_allocation(self, allocation_id: int):
         logger.debug(f'resetting allocation {allocation_id}')
-        job_id = self.db.get_allocation_value(allocation_id, 'Job_Id')
 
         if self.read_only is False:
-            self.db.set_allocation_value(allocation_id, 'Status', Job_Status.PENDING)
+            self.writer.set_allocation_value(allocation_id, 'Status', Job_Status.PENDING)
 
-        try:
-            allocation_node = self.resolver.get(self.root, f'/root/{job_id}/{allocation_id}')
-        except anytree.resolver.ChildResolverError as e:
-            logger.warning(f'JobTree: Failed to reset allocation {allocation_id} - {e}')
+        allocation_node = self.get_allocation(allocation_id)
+        if allocation_node is None:
+            logger.warning(f'JobTree: Failed to reset allocation {allocation_id} - allocation is not in the tree')
             return False
 
         for task_node in allocation_node.children:
@@ -360,35 +799,42 @@ class JobTreeItemModel(QAbstractItemModel):
         allocation_node.status = Job_Status.PENDING
         allocation_node.computer = None
         allocation_node.progress = 0
+        self.queue_allocation(allocation_node)
         logger.debug(f'JobTree: Reset allocation {allocation_id}')
         return True
 
     def pick_allocation(self) -> jobItem.JobItem | None:
-        if len(self.root.children) == 0:
-            yield None
-        for job in self.root.children:
-            for allocation in job.children:
-                yield allocation
-        yield None
+        """
+        :return: the allocation which should be dispatched next or None if no allocation is pending.
+            It stays queued until it is started, see start_allocation
+        """
+        while True:
+            allocation_id = self.ready.peek()
+            if allocation_id is None:
+                return None
+            allocation = self.allocations.get(allocation_id)
+            if allocation is not None and allocation.status == Job_Status.PENDING:
+                return allocation
+            self.ready.discard(allocation_id)
+
+    def allocations_on(self, computer: str) -> list:
+        """
+        :return: (list) the allocations in progress on computer
+        """
+        return [allocation for allocation in self.allocations.values() if allocation.computer == computer and allocation.status == Job_Status.INPROGRESS]
 
     def get_allocation(self, allocation_id: int):
-        job_id = self.db.get_allocation_value(allocation_id, 'Job_Id')
-        try:
-            allocation_node = self.resolver.get(self.root, f'/root/{job_id}/{allocation_id}')
-        except anytree.resolver.ChildResolverError as e:
+        allocation_node = self.allocations.get(allocation_id)
+        if allocation_node is None:
             logger.debug(f'cannot find allocation {allocation_id}')
-            return None
         return allocation_node
 
     def get_task(self, task_id: int):
-        job_id = self.db.get_task_value(task_id, 'Job_Id')
-        allocation_id = self.db.get_task_value(task_id, 'Allocation_Id')
-        self.db.set_task_value(task_id, 'Status', Job_Status.DONE)
-        try:
-            task_node = self.resolver.get(self.root, f'/root/{job_id}/{allocation_id}/{task_id}')
-        except anytree.resolver.ChildResolverError as e:
-            logger.warning(f'JobTree: Failed to find task {task_id} - {e}')
-            return None
+        task_node = self.tasks.get(task_id)
+        if task_node is None:
+            task_node = self.materialize_task(task_id)
+        if task_node is None:
+            logger.warning(f'JobTree: Failed to find task {task_id}')
         return task_node
 
     def start_allocation(self, computer: str, allocation: int | jobItem.JobItem) -> (jobItem.JobItem, None):
@@ -406,10 +852,11 @@ class JobTreeItemModel(QAbstractItemModel):
 
         allocation.status = Job_Status.INPROGRESS
         allocation.computer = computer
+        self.ready.start(allocation.name)
 
         if self.read_only is False:
-            self.db.set_allocation_value(allocation.name, 'Status', Job_Status.INPROGRESS)
-            self.db.set_allocation_value(allocation.name, 'Computer', computer)
+            self.writer.set_allocation_value(allocation.name, 'Status', Job_Status.INPROGRESS)
+            self.writer.set_allocation_value(allocation.name, 'Computer', computer)
 
         index = self.index_from_item(allocation, column=2)
         self.dataChanged.emit(index, [Qt.DisplayRole])
@@ -426,8 +873,8 @@ class JobTreeItemModel(QAbstractItemModel):
         task_node.status = Job_Status.INPROGRESS
 
         if self.read_only is False:
-            self.db.set_task_value(task_id, 'Status', Job_Status.INPROGRESS)
-            self.db.set_task_value(task_id, 'Computer', computer)
+            self.writer.set_task_value(task_id, 'Status', Job_Status.INPROGRESS)
+            self.writer.set_task_value(task_id, 'Computer', computer)
 
         index = self.index_from_item(task_node, column=2)
         self.dataChanged.emit(index, [Qt.DisplayRole])
@@ -435,47 +882,42 @@ class JobTreeItemModel(QAbstractItemModel):
         return task_node
 
     def allocation_as_message(self, allocation: jobItem.JobItem | int) -> envy.lib.network.message.FunctionMessage:
-        if isinstance(allocation, jobItem.JobItem):
-            allocation = allocation.name
-        allocation_id = allocation
-        allocation = self.db.get_allocation_values(allocation)
-        job_id = allocation[1]
-        task_ids = json.loads(allocation[2])
-
-        job_values = self.db.get_job_values(job_id)
-        name = job_values[1]
-        purpose = job_values[3]
-        job_type = job_values[5]
-        environment = job_values[6]
-        environment = json.loads(environment)
-        parameters = job_values[7]
-        parameters = json.loads(parameters)
+        """
+        Builds the message which hands an allocation to a client.
+        Everything comes from the nodes in the tree so no database access is needed.
+        """
+        if isinstance(allocation, int):
+            allocation = self.get_allocation(allocation)
+        allocation_id = allocation.name
+        job_node = allocation.parent
 
         tasks = {}
-        for task in task_ids:
-            task = int(task)
-            task_status = self.db.get_task_value(task, 'Status')
-            frame = self.db.get_task_value(task, 'Frame')
-
-            # skip if the task is done
-            if task_status == Job_Status.DONE:
-                continue
+        if allocation.frames is not None:
+            for index, frame in enumerate(allocation.frames):
+                task_id = allocation.task_base + index
+                if task_id not in allocation.finished_tasks:
+                    tasks[task_id] = frame
+        else:
+            for task in allocation.children:
+                # skip if the task is done
+                if task.status == Job_Status.DONE:
+                    continue
 
-            tasks[task] = frame
+                tasks[task.name] = task.frame
 
         data = {
             'Allocation_Id': allocation_id,
-            'Purpose': purpose,
+            'Purpose': job_node.purpose,
             'Tasks': tasks,
-            'Environment': environment,
-            'Parameters': parameters,
+            'Environment': job_node.environment,
+            'Parameters': job_node.parameters,
         }
 
-        new_message = envy.envyRepo.networkUtils.message.FunctionMessage(f'Job: {name} Allocation: {allocation_id}')
-        new_message.set_function(job_type)
-        new_message.format_arguments(json.dumps(data))
+        new_message = envy.lib.network.message.FunctionMessage(f'Job: {job_node.job_name} Allocation: {allocation_id}')
+        new_message.set_function(job_node.job_type)
+        new_message.format_arguments(codec.JSON.dumps(data))
         new_message.set_target(MessageTarget.CLIENT)
-        logger.debug(f'DB: Wrote Allocation: {allocation} as message')
+        logger.debug(f'DB: Wrote Allocation: {allocation_id} as message')
         return new_message
 
     def update_allocation_progress(self, allocation_id: int, progress: int):
@@ -496,10 +938,9 @@ class JobTreeItemModel(QAbstractItemModel):
     def update_job_progress(self, job_id: int):
         job_node = job_id
         if isinstance(job_node, int):
-            try:
-                job_node = self.resolver.get(self.root, f'/root/{job_node}')
-            except anytree.resolver.ChildResolverError:
-                logger.info(f'jobTree: unable to find job {job_node}')
+            job_node = self.jobs.get(job_id)
+            if job_node is None:
+                logger.info(f'jobTree: unable to find job {job_id}')
                 return
 
         progresses = 0
@@ -0,0 +1,87 @@
+"""
+ready_queue.py: the allocations which can be dispatched right now, so the scheduler never has to walk the job tree to find one
+"""
+
+from __future__ import annotations
+
+import heapq
+import typing
+
+# entries removed from the middle of the heap are only dropped once they reach the top, past this many the heap is rebuilt
+MIN_COMPACT_SIZE = 64
+
+
+class ReadyQueue:
+    def __init__(self):
+        """
+        Allocation ids ordered by priority and then by id.
+        Ids are time ordered, see utils.ids, so allocations of the same priority go out in the order they were submitted.
+        Push, discard and peek are all O(log n) no matter how many allocations are queued.
+        A discarded entry is only marked and left in the heap until it reaches the top.
+        """
+        self._heap: list[list] = []
+        self._entries: dict[int, list] = {}
+
+    def push(self, allocation_id: int, priority: int = 0) -> None:
+        """
+        Queues an allocation or moves it to a new priority if it is already queued
+        :param allocation_id: ID of the allocation
+        :param priority: higher priorities are dispatched first
+        """
+        self.discard(allocation_id)
+        entry = [-priority, allocation_id, True]
+        self._entries[allocation_id] = entry
+        heapq.heappush(self._heap, entry)
+
+    def discard(self, allocation_id: int) -> bool:
+        """
+        :return: (bool) True if the allocation was queued
+        """
+        entry = self._entries.pop(allocation_id, None)
+        if entry is None:
+            return False
+        entry[2] = False
+        if len(self._heap) > MIN_COMPACT_SIZE and len(self._heap) > 2 * len(self._entries):
+            self._compact()
+        return True
+
+    def start(self, allocation_id: int) -> None:
+        """
+        Called once an allocation was sent to a client, a plain queue just forgets it
+        """
+        self.discard(allocation_id)
+
+    def _compact(self) -> None:
+        self._heap = [entry for entry in self._heap if entry[2]]
+        heapq.heapify(self._heap)
+
+    def peek(self) -> int | None:
+        """
+        :return: ID of the allocation which should be dispatched next or None if nothing is queued
+        """
+        heap = self._heap
+        while heap and not heap[0][2]:
+            heapq.heappop(heap)
+        return heap[0][1] if heap else None
+
+    def pop(self) -> int | None:
+        allocation_id = self.peek()
+        if allocation_id is not None:
+            self.discard(allocation_id)
+        return allocation_id
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __bool__(self) -> bool:
+        return len(self._entries) > 0
+
+    def __contains__(self, allocation_id: int) -> bool:
+        return allocation_id in self._entries
+
+    def __iter__(self) -> typing.Iterator[int]:
+        """
+        Yields the queued ids in dispatch order, this sorts the queue so it is meant for inspection not scheduling
+        """
+        for _, allocation_id, _ in sorted(self._entries.values()):
+            yield allocation_id
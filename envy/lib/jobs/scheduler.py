@@ -1,59 +1,173 @@
 import asyncio
+import collections
 import logging
-import sys
+import time
 
 import anytree
 
 import envy.lib.jobs.ingestor as ingestor
-from envy.lib.db import db
-from envy.lib.jobs.enums import Status
+from envy.lib.jobs import chunking, dependencies
+from envy.Plugins import Server_Functions as SRV
+from envy.lib.core.data import ClientStatus
+from envy.lib.db import writer
+from envy.lib.db.journal import Journal
+from envy.lib.jobs.enums import DuplicatePolicy, Status
+from envy.lib.jobs.fair_share import FairSharePolicy
 from envy.lib.jobs.jobTreeAbstractItemModel import JobTreeItemModel as JobTree
-
-SRV = sys.modules.get('Server_Functions')
+from envy.lib.utils.config import Config
 
 logger = logging.getLogger(__name__)
 
+# the dispatch loop runs on its own this often in case a wake-up was missed, eg: a client which never reported being idle
+RESCAN_INTERVAL = 10
+# how often the time from a client becoming idle to it being sent an allocation is logged
+LATENCY_REPORT_INTERVAL = 60
+# a client which did not answer a request to give up frames within this many seconds can be asked again, eg: because its plugin is too old to answer
+STEAL_TIMEOUT = 60
+
 
 class Scheduler:
-    def __init__(self, server, event_loop):
+    def __init__(self, server, database, journal: Journal = None):
+        """
+        :param server: the server this scheduler belongs to
+        :param database: the servers db.async_db.AsyncDB. Every query the scheduler makes goes through it so the event loop never blocks on sqlite
+        :param journal: optional db.journal.Journal which makes every state change durable before it is checkpointed into the database
+        """
         self.server = server
 
-        self.event_loop = asyncio.get_running_loop()
-        self.db = db.DB()
-        self.ingestor = ingestor.Ingestor(self)
+        self.event_loop = None
+        self.db = database
+        if journal is not None:
+            self.db_writer = writer.DBWriter(self.db, flush_interval=writer.CHECKPOINT_INTERVAL, journal=journal)
+        else:
+            self.db_writer = writer.DBWriter(self.db)
+        self.dedup_window = Config.DEDUPWINDOW
+        self.ingestor = ingestor.Ingestor(self, dedup_window=self.dedup_window)
         self.job_tree = JobTree()
+        self.job_tree.set_ready_queue(FairSharePolicy(self.job_tree))
         self.scheduler_tasks = []
         self.clients = server.clients
+        self._wake = asyncio.Event()
+        self._idle_since: dict[str, float] = {}
+        self.dispatch_latencies = collections.deque(maxlen=10000)
+        # what allocations of every job and scene measured to cost so pending allocations can be resized, see rechunk_job
+        self.costs = chunking.CostModel()
+        self.allocation_timer = chunking.AllocationTimer()
+        self._rechunking: set[int] = set()
+        # allocation id -> when its client was asked to give up its unstarted frames, see steal_frames
+        self._steals: dict[int, float] = {}
+        # allocation id -> the first task its client gave up which could not be split off, see allocation_truncated
+        self._given_up: dict[int, int] = {}
+
+    def wake(self) -> None:
+        """
+        Runs the dispatch loop now instead of at its next interval, eg: because a job just arrived.
+        Any number of calls before the loop gets to run result in a single pass.
+        """
+        self._wake.set()
+
+    def client_changed(self, computer_name: str) -> None:
+        """
+        Called whenever a client connects, disconnects or reports its status.
+        A client which is now idle gets an allocation right away and the time until it does is recorded, see report_dispatch_latency
+        :param computer_name: name of the client
+        """
+        client = self.clients.get(computer_name)
+        if client is None:
+            # whatever the client was working on goes back into the queue, like it used to be picked up again by the next scan of the tree
+            for allocation in self.job_tree.allocations_on(computer_name):
+                logger.info(f'Scheduler: {computer_name} disconnected, requeueing allocation {allocation.name}')
+                self.allocation_timer.discard(allocation.name)
+                self.job_tree.reset_allocation(allocation.name)
+        if client is None or client.status != ClientStatus.IDLE:
+            self._idle_since.pop(computer_name, None)
+            if client is None and self.job_tree.ready:
+                self.wake()
+            return
+        self._idle_since.setdefault(computer_name, time.monotonic())
+        self.wake()
+
+    def report_dispatch_latency(self) -> None:
+        """
+        Logs how long clients waited between becoming idle and being sent an allocation since the last report
+        """
+        if len(self.dispatch_latencies) == 0:
+            return
+        latencies = sorted(self.dispatch_latencies)
+        self.dispatch_latencies.clear()
+        p50 = latencies[len(latencies) // 2]
+        p95 = latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)]
+        logger.info(f'Scheduler: dispatch latency over {len(latencies)} allocations p50 {p50 * 1000:.1f}ms p95 {p95 * 1000:.1f}ms max {latencies[-1] * 1000:.1f}ms')
+
+    def set_job_share(self, job_id: int, priority: int = None, weight: float = None):
+        """
+        Changes the priority or weight of a job, the next dispatch already takes it into account
+        :return: the job node or None if the job is not in the tree
+        """
+        try:
+            job_node = self.job_tree.set_job_share(job_id, priority=priority, weight=weight)
+        except ValueError as e:
+            logger.warning(f'Scheduler: cannot change the share of job {job_id}: {e}')
+            return None
+        if job_node is not None:
+            logger.info(f'Scheduler: job {job_id} now has priority {job_node.priority} and weight {job_node.weight}')
+            self.wake()
+        return job_node
 
     async def issue_task(self, computer_name: str) -> bool:
         logger.debug(f'Scheduler: allocating tasks for {computer_name}')
-        for allocation in self.job_tree.pick_allocation():
+        while True:
+            allocation = self.job_tree.pick_allocation()
             if allocation is None:
                 return False
-            if self.check_allocation(allocation, computer=computer_name) is True:
-                logger.debug(f'Scheduler: Allocation ({allocation.name}) chosen for {computer_name}')
-                self.clients[computer_name]['Job'] = allocation.parent.name
-                self.clients[computer_name]['Allocation'] = allocation.name
-                self.job_tree.start_allocation(computer_name, allocation)
-                message = self.job_tree.allocation_as_message(allocation)
-                await SRV.mark_allocation_as_started(self.server, allocation.name, computer_name)
-                await SRV.send_to_client(self.server, computer_name, message)
-                return True
+            if self.check_allocation(allocation, computer=computer_name) is not True:
+                self.job_tree.ready.discard(allocation.name)
+                continue
+            logger.debug(f'Scheduler: Allocation ({allocation.name}) chosen for {computer_name}')
+            self.clients[computer_name].job_id = allocation.parent.name
+            self.clients[computer_name].task_id = allocation.name
+            # the client reports working once it gets the allocation, until then it must not be picked again
+            self.clients[computer_name].status = ClientStatus.WORKING
+            self.job_tree.start_allocation(computer_name, allocation)
+            self.allocation_timer.start(allocation.name, time.monotonic())
+            message = self.job_tree.allocation_as_message(allocation)
+            await SRV.mark_allocation_as_started(self.server, allocation.name, computer_name)
+            await SRV.send_to_client(self.server, computer_name, message)
+            idle_since = self._idle_since.pop(computer_name, None)
+            if idle_since is not None:
+                self.dispatch_latencies.append(time.monotonic() - idle_since)
+            if self.server.lease_acquired is not None:
+                logger.info(f'Scheduler: first dispatch {time.monotonic() - self.server.lease_acquired:.2f}s after taking over the lease')
+                self.server.lease_acquired = None
+            return True
 
     async def finish_job(self, job_id: int, stop_workers: bool = False):
         logger.info(f'Scheduler: Finishing Job {job_id}')
 
         if stop_workers is True:
             for client in self.clients:
-                if self.clients[client]['Job'] == job_id:
+                if self.clients[client].job_id == job_id:
                     logger.debug(f'Scheduler: stopping {client}')
                     await SRV.stop_client(self.server, client)
 
         self.job_tree.finish_job(job_id)
+        self.wake()
 
     async def finish_task(self, task_id: int):
         logger.info(f'Scheduler: Finishing task {task_id}')
+        task = self.job_tree.get_task(task_id)
+        allocation = task.parent if task is not None else None
+        job_node = allocation.parent if allocation is not None else None
+        waiting = len(self.job_tree.frame_dependencies)
         self.job_tree.finish_task(task_id=task_id)
+        if len(self.job_tree.frame_dependencies) < waiting:
+            # the frame let allocations of jobs which depend on its job frame by frame start
+            self.wake()
+        if allocation is None:
+            return
+        self.allocation_timer.finish_frame(allocation.name, time.monotonic())
+        if allocation.status == Status.DONE:
+            await self.measure_allocation(allocation, job_node)
 
     async def start_task(self, task_id: int, computer: str):
         logger.info(f'Scheduler: {computer} started task {task_id}')
@@ -64,19 +178,195 @@ class Scheduler:
 
         if stop_workers is True:
             for client in self.clients:
-                if self.clients[client]['Allocation'] == allocation_id:
+                if self.clients[client].task_id == allocation_id:
                     logger.debug(f'Scheduler: stopping {client}')
                     await SRV.stop_client(self.server, client)
 
+        allocation = self.job_tree.get_allocation(allocation_id)
+        job_node = allocation.parent if allocation is not None else None
+        if self._given_up.pop(allocation_id, None) is not None and allocation is not None and not self.job_tree.is_allocation_done(allocation):
+            # its client stopped before the frames it gave up, they are dispatched again on their own since finished frames are skipped
+            logger.warning(f'Scheduler: allocation {allocation_id} finished without the frames its client gave up, queueing them again')
+            self.allocation_timer.discard(allocation_id)
+            self.job_tree.reset_allocation(allocation_id)
+            self.wake()
+            return
         self.job_tree.finish_allocation(allocation_id)
+        self.wake()
+        if allocation is not None and allocation.status == Status.DONE:
+            await self.measure_allocation(allocation, job_node)
 
     async def fail_task(self, task_id: int, reason: str):
         logger.info(f'Scheduler: failing task {task_id} for reason {reason}')
+        task = self.job_tree.get_task(task_id)
+        if task is not None and task.parent is not None:
+            self.allocation_timer.discard(task.parent.name)
         self.job_tree.fail_task(task_id, reason)
+        self.wake()
 
     async def fail_allocation(self, allocation_id: int, reason: str):
         logger.info(f'Scheduler: Failing allocation {allocation_id} for reason {reason}')
+        self.allocation_timer.discard(allocation_id)
+        self._given_up.pop(allocation_id, None)
         self.job_tree.fail_allocation(allocation_id, reason)
+        self.wake()
+
+    async def measure_allocation(self, allocation: anytree.Node, job_node: anytree.Node) -> None:
+        """
+        Records what a finished allocation cost and resizes the pending allocations of its job if they are far off, see rechunk_job
+        :param allocation: the allocation node, it is no longer in the tree
+        :param job_node: the job the allocation belonged to
+        """
+        if allocation.frames is None or job_node is None:
+            return
+        keys = (job_node.name, self.scene_key(job_node))
+        measured = self.allocation_timer.finish(allocation.name, time.monotonic(), len(allocation.frames), known=self.costs.get(*keys))
+        if measured is None:
+            return
+        self.costs.observe(keys, *measured)
+        if job_node.name not in self.job_tree.jobs:
+            # the job is done, only what its scene costs is worth remembering
+            self.costs.discard(job_node.name)
+            return
+        await self.rechunk_job(job_node.name)
+
+    @staticmethod
+    def scene_key(job_node: anytree.Node) -> tuple | None:
+        return chunking.scene_key(job_node.job_type, job_node.purpose, job_node.environment)
+
+    async def rechunk_job(self, job_id: int) -> bool:
+        """
+        Rebuilds the pending allocations of a job so each takes about chunking.TARGET_SECONDS, getting smaller toward the end of the job.
+        The cost comes from the allocations of the job which already finished or, before any did, from earlier jobs of the same scene.
+        The allocations are held back while the database rebuilds them so none of them can be dispatched halfway through
+        :param job_id: ID of the job
+        :return: (bool) True if the allocations were rebuilt
+        """
+        job_node = self.job_tree.jobs.get(job_id)
+        if job_node is None or job_id in self._rechunking:
+            return False
+        cost = self.costs.get(job_id, self.scene_key(job_node))
+        if cost is None:
+            return False
+        allocations = self.job_tree.rechunkable_allocations(job_id)
+        current = [len(allocation.frames) for allocation in allocations]
+        planned = chunking.plan(sum(current), self.costs.allocation_size(cost), len(self.clients), minimum=self.costs.minimum_size(cost))
+        if not chunking.needs_rebuild(current, planned):
+            return False
+
+        allocation_ids = [allocation.name for allocation in allocations]
+        self._rechunking.add(job_id)
+        self.job_tree.hold_allocations(allocation_ids)
+        try:
+            allocation_rows = await self.db_writer.rechunk_allocations(allocation_ids, planned)
+        finally:
+            self._rechunking.discard(job_id)
+        if allocation_rows is None:
+            for allocation in allocations:
+                if self.job_tree.allocations.get(allocation.name) is allocation and allocation.status == Status.PENDING:
+                    self.job_tree.queue_allocation(allocation)
+            return False
+
+        self.job_tree.replace_allocations(allocation_ids, allocation_rows)
+        logger.info(
+            f'Scheduler: job {job_id} costs {cost.startup:.1f}s to start and {cost.per_frame:.1f}s per frame, '
+            f'rebuilt {len(allocation_ids)} pending allocations into {len(allocation_rows)} of {planned[0]}-{planned[-1]} frames'
+        )
+        self.wake()
+        return True
+
+    async def steal_frames(self, clients: int) -> int:
+        """
+        Asks the clients with the most frames left to start in their allocation to hand the end of it to idle clients.
+        A client gives up the frames after the one it is working on and the one after that, see allocation_truncated
+        :param clients: number of idle clients
+        :return: (int) number of clients which were asked
+        """
+        now = time.monotonic()
+        for allocation_id, asked in list(self._steals.items()):
+            if now - asked > STEAL_TIMEOUT:
+                del self._steals[allocation_id]
+
+        candidates = []
+        for allocation in self.job_tree.stealable_allocations():
+            if allocation.name in self._steals or allocation.computer not in self.clients:
+                continue
+            job_node = allocation.parent
+            # the client keeps the frame it works on and the one after it, which its process may already have started
+            remaining = len(allocation.frames) - len(allocation.finished_tasks) - 2
+            size = chunking.steal_size(remaining, self.costs.get(job_node.name, self.scene_key(job_node)))
+            if size > 0:
+                candidates.append((size, allocation))
+        candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+
+        asked = 0
+        for size, allocation in candidates[:clients]:
+            task_id = allocation.task_base + len(allocation.frames) - size
+            self._steals[allocation.name] = now
+            logger.info(f'Scheduler: asking {allocation.computer} to give up the last {size} frames of allocation {allocation.name}')
+            try:
+                await SRV.truncate_allocation(self.server, allocation.computer, allocation.name, task_id)
+            except RuntimeError as e:
+                logger.warning(f'Scheduler: could not ask {allocation.computer} to give up frames: {e}')
+                continue
+            asked += 1
+        return asked
+
+    async def allocation_truncated(self, allocation_id: int, task_id: int | None) -> bool:
+        """
+        Called once a client gave up the end of its allocation, see steal_frames.
+        The frames from task_id on become a new pending allocation which the next idle client picks up.
+        Frames from task_id on which already started stay with the allocation so none of them renders twice, the split moves after them.
+        Frames the client gave up which could not be split off stay with the allocation too, it is queued again instead of finished once its client is done, see finish_allocation
+        :param allocation_id: ID of the allocation
+        :param task_id: the first task the client gave up or None if it kept every frame eg: because it runs a simulation
+        :return: (bool) True if the frames were split off
+        """
+        if task_id is None:
+            # the client is not asked again until STEAL_TIMEOUT passed
+            logger.debug(f'Scheduler: allocation {allocation_id} kept all of its frames')
+            self._steals[allocation_id] = time.monotonic()
+            return False
+        self._steals.pop(allocation_id, None)
+
+        allocation = self.job_tree.get_allocation(allocation_id)
+        if allocation is None or allocation.frames is None:
+            return False
+        end = allocation.task_base + len(allocation.frames)
+        if task_id >= end:
+            return False
+
+        started = [task_node.name for task_node in allocation.children if task_node.status != Status.PENDING]
+        started = [started_id for started_id in (*allocation.finished_tasks, *started) if started_id >= task_id]
+        split_at = max(task_id, allocation.task_base + 1, max(started, default=task_id - 1) + 1)
+        if split_at > task_id:
+            logger.warning(f'Scheduler: frames of allocation {allocation_id} after task {task_id} already started, splitting it at task {split_at}')
+        if split_at >= end:
+            self._give_up(allocation_id, task_id)
+            return False
+
+        job_id = allocation.parent.name
+        allocation_row = await self.db_writer.split_allocation(allocation_id, split_at - allocation.task_base)
+        if allocation_row is None:
+            logger.error(f'Scheduler: failed to split allocation {allocation_id}')
+            self._give_up(allocation_id, task_id)
+            return False
+        new_allocation = self.job_tree.split_allocation(allocation_id, allocation_row)
+        if new_allocation is None:
+            return False
+        if split_at > task_id:
+            self._give_up(allocation_id, task_id)
+        logger.info(f'Scheduler: allocation {allocation_id} gave up {len(new_allocation.frames)} frames to allocation {new_allocation.name}')
+        await SRV.console_sync_job(self.server, job_id)
+        self.wake()
+        return True
+
+    def _give_up(self, allocation_id: int, task_id: int) -> None:
+        """
+        Remembers that the client of an allocation will not render its frames from task_id on although they are still part of it
+        """
+        logger.warning(f'Scheduler: allocation {allocation_id} keeps frames from task {task_id} on which its client gave up, they run again once it finished')
+        self._given_up[allocation_id] = min(task_id, self._given_up.get(allocation_id, task_id))
 
     def check_allocation(self, allocation: anytree.Node | int, computer: str = None) -> bool:
         logger.debug(f'checking allocation {allocation} with computer {computer}')
@@ -95,14 +385,116 @@ class Scheduler:
         return True
 
     async def sync_job(self, job_id: int):
-        self.job_tree.sync_job(job_id)
+        job_tree = await self.db.get_job_tree(job_id)
+        await self.insert_jobs([job_tree])
         await SRV.console_sync_job(self.server, job_id)
 
+    async def insert_jobs(self, job_trees: list, **kwargs) -> list:
+        """
+        Inserts jobs read with DB.get_job_tree into the tree, every job after the jobs it depends on.
+        Jobs they depend on which are neither in the tree nor among job_trees are looked up in the database with one query to tell whether they are done.
+        :param job_trees: results of DB.get_job_tree
+        :param kwargs: passed on to JobTreeItemModel.insert_job
+        :return: (list) the active allocations of the jobs
+        """
+        batch = {job_row.id for job_row, _ in job_trees}
+        unknown = {parent for job_row, _ in job_trees for parent in dependencies.parent_ids(job_row.dependencies)}
+        unknown = {parent for parent in unknown if parent not in batch and parent not in self.job_tree.jobs}
+        finished = set()
+        if unknown:
+            statuses = await self.db.get_job_statuses(unknown)
+            finished = {job_id for job_id, status in statuses.items() if status == Status.DONE}
+            missing = unknown - statuses.keys()
+            if missing:
+                logger.warning(f'Scheduler: jobs {", ".join(str(job_id) for job_id in sorted(missing))} are depended on but do not exist yet')
+
+        active_allocations = []
+        for job_tree in dependencies.topological_order(job_trees, lambda item: item[0].id, lambda item: item[0].dependencies):
+            active_allocations.extend(self.job_tree.insert_job(job_tree, finished_jobs=finished, **kwargs))
+        return active_allocations
+
+    def find_blocked_jobs(self, jobs: list) -> set[int]:
+        """
+        :param jobs: job.Job objects about to be added
+        :return: (set) ids of the jobs which are part of or depend on a dependency cycle and would never run
+        """
+        return dependencies.find_cycles(jobs, known_parents=self.job_tree.job_parents)
+
+    async def sync_jobs(self, job_ids: list[int]) -> None:
+        """
+        Syncs several new jobs with one trip to the database and one message to the consoles
+        :param job_ids: list of job IDs
+        """
+        if len(job_ids) == 0:
+            return
+        job_trees = await self.db.read_many(('get_job_tree', (job_id,)) for job_id in job_ids)
+        await self.insert_jobs(job_trees)
+        await SRV.console_sync_jobs(self.server, job_ids)
+        # jobs of a scene which was rendered before start out with allocations sized from what it cost then
+        for job_id in job_ids:
+            await self.rechunk_job(job_id)
+
+    async def submit_jobs(self, jobs: list) -> list[int | None]:
+        """
+        Adds jobs to the database in one transaction and makes them available for dispatch right away
+        :param jobs: list of job.Job
+        :return: (list) see settle_jobs
+        :raises RuntimeError: If the jobs could not be added, in which case none of them were
+        """
+        blocked = self.find_blocked_jobs(jobs)
+        if blocked:
+            names = ', '.join(str(new_job) for new_job in jobs if new_job.get_id() in blocked)
+            raise RuntimeError(f'dependency cycle between {names}')
+        job_ids = await self.db_writer.add_jobs(jobs, window=self.dedup_window)
+        if job_ids is None:
+            raise RuntimeError(f'failed to add {len(jobs)} jobs to the database')
+        job_ids = await self.settle_jobs(jobs, job_ids)
+        self.wake()
+        return job_ids
+
+    async def settle_jobs(self, jobs: list, job_ids: list[int]) -> list[int | None]:
+        """
+        Syncs the jobs DB.add_jobs added and reports the ones which duplicated an existing job to the consoles
+        :param jobs: list of job.Job which were passed to DB.add_jobs
+        :param job_ids: what DB.add_jobs returned for them
+        :return: (list) the job each submission ended up as, the existing job for merged duplicates and None for rejected ones
+        """
+        new_ids = []
+        duplicates = []
+        settled = []
+        for new_job, job_id in zip(jobs, job_ids):
+            if job_id == new_job.get_id():
+                new_ids.append(job_id)
+                settled.append(job_id)
+                continue
+            policy = new_job.get_duplicate_policy()
+            duplicates.append([str(new_job), new_job.get_id(), job_id, policy.value])
+            settled.append(job_id if policy == DuplicatePolicy.MERGE else None)
+
+        await self.sync_jobs(new_ids)
+        if duplicates:
+            logger.warning(f'Scheduler: {len(duplicates)} duplicate jobs submitted')
+            await SRV.console_report_duplicates(self.server, duplicates)
+        return settled
+
+    async def build_from_db(self) -> list:
+        logger.debug('Scheduler: building job tree from database')
+        job_ids = await self.db.get_ids_by_value('jobs', 'Status', Status.INPROGRESS)
+        job_ids.extend(await self.db.get_ids_by_value('jobs', 'Status', Status.PENDING))
+
+        job_trees = [await self.db.get_job_tree(job_id) for (job_id,) in job_ids]
+        return await self.insert_jobs(
+            job_trees,
+            skip_complete_allocations=self.job_tree.skip_complete_allocations,
+            skip_complete_tasks=self.job_tree.skip_complete_tasks,
+        )
+
     async def start(self):
         logger.debug("Starting...")
-        self.db.start()
-        self.job_tree.set_db(self.db)
-        active_allocations = self.job_tree.build_from_db()
+        self.event_loop = asyncio.get_running_loop()
+        self.job_tree.set_db_writer(self.db_writer)
+        await self.db_writer.recover()
+        active_allocations = await self.build_from_db()
 
         logger.debug(f'Scheduler: Active Task_Allocations: {active_allocations}')
         if active_allocations is not None:
@@ -111,19 +503,52 @@ class Scheduler:
                 if status is True:
                     self.job_tree.reset_allocation(allocation)
 
-        self.ingestor.set_db(self.db)
+        # jobs are added through the writer which journals them before their files are deleted
+        self.ingestor.set_db(self.db_writer)
         ingestor_task = self.event_loop.create_task(self.ingestor.start())
         ingestor_task.set_name('ingestor.start()')
         self.scheduler_tasks.append(ingestor_task)
 
+        writer_task = self.event_loop.create_task(self.db_writer.start())
+        writer_task.set_name('db_writer.start()')
+        self.scheduler_tasks.append(writer_task)
+
+        for computer_name in list(self.clients):
+            self.client_changed(computer_name)
+
+        last_report = time.monotonic()
         while True:
-            await asyncio.sleep(2)
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=RESCAN_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            # wake-ups during the pass set the event again and get a pass of their own
+            self._wake.clear()
+
+            if time.monotonic() - last_report >= LATENCY_REPORT_INTERVAL:
+                self.report_dispatch_latency()
+                last_report = time.monotonic()
+
             if self.job_tree.number_of_jobs == 0:
                 continue
+            await self.dispatch()
 
-            for client in self.clients:
-                if self.clients[client]['Status'] != Status.IDLE:
-                    continue
-                success = await self.issue_task(client)
-                if not success:
-                    continue
+    async def dispatch(self) -> None:
+        """
+        Offers an allocation to every idle client, once no allocation is pending idle clients get frames of running allocations, see steal_frames
+        """
+        # clients can connect or disconnect while an allocation is being sent
+        for computer_name in list(self.clients):
+            if not self.job_tree.ready:
+                break
+            client = self.clients.get(computer_name)
+            if client is None or client.status != ClientStatus.IDLE:
+                continue
+            await self.issue_task(computer_name)
+
+        if self.job_tree.ready:
+            return
+        # nothing left to start, the allocations still running are split up instead of idle clients waiting for them
+        idle = sum(1 for client in self.clients.values() if client.status == ClientStatus.IDLE)
+        if idle > 0:
+            await self.steal_frames(idle)
@@ -0,0 +1,129 @@
+"""
+submit.py: sends jobs straight to the server from DCC sessions and scripts.
+Every job of a call goes over one short lived connection and is added in one transaction,
+if the server cannot be reached the jobs are written to the jobs folder for the ingestor instead.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import socket
+import sqlite3
+import uuid
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+from envy.lib.db.utils import get_server_ip
+from envy.lib.jobs import job
+from envy.lib.jobs.enums import DuplicatePolicy
+from envy.lib.network import codec
+from envy.lib.network.message import FunctionMessage, MessageTarget, build_from_message_dict
+from envy.lib.network.types import ConnectionType
+from envy.lib.utils.utils import get_hash
+
+logger = logging.getLogger(__name__)
+
+PORT = 3720
+TIMEOUT = 10
+# the server replies once every job is added and journaled, which takes longer the more jobs are sent at once
+REPLY_TIMEOUT = 30
+REPLY_TIMEOUT_PER_JOB = 0.05
+
+
+def submit_jobs(jobs: list[job.Job], timeout: float = TIMEOUT, duplicate_policy: DuplicatePolicy | None = None) -> list[int] | None:
+    """
+    Submits jobs to the server in one round trip
+    :param jobs: list of job.Job, a bundle.Bundle counts as every job it expands into
+    :param timeout: seconds to wait for the connection, the wait for the reply also scales with the number of jobs, see reply_timeout
+    :param duplicate_policy: overrides the policy of every job, eg: DuplicatePolicy.MERGE to fold jobs which are still on the farm into the job already there.
+        None keeps the policy each job was built with, see job.Job.set_duplicate_policy
+    :return: (list) the job IDs the server assigned or None if the server could not be reached and the jobs were written to the jobs folder instead.
+        A job which duplicated one already on the farm gets that job's ID, or None if its duplicate policy rejected it.
+    :raises RuntimeError: If the server rejected the jobs or did not reply after receiving them.
+        The jobs are not written to the jobs folder in that case since the server may have added them already.
+    """
+    if duplicate_policy is not None:
+        for new_job in jobs:
+            new_job.set_duplicate_policy(duplicate_policy)
+
+    if websockets is not None:
+        try:
+            return asyncio.run(submit_over_websocket(jobs, timeout))
+        except ConnectionError as e:
+            logger.warning(f'Could not reach the server, writing job files instead: {e}')
+
+    for new_job in jobs:
+        new_job.write()
+    return None
+
+
+async def submit_over_websocket(jobs: list[job.Job], timeout: float = TIMEOUT) -> list[int]:
+    """
+    Connects as a console, calls Server_Functions.submit_jobs and waits for its reply
+    :return: (list) the new job IDs
+    :raises ConnectionError: If the jobs could not be sent to the server
+    :raises RuntimeError: If the server rejected the jobs or did not reply in time
+    """
+    try:
+        server_ip = get_server_ip()
+    except (sqlite3.Error, OSError) as e:
+        # the shared database is unreachable or locked, so is the server as far as this session can tell
+        raise ConnectionError(f'could not look up the server: {e}') from e
+    if server_ip is None:
+        raise ConnectionError('there is no server')
+
+    # a unique name so a console already running on this computer does not block the connection
+    name = f'{socket.gethostname()}-submit-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+    request_id = uuid.uuid4().hex
+    uri = f'ws://{server_ip}:{PORT}/{ConnectionType.CONSOLE}'
+
+    new_message = FunctionMessage(f'Submit {len(jobs)} jobs')
+    new_message.set_target(MessageTarget.SERVER)
+    new_message.set_function('submit_jobs')
+    new_message.format_arguments(name, request_id, [new_job.as_dict() for new_job in jobs])
+
+    try:
+        websocket = await websockets.connect(uri, extra_headers={'passkey': get_hash(), 'name': name}, open_timeout=timeout)
+        await websocket.send(new_message.encode())
+    except (OSError, asyncio.TimeoutError, websockets.exceptions.WebSocketException) as e:
+        raise ConnectionError(f'failed to send jobs to {server_ip}: {e}') from e
+
+    try:
+        return await asyncio.wait_for(_receive_reply(websocket, request_id), timeout=max(timeout, reply_timeout(jobs)))
+    except (asyncio.TimeoutError, websockets.exceptions.WebSocketException) as e:
+        raise RuntimeError(f'{server_ip} received the jobs but did not reply: {e!r}') from e
+    finally:
+        await websocket.close()
+
+
+def reply_timeout(jobs: list[job.Job]) -> float:
+    """
+    How long to wait for the server to reply once the jobs are sent, jobs are never written to the jobs folder after they were sent
+    so a batch which outlasts this is reported as an error instead of being added twice
+    :param jobs: list of job.Job
+    :return: (float) seconds
+    """
+    return REPLY_TIMEOUT + REPLY_TIMEOUT_PER_JOB * len(jobs)
+
+
+async def _receive_reply(websocket, request_id: str) -> list[int]:
+    async for raw_message in websocket:
+        try:
+            reply = build_from_message_dict(codec.decode(raw_message))
+        except (ValueError, KeyError):
+            continue
+        # consoles also receive every broadcast, only the reply to this request matters
+        if not isinstance(reply, FunctionMessage) or reply.get_function() != 'submitted_jobs':
+            continue
+        reply_id, job_ids, error = reply.get_args()
+        if reply_id != request_id:
+            continue
+        if error:
+            raise RuntimeError(error)
+        return job_ids
+    raise RuntimeError('connection closed before the server replied')
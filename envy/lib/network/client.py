@@ -1,10 +1,11 @@
-import socket, logging, websockets, asyncio, json
+import socket, logging, websockets, asyncio
 import envy.lib.utils.config as config
 from queue import Queue
 from envy.lib.network.messagepurpose import MessagePurpose
 from envy.lib.utils import utils as eutils
 from envy.lib.network import exceptions as network_exceptions
 import envy.lib.network.message as m
+from envy.lib.network import codec
 
 
 class Client:
@@ -167,7 +168,7 @@ class Client:
         self.logger.debug(f"connected to: {client_ip}")
         try:
             async for message in self.websocket:
-                deserialized_message = json.loads(message)
+                deserialized_message = codec.decode(message)
                 message_object = m.build_from_message_dict(deserialized_message)
                 self.logger.debug(f"received message from: server -> ({message_object})")
                 status = await self.consumer(message_object)
@@ -0,0 +1,133 @@
+"""
+codec.py: serializes messages and jobs with the fastest backend that is installed.
+Every codec reads what any other codec wrote so peers with different backends installed can still talk to each other,
+only msgpack frames need msgpack on the receiving end which is why json stays the default on the wire.
+"""
+
+from __future__ import annotations
+
+import enum
+import json
+import logging
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from envy.lib.utils.config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class DecodeError(ValueError):
+    pass
+
+
+def _default(value):
+    """
+    Called for anything the backend cannot serialize by itself
+    """
+    if isinstance(value, enum.Enum):
+        return value.value
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not serializable')
+
+
+class JsonCodec:
+    name = 'json'
+
+    def dumps(self, value) -> str:
+        return json.dumps(value, default=_default)
+
+    def loads(self, data: str | bytes):
+        try:
+            return json.loads(data)
+        except (ValueError, TypeError) as e:
+            raise DecodeError(str(e)) from e
+
+
+class OrjsonCodec(JsonCodec):
+    name = 'orjson'
+
+    def dumps(self, value) -> str:
+        return orjson.dumps(value, default=_default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+
+    def loads(self, data: str | bytes):
+        try:
+            return orjson.loads(data)
+        except (ValueError, TypeError) as e:
+            raise DecodeError(str(e)) from e
+
+
+class MsgpackCodec:
+    name = 'msgpack'
+
+    def dumps(self, value) -> bytes:
+        return msgpack.packb(value, default=_default, use_bin_type=True)
+
+    def loads(self, data: bytes):
+        try:
+            return msgpack.unpackb(data, raw=False, strict_map_key=False)
+        except (ValueError, TypeError, msgpack.UnpackException) as e:
+            raise DecodeError(str(e)) from e
+
+
+def available() -> list:
+    """
+    :return: (list) an instance of every codec whose backend is installed
+    """
+    codecs = [JsonCodec()]
+    if orjson is not None:
+        codecs.append(OrjsonCodec())
+    if msgpack is not None:
+        codecs.append(MsgpackCodec())
+    return codecs
+
+
+def get_codec(name: str):
+    """
+    :param name: 'json' for the fastest installed json backend or 'msgpack'
+    :return: codec, falls back to json if the requested backend is not installed
+    """
+    if name == 'msgpack':
+        if msgpack is not None:
+            return MsgpackCodec()
+        logger.warning('msgpack is not installed, falling back to json')
+    elif name != 'json':
+        logger.warning(f'Unknown codec {name}, falling back to json')
+    return OrjsonCodec() if orjson is not None else JsonCodec()
+
+
+# jobs are stored in the database and written to files as text so they always use json
+JSON = get_codec('json')
+WIRE = get_codec(Config.CODEC)
+MSGPACK = MsgpackCodec() if msgpack is not None else None
+
+
+def encode(value) -> str | bytes:
+    """
+    Encodes a websocket frame with the codec set in the config
+    """
+    return WIRE.dumps(value)
+
+
+def decode(data: str | bytes):
+    """
+    Decodes a websocket frame written by any codec.
+    json text always starts with an ascii character while a msgpack map or array starts with a byte of 0x80 or higher
+    :param data: the frame as received
+    :return: the decoded value
+    :raises DecodeError: If the frame cannot be decoded
+    """
+    if isinstance(data, (bytes, bytearray, memoryview)) and len(data) > 0 and data[0] >= 0x80:
+        if MSGPACK is None:
+            raise DecodeError('received a msgpack frame but msgpack is not installed')
+        return MSGPACK.loads(data)
+    return JSON.loads(data)
@@ -4,6 +4,8 @@ import json
 import logging
 import enum
 
+from envy.lib.network import codec
+
 logger = logging.getLogger(__name__)
 
 
@@ -95,13 +97,11 @@ class Message:
         """
         return self._message
 
-    def encode(self) -> str:
+    def encode(self) -> str | bytes:
         """
-        encodes the current message object into a json string
+        encodes the current message object with the codec set in the config, see network.codec
         """
-        message_dict = self.as_dict()
-        json_string = json.dumps(message_dict)
-        return json_string
+        return codec.encode(self.as_dict())
 
     def get_target(self) -> MessageTarget:
         """
@@ -268,6 +268,13 @@ class FunctionMessage(Message):
         return formatted_string
 
 
+def _as_enum(enum_class: type[enum.Enum], value):
+    try:
+        return enum_class(value)
+    except ValueError:
+        return value
+
+
 def build_from_message_dict(input_dict: dict) -> Message | FunctionMessage:
     """
     Given a dictionary which was created from a message object, build a new message object with payload set to message from the dict
@@ -278,17 +285,20 @@ def build_from_message_dict(input_dict: dict) -> Message | FunctionMessage:
     """
 
     logger.debug(f'input_dict: {input_dict}')
+    if not isinstance(input_dict, dict):
+        raise ValueError(f'{input_dict!r} is not a message dictionary, decode it first with network.codec.decode')
+
     if 'Message_Purpose' not in input_dict:
         raise ValueError(f'Message_Purpose Key cannot be found in {input_dict}, are you sure this is a message dictionary?')
 
     if 'Message' not in input_dict:
         raise ValueError(f'Message Key cannot be found in {input_dict}, are you sure this is a message dictionary?')
 
-    purpose = input_dict['Message_Purpose']
+    purpose = _as_enum(MessageType, input_dict['Message_Purpose'])
     message = input_dict['Message']
     name = input_dict['Name']
     data = input_dict['Data']
-    target = input_dict['Target']
+    target = _as_enum(MessageTarget, input_dict['Target'])
 
     # If purpose is Message_Purpose.Function_Message then return a FunctionMessage
     if purpose == MessageType.FUNCTION_MESSAGE:
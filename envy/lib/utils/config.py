@@ -5,7 +5,7 @@ import logging
 
 logger = logging.getLogger(__name__)
 
-config_path = os.path.join(envy.__file__, os.path.pardir)
+config_path = os.path.dirname(envy.__file__)
 logger.debug(f'Config path: {config_path}')
 
 config = configparser.ConfigParser()
@@ -17,3 +17,8 @@ class Config:
     HOUDINIBINPATH = config.get('DEFAULT', 'houdinibinpath').replace('\\', '/')
     MAYABINPATH = config.get('DEFAULT', 'mayabinpath').replace('\\', '/')
     TEMP = config.get('DEFAULT', 'TEMP')
+    ARCHIVEAGE = config.getfloat('DEFAULT', 'archiveage', fallback=7) * 86400
+    ARCHIVEINTERVAL = config.getfloat('DEFAULT', 'archiveinterval', fallback=3600)
+    SNAPSHOTINTERVAL = config.getfloat('DEFAULT', 'snapshotinterval', fallback=30)
+    DEDUPWINDOW = config.getfloat('DEFAULT', 'dedupwindow', fallback=3600)
+    CODEC = config.get('DEFAULT', 'codec', fallback='json')
@@ -0,0 +1,150 @@
+"""
+ids.py: time ordered 64-bit ids for jobs, allocations and tasks which any process can generate without asking the database
+"""
+
+from __future__ import annotations
+
+import os
+import secrets
+import threading
+import time
+
+# 2024-01-01 UTC in milliseconds, 41 bits of milliseconds from here last until 2093
+EPOCH = 1704067200000
+
+# every client generates job ids, with hundreds of machines a node has to be drawn from a space large enough that two processes rarely share one
+NODE_BITS = 16
+SEQUENCE_BITS = 6
+NODE_SHIFT = SEQUENCE_BITS
+TIME_SHIFT = NODE_BITS + SEQUENCE_BITS
+MAX_NODE = (1 << NODE_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+
+def default_node() -> int:
+    """
+    A node drawn at random for every process.
+    Hostnames and pids hashed into a node collide across a farm of a few hundred machines, a random node only collides
+    with the node of another process by chance and even then two ids only collide if both processes generate one in the same millisecond
+    :return: (int) node of the current process
+    """
+    return secrets.randbits(NODE_BITS)
+
+
+class IdGenerator:
+    def __init__(self, node: int | None = None):
+        """
+        Hands out ids made of the milliseconds since EPOCH, a node number and a sequence number
+        | 41 bits time | 16 bits node | 6 bits sequence |
+        Ids from one generator only ever go up so rows inserted with them are appended to the end of a primary key instead of scattered across it.
+        If the clock goes backwards or more than 64 ids are needed in one millisecond the generator borrows from the next millisecond instead of waiting.
+        :param node: 0 - 65535 unique to the process, defaults to default_node()
+        """
+        self.node = default_node() if node is None else node
+        if not 0 <= self.node <= MAX_NODE:
+            raise ValueError(f'invalid node {self.node}')
+        self._lock = threading.Lock()
+        self._tick = 0
+        self._sequence = MAX_SEQUENCE
+
+    def _advance(self, count: int) -> tuple[int, int]:
+        """
+        Claims count sequence numbers which follow each other within one millisecond.
+        Must be called with the lock held.
+        :return: (tick, first sequence)
+        """
+        tick = max(int(time.time() * 1000) - EPOCH, self._tick)
+        if tick == self._tick:
+            if self._sequence + count > MAX_SEQUENCE:
+                tick += 1
+                sequence = 0
+            else:
+                sequence = self._sequence + 1
+        else:
+            sequence = 0
+        self._tick = tick
+        self._sequence = sequence + count - 1
+        return tick, sequence
+
+    def _compose(self, tick: int, sequence: int) -> int:
+        return (tick << TIME_SHIFT) | (self.node << NODE_SHIFT) | sequence
+
+    def next_id(self) -> int:
+        with self._lock:
+            return self._compose(*self._advance(1))
+
+    def next_ids(self, count: int) -> list[int]:
+        """
+        Ids for several rows submitted together. They go up and follow each other directly as long as they fit into one millisecond, ie: count <= 64
+        :param count: number of ids
+        :return: (list) of ids in ascending order
+        """
+        ids = []
+        with self._lock:
+            while count > 0:
+                size = min(count, MAX_SEQUENCE + 1)
+                tick, sequence = self._advance(size)
+                ids.extend(self._compose(tick, sequence + i) for i in range(size))
+                count -= size
+        return ids
+
+    def reserve(self, count: int) -> int:
+        """
+        Reserves count ids which directly follow each other eg: one per frame of a job so a task id is Task_Base + its position.
+        Blocks larger than 64 run over the ids other nodes would use in the same millisecond,
+        so they may only be reserved for tables a single process writes to, which for allocations and tasks is the server holding the lease.
+        :param count: number of ids
+        :return: (int) the first id of the block
+        """
+        if count <= MAX_SEQUENCE + 1:
+            with self._lock:
+                return self._compose(*self._advance(max(count, 1)))
+        with self._lock:
+            tick, sequence = self._advance(1)
+            first = self._compose(tick, sequence)
+            last = first + count - 1
+            # nothing this generator hands out afterward may fall inside the block
+            self._tick = last >> TIME_SHIFT
+            self._sequence = MAX_SEQUENCE
+        return first
+
+
+def timestamp(value: int) -> float:
+    """
+    :return: (float) the unix time an id was generated at
+    """
+    return ((value >> TIME_SHIFT) + EPOCH) / 1000
+
+
+def first_id_at(unix_time: float) -> int:
+    """
+    The lowest id which can be generated at unix_time, eg: WHERE Id >= first_id_at(t) finds every job submitted since t
+    :param unix_time: seconds since the unix epoch
+    :return: (int) id
+    """
+    return max(int(unix_time * 1000) - EPOCH, 0) << TIME_SHIFT
+
+
+_generator = IdGenerator()
+
+
+def _reset_after_fork() -> None:
+    # a forked process must neither share the node of its parent nor continue its sequence
+    global _generator
+    _generator = IdGenerator()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def next_id() -> int:
+    return _generator.next_id()
+
+
+def next_ids(count: int) -> list[int]:
+    return _generator.next_ids(count)
+
+
+def reserve(count: int) -> int:
+    return _generator.reserve(count)
@@ -0,0 +1,162 @@
+"""
+watcher.py: waits for files to appear in a directory without listing it over and over
+"""
+
+from __future__ import annotations
+
+import asyncio
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import struct
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 0.25
+# events on network shares can get lost so every file is reported again this often
+RESCAN_INTERVAL = 30.0
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+def scan(path: str) -> dict[str, int]:
+    """
+    :return: {file name: mtime in ns} of every file in path
+    """
+    with os.scandir(path) as entries:
+        return {entry.name: entry.stat().st_mtime_ns for entry in entries if entry.is_file()}
+
+
+class ScandirWatcher:
+    def __init__(self, path: str, poll_interval: float = POLL_INTERVAL, rescan_interval: float = RESCAN_INTERVAL):
+        """
+        Portable watcher which polls the mtime of the directory itself and only lists it once that changed.
+        :param path: directory to watch
+        :param poll_interval: seconds between checks of the directories mtime
+        :param rescan_interval: seconds between full rescans which report every file
+        """
+        self.path = path
+        self.poll_interval = poll_interval
+        self.rescan_interval = rescan_interval
+
+        self._mtime = None
+        self._files = {}
+        self._last_rescan = None
+
+    async def changes(self) -> list[str]:
+        """
+        Waits until files were added or modified
+        :return: names of the files, the first call and every rescan return every file in the directory
+        """
+        while True:
+            changed = await asyncio.to_thread(self._poll)
+            if changed:
+                return changed
+            await asyncio.sleep(self.poll_interval)
+
+    def close(self) -> None:
+        pass
+
+    def _poll(self) -> list[str]:
+        now = time.monotonic()
+        rescan = self._last_rescan is None or now - self._last_rescan >= self.rescan_interval
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime == self._mtime and not rescan:
+            return []
+
+        self._mtime = mtime
+        files = scan(self.path)
+        if rescan:
+            self._last_rescan = now
+            changed = list(files)
+        else:
+            changed = [name for name, file_mtime in files.items() if self._files.get(name) != file_mtime]
+        self._files = files
+        return sorted(changed)
+
+
+class InotifyWatcher:
+    def __init__(self, path: str, rescan_interval: float = RESCAN_INTERVAL):
+        """
+        Linux watcher which is told by the kernel when a file is closed after writing or renamed into the directory.
+        :param path: directory to watch
+        :param rescan_interval: seconds without any event after which every file is reported again
+        :raises OSError: If inotify is not available
+        """
+        self.path = path
+        self.rescan_interval = rescan_interval
+        self._scanned = False
+
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        if libc.inotify_add_watch(self._fd, os.fsencode(path), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            error = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(error, os.strerror(error))
+
+    async def changes(self) -> list[str]:
+        """
+        Waits until files were written or moved into the directory
+        :return: names of the files, the first call and every rescan return every file in the directory
+        """
+        if not self._scanned:
+            self._scanned = True
+            return sorted(await asyncio.to_thread(scan, self.path))
+
+        loop = asyncio.get_running_loop()
+        readable = asyncio.Event()
+        loop.add_reader(self._fd, readable.set)
+        try:
+            await asyncio.wait_for(readable.wait(), timeout=self.rescan_interval)
+        except asyncio.TimeoutError:
+            return sorted(await asyncio.to_thread(scan, self.path))
+        finally:
+            loop.remove_reader(self._fd)
+        return self._read_events()
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+    def _read_events(self) -> list[str]:
+        names = set()
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except BlockingIOError:
+                break
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            position = 0
+            while position < len(data):
+                _, _, _, length = INOTIFY_EVENT.unpack_from(data, position)
+                position += INOTIFY_EVENT.size
+                name = data[position : position + length].rstrip(b'\0')
+                position += length
+                if name:
+                    names.add(os.fsdecode(name))
+        return sorted(names)
+
+
+def create_watcher(path: str) -> InotifyWatcher | ScandirWatcher:
+    """
+    :return: an InotifyWatcher on linux if inotify is available otherwise a ScandirWatcher
+    """
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(path)
+        except (OSError, AttributeError) as e:
+            logger.warning(f'inotify is not available, falling back to polling {path}: {e}')
+    return ScandirWatcher(path)
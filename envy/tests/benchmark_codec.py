@@ -0,0 +1,73 @@
+"""
+benchmark_codec.py: encode and decode throughput of every installed codec for the messages the server sends most
+Run with: python -m envy.tests.benchmark_codec
+"""
+
+import json
+import time
+
+from envy.lib.jobs.enums import Purpose, Status
+from envy.lib.network import codec
+from envy.lib.network.message import FunctionMessage, MessageTarget
+
+MESSAGES = 20000
+
+
+def allocation_message() -> FunctionMessage:
+    # what JobTreeItemModel.allocation_as_message sends a client for an allocation of 10 frames
+    data = {
+        'Allocation_Id': 370088534161076225,
+        'Purpose': Purpose.CACHE,
+        'Tasks': {370088534337238043 + i: 1001 + i for i in range(10)},
+        'Environment': {'HIP': 'Z:/show/shot/fx/pyro_v012.hip', 'JOB': 'Z:/show', 'Job_Type': 'cache', 'Target_Button': '/obj/pyro/filecache1/execute'},
+        'Parameters': {'/obj/pyro/filecache1/version': 12, '/obj/pyro/seed': 4},
+    }
+    new_message = FunctionMessage('Job: pyro_v012 Allocation: 370088534161076225')
+    new_message.set_function('PLUGIN_eHoudini')
+    new_message.format_arguments(codec.JSON.dumps(data))
+    new_message.set_target(MessageTarget.CLIENT)
+    return new_message
+
+
+def status_message() -> FunctionMessage:
+    new_message = FunctionMessage('finish_task')
+    new_message.set_function('finish_task')
+    new_message.format_arguments(370088534337238043, Status.DONE)
+    new_message.set_target(MessageTarget.SERVER)
+    return new_message
+
+
+def benchmark(message_codec, message: FunctionMessage) -> tuple[float, float]:
+    start = time.perf_counter()
+    for _ in range(MESSAGES):
+        encoded = message_codec.dumps(message.as_dict())
+    encode_rate = MESSAGES / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for _ in range(MESSAGES):
+        message_codec.loads(encoded)
+    decode_rate = MESSAGES / (time.perf_counter() - start)
+    return encode_rate, decode_rate
+
+
+def benchmark_double_decode(message: FunctionMessage) -> float:
+    # what the client and console consumers used to do, parse a frame once to validate it and once more to use it
+    encoded = json.dumps(message.as_dict())
+    start = time.perf_counter()
+    for _ in range(MESSAGES):
+        json.loads(encoded)
+        json.loads(encoded)
+    return MESSAGES / (time.perf_counter() - start)
+
+
+def main() -> None:
+    print(f'{"message":>12} {"codec":>8} {"encode/s":>12} {"decode/s":>12}')
+    for name, message in (('allocation', allocation_message()), ('status', status_message())):
+        print(f'{name:>12} {"json x2":>8} {"":>12} {benchmark_double_decode(message):>12,.0f}')
+        for message_codec in codec.available():
+            encode_rate, decode_rate = benchmark(message_codec, message)
+            print(f'{name:>12} {message_codec.name:>8} {encode_rate:>12,.0f} {decode_rate:>12,.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+benchmark_db.py: measures how quickly DB.add_job writes jobs, allocations and tasks with and without compact allocations.
+Run with: python -m envy.tests.benchmark_db
+"""
+
+import os
+import tempfile
+import time
+
+from envy.lib.db import db
+from envy.lib.jobs import job as j
+from envy.lib.jobs.enums import Purpose
+
+FRAME_COUNTS = (100, 10_000, 100_000)
+ALLOCATION = 10
+
+
+def make_job(frames: int) -> j.Job:
+    new_job = j.Job(f'benchmark_{frames}')
+    new_job.add_range(1, frames, 1)
+    new_job.set_allocation(ALLOCATION)
+    new_job.set_purpose(Purpose.CACHE)
+    new_job.set_type('PLUGIN_eHoudini')
+    new_job.set_environment({'HIP': 'Z:/benchmark.hip', 'JOB': 'Z:/'})
+    return new_job
+
+
+def benchmark_add_job(frames: int, repeats: int, compact: bool) -> tuple[float, float, int]:
+    with tempfile.TemporaryDirectory() as directory:
+        database = db.DB(os.path.join(directory, 'Envy_Database.db'))
+        database.start()
+
+        jobs = [make_job(frames) for _ in range(repeats)]
+        for i, new_job in enumerate(jobs):
+            new_job.set_id(i + 1)
+
+        start = time.perf_counter()
+        for new_job in jobs:
+            if database.add_job(new_job, compact=compact) is None:
+                raise RuntimeError(f'failed to add {new_job}')
+        elapsed = time.perf_counter() - start
+        database.disconnect()
+        size = os.path.getsize(os.path.join(directory, 'Envy_Database.db'))
+
+    return repeats / elapsed, repeats * frames / elapsed, size
+
+
+def main() -> None:
+    print(f'{"frames":>10} {"mode":>10} {"jobs/s":>12} {"frames/s":>14} {"db size":>12}')
+    for frames in FRAME_COUNTS:
+        repeats = max(1, 100_000 // frames)
+        for compact in (False, True):
+            jobs_per_second, frames_per_second, size = benchmark_add_job(frames, repeats, compact)
+            mode = 'compact' if compact else 'per-frame'
+            print(f'{frames:>10} {mode:>10} {jobs_per_second:>12.1f} {frames_per_second:>14.0f} {size // 1024:>10}KB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+benchmark_dispatch.py: the cost of picking the next allocation for an idle client as the number of queued allocations grows.
+Compares the old walk over every job and allocation of the tree against jobs.ready_queue.ReadyQueue.
+The tree needs Qt so it is modelled with plain lists, which walk at least as fast as anytree children do.
+Run with: python -m envy.tests.benchmark_dispatch
+"""
+
+import collections
+import time
+
+from envy.lib.jobs.enums import Status
+from envy.lib.jobs.ready_queue import ReadyQueue
+
+ALLOCATIONS_PER_JOB = 40
+JOB_COUNTS = (50, 150, 500)
+CLIENTS = 300
+DISPATCHES = 2000
+
+
+class Allocation:
+    __slots__ = ('id', 'status')
+
+    def __init__(self, allocation_id: int):
+        self.id = allocation_id
+        self.status = Status.PENDING
+
+
+def make_jobs(job_count: int) -> list[list[Allocation]]:
+    return [[Allocation(job * ALLOCATIONS_PER_JOB + i) for i in range(ALLOCATIONS_PER_JOB)] for job in range(job_count)]
+
+
+def scan(jobs: list[list[Allocation]]) -> Allocation | None:
+    # what JobTreeItemModel.pick_allocation + Scheduler.check_allocation did for every idle client
+    for allocation_list in jobs:
+        for allocation in allocation_list:
+            if allocation.status == Status.PENDING:
+                return allocation
+    return None
+
+
+def benchmark_scan(job_count: int) -> float:
+    jobs = make_jobs(job_count)
+    running = collections.deque()
+
+    start = time.perf_counter()
+    for _ in range(DISPATCHES):
+        if len(running) == CLIENTS:
+            finished = running.popleft()
+            finished.status = Status.DONE
+            jobs[finished.id // ALLOCATIONS_PER_JOB].remove(finished)
+        allocation = scan(jobs)
+        allocation.status = Status.INPROGRESS
+        running.append(allocation)
+    return (time.perf_counter() - start) / DISPATCHES
+
+
+def benchmark_ready_queue(job_count: int) -> float:
+    jobs = make_jobs(job_count)
+    allocations = {allocation.id: allocation for allocation_list in jobs for allocation in allocation_list}
+    ready = ReadyQueue()
+    for allocation_id in allocations:
+        ready.push(allocation_id)
+    running = collections.deque()
+
+    start = time.perf_counter()
+    for _ in range(DISPATCHES):
+        if len(running) == CLIENTS:
+            finished = running.popleft()
+            finished.status = Status.DONE
+            del allocations[finished.id]
+            ready.discard(finished.id)
+        allocation = allocations[ready.peek()]
+        allocation.status = Status.INPROGRESS
+        ready.discard(allocation.id)
+        running.append(allocation)
+    return (time.perf_counter() - start) / DISPATCHES
+
+
+def benchmark_nothing_pending(job_count: int) -> tuple[float, float]:
+    """
+    An idle client asking for work while every allocation is running or failed, eg: the tail end of a night of renders
+    """
+    jobs = make_jobs(job_count)
+    for allocation_list in jobs:
+        for allocation in allocation_list:
+            allocation.status = Status.INPROGRESS
+    ready = ReadyQueue()
+
+    start = time.perf_counter()
+    for _ in range(CLIENTS):
+        scan(jobs)
+    scan_time = (time.perf_counter() - start) / CLIENTS
+
+    start = time.perf_counter()
+    for _ in range(CLIENTS):
+        ready.peek()
+    return scan_time, (time.perf_counter() - start) / CLIENTS
+
+
+def main() -> None:
+    print(f'{"":>19} {"dispatch":>29} {"nothing pending":>29}')
+    print(f'{"jobs":>6} {"allocations":>12} {"tree scan":>14} {"ready queue":>14} {"tree scan":>14} {"ready queue":>14}')
+    for job_count in JOB_COUNTS:
+        scan_dispatch = benchmark_scan(job_count)
+        queue_dispatch = benchmark_ready_queue(job_count)
+        scan_miss, queue_miss = benchmark_nothing_pending(job_count)
+        print(
+            f'{job_count:>6} {job_count * ALLOCATIONS_PER_JOB:>12} {scan_dispatch * 1e6:>11.1f} us {queue_dispatch * 1e6:>11.1f} us'
+            f' {scan_miss * 1e6:>11.1f} us {queue_miss * 1e6:>11.1f} us'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+benchmark_event_loop.py: measures how long the event loop stalls while the database is slow.
+Every query is delayed to simulate a locked or slow network share, then the same workload runs
+once with DB called straight from a coroutine and once through AsyncDB.
+Run with: python -m envy.tests.benchmark_event_loop
+"""
+
+import asyncio
+import os
+import tempfile
+import time
+
+from envy.lib.db import db
+from envy.lib.db.async_db import AsyncDB
+
+QUERY_DELAY = 0.05
+QUERIES = 40
+TICK = 0.005
+
+
+class SlowDB(db.DB):
+    def get_job_values(self, job_id: int) -> tuple:
+        time.sleep(QUERY_DELAY)
+        return super().get_job_values(job_id)
+
+
+async def measure_lag(stop: asyncio.Event) -> float:
+    max_lag = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        max_lag = max(max_lag, time.perf_counter() - start - TICK)
+    return max_lag
+
+
+def seed(path: str) -> None:
+    database = db.DB(path)
+    database.start()
+    database.cursor.execute("INSERT INTO jobs (Id, Name, Status) VALUES (1, 'benchmark', 'pending')")
+    database.connection.commit()
+    database.disconnect()
+
+
+async def blocking(path: str) -> tuple[float, float]:
+    database = SlowDB(path)
+    database.start()
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(measure_lag(stop))
+    await asyncio.sleep(TICK * 2)
+
+    start = time.perf_counter()
+    for _ in range(QUERIES):
+        database.get_job_values(1)
+        await asyncio.sleep(0)
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    database.disconnect()
+    return elapsed, await lag_task
+
+
+async def off_loop(path: str) -> tuple[float, float]:
+    database = AsyncDB(path)
+    database.db = SlowDB(path)
+    await database.start()
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(measure_lag(stop))
+    await asyncio.sleep(TICK * 2)
+
+    start = time.perf_counter()
+    for _ in range(QUERIES):
+        await database.get_job_values(1)
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await database.stop()
+    return elapsed, await lag_task
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'Envy_Database.db')
+        seed(path)
+        print(f'{QUERIES} queries with {QUERY_DELAY * 1000:.0f}ms simulated disk latency each')
+        print(f'{"mode":>10} {"wall (s)":>10} {"max loop lag (ms)":>20}')
+        for name, benchmark in (('blocking', blocking), ('AsyncDB', off_loop)):
+            elapsed, lag = asyncio.run(benchmark(path))
+            print(f'{name:>10} {elapsed:>10.2f} {lag * 1000:>20.1f}')
+
+
+if __name__ == '__main__':
+    main()
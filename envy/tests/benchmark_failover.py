@@ -0,0 +1,50 @@
+"""
+benchmark_failover.py: simulates the server dying on a farm of candidates which all watch the lease in a shared database
+and measures the time from the last heartbeat to the new server renewing its lease, split into detection and election.
+Every candidate runs in this process so the sqlite contention is worse than on a real farm where each one is its own machine.
+Run with: python -m envy.tests.benchmark_failover
+"""
+
+import asyncio
+import contextlib
+import os
+import sqlite3
+import tempfile
+import time
+
+from envy.lib.db import lease
+
+CANDIDATE_COUNTS = (30, 300)
+
+
+async def benchmark_failover(path: str, candidates: int) -> tuple[float, float, int]:
+    with contextlib.closing(sqlite3.connect(path)) as connection:
+        lease.prepare(connection)
+        held = lease.read(connection)
+        token = lease.take_over(connection, '10.0.0.1', held)
+        lease.renew(connection, '10.0.0.1', token)
+    # the server dies right after its last heartbeat
+    died = time.perf_counter()
+
+    results = await asyncio.gather(*(lease.Election(path, f'10.0.1.{i}').run() for i in range(candidates)))
+    winners = [current for current, won in results if won]
+    elected = time.perf_counter()
+
+    with contextlib.closing(sqlite3.connect(path)) as connection:
+        lease.renew(connection, winners[0].server, winners[0].token)
+    renewed = time.perf_counter()
+    return elected - died, renewed - died, len(winners)
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        print(f'{"candidates":>10} {"elected s":>10} {"renewed s":>10} {"winners":>8}')
+        for candidates in CANDIDATE_COUNTS:
+            path = os.path.join(directory, f'Envy_Database_{candidates}.db')
+            elected, renewed, winners = asyncio.run(benchmark_failover(path, candidates))
+            print(f'{candidates:>10} {elected:>10.2f} {renewed:>10.2f} {winners:>8}')
+        print(f'lease duration {lease.LEASE_DURATION}s + up to {lease.ELECTION_JITTER}s jitter, add the time it takes to launch the server process')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+benchmark_fair_share.py: simulates a farm where one user submits a very large job and others keep submitting small ones.
+Compares job turnaround, the time from submission until the last allocation finished, between dispatching in submission order
+with jobs.ready_queue.ReadyQueue and dispatching with jobs.fair_share.FairSharePolicy.
+Time is simulated so the whole day runs in a few seconds.
+Run with: python -m envy.tests.benchmark_fair_share
+"""
+
+import heapq
+import random
+import statistics
+import time
+from types import SimpleNamespace
+
+from envy.lib.jobs.fair_share import FairSharePolicy
+from envy.lib.jobs.ready_queue import ReadyQueue
+
+CLIENTS = 50
+SECONDS_PER_FRAME = 30
+# the big job arrives first and on its own would keep every client busy for 10000 * 30 / 50 seconds, a little under 2 hours
+BIG_JOB_FRAMES = 10000
+BIG_JOB_ALLOCATION = 10
+SMALL_JOB_FRAMES = 20
+SMALL_JOB_ALLOCATION = 5
+SMALL_JOB_OWNERS = ('bob', 'carol', 'dave', 'erin')
+# mean seconds between two small submissions
+SMALL_JOB_INTERVAL = 120
+SUBMISSION_WINDOW = 4 * 3600
+SEED = 7
+
+
+class Tree:
+    """
+    The parts of jobTreeAbstractItemModel.JobTreeItemModel the policies read, which needs Qt to import
+    """
+
+    def __init__(self):
+        self.allocations = {}
+
+
+def make_workload() -> list[tuple[float, str, int, int]]:
+    """
+    :return: (list) of (submission time, owner, frames, allocation size)
+    """
+    randomizer = random.Random(SEED)
+    jobs = [(0.0, 'alice', BIG_JOB_FRAMES, BIG_JOB_ALLOCATION)]
+    submitted = randomizer.expovariate(1 / SMALL_JOB_INTERVAL)
+    while submitted < SUBMISSION_WINDOW:
+        jobs.append((submitted, randomizer.choice(SMALL_JOB_OWNERS), SMALL_JOB_FRAMES, SMALL_JOB_ALLOCATION))
+        submitted += randomizer.expovariate(1 / SMALL_JOB_INTERVAL)
+    return jobs
+
+
+def simulate(make_queue) -> dict[int, float]:
+    """
+    :param make_queue: builds the queue pending allocations are picked from given the tree and the simulated clock
+    :return: (dict) job number -> turnaround in seconds
+    """
+    randomizer = random.Random(SEED)
+    now = 0.0
+    tree = Tree()
+    queue = make_queue(tree, lambda: now)
+    events = []
+    sequence = 0
+
+    for number, (submitted, owner, frames, allocation) in enumerate(make_workload()):
+        heapq.heappush(events, (submitted, sequence, 'submit', (number, owner, frames, allocation)))
+        sequence += 1
+
+    submitted_at = {}
+    remaining = {}
+    turnaround = {}
+    idle = CLIENTS
+    next_allocation_id = 0
+
+    while events:
+        now, _, kind, data = heapq.heappop(events)
+        if kind == 'submit':
+            number, owner, frames, allocation = data
+            job_node = SimpleNamespace(name=number, owner=owner, priority=0, weight=1)
+            submitted_at[number] = now
+            remaining[number] = 0
+            for first in range(0, frames, allocation):
+                next_allocation_id += 1
+                tree.allocations[next_allocation_id] = SimpleNamespace(name=next_allocation_id, parent=job_node, frames=min(allocation, frames - first))
+                remaining[number] += 1
+                queue.push(next_allocation_id)
+        else:
+            allocation_id = data
+            allocation = tree.allocations.pop(allocation_id)
+            queue.discard(allocation_id)
+            idle += 1
+            number = allocation.parent.name
+            remaining[number] -= 1
+            if remaining[number] == 0:
+                turnaround[number] = now - submitted_at[number]
+
+        while idle > 0 and queue:
+            allocation_id = queue.peek()
+            queue.start(allocation_id)
+            idle -= 1
+            duration = sum(randomizer.uniform(0.8, 1.2) * SECONDS_PER_FRAME for _ in range(tree.allocations[allocation_id].frames))
+            heapq.heappush(events, (now + duration, sequence, 'finish', allocation_id))
+            sequence += 1
+    return turnaround
+
+
+def report(name: str, turnaround: dict[int, float]) -> None:
+    small = sorted(value for number, value in turnaround.items() if number != 0)
+    p95 = small[min(int(len(small) * 0.95), len(small) - 1)]
+    print(
+        f'{name:<10} small jobs ({len(small)}) mean {statistics.mean(small) / 60:6.1f}min p95 {p95 / 60:6.1f}min'
+        f'    big job {turnaround[0] / 60:6.1f}min    all jobs mean {statistics.mean(turnaround.values()) / 60:6.1f}min'
+    )
+
+
+def main():
+    start = time.perf_counter()
+    report('fifo', simulate(lambda tree, clock: ReadyQueue()))
+    report('fair share', simulate(lambda tree, clock: FairSharePolicy(tree, clock=clock)))
+    print(f'simulated in {time.perf_counter() - start:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
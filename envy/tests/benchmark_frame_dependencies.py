@@ -0,0 +1,132 @@
+"""
+benchmark_frame_dependencies.py: simulates a farm working through several cache -> render chains.
+Compares the makespan, the time until the last render finished, and the turnaround of every chain between renders which wait for
+their whole cache with DependencyMode.JOB and renders which wait frame by frame with DependencyMode.FRAME.
+Time is simulated so a whole day runs in a few seconds.
+Run with: python -m envy.tests.benchmark_frame_dependencies
+"""
+
+import heapq
+import random
+import statistics
+import time
+
+from envy.lib.jobs import dependencies
+from envy.lib.jobs.ready_queue import ReadyQueue
+
+CLIENTS = 40
+FRAMES = 240
+# a simulation runs on one client frame after frame, a cache without a simulation is split into allocations
+SIMULATION_SECONDS_PER_FRAME = 20
+CACHE_SECONDS_PER_FRAME = 10
+CACHE_ALLOCATION = 20
+RENDER_SECONDS_PER_FRAME = 90
+RENDER_ALLOCATION = 2
+# (cache kind, window) of every chain, a window of 1 means frame f of the render also needs cache frames f - 1 and f + 1 eg: for motion blur
+CHAINS = (('simulation', 0), ('simulation', 1), ('simulation', 0), ('cache', 0), ('cache', 1), ('cache', 0))
+SEED = 7
+
+
+def make_jobs() -> list[dict]:
+    """
+    :return: (list) every job with its frames, allocation size, seconds per frame and the job it depends on
+    """
+    jobs = []
+    for kind, window in CHAINS:
+        allocation = FRAMES if kind == 'simulation' else CACHE_ALLOCATION
+        seconds = SIMULATION_SECONDS_PER_FRAME if kind == 'simulation' else CACHE_SECONDS_PER_FRAME
+        cache = {'id': len(jobs), 'allocation': allocation, 'seconds': seconds, 'parent': None, 'window': 0}
+        jobs.append(cache)
+        jobs.append({'id': len(jobs), 'allocation': RENDER_ALLOCATION, 'seconds': RENDER_SECONDS_PER_FRAME, 'parent': cache['id'], 'window': window})
+    return jobs
+
+
+def simulate(frame_mode: bool) -> dict[int, float]:
+    """
+    Dispatches the same way JobTreeItemModel does, see JobTreeItemModel.queue_allocation
+    :param frame_mode: renders depend on their cache frame by frame instead of waiting for the whole cache
+    :return: (dict) render job id -> time its last frame finished
+    """
+    randomizer = random.Random(SEED)
+    jobs = make_jobs()
+    queue = ReadyQueue()
+    graph = dependencies.DependencyGraph()
+    frame_graph = dependencies.FrameDependencies()
+    allocations = {}
+    job_allocations = {job['id']: [] for job in jobs}
+    pending_frames = {job['id']: set(range(1, FRAMES + 1)) for job in jobs}
+    remaining = {job['id']: 0 for job in jobs}
+
+    for job in jobs:
+        for first in range(1, FRAMES + 1, job['allocation']):
+            allocation_id = len(allocations)
+            allocations[allocation_id] = (job, list(range(first, min(first + job['allocation'], FRAMES + 1))))
+            job_allocations[job['id']].append(allocation_id)
+            remaining[job['id']] += 1
+
+    def queue_allocation(allocation_id: int) -> None:
+        job, frames = allocations[allocation_id]
+        parent = job['parent']
+        if parent is not None and frame_mode:
+            needed = dependencies.needed_frames(frames, {parent: (job['window'], pending_frames[parent])})
+            if frame_graph.add(allocation_id, needed):
+                return
+        queue.push(allocation_id)
+
+    for job in jobs:
+        waiting = job['parent'] is not None and not frame_mode and graph.add(job['id'], [job['parent']])
+        if not waiting:
+            for allocation_id in job_allocations[job['id']]:
+                queue_allocation(allocation_id)
+
+    now = 0.0
+    events = []
+    sequence = 0
+    idle = CLIENTS
+    finished = {}
+    while True:
+        while idle > 0 and queue:
+            allocation_id = queue.peek()
+            queue.start(allocation_id)
+            idle -= 1
+            job, frames = allocations[allocation_id]
+            finish = now
+            for frame in frames:
+                finish += randomizer.uniform(0.8, 1.2) * job['seconds']
+                heapq.heappush(events, (finish, sequence, allocation_id, frame, frame == frames[-1]))
+                sequence += 1
+        if not events:
+            break
+
+        now, _, allocation_id, frame, last = heapq.heappop(events)
+        job, _ = allocations[allocation_id]
+        pending_frames[job['id']].discard(frame)
+        for released in frame_graph.finish_frame(job['id'], frame):
+            queue.push(released)
+        if not last:
+            continue
+        idle += 1
+        remaining[job['id']] -= 1
+        if remaining[job['id']] == 0:
+            finished[job['id']] = now
+            for child in graph.finish(job['id']):
+                for child_allocation in job_allocations[child]:
+                    queue_allocation(child_allocation)
+            for released in frame_graph.finish_job(job['id']):
+                queue.push(released)
+    return {job['id']: finished[job['id']] for job in jobs if job['parent'] is not None}
+
+
+def report(name: str, finished: dict[int, float]) -> None:
+    print(f'{name:<14} makespan {max(finished.values()) / 60:6.1f}min    chain turnaround mean {statistics.mean(finished.values()) / 60:6.1f}min')
+
+
+def main():
+    start = time.perf_counter()
+    report('whole job', simulate(frame_mode=False))
+    report('frame by frame', simulate(frame_mode=True))
+    print(f'simulated in {time.perf_counter() - start:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
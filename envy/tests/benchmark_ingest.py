@@ -0,0 +1,102 @@
+"""
+benchmark_ingest.py: measures the time from Job.write to the first dispatch of that job.
+Compares the previous pipeline, which listed the jobs folder every 2 seconds and ran the dispatch loop every 2 seconds,
+against the watcher based ingestor which wakes the dispatch loop as soon as a job arrived.
+Run with: python -m envy.tests.benchmark_ingest
+"""
+
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from envy.lib.jobs import ingestor
+from envy.tests.benchmark_db import make_job
+
+SUBMISSIONS = 10
+POLL_INTERVAL = 2
+DISPATCH_INTERVAL = 2
+
+
+class Database:
+    def __init__(self):
+        self.job_id = 0
+
+    async def add_job(self, new_job) -> int:
+        self.job_id += 1
+        return self.job_id
+
+    async def add_jobs(self, new_jobs: list, window: float = None) -> list[int]:
+        return [await self.add_job(new_job) for new_job in new_jobs]
+
+
+class Scheduler:
+    def __init__(self):
+        self.pending = 0
+        self.dispatched = asyncio.Event()
+        self._wake = asyncio.Event()
+
+    async def settle_jobs(self, new_jobs: list, job_ids: list) -> list:
+        self.pending += len(job_ids)
+        return job_ids
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    async def start(self, event_driven: bool) -> None:
+        while True:
+            if event_driven:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=DISPATCH_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+            else:
+                await asyncio.sleep(DISPATCH_INTERVAL)
+            if self.pending:
+                self.pending = 0
+                self.dispatched.set()
+
+
+async def poll_directory(job_ingestor: ingestor.Ingestor) -> None:
+    # the ingestion loop before the watcher, minus picking up half written files
+    while True:
+        await asyncio.sleep(POLL_INTERVAL)
+        await job_ingestor.ingest(list(filter(ingestor.is_job_file, os.listdir(job_ingestor.path))))
+
+
+async def benchmark_latency(directory: str, event_driven: bool) -> list[float]:
+    scheduler = Scheduler()
+    job_ingestor = ingestor.Ingestor(scheduler, path=directory)
+    job_ingestor.set_db(Database())
+    tasks = [
+        asyncio.create_task(scheduler.start(event_driven)),
+        asyncio.create_task(job_ingestor.start() if event_driven else poll_directory(job_ingestor)),
+    ]
+
+    latencies = []
+    for i in range(SUBMISSIONS):
+        # submissions arrive at random points of the polling cycles
+        await asyncio.sleep(0.37 * i % 1.0)
+        scheduler.dispatched.clear()
+        start = time.perf_counter()
+        await asyncio.to_thread(make_job(100).write, directory)
+        await scheduler.dispatched.wait()
+        latencies.append(time.perf_counter() - start)
+
+    for task in tasks:
+        task.cancel()
+    return latencies
+
+
+def main() -> None:
+    print(f'{"pipeline":>12} {"mean ms":>10} {"max ms":>10}')
+    for name, event_driven in (('poll', False), ('watcher', True)):
+        with tempfile.TemporaryDirectory() as directory:
+            latencies = asyncio.run(benchmark_latency(directory, event_driven))
+        print(f'{name:>12} {statistics.mean(latencies) * 1000:>10.1f} {max(latencies) * 1000:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+benchmark_ingest_batch.py: ingests 1,000 job files into a real database and reports wall time and the longest event loop stall.
+Compares the previous ingestor, which parsed every file on the event loop and added and synced one job at a time,
+against batches parsed on the ingestor's thread pool, added in one transaction and synced with one call.
+Run with: python -m envy.tests.benchmark_ingest_batch
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+from envy.lib.db.async_db import AsyncDB
+from envy.lib.jobs import ingestor
+from envy.lib.jobs import job as j
+from envy.tests.benchmark_db import make_job
+from envy.tests.benchmark_event_loop import measure_lag
+
+JOB_FILES = 1000
+FRAMES = 100
+
+
+class Scheduler:
+    def __init__(self, database: AsyncDB):
+        self.db = database
+        self.job_trees = []
+
+    async def sync_job(self, job_id: int) -> None:
+        self.job_trees.append(await self.db.get_job_tree(job_id))
+
+    async def settle_jobs(self, new_jobs: list, job_ids: list) -> list:
+        self.job_trees.extend(await self.db.read_many(('get_job_tree', (job_id,)) for job_id in job_ids))
+        return job_ids
+
+    def wake(self) -> None:
+        pass
+
+
+def write_job_files(directory: str) -> list[str]:
+    file_names = []
+    for i in range(JOB_FILES):
+        new_job = make_job(FRAMES)
+        new_job.set_id(i + 1)
+        file_name = f'benchmark_{i}.json'
+        with open(os.path.join(directory, file_name), 'w') as job_file:
+            json.dump(new_job.as_dict(), job_file, indent=4)
+        file_names.append(file_name)
+    return file_names
+
+
+async def serial(job_ingestor: ingestor.Ingestor, file_names: list[str]) -> None:
+    # the ingestor before batching
+    for file_name in file_names:
+        job_path = os.path.join(job_ingestor.path, file_name)
+        with open(job_path, 'r') as job_file:
+            job_as_dict = json.load(job_file)
+        new_job = j.job_from_dict(job_as_dict, logger=ingestor.logger)
+        job_id = await job_ingestor.db.add_job(new_job)
+        await job_ingestor.scheduler.sync_job(job_id)
+        os.remove(job_path)
+
+
+async def batched(job_ingestor: ingestor.Ingestor, file_names: list[str]) -> None:
+    for i in range(0, len(file_names), ingestor.MAX_BATCH_SIZE):
+        await job_ingestor.ingest(file_names[i : i + ingestor.MAX_BATCH_SIZE])
+
+
+async def benchmark(directory: str, ingest) -> tuple[float, float]:
+    jobs_path = os.path.join(directory, 'Jobs')
+    os.makedirs(jobs_path)
+    file_names = write_job_files(jobs_path)
+
+    database = AsyncDB(os.path.join(directory, 'Envy_Database.db'))
+    await database.start()
+    scheduler = Scheduler(database)
+    job_ingestor = ingestor.Ingestor(scheduler, path=jobs_path)
+    job_ingestor.set_db(database)
+
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(measure_lag(stop))
+    await asyncio.sleep(0.01)
+
+    start = time.perf_counter()
+    await ingest(job_ingestor, file_names)
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    lag = await lag_task
+    await database.stop()
+    assert len(scheduler.job_trees) == JOB_FILES and len(os.listdir(jobs_path)) == 0
+    return elapsed, lag
+
+
+def main() -> None:
+    print(f'{JOB_FILES} job files with {FRAMES} frames each')
+    print(f'{"ingestor":>10} {"wall (s)":>10} {"max loop stall (ms)":>22}')
+    for name, ingest in (('serial', serial), ('batched', batched)):
+        with tempfile.TemporaryDirectory() as directory:
+            elapsed, lag = asyncio.run(benchmark(directory, ingest))
+        print(f'{name:>10} {elapsed:>10.2f} {lag * 1000:>22.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+benchmark_journal.py: compares making a scheduler state change durable with a sqlite UPDATE + commit against a journal append + fsync.
+Run with: python -m envy.tests.benchmark_journal
+"""
+
+import asyncio
+import os
+import tempfile
+import time
+
+from envy.lib.db import db, journal
+from envy.tests.benchmark_db import make_job
+
+EVENTS = 2000
+GROUP_SIZES = (1, 10, 100)
+
+
+def benchmark_sqlite(directory: str) -> float:
+    database = db.DB(os.path.join(directory, 'Envy_Database.db'))
+    database.start()
+    new_job = make_job(EVENTS)
+    new_job.set_id(1)
+    database.add_job(new_job, compact=False)
+    task_ids = [task_id for allocation_id in database.get_allocation_ids(1) for task_id in database.get_task_ids(allocation_id)]
+
+    start = time.perf_counter()
+    for task_id in task_ids:
+        database.set_task_value(task_id, 'Status', 'done')
+    elapsed = time.perf_counter() - start
+    database.disconnect()
+    return elapsed / EVENTS
+
+
+async def benchmark_journal(directory: str, group_size: int) -> float:
+    event_journal = journal.Journal(os.path.join(directory, f'Envy_Database.journal_{group_size}'))
+    event_journal.open(0)
+
+    start = time.perf_counter()
+    for task_id in range(EVENTS):
+        event_journal.append('tasks', task_id, 'Status', 'done')
+        if (task_id + 1) % group_size == 0:
+            await event_journal.sync()
+    await event_journal.sync()
+    return (time.perf_counter() - start) / EVENTS
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        print(f'{"write path":>24} {"us/event":>10}')
+        print(f'{"sqlite update + commit":>24} {benchmark_sqlite(directory) * 1e6:>10.1f}')
+        for group_size in GROUP_SIZES:
+            per_event = asyncio.run(benchmark_journal(directory, group_size))
+            print(f'{f"journal, fsync every {group_size}":>24} {per_event * 1e6:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
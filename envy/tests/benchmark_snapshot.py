@@ -0,0 +1,46 @@
+"""
+benchmark_snapshot.py: measures how long a replica snapshot keeps the database thread busy and how long the copy to the share takes for growing databases.
+Run with: python -m envy.tests.benchmark_snapshot
+"""
+
+import asyncio
+import os
+import tempfile
+
+from envy.lib.db import async_db, replica, writer
+from envy.tests.benchmark_db import make_job
+
+JOB_COUNTS = (10, 100, 1000)
+FRAMES = 1000
+
+
+async def benchmark_snapshot(directory: str, jobs: int) -> replica.SnapshotMetrics:
+    database = async_db.AsyncDB(os.path.join(directory, f'Envy_Database_{jobs}.db'), wal=True)
+    await database.start()
+    for i in range(jobs):
+        new_job = make_job(FRAMES)
+        new_job.set_id(i + 1)
+        await database.add_job(new_job, compact=False)
+
+    db_writer = writer.DBWriter(database)
+    writer_task = asyncio.create_task(db_writer.start())
+    server_replica = replica.Replica(database, db_writer, os.path.join(directory, f'Envy_Snapshot_{jobs}.db'))
+    for _ in range(3):
+        await server_replica.snapshot()
+
+    db_writer.stop()
+    await writer_task
+    await database.stop()
+    return server_replica.metrics
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        print(f'{"jobs":>6} {"size KB":>10} {"backup ms":>10} {"copy ms":>10}')
+        for jobs in JOB_COUNTS:
+            metrics = asyncio.run(benchmark_snapshot(directory, jobs))
+            print(f'{jobs:>6} {metrics.last_size // 1024:>10} {metrics.max_backup_time * 1000:>10.1f} {metrics.max_copy_time * 1000:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
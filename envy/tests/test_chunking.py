@@ -0,0 +1,46 @@
+from envy.lib.jobs import chunking
+
+
+def test_allocation_timer_separates_startup_from_frames():
+    timer = chunking.AllocationTimer()
+    timer.start(1, 0.0)
+    for finished in (70.0, 80.0, 90.0):
+        timer.finish_frame(1, finished)
+    assert timer.finish(1, 90.0, 3) == (60.0, 10.0)
+
+    # a single frame can only be told apart from the startup once the cost of a frame is known
+    timer.start(2, 0.0)
+    assert timer.finish(2, 100.0, 1) == (None, 100.0)
+    timer.start(3, 0.0)
+    assert timer.finish(3, 100.0, 4, known=chunking.FrameCost(60.0, 10.0)) == (60.0, 10.0)
+    assert timer.finish(3, 100.0, 4) is None
+
+
+def test_cost_model_sizes_allocations_toward_the_target():
+    model = chunking.CostModel(target_seconds=600)
+    scene = chunking.scene_key('PLUGIN_eHoudini', 'cache', {'HIP': 'Z:/shot.hip', 'Target_Button': '/obj/geo/cache/execute'})
+    model.observe((1, scene), None, 70.0)
+    model.observe((1, scene), 60.0, 10.0)
+    model.observe((1, scene), None, 20.0)
+    cost = model.get(2, scene)
+    assert (cost.startup, cost.per_frame, cost.samples) == (60.0, 13.0, 2)
+    assert model.allocation_size(cost) == 41
+    assert model.minimum_size(cost) == 5
+    assert chunking.scene_key('PLUGIN_eHoudini', 'cache', {'JOB': 'Z:/'}) is None
+
+
+def test_plan_shrinks_allocations_toward_the_end_of_a_job():
+    assert chunking.plan(100, 10, 4) == [10] * 7 + [8, 6, 4, 3, 3, 2, 1, 1, 1, 1]
+    assert chunking.plan(100, 10, 4, minimum=4) == [10] * 7 + [8, 6, 4, 4, 4, 4]
+    assert chunking.plan(5, 10, 1) == [5]
+    assert not chunking.needs_rebuild([10] * 10, [10] * 9 + [8, 2])
+    assert chunking.needs_rebuild([1] * 40, [10] * 4)
+
+
+def test_steal_size_leaves_both_clients_finishing_together():
+    assert chunking.steal_size(20) == 10
+    assert chunking.steal_size(1) == 0
+    # the idle client opens the scene before its first frame, 60s is worth 6 frames of 10s
+    assert chunking.steal_size(20, chunking.FrameCost(60.0, 10.0)) == 7
+    assert chunking.steal_size(6, chunking.FrameCost(60.0, 10.0)) == 0
+    assert chunking.steal_size(20, chunking.FrameCost(0.0, 13.0, startup_known=False)) == 10
@@ -0,0 +1,28 @@
+import pytest
+
+from envy.lib.jobs.enums import Status
+from envy.lib.network import codec
+from envy.lib.network.message import FunctionMessage, MessageTarget, MessageType, build_from_message_dict
+
+
+def make_message() -> FunctionMessage:
+    new_message = FunctionMessage('Job: cache Allocation: 12')
+    new_message.set_function('mark_allocation_as_started')
+    new_message.format_arguments(2**62 + 1, 'LAB1-01', Status.INPROGRESS)
+    new_message.set_target(MessageTarget.SERVER)
+    return new_message
+
+
+@pytest.mark.parametrize('message_codec', codec.available(), ids=lambda message_codec: message_codec.name)
+def test_every_codec_round_trips_messages(message_codec):
+    decoded = build_from_message_dict(codec.decode(message_codec.dumps(make_message().as_dict())))
+    assert decoded.get_args() == [2**62 + 1, 'LAB1-01', 'inprogress']
+    assert decoded.get_target() is MessageTarget.SERVER
+    assert decoded.as_dict()['Message_Purpose'] is MessageType.FUNCTION_MESSAGE
+
+
+def test_decode_rejects_garbage():
+    with pytest.raises(codec.DecodeError):
+        codec.decode('{"Message_Purpose": ')
+    with pytest.raises(ValueError):
+        build_from_message_dict('{"Message_Purpose": "4", "Message": null}')
@@ -0,0 +1,628 @@
+import asyncio
+import contextlib
+import getpass
+import json
+import os
+import sqlite3
+
+import pytest
+
+from envy.lib.db import async_db, db, journal, lease, migrations, replica, schema, writer
+from envy.lib.jobs import bundle
+from envy.lib.jobs import job as j
+from envy.lib.jobs.enums import DuplicatePolicy, Purpose, Status
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    monkeypatch.setattr(os, 'getlogin', getpass.getuser, raising=False)
+    database = db.DB(str(tmp_path / 'Envy_Database.db'))
+    database.start()
+    yield database
+    database.disconnect()
+
+
+def make_job(name: str, start: int, end: int, allocation: int) -> j.Job:
+    new_job = j.Job(name)
+    new_job.add_range(start, end, 1)
+    new_job.set_allocation(allocation)
+    new_job.set_purpose(Purpose.CACHE)
+    new_job.set_type('PLUGIN_eHoudini')
+    return new_job
+
+
+def test_add_job_writes_every_row(database):
+    job_id = database.add_job(make_job('cache', 1, 25, 10))
+
+    allocation_ids = database.get_allocation_ids(job_id)
+    assert len(allocation_ids) == 3
+
+    frames = []
+    for allocation_id in allocation_ids:
+        for task_id in database.get_task_ids(allocation_id):
+            assert database.get_task_value(task_id, 'Allocation_Id') == allocation_id
+            frames.append(database.get_task_value(task_id, 'Frame'))
+    assert frames == list(range(1, 26))
+
+
+def test_add_job_ids_continue_from_existing_rows(database):
+    first_id = database.add_job(make_job('first', 1, 4, 2))
+    second_id = database.add_job(make_job('second', 1, 4, 2))
+
+    first_allocations = database.get_allocation_ids(first_id)
+    assert first_allocations == list(range(first_allocations[0], first_allocations[0] + 2))
+    assert database.get_allocation_ids(second_id)[0] > first_allocations[-1]
+    last_task = database.get_task_ids(first_allocations[-1])[-1]
+    assert database.get_task_ids(database.get_allocation_ids(second_id)[0])[0] > last_task
+
+
+def test_add_job_rolls_back_on_failure(database):
+    new_job = make_job('cache', 1, 10, 5)
+    assert database.add_job(new_job, compact=False) is not None
+    assert database.add_job(new_job, compact=False) is None  # duplicate primary key
+
+    database.cursor.execute('SELECT COUNT(*) FROM allocations')
+    assert database.cursor.fetchone()[0] == 2
+    database.cursor.execute('SELECT COUNT(*) FROM tasks')
+    assert database.cursor.fetchone()[0] == 10
+
+
+def test_migrates_json_id_lists(tmp_path):
+    path = str(tmp_path / 'Envy_Database.db')
+    connection = sqlite3.connect(path)
+    connection.execute(
+        'CREATE TABLE jobs (Id INTEGER PRIMARY KEY, Name TEXT NOT NULL, Allocation_Ids TEXT, Purpose TEXT, Metadata TEXT, Type TEXT, '
+        'Environment TEXT, Parameters TEXT, Range TEXT, Status TEXT, Dependencies TEXT, Allocation INTEGER, Info Text)'
+    )
+    connection.execute(
+        'CREATE TABLE allocations (Id INTEGER PRIMARY KEY AUTOINCREMENT, Job_Id INTEGER, Task_Ids TEXT, Computer TEXT, Status TEXT, Info TEXT, '
+        'FOREIGN KEY(Job_Id) REFERENCES jobs(Id))'
+    )
+    connection.execute(
+        'CREATE TABLE tasks (Id INTEGER PRIMARY KEY AUTOINCREMENT, Job_Id INTEGER, Allocation_Id INTEGER, Frame INTEGER, Status TEXT, Computer TEXT, '
+        'FOREIGN KEY(Allocation_Id) REFERENCES allocations(Id))'
+    )
+    connection.execute("INSERT INTO jobs VALUES (7, 'old', '[1, 2]', 'cache', '{}', 'PLUGIN_eHoudini', '{}', '{}', '1-4:1', 'pending', '[]', 2, '')")
+    connection.execute("INSERT INTO allocations VALUES (1, 7, '[1, 2]', '', 'done', '')")
+    connection.execute("INSERT INTO allocations VALUES (2, NULL, '[3, 4]', '', 'pending', '')")
+    connection.executemany('INSERT INTO tasks VALUES (?, 7, ?, ?, ?, NULL)', [(1, 1, 1, 'done'), (2, 1, 2, 'done'), (3, None, 3, 'pending'), (4, 2, 4, 'pending')])
+    connection.commit()
+    connection.close()
+
+    database = db.DB(path)
+    database.start()
+
+    assert database.get_allocation_ids(7) == [1, 2]
+    assert database.get_task_ids(2) == [3, 4]
+    assert database.get_job_value(7, 'Status') == 'pending'
+    assert migrations.get_version(database.connection) == schema.SCHEMA_VERSION
+    assert 'Allocation_Ids' not in migrations.columns(database.connection, 'jobs')
+    database.disconnect()
+
+
+def test_get_job_tree_reads_rows_in_three_queries(database):
+    job_id = database.add_job(make_job('render', 1, 1000, 10), compact=False)
+
+    queries = []
+    database.connection.set_trace_callback(queries.append)
+    job_row, allocations = database.get_job_tree(job_id)
+    database.connection.set_trace_callback(None)
+
+    assert len(queries) == 3
+    assert job_row.id == job_id
+    assert job_row.name == 'render'
+    assert len(allocations) == 100
+    allocation_row, task_rows = allocations[0]
+    assert allocation_row.job_id == job_id
+    assert [task.frame for task in task_rows] == list(range(1, 11))
+    assert all(task.allocation_id == allocation_row.id for task in task_rows)
+    assert task_rows[0] == database.get_task_values(task_rows[0].id)
+    # rows hash like the tuples they equal
+    assert task_rows[0] in {tuple(task_rows[0])}
+    assert len({row for row in task_rows} | {tuple(row) for row in task_rows}) == len(task_rows)
+
+
+def test_compact_allocations_only_write_changed_frames(database):
+    job_id = database.add_job(make_job('particles', 1, 50000, 1000))
+    database.cursor.execute('SELECT COUNT(*) FROM tasks')
+    assert database.cursor.fetchone()[0] == 0
+
+    job_row, allocations = database.get_job_tree(job_id)
+    allocation_row, task_rows = allocations[1]
+    assert len(allocations) == 50
+    assert task_rows == []
+    assert (allocation_row.frames, allocation_row.task_base) == ('1001-2000:1', allocations[0][0].task_base + 1000)
+
+    task_id = allocation_row.task_base + 9
+    assert database.get_task_value(task_id, 'Frame') == 1010
+    database.apply_updates({('tasks', task_id): {'Status': 'done'}, ('tasks', task_id + 1): {'Status': 'inprogress'}})
+    assert database.get_task_value(task_id, 'Status') == 'done'
+    assert database.count_frames(job_id)[allocation_row.id] == {'done': 1, 'inprogress': 1, 'pending': 998}
+
+    database.set_allocation_value(allocation_row.id, 'Status', 'done')
+    database.cursor.execute('SELECT COUNT(*) FROM tasks WHERE Allocation_Id = ?', (allocation_row.id,))
+    assert database.cursor.fetchone()[0] == 1
+    assert database.count_frames(job_id)[allocation_row.id] == {'done': 1000}
+    assert database.add_job(make_job('next', 1, 1, 1)) is not None
+    assert database.get_allocations(database.get_ids_by_value('jobs', 'Name', 'next')[0][0])[0].task_base > allocations[0][0].task_base + 49999
+
+
+def test_reads_reject_unknown_columns(database):
+    with pytest.raises(ValueError):
+        database.get_task_value(1, 'Status FROM tasks; --')
+    with pytest.raises(ValueError):
+        database.get_ids_by_value('sqlite_master', 'name', 'tasks')
+
+
+def test_archive_and_restore_finished_jobs(database, tmp_path):
+    archive_path = str(tmp_path / 'Envy_Archive.db')
+    finished_id = database.add_job(make_job('finished', 1, 20, 5))
+    running_id = database.add_job(make_job('running', 1, 20, 5))
+    database.set_job_value(finished_id, 'Status', 'done')
+    assert database.get_job(finished_id).finished is not None
+    assert database.get_job(running_id).finished is None
+
+    assert database.archive_jobs(archive_path, older_than=3600) == []
+    assert database.archive_jobs(archive_path, older_than=-1) == [finished_id]
+    assert database.get_allocation_ids(finished_id) == []
+    assert len(database.get_allocation_ids(running_id)) == 4
+    assert [job.id for job in database.get_archived_jobs(archive_path)] == [finished_id]
+    assert database.incremental_vacuum() >= 0
+
+    assert database.restore_job(archive_path, finished_id) is True
+    assert database.restore_job(archive_path, finished_id) is False
+    assert [len(database.get_tasks(allocation_id)) for allocation_id in database.get_allocation_ids(finished_id)] == [5] * 4
+    assert database.get_archived_jobs(archive_path) == []
+
+
+def test_archive_and_restore_jobs_left_live_by_a_failover(database, tmp_path):
+    archive_path = str(tmp_path / 'Envy_Archive.db')
+    finished_id = database.add_job(make_job('finished', 1, 20, 5))
+    database.set_job_value(finished_id, 'Status', 'done')
+    # what a server which took over before the delete reached the journal starts from
+    stale_paths = [str(tmp_path / f'Envy_Stale_{i}.db') for i in range(2)]
+    for stale_path in stale_paths:
+        with contextlib.closing(sqlite3.connect(stale_path)) as stale_connection:
+            database.connection.backup(stale_connection)
+    assert database.archive_jobs(archive_path, older_than=-1) == [finished_id]
+
+    rearchived, restored = db.DB(stale_paths[0]), db.DB(stale_paths[1])
+    rearchived.start()
+    restored.start()
+    try:
+        assert rearchived.archive_jobs(archive_path, older_than=-1) == [finished_id]
+        assert [job.id for job in rearchived.get_archived_jobs(archive_path)] == [finished_id]
+        assert rearchived.get_allocation_ids(finished_id) == []
+
+        assert restored.restore_job(archive_path, finished_id) is True
+        assert restored.get_archived_jobs(archive_path) == []
+        assert [len(restored.get_tasks(allocation_id)) for allocation_id in restored.get_allocation_ids(finished_id)] == [5] * 4
+        assert restored.restore_job(archive_path, finished_id) is False
+    finally:
+        rearchived.disconnect()
+        restored.disconnect()
+
+
+def test_writer_coalesces_updates(database):
+    job_id = database.add_job(make_job('cache', 1, 4, 2))
+    task_id = database.get_task_ids(database.get_allocation_ids(job_id)[0])[0]
+
+    async def run():
+        db_writer = writer.DBWriter(database, flush_interval=10)
+        writer_task = asyncio.create_task(db_writer.start())
+        db_writer.set_task_value(task_id, 'Status', 'inprogress')
+        db_writer.set_task_value(task_id, 'Computer', 'LAB1-01')
+        db_writer.set_task_value(task_id, 'Status', 'done')
+        await db_writer.flush()
+        db_writer.stop()
+        await writer_task
+        return db_writer.metrics
+
+    metrics = asyncio.run(run())
+    assert database.get_task_value(task_id, 'Status') == 'done'
+    assert database.get_task_value(task_id, 'Computer') == 'LAB1-01'
+    assert metrics.mutations == 3
+    assert metrics.rows_written == 1
+    assert metrics.batches == 1
+
+
+def test_writer_rejects_unknown_columns(database):
+    db_writer = writer.DBWriter(database)
+    with pytest.raises(ValueError):
+        db_writer.set_task_value(1, 'Status; DROP TABLE tasks', 'done')
+
+
+def test_async_db_runs_queries_off_the_event_loop(tmp_path, monkeypatch):
+    monkeypatch.setattr(os, 'getlogin', getpass.getuser, raising=False)
+
+    async def run():
+        database = async_db.AsyncDB(str(tmp_path / 'Envy_Database.db'))
+        await database.start()
+        job_id = await database.add_job(make_job('cache', 1, 10, 5))
+        allocation_ids, job_values = await database.read_many([('get_allocation_ids', (job_id,)), ('get_job_values', (job_id,))])
+
+        def add_then_fail(transaction_db):
+            transaction_db.cursor.execute("INSERT INTO jobs (Id, Name) VALUES (1, 'rolled back')")
+            raise RuntimeError('abort')
+
+        with pytest.raises(RuntimeError):
+            await database.transaction(add_then_fail)
+        remaining = await database.get_ids_by_value('jobs', 'Name', 'rolled back')
+        await database.stop()
+        return allocation_ids, job_values, remaining
+
+    allocation_ids, job_values, remaining = asyncio.run(run())
+    assert len(allocation_ids) == 2
+    assert job_values[1] == 'cache'
+    assert remaining == []
+
+
+def test_journal_replays_unchecked_records_after_a_crash(database, tmp_path):
+    job_id = database.add_job(make_job('cache', 1, 10, 5))
+    allocation_id = database.get_allocation_ids(job_id)[0]
+    task_id = database.get_task_ids(allocation_id)[0]
+    journal_path = str(tmp_path / 'Envy_Database.journal')
+
+    async def crash():
+        db_writer = writer.DBWriter(database, flush_interval=60, journal=journal.Journal(journal_path))
+        await db_writer.recover()
+        db_writer.set_task_value(task_id, 'Status', 'done')
+        db_writer.set_allocation_value(allocation_id, 'Computer', 'LAB1-01')
+        await db_writer.journal.sync()
+        # the server dies before the writer checkpoints
+
+    async def restart():
+        db_writer = writer.DBWriter(database, journal=journal.Journal(journal_path))
+        return await db_writer.recover()
+
+    asyncio.run(crash())
+    assert database.get_task_value(task_id, 'Status') == 'pending'
+
+    with open(journal.Journal(journal_path).segments()[-1][1], 'ab') as segment:
+        segment.write(journal.encode_record(99, 'tasks', task_id, 'Status', 'failed')[:-3])
+
+    assert asyncio.run(restart()) == 2
+    assert database.get_task_value(task_id, 'Status') == 'done'
+    assert database.get_allocation_value(allocation_id, 'Computer') == 'LAB1-01'
+    assert database.get_checkpoint() == 2
+    assert journal.Journal(journal_path).segments() == []
+
+
+def test_writer_checkpoints_journal(database, tmp_path):
+    job_id = database.add_job(make_job('cache', 1, 4, 2))
+    task_id = database.get_task_ids(database.get_allocation_ids(job_id)[0])[0]
+    journal_path = str(tmp_path / 'Envy_Database.journal')
+
+    async def run():
+        db_writer = writer.DBWriter(database, flush_interval=60, journal=journal.Journal(journal_path))
+        await db_writer.recover()
+        writer_task = asyncio.create_task(db_writer.start())
+        db_writer.set_task_value(task_id, 'Status', 'inprogress')
+        db_writer.set_task_value(task_id, 'Status', 'done')
+        await db_writer.flush()
+        db_writer.stop()
+        await writer_task
+
+    asyncio.run(run())
+    assert database.get_task_value(task_id, 'Status') == 'done'
+    assert database.get_checkpoint() == 2
+    assert journal.Journal(journal_path).segments() == []
+
+
+def test_replica_snapshot_restores_with_journal(tmp_path, monkeypatch):
+    monkeypatch.setattr(os, 'getlogin', getpass.getuser, raising=False)
+    local_path = str(tmp_path / 'local' / 'Envy_Database.db')
+    snapshot_path = str(tmp_path / 'Envy_Snapshot.db')
+    journal_path = str(tmp_path / 'Envy_Database.journal')
+    os.makedirs(os.path.dirname(local_path))
+
+    async def run():
+        database = async_db.AsyncDB(local_path, wal=True)
+        await database.start()
+        job_id = await database.add_job(make_job('cache', 1, 4, 2))
+        task_id = (await database.get_task_ids((await database.get_allocation_ids(job_id))[0]))[0]
+
+        db_writer = writer.DBWriter(database, flush_interval=60, journal=journal.Journal(journal_path))
+        await db_writer.recover()
+        server_replica = replica.Replica(database, db_writer, snapshot_path)
+        writer_task = asyncio.create_task(db_writer.start())
+
+        db_writer.set_task_value(task_id, 'Status', 'done')
+        await server_replica.snapshot()
+        # checkpointed into the snapshot, so no longer needed on the share
+        assert db_writer.journal.segments() == []
+
+        db_writer.set_task_value(task_id, 'Computer', 'LAB1-01')
+        await db_writer.journal.sync()
+        # the server dies before the next snapshot
+        writer_task.cancel()
+        await database.stop()
+        return task_id
+
+    task_id = asyncio.run(run())
+    restored_path = str(tmp_path / 'other' / 'Envy_Database.db')
+    assert replica.restore(restored_path, snapshot_path) == snapshot_path
+
+    async def failover():
+        database = async_db.AsyncDB(restored_path, wal=True)
+        await database.start()
+        await writer.DBWriter(database, journal=journal.Journal(journal_path)).recover()
+        values = await database.get_task_values(task_id)
+        await database.stop()
+        return values
+
+    values = asyncio.run(failover())
+    assert 'done' in values and 'LAB1-01' in values
+
+
+def test_candidates_only_prepare_the_lease_in_the_shared_database(tmp_path, monkeypatch):
+    monkeypatch.setattr(os, 'getlogin', getpass.getuser, raising=False)
+    shared_path = str(tmp_path / 'Envy_Database.db')
+    local_path = str(tmp_path / 'local' / 'Envy_Database.db')
+    snapshot_path = str(tmp_path / 'Envy_Snapshot.db')
+
+    candidate = db.DB(shared_path)
+    candidate.prepare_lock()
+    assert migrations.table_exists(candidate.connection, 'server') and not migrations.table_exists(candidate.connection, 'jobs')
+    candidate.disconnect()
+    # a shared database which only holds the lease is nothing to restore
+    assert replica.restore(local_path, snapshot_path, legacy_path=shared_path) is None
+
+    # a farm from before replication restores its shared database and migrates the local copy of it
+    legacy = db.DB(shared_path)
+    legacy.start()
+    job_id = legacy.add_job(make_job('cache', 1, 4, 2))
+    legacy.disconnect()
+    assert replica.restore(local_path, snapshot_path, legacy_path=shared_path) == shared_path
+    restored = db.DB(local_path)
+    restored.start()
+    assert restored.get_job_value(job_id, 'Name') == 'cache'
+    restored.disconnect()
+
+
+def test_jobs_added_after_a_snapshot_survive_failover(tmp_path, monkeypatch):
+    monkeypatch.setattr(os, 'getlogin', getpass.getuser, raising=False)
+    local_path = str(tmp_path / 'local' / 'Envy_Database.db')
+    snapshot_path = str(tmp_path / 'Envy_Snapshot.db')
+    journal_path = str(tmp_path / 'Envy_Database.journal')
+    archive_path = str(tmp_path / 'Envy_Archive.db')
+    os.makedirs(os.path.dirname(local_path))
+
+    async def run():
+        database = async_db.AsyncDB(local_path, wal=True)
+        await database.start()
+        db_writer = writer.DBWriter(database, flush_interval=60, journal=journal.Journal(journal_path))
+        await db_writer.recover()
+        server_replica = replica.Replica(database, db_writer, snapshot_path)
+        writer_task = asyncio.create_task(db_writer.start())
+        [finished_id] = await db_writer.add_jobs([make_job('cache', 1, 4, 2)])
+        await server_replica.snapshot()
+
+        # submitted after the last snapshot, the submission is acknowledged once add_jobs returned
+        job_id = (await db_writer.add_jobs([make_job('render', 1, 20, 10)]))[0]
+        # a client gave up the end of the first allocation, then both allocations made progress
+        running = (await database.get_allocation_ids(job_id))[0]
+        task_base = await database.get_allocation_value(running, 'Task_Base')
+        stolen = await db_writer.split_allocation(running, 6)
+        db_writer.set_allocation_value(running, 'Status', Status.INPROGRESS)
+        db_writer.set_allocation_value(stolen.id, 'Status', Status.INPROGRESS)
+        db_writer.set_task_value(task_base, 'Status', Status.DONE)
+        db_writer.set_task_value(stolen.task_base, 'Status', Status.DONE)
+        # the job from before the snapshot finished and was archived
+        db_writer.set_job_value(finished_id, 'Status', Status.DONE)
+        await db_writer.flush()
+        assert await db_writer.archive_jobs(archive_path, -60) == [finished_id]
+        await db_writer.journal.sync()
+        # none of it needed another snapshot of the whole database
+        assert server_replica.metrics.snapshots == 1
+        # the server dies before the next snapshot
+        writer_task.cancel()
+        await database.stop()
+        return finished_id, job_id, running, stolen, task_base
+
+    finished_id, job_id, running, stolen, task_base = asyncio.run(run())
+
+    async def failover(restored_path: str):
+        assert replica.restore(restored_path, snapshot_path) == snapshot_path
+        database = async_db.AsyncDB(restored_path, wal=True)
+        await database.start()
+        db_writer = writer.DBWriter(database, journal=journal.Journal(journal_path))
+        # like the server, which keeps the segments until its first snapshot
+        db_writer.retain_segments = True
+        await db_writer.recover()
+        finished = await database.get_ids_by_value('jobs', 'Id', finished_id)
+        job_name = await database.get_job_value(job_id, 'Name')
+        allocations = [await database.get_allocation_values(allocation_id) for allocation_id in (running, stolen.id)]
+        statuses = [await database.get_task_value(task_id, 'Status') for task_id in (task_base, stolen.task_base)]
+        await database.stop()
+        return finished, job_name, allocations, statuses
+
+    # replaying the same journal onto the same snapshot twice gives the same database
+    for restored_path in (tmp_path / 'other' / 'Envy_Database.db', tmp_path / 'third' / 'Envy_Database.db'):
+        finished, job_name, allocations, statuses = asyncio.run(failover(str(restored_path)))
+        assert finished == []
+        assert job_name == 'render'
+        assert [(allocation[3], allocation[5]) for allocation in allocations] == [(Status.INPROGRESS, '1-6:1'), (Status.INPROGRESS, '7-10:1')]
+        assert statuses == [Status.DONE, Status.DONE]
+
+
+def test_lease_fences_the_old_holder_after_takeover(tmp_path):
+    path = str(tmp_path / 'Envy_Database.db')
+
+    async def elect(ip: str, **kwargs) -> tuple[lease.Lease, bool]:
+        return await lease.Election(path, ip, duration=0.2, poll_interval=0.02, **kwargs).run()
+
+    first, won = asyncio.run(elect('10.0.0.1'))
+    assert won and first.token == 1
+
+    connection = sqlite3.connect(path)
+    lease.renew(connection, '10.0.0.1', first.token)
+
+    async def candidates() -> list:
+        return await asyncio.gather(*(elect(f'10.0.1.{i}', jitter=0.1) for i in range(20)))
+
+    results = asyncio.run(candidates())
+    winners = [current for current, won in results if won]
+    assert len(winners) == 1 and winners[0].token == 2
+    # every loser knows who won and backs off
+    assert {current.server for current, won in results} == {winners[0].server}
+
+    with pytest.raises(lease.LeaseLost):
+        lease.renew(connection, '10.0.0.1', first.token)
+    lease.renew(connection, winners[0].server, winners[0].token)
+    connection.close()
+
+
+def test_lease_is_kept_while_renewed(tmp_path):
+    path = str(tmp_path / 'Envy_Database.db')
+
+    async def run() -> tuple[lease.Lease, bool]:
+        held, _ = await lease.Election(path, '10.0.0.1', duration=0).run()
+
+        async def heartbeat():
+            with contextlib.closing(sqlite3.connect(path)) as connection:
+                while True:
+                    lease.renew(connection, '10.0.0.1', held.token)
+                    await asyncio.sleep(0.02)
+
+        heartbeat_task = asyncio.create_task(heartbeat())
+        result = await lease.Election(path, '10.0.0.2', duration=0.2, poll_interval=0.05).run()
+        heartbeat_task.cancel()
+        return result
+
+    current, won = asyncio.run(run())
+    assert not won and current.server == '10.0.0.1' and current.token == 1
+
+
+def test_add_jobs_is_one_transaction(database):
+    first, second = make_job('first', 1, 10, 5), make_job('second', 1, 10, 5)
+    job_ids = database.add_jobs([first, second])
+    assert job_ids == [first.get_id(), second.get_id()]
+    assert len(database.get_allocation_ids(job_ids[1])) == 2
+
+    # the duplicate rolls back the new job in front of it as well
+    assert database.add_jobs([make_job('third', 1, 10, 5), first]) is None
+    database.cursor.execute('SELECT COUNT(*) FROM jobs')
+    assert database.cursor.fetchone()[0] == 2
+
+
+def test_rechunk_allocations_keeps_task_ids(database):
+    job_id = database.add_job(make_job('particles', 1, 40, 10))
+    _, allocations = database.get_job_tree(job_id)
+    started, pending = allocations[0][0], [allocation for allocation, _ in allocations[1:]]
+    database.set_allocation_value(started.id, 'Status', Status.INPROGRESS)
+    # a frame of a pending allocation which was written already, eg: because the allocation was reset
+    database.set_task_value(pending[0].task_base + 3, 'Status', Status.PENDING)
+
+    assert database.rechunk_allocations([started.id, pending[0].id], [20]) is None
+    assert database.rechunk_allocations([allocation.id for allocation in pending], [20, 5, 4]) is None
+    new_rows = database.rechunk_allocations([allocation.id for allocation in pending], [20, 6, 4])
+    assert [row.frames for row in new_rows] == ['11-30:1', '31-36:1', '37-40:1']
+    assert [row.task_base for row in new_rows] == [pending[0].task_base, pending[0].task_base + 20, pending[0].task_base + 26]
+
+    _, allocations = database.get_job_tree(job_id)
+    assert [allocation.id for allocation, _ in allocations] == [started.id] + [row.id for row in new_rows]
+    assert database.get_task_value(pending[0].task_base + 3, 'Allocation_Id') == new_rows[0].id
+    assert database.get_task_value(new_rows[2].task_base + 1, 'Frame') == 38
+    assert sum(sum(counts.values()) for counts in database.count_frames(job_id).values()) == 40
+
+    # allocations which do not follow each other are rebuilt without a frame changing its task id
+    merged = database.rechunk_allocations([new_rows[0].id, new_rows[2].id], [12, 12])
+    assert [(row.frames, row.task_base) for row in merged] == [
+        ('11-22:1', new_rows[0].task_base),
+        ('23-30:1', new_rows[0].task_base + 12),
+        ('37-40:1', new_rows[2].task_base),
+    ]
+
+
+def test_split_allocation_moves_the_tail(database):
+    job_id = database.add_job(make_job('particles', 1, 20, 10))
+    _, allocations = database.get_job_tree(job_id)
+    running = allocations[0][0]
+    database.set_allocation_value(running.id, 'Status', Status.INPROGRESS)
+    # a frame of the tail which was written already, eg: because the allocation was reset once
+    database.set_task_value(running.task_base + 8, 'Status', Status.PENDING)
+
+    assert database.split_allocation(running.id, 10) is None
+    assert database.split_allocation(running.id, 0) is None
+    new_row = database.split_allocation(running.id, 6)
+    assert (new_row.frames, new_row.task_base, new_row.status) == ('7-10:1', running.task_base + 6, Status.PENDING)
+    assert database.get_allocation_value(running.id, 'Frames') == '1-6:1'
+    assert database.get_task_value(running.task_base + 8, 'Allocation_Id') == new_row.id
+    assert database.get_task_value(running.task_base + 9, 'Frame') == 10
+    assert sum(sum(counts.values()) for counts in database.count_frames(job_id).values()) == 20
+
+
+def test_add_jobs_finds_duplicates_by_fingerprint(database):
+    original = make_job('original', 1, 10, 5)
+    merged, rejected, allowed = make_job('merged', 1, 10, 5), make_job('rejected', 1, 10, 5), make_job('allowed', 1, 10, 5)
+    merged.set_duplicate_policy(DuplicatePolicy.MERGE)
+    rejected.set_duplicate_policy(DuplicatePolicy.REJECT)
+    # jobs are added even if they duplicate one unless their submitter asks otherwise
+    assert allowed.get_duplicate_policy() == DuplicatePolicy.ALLOW
+    other = make_job('other', 1, 11, 5)
+
+    job_ids = database.add_jobs([original, merged, rejected, allowed, other], window=60)
+    assert job_ids == [original.get_id(), original.get_id(), original.get_id(), allowed.get_id(), other.get_id()]
+    database.cursor.execute('SELECT COUNT(*) FROM jobs')
+    assert database.cursor.fetchone()[0] == 3
+    assert json.loads(database.get_job_value(original.get_id(), 'Metadata'))['Merged'] == [merged.get_id()]
+
+    # finished work is rendered again when it is submitted again
+    database.set_job_value(original.get_id(), 'Status', Status.DONE)
+    database.set_job_value(allowed.get_id(), 'Status', Status.DONE)
+    again = make_job('again', 1, 10, 5)
+    assert database.add_jobs([again], window=60) == [again.get_id()]
+
+    # a job depending on a duplicate waits for the job it duplicates instead
+    duplicate, render = make_job('duplicate', 1, 10, 5), make_job('render', 1, 12, 5)
+    duplicate.set_duplicate_policy(DuplicatePolicy.MERGE)
+    render.add_dependency(duplicate)
+    assert database.add_jobs([duplicate, render], window=60) == [again.get_id(), render.get_id()]
+    assert json.loads(database.get_job_value(render.get_id(), 'Dependencies')) == [{'Id': again.get_id(), 'Name': 'duplicate'}]
+    assert database.get_job_statuses([again.get_id(), duplicate.get_id()]) == {again.get_id(): Status.PENDING}
+
+
+def test_bundle_children_share_one_environment(database, tmp_path):
+    sweep = bundle.Bundle('wedge')
+    sweep.add_range(1, 10, 1)
+    sweep.set_allocation(5)
+    sweep.set_purpose(Purpose.CACHE)
+    sweep.set_type('PLUGIN_eHoudini')
+    sweep.set_environment({'HIP': 'Z:/wedge.hip', 'JOB': 'Z:/'})
+    sweep.set_parameters({'/obj/geo/seed': 0})
+    sweep.add_variant(name='low', parameters={'/obj/geo/res': 10})
+    sweep.add_variant(name='high', parameters={'/obj/geo/res': 100}, environment={'JOB': 'Z:/high'})
+    sweep.set_sweep({'/obj/geo/seed': [1, 2, 3]})
+
+    children = list(bundle.bundle_from_dict(json.loads(json.dumps(sweep.as_dict()))).expand())
+    assert len(children) == sweep.count() == 6
+    assert children[2].get_parameters() == {'/obj/geo/seed': 3, '/obj/geo/res': 10}
+
+    job_ids = database.add_jobs(children)
+    assert job_ids == sorted(job_ids) and len(set(job_ids)) == 6
+    assert all(child.get_meta()['Bundle'] == sweep.get_id() for child in children)
+    database.cursor.execute('SELECT COUNT(*) FROM environments')
+    assert database.cursor.fetchone()[0] == 2
+    assert json.loads(database.get_job(job_ids[0]).environment) == {'HIP': 'Z:/wedge.hip', 'JOB': 'Z:/'}
+    assert json.loads(database.get_job_value(job_ids[-1], 'Environment'))['JOB'] == 'Z:/high'
+
+    # the archive keeps its own copy of the environment
+    archive_path = str(tmp_path / 'Envy_Archive.db')
+    database.set_job_value(job_ids[0], 'Status', 'done')
+    assert database.archive_jobs(archive_path, older_than=-1) == [job_ids[0]]
+    assert json.loads(database.get_archived_jobs(archive_path)[0].environment)['HIP'] == 'Z:/wedge.hip'
+    assert database.restore_job(archive_path, job_ids[0]) is True
+    assert json.loads(database.get_job(job_ids[0]).environment)['HIP'] == 'Z:/wedge.hip'
+
+
+def test_job_priority_and_weight_are_stored(database):
+    new_job = make_job('priority', 1, 10, 5)
+    new_job.set_priority(3)
+    new_job.set_weight(2)
+    job_id = database.add_job(new_job)
+
+    job_row, allocation_rows = database.get_job_tree(job_id)
+    assert (job_row.priority, job_row.weight) == (3, 2.0)
+    assert json.loads(job_row.metadata)['Owner'] == getpass.getuser()
+    assert len(allocation_rows) == 2
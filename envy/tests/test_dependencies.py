@@ -0,0 +1,88 @@
+import pytest
+
+from envy.lib.jobs import dependencies
+from envy.lib.jobs import job as j
+from envy.lib.jobs.enums import DependencyMode
+
+
+def make_jobs(*names: str) -> list[j.Job]:
+    return [j.Job(name) for name in names]
+
+
+def test_add_dependency_and_chain():
+    cache, simulation, render = make_jobs('cache', 'simulation', 'render')
+    dependencies.chain([cache, simulation, render])
+    render.add_dependency(cache.get_id())
+    render.add_dependency(simulation)
+
+    assert simulation.get_dependencies() == [{'Id': cache.get_id(), 'Name': 'cache'}]
+    assert render.get_dependency_ids() == [simulation.get_id(), cache.get_id()]
+    assert dependencies.parent_ids(j.codec.JSON.dumps(render.get_dependencies())) == render.get_dependency_ids()
+    # dependencies written before they had ids are ignored
+    assert dependencies.parent_ids([{'Name': 'legacy'}]) == []
+    with pytest.raises(ValueError):
+        cache.add_dependency(cache)
+    assert render.remove_dependency('simulation') and render.get_dependency_ids() == [cache.get_id()]
+
+
+def test_find_cycles_rejects_cycles_and_their_descendants():
+    cache, simulation, render, other = make_jobs('cache', 'simulation', 'render', 'other')
+    dependencies.chain([cache, simulation, render])
+    assert dependencies.find_cycles([render, simulation, cache, other]) == set()
+
+    cache.add_dependency(simulation)
+    other.add_dependency(render)
+    assert dependencies.find_cycles([cache, simulation, render, other]) == {cache.get_id(), simulation.get_id(), render.get_id(), other.get_id()}
+
+    # a cycle can also close through jobs which are already waiting on the farm
+    graph = dependencies.DependencyGraph()
+    graph.add(1, [cache.get_id()])
+    late = make_jobs('late')[0]
+    late.add_dependency(1)
+    cache.set_dependencies([{'Id': late.get_id(), 'Name': 'late'}])
+    assert dependencies.find_cycles([cache, late], known_parents=graph.parents) == {cache.get_id(), late.get_id()}
+
+
+def test_topological_order_puts_parents_first():
+    cache, simulation, render = make_jobs('cache', 'simulation', 'render')
+    dependencies.chain([cache, simulation, render])
+    ordered = dependencies.topological_order([render, simulation, cache], lambda item: item.get_id(), lambda item: item.get_dependencies())
+    assert [item.name for item in ordered] == ['cache', 'simulation', 'render']
+
+
+def test_dependency_graph_releases_a_job_once_every_parent_is_done():
+    graph = dependencies.DependencyGraph()
+    assert not graph.add(1, [])
+    assert graph.add(3, [1, 2])
+    assert graph.add(4, [3])
+    assert graph.is_waiting(3) and graph.parents(3) == {1, 2} and graph.children(1) == {3}
+
+    assert graph.finish(1) == []
+    assert graph.finish(2) == [3]
+    assert not graph.is_waiting(3)
+    graph.discard(4)
+    assert graph.finish(3) == [] and len(graph) == 0
+
+
+def test_frame_dependencies_release_an_allocation_once_its_frames_are_done():
+    cache, render = make_jobs('cache', 'render')
+    render.add_dependency(cache, mode=DependencyMode.FRAME, window=1)
+    assert dependencies.frame_windows(j.codec.JSON.dumps(render.get_dependencies())) == {cache.get_id(): 1}
+    assert dependencies.parent_ids(render.get_dependencies()) == [cache.get_id()]
+
+    # the cache still has to write frames 3-10, the render allocation covering 1-2 also needs frame 3 because of the window
+    parents = {cache.get_id(): (1, set(range(3, 11)))}
+    graph = dependencies.FrameDependencies()
+    assert not graph.add(1, dependencies.needed_frames([1], parents))
+    assert graph.add(2, dependencies.needed_frames([1, 2], parents))
+    assert graph.add(3, dependencies.needed_frames([3, 4], parents))
+    assert graph.frames(2) == {(cache.get_id(), 3)}
+
+    assert graph.finish_frame(cache.get_id(), 3) == [2]
+    assert graph.finish_frame(cache.get_id(), 4) == []
+    graph.discard(3)
+    assert len(graph) == 0
+
+    assert graph.add(4, dependencies.needed_frames([9, 10], parents))
+    assert graph.finish_job(cache.get_id()) == [4]
+    assert not graph.is_waiting(4)
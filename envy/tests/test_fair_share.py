@@ -0,0 +1,70 @@
+from types import SimpleNamespace
+
+from envy.lib.jobs.fair_share import AGING_CHECK_INTERVAL, FairSharePolicy
+
+
+class FakeTree:
+    def __init__(self):
+        self.allocations = {}
+        self._next_id = 0
+
+    def add_job(self, job_id: int, owner: str, allocations: int, priority: int = 0, weight: float = 1) -> list[int]:
+        job_node = SimpleNamespace(name=job_id, owner=owner, priority=priority, weight=weight)
+        allocation_ids = []
+        for _ in range(allocations):
+            self._next_id += 1
+            self.allocations[self._next_id] = SimpleNamespace(name=self._next_id, parent=job_node)
+            allocation_ids.append(self._next_id)
+        return allocation_ids
+
+
+def dispatch(policy: FairSharePolicy, tree: FakeTree, count: int) -> list[int]:
+    jobs = []
+    for _ in range(count):
+        allocation_id = policy.peek()
+        policy.start(allocation_id)
+        jobs.append(tree.allocations[allocation_id].parent.name)
+    return jobs
+
+
+def test_fair_share_splits_the_farm_between_owners():
+    tree = FakeTree()
+    policy = FairSharePolicy(tree)
+    for allocation_id in tree.add_job(1, 'alice', 100) + tree.add_job(2, 'alice', 100) + tree.add_job(3, 'bob', 100):
+        policy.push(allocation_id)
+
+    jobs = dispatch(policy, tree, 40)
+    # bob gets as much as alice, and alice's share is split between her two jobs
+    assert jobs.count(3) == 20
+    assert jobs.count(1) == jobs.count(2) == 10
+    assert policy.running('alice') == policy.running('bob') == 20
+
+    # a finished allocation hands its slot to whoever is most under-served
+    finished = next(allocation_id for allocation_id, allocation in tree.allocations.items() if allocation.parent.name == 3)
+    assert policy.discard(finished)
+    assert dispatch(policy, tree, 1) == [3]
+
+
+def test_fair_share_priority_weight_and_aging():
+    tree = FakeTree()
+    now = [0.0]
+    policy = FairSharePolicy(tree, aging_interval=60, clock=lambda: now[0])
+    for allocation_id in tree.add_job(1, 'alice', 50, weight=3) + tree.add_job(2, 'alice', 50):
+        policy.push(allocation_id)
+    jobs = dispatch(policy, tree, 40)
+    assert (jobs.count(1), jobs.count(2)) == (30, 10)
+
+    urgent = tree.add_job(3, 'bob', 5, priority=-1)
+    for allocation_id in urgent:
+        policy.push(allocation_id)
+    # alice's jobs outrank bob's until it has waited long enough with nothing running to age past its lower priority
+    assert dispatch(policy, tree, 1) != [3]
+    now[0] += 60 + AGING_CHECK_INTERVAL
+    assert dispatch(policy, tree, 1) == [3]
+
+    policy.update_job(2, priority=5)
+    assert dispatch(policy, tree, 3) == [2, 2, 2]
+
+    for allocation_id in list(tree.allocations):
+        policy.discard(allocation_id)
+    assert len(policy) == 0 and policy.running() == 0 and policy.peek() is None
@@ -0,0 +1,46 @@
+from envy.lib.jobs.frame_range import FrameRange
+
+
+def test_from_frames_merges_runs():
+    frame_range = FrameRange.from_frames([1, 2, 3, 4, 10, 12, 14, 20])
+    assert frame_range.segments == [(1, 4, 1), (10, 14, 2), (20, 20, 1)]
+    assert len(frame_range) == 8
+    assert list(frame_range) == [1, 2, 3, 4, 10, 12, 14, 20]
+
+
+def test_indexing_is_arithmetic():
+    frame_range = FrameRange([(1, 50000, 1), (60000, 70000, 10)])
+    assert len(frame_range) == 51001
+    assert frame_range[49999] == 50000
+    assert frame_range[50000] == 60000
+    assert frame_range[-1] == 70000
+    assert frame_range.index(60010) == 50001
+    assert 60005 not in frame_range
+
+
+def test_encode_round_trip():
+    frame_range = FrameRange.from_frames([5, 6, 7, 9])
+    assert frame_range.encode() == '5-7:1 9-9:1'
+    assert FrameRange.decode(frame_range.encode()) == frame_range
+
+
+def test_decode_negative_single_and_float_frames():
+    frame_range = FrameRange.decode('-10--8:1 5 1-2:0.25')
+    assert list(frame_range) == [-10, -9, -8, 5, 1, 1.25, 1.5, 1.75, 2]
+    assert 1.5 in frame_range
+    assert FrameRange.decode(frame_range.encode()) == frame_range
+
+
+def test_chunks_do_not_expand_the_range():
+    frame_range = FrameRange.decode('1-1000000:1')
+    chunks = list(frame_range.chunks(300000))
+    assert [chunk.encode() for chunk in chunks] == ['1-300000:1', '300001-600000:1', '600001-900000:1', '900001-1000000:1']
+    assert frame_range[10:20].encode() == '11-20:1'
+
+
+def test_missing_frames():
+    frame_range = FrameRange.decode('1-100:1')
+    done = FrameRange.decode('1-10:1 50-60:1')
+    assert (frame_range - done).encode() == '11-49:1 61-100:1'
+    assert (done | FrameRange.decode('11-49:1')).encode() == '1-60:1'
+    assert (frame_range & FrameRange.decode('95-110:1')).encode() == '95-100:1'
@@ -0,0 +1,55 @@
+import multiprocessing
+import time
+
+from envy.lib.utils import ids
+
+
+def generate(count: int) -> list[int]:
+    generated = [ids.next_id() for _ in range(count // 2)]
+    generated.extend(ids.next_ids(count - count // 2))
+    return generated
+
+
+def test_ids_are_unique_across_processes():
+    with multiprocessing.get_context('fork').Pool(4) as pool:
+        results = pool.map(generate, [20000] * 8)
+
+    for generated in results:
+        assert generated == sorted(generated)
+    generated = [value for result in results for value in result]
+    assert len(set(generated)) == len(generated)
+    assert all(0 < value < 2**63 for value in generated)
+
+
+def test_ids_are_time_ordered():
+    before = time.time()
+    value = ids.next_id()
+    assert ids.first_id_at(before - 1) <= value < ids.first_id_at(time.time() + 1)
+    assert abs(ids.timestamp(value) - before) < 1
+
+
+def test_reserve_does_not_overlap_later_ids():
+    generator = ids.IdGenerator(node=3)
+    small = generator.reserve(10)
+    large = generator.reserve(100000)
+    assert large > small + 9
+    assert generator.next_id() > large + 99999
+
+    block = generator.next_ids(ids.MAX_SEQUENCE + 1)
+    assert block == list(range(block[0], block[0] + ids.MAX_SEQUENCE + 1))
+
+
+def test_nodes_rarely_collide_across_hosts():
+    # hosts whose hostname and pid hashed to the same node kept colliding, drawn nodes do not depend on either
+    assert len({ids.default_node() for _ in range(8)}) > 1
+
+    # a farm of a few hundred processes expects less than one pair of them to share a node
+    nodes = [ids.default_node() for _ in range(300)]
+    assert all(0 <= node <= ids.MAX_NODE for node in nodes)
+    assert len(set(nodes)) >= 290
+
+    # processes which do share a node still only produce the same id within the same millisecond
+    first, second = ids.IdGenerator(node=7), ids.IdGenerator(node=7)
+    value = first.next_id()
+    time.sleep(0.002)
+    assert second.next_id() > value
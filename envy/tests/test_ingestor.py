@@ -0,0 +1,153 @@
+import asyncio
+import getpass
+import os
+
+import pytest
+
+from envy.lib.jobs import bundle, dependencies, ingestor
+from envy.lib.jobs import job as j
+from envy.lib.jobs.enums import Purpose
+from envy.lib.utils import watcher
+
+
+@pytest.fixture(autouse=True)
+def login(monkeypatch):
+    monkeypatch.setattr(os, 'getlogin', getpass.getuser, raising=False)
+
+
+def make_job(name: str) -> j.Job:
+    new_job = j.Job(name)
+    new_job.add_range(1, 10, 1)
+    new_job.set_allocation(5)
+    new_job.set_purpose(Purpose.CACHE)
+    new_job.set_type('PLUGIN_eHoudini')
+    return new_job
+
+
+class Database:
+    def __init__(self):
+        self.jobs = []
+        self.transactions = 0
+
+    async def add_job(self, new_job: j.Job) -> int:
+        if new_job.name == 'broken':
+            return None
+        self.jobs.append(new_job)
+        return len(self.jobs)
+
+    async def add_jobs(self, new_jobs: list, window: float = None) -> list | None:
+        self.transactions += 1
+        if any(new_job.name == 'broken' for new_job in new_jobs):
+            return None
+        return [await self.add_job(new_job) for new_job in new_jobs]
+
+
+class Scheduler:
+    def __init__(self):
+        self.synced = []
+        self.woken = asyncio.Event()
+
+    async def settle_jobs(self, new_jobs: list, job_ids: list) -> list:
+        self.synced.append(job_ids)
+        return job_ids
+
+    def wake(self) -> None:
+        self.woken.set()
+
+    def find_blocked_jobs(self, new_jobs: list) -> set:
+        return dependencies.find_cycles(new_jobs)
+
+
+@pytest.mark.parametrize('create_watcher', [watcher.InotifyWatcher, lambda path: watcher.ScandirWatcher(path, poll_interval=0.01)])
+def test_watcher_reports_written_jobs(tmp_path, create_watcher):
+    (tmp_path / 'existing.json').write_text('{}')
+
+    async def run() -> tuple[list, list]:
+        directory_watcher = create_watcher(str(tmp_path))
+        try:
+            existing = await directory_watcher.changes()
+            make_job('cache').write(str(tmp_path))
+            written = await asyncio.wait_for(directory_watcher.changes(), timeout=5)
+        finally:
+            directory_watcher.close()
+        return existing, written
+
+    existing, written = asyncio.run(run())
+    assert existing == ['existing.json']
+    assert [name for name in written if ingestor.is_job_file(name)] == [name for name in os.listdir(tmp_path) if name.startswith('cache_')]
+    assert not any(name.endswith('.tmp') for name in os.listdir(tmp_path))
+
+
+def test_ingestor_ingests_new_jobs_and_wakes_the_scheduler(tmp_path):
+    scheduler = Scheduler()
+    job_ingestor = ingestor.Ingestor(scheduler, path=str(tmp_path))
+    job_ingestor.set_db(Database())
+    (tmp_path / '.cache.json.123.tmp').write_text('{')
+
+    async def run() -> None:
+        ingestor_task = asyncio.create_task(job_ingestor.start())
+        await asyncio.sleep(0.05)
+        make_job('cache').write(str(tmp_path))
+        await asyncio.wait_for(scheduler.woken.wait(), timeout=5)
+        job_ingestor.stop()
+        ingestor_task.cancel()
+
+    asyncio.run(run())
+    assert scheduler.synced == [[1]]
+    assert job_ingestor.db.jobs[0].name == 'cache'
+    assert os.listdir(tmp_path) == ['.cache.json.123.tmp']
+
+
+def test_ingest_batch_skips_bad_files(tmp_path):
+    scheduler = Scheduler()
+    job_ingestor = ingestor.Ingestor(scheduler, path=str(tmp_path))
+    job_ingestor.set_db(Database())
+    good = [os.path.basename(make_job(f'cache{i}').write(str(tmp_path))) for i in range(3)]
+    broken = os.path.basename(make_job('broken').write(str(tmp_path)))
+    (tmp_path / 'invalid.json').write_text('{"Name": "invalid"}')
+
+    job_ids = asyncio.run(job_ingestor.ingest(good + [broken, 'invalid.json', 'missing.json']))
+
+    assert job_ids == [1, 2, 3]
+    assert scheduler.synced == [[1, 2, 3]]
+    assert os.listdir(tmp_path) == [ingestor.REJECTED_FOLDER]
+    assert sorted(os.listdir(tmp_path / ingestor.REJECTED_FOLDER)) == sorted([broken, 'invalid.json'])
+
+
+def test_ingest_expands_bundles_in_one_transaction(tmp_path):
+    scheduler = Scheduler()
+    job_ingestor = ingestor.Ingestor(scheduler, path=str(tmp_path))
+    job_ingestor.set_db(Database())
+    sweep = bundle.Bundle('wedge')
+    sweep.add_range(1, 10, 1)
+    sweep.set_allocation(5)
+    sweep.set_purpose(Purpose.CACHE)
+    sweep.set_type('PLUGIN_eHoudini')
+    sweep.set_environment({'HIP': 'Z:/wedge.hip'})
+    sweep.set_sweep({'/obj/geo/seed': list(range(200))})
+    file_name = os.path.basename(sweep.write(str(tmp_path)))
+
+    job_ids = asyncio.run(job_ingestor.ingest([file_name]))
+
+    assert len(job_ids) == 200 and job_ingestor.db.transactions == 1
+    assert job_ingestor.db.jobs[199].name == 'wedge_200' and job_ingestor.db.jobs[199].get_parameters() == {'/obj/geo/seed': 199}
+    assert os.listdir(tmp_path) == []
+
+
+def test_ingest_moves_dependency_cycles_aside(tmp_path):
+    scheduler = Scheduler()
+    job_ingestor = ingestor.Ingestor(scheduler, path=str(tmp_path))
+    job_ingestor.set_db(Database())
+    cache, render, loop_a, loop_b = make_job('cache'), make_job('render'), make_job('loop_a'), make_job('loop_b')
+    render.add_dependency(cache)
+    loop_a.add_dependency(loop_b)
+    loop_b.add_dependency(loop_a)
+    good = [os.path.basename(new_job.write(str(tmp_path))) for new_job in (render, cache)]
+    cyclic = [os.path.basename(new_job.write(str(tmp_path))) for new_job in (loop_a, loop_b)]
+
+    job_ids = asyncio.run(job_ingestor.ingest(good + cyclic))
+
+    assert job_ids == [1, 2]
+    assert [new_job.name for new_job in job_ingestor.db.jobs] == ['render', 'cache']
+    assert os.listdir(tmp_path) == [ingestor.REJECTED_FOLDER]
+    assert sorted(os.listdir(tmp_path / ingestor.REJECTED_FOLDER)) == sorted(cyclic)
@@ -0,0 +1,28 @@
+from envy.lib.jobs.ready_queue import ReadyQueue
+
+
+def test_ready_queue_orders_by_priority_then_id():
+    ready = ReadyQueue()
+    for allocation_id in (30, 10, 20):
+        ready.push(allocation_id)
+    ready.push(40, priority=1)
+    assert list(ready) == [40, 10, 20, 30]
+    assert [ready.pop() for _ in range(4)] == [40, 10, 20, 30]
+    assert ready.pop() is None
+
+
+def test_ready_queue_discard_and_requeue():
+    ready = ReadyQueue()
+    for allocation_id in range(1000):
+        ready.push(allocation_id)
+    for allocation_id in range(0, 1000, 2):
+        assert ready.discard(allocation_id)
+    assert not ready.discard(0)
+    assert len(ready) == 500 and 0 not in ready
+    assert ready.peek() == 1
+
+    ready.push(0)
+    ready.push(999, priority=5)
+    assert ready.pop() == 999
+    assert ready.pop() == 0
+    assert ready.peek() == 1
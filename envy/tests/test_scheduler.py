@@ -0,0 +1,342 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('anytree')
+pytest.importorskip('PySide6.QtCore')
+pytest.importorskip('websockets')
+
+from envy.lib.core.data import Client, ClientStatus
+from envy.lib.db import async_db
+from envy.lib.jobs import dependencies, scheduler
+from envy.lib.jobs import job as j
+from envy.lib.jobs.enums import DependencyMode, Purpose, Status
+from envy.lib.jobs.fair_share import FairSharePolicy
+
+
+class FakeClient:
+    def __init__(self, name: str, keeps_frames: bool = False, answers: bool = True):
+        """
+        Works through its allocation frame by frame like the eHoudini and eMaya plugins do
+        :param keeps_frames: answers requests to give up frames with None, eg: because it runs a simulation
+        :param answers: False never answers them, eg: because its plugin is too old
+        """
+        self.name = name
+        self.keeps_frames = keeps_frames
+        self.answers = answers
+        self.scheduler = None
+        self.allocation_id = None
+        self.task_list = []
+        self.rendered = []
+
+    def start(self, allocation) -> None:
+        # like the message a client is sent, frames which are already done are left out
+        self.allocation_id = allocation.name
+        self.task_list = [task_id for task_id in range(allocation.task_base, allocation.task_base + len(allocation.frames)) if task_id not in allocation.finished_tasks]
+
+    def truncate(self, task_id: int) -> int | None:
+        # the frame being worked on and the one after it are kept
+        keep = 2
+        while keep < len(self.task_list) and self.task_list[keep] < task_id:
+            keep += 1
+        if self.keeps_frames or keep >= len(self.task_list):
+            return None
+        given_up = self.task_list[keep]
+        self.task_list = self.task_list[:keep]
+        return given_up
+
+    async def render(self, frames: int = None) -> None:
+        """
+        Finishes frames in order and reports the allocation as finished and itself as idle after the last one
+        """
+        for _ in range(len(self.task_list) if frames is None else frames):
+            self.rendered.append(self.task_list.pop(0))
+            await self.scheduler.finish_task(self.rendered[-1])
+        if not self.task_list:
+            await self.scheduler.finish_allocation(self.allocation_id)
+            self.scheduler.clients[self.name].status = ClientStatus.IDLE
+            self.scheduler.client_changed(self.name)
+
+
+class Farm:
+    def __init__(self, monkeypatch, tmp_path, clients: list[FakeClient]):
+        """
+        A scheduler on a real database whose messages to clients and consoles go to FakeClients instead of the network
+        """
+        self.clock = 0.0
+        monkeypatch.setattr(scheduler, 'time', SimpleNamespace(monotonic=lambda: self.clock))
+        for name in ('mark_allocation_as_started', 'console_sync_job', 'console_sync_jobs', 'console_report_duplicates'):
+            monkeypatch.setattr(scheduler.SRV, name, self.ignore)
+        monkeypatch.setattr(scheduler.SRV, 'send_to_client', self.send_to_client)
+        monkeypatch.setattr(scheduler.SRV, 'truncate_allocation', self.truncate_allocation)
+
+        self.clients = {client.name: client for client in clients}
+        self.server = SimpleNamespace(clients={name: Client(name, ClientStatus.IDLE) for name in self.clients}, lease_acquired=None)
+        self.database = async_db.AsyncDB(str(tmp_path / 'Envy_Database.db'))
+        self.scheduler = None
+        # (computer, allocation id, task id) of every request to give up frames
+        self.requests = []
+        self._pending = []
+        self._writer_task = None
+
+    async def __aenter__(self):
+        await self.database.start()
+        self.scheduler = scheduler.Scheduler(self.server, self.database)
+        self.scheduler.job_tree.set_db_writer(self.scheduler.db_writer)
+        self._writer_task = asyncio.create_task(self.scheduler.db_writer.start())
+        for client in self.clients.values():
+            client.scheduler = self.scheduler
+        return self
+
+    async def __aexit__(self, *exception):
+        self.scheduler.db_writer.stop()
+        await self._writer_task
+        await self.database.stop()
+
+    @staticmethod
+    async def ignore(*args) -> None:
+        pass
+
+    async def send_to_client(self, server, computer: str, message) -> None:
+        self.clients[computer].start(self.scheduler.job_tree.allocations[server.clients[computer].task_id])
+
+    async def truncate_allocation(self, server, computer: str, allocation_id: int, task_id: int) -> None:
+        self.requests.append((computer, allocation_id, task_id))
+        self._pending.append((computer, allocation_id, task_id))
+
+    async def reply(self) -> None:
+        """
+        Delivers what the clients answered to every request since the last call, see Envy_Functions.truncate_allocation
+        """
+        pending, self._pending = self._pending, []
+        for computer, allocation_id, task_id in pending:
+            client = self.clients[computer]
+            if client.answers and client.allocation_id == allocation_id:
+                await self.scheduler.allocation_truncated(allocation_id, client.truncate(task_id))
+
+    async def allocations_in_db(self, job_id: int) -> dict:
+        await self.scheduler.db_writer.flush()
+        _, allocations = await self.database.get_job_tree(job_id)
+        return {allocation.id: (allocation.status, allocation.frames, allocation.task_base) for allocation, _ in allocations}
+
+    def allocations_in_tree(self, job_id: int) -> dict:
+        return {allocation.name: (allocation.status, allocation.frames.encode(), allocation.task_base) for allocation in self.scheduler.job_tree.jobs[job_id].children}
+
+    async def frames_done(self, job_id: int) -> int:
+        await self.scheduler.db_writer.flush()
+        counts = await self.database.count_frames(job_id)
+        return sum(allocation_counts.get(Status.DONE.value, 0) for allocation_counts in counts.values())
+
+
+def make_job(name: str, start: int, end: int, allocation: int) -> j.Job:
+    new_job = j.Job(name)
+    new_job.add_range(start, end, 1)
+    new_job.set_allocation(allocation)
+    new_job.set_purpose(Purpose.RENDER)
+    new_job.set_type('PLUGIN_eHoudini')
+    return new_job
+
+
+def test_idle_clients_take_over_the_end_of_running_allocations(tmp_path, monkeypatch):
+    async def run():
+        async with Farm(monkeypatch, tmp_path, [FakeClient('c0'), FakeClient('c1')]) as farm:
+            [job_id] = await farm.scheduler.submit_jobs([make_job('render', 1, 20, 20)])
+            await farm.scheduler.dispatch()
+            c0, c1 = farm.clients['c0'], farm.clients['c1']
+            running = c0.allocation_id
+            task_base = c0.task_list[0]
+            # nothing is pending so the idle client gets half of what c0 has not started, minus the two frames c0 keeps
+            assert farm.requests == [('c0', running, task_base + 11)]
+            await c0.render(frames=3)
+
+            await farm.reply()
+            assert c0.task_list == list(range(task_base + 3, task_base + 11))
+            tree = farm.allocations_in_tree(job_id)
+            stolen = next(allocation_id for allocation_id in tree if allocation_id != running)
+            assert tree == {running: (Status.INPROGRESS, '1-11:1', task_base), stolen: (Status.PENDING, '12-20:1', task_base + 11)}
+            assert await farm.allocations_in_db(job_id) == tree
+            assert farm.scheduler.job_tree.pick_allocation().name == stolen
+
+            await farm.scheduler.dispatch()
+            assert c1.allocation_id == stolen and c1.task_list == list(range(task_base + 11, task_base + 20))
+            # the frames the split allocation kept finish it rather than fail it
+            await c0.render()
+            assert running not in farm.scheduler.job_tree.allocations
+            assert (await farm.allocations_in_db(job_id))[running][0] == Status.DONE
+            await c1.render()
+            assert await farm.frames_done(job_id) == 20
+            assert await farm.database.get_job_value(job_id, 'Status') == Status.DONE
+            # a finished allocation is never asked for frames again
+            await farm.scheduler.dispatch()
+            assert len(farm.requests) == 1
+
+    asyncio.run(run())
+
+
+def test_frames_which_already_started_are_not_split_off(tmp_path, monkeypatch):
+    async def run():
+        async with Farm(monkeypatch, tmp_path, [FakeClient('c0'), FakeClient('c1')]) as farm:
+            [job_id] = await farm.scheduler.submit_jobs([make_job('render', 1, 20, 20)])
+            await farm.scheduler.dispatch()
+            c0, c1 = farm.clients['c0'], farm.clients['c1']
+            running = c0.allocation_id
+            task_base = c0.task_list[0]
+            await c0.render(frames=3)
+
+            # a client which gave up frames from task 11 on but had already started task 12, which it keeps rendering
+            await farm.scheduler.start_task(task_base + 12, 'c0')
+            c0.task_list = [*range(task_base + 3, task_base + 11), task_base + 12]
+            assert await farm.scheduler.allocation_truncated(running, task_base + 11)
+            tree = farm.allocations_in_tree(job_id)
+            stolen = next(allocation_id for allocation_id in tree if allocation_id != running)
+            assert tree == {running: (Status.INPROGRESS, '1-13:1', task_base), stolen: (Status.PENDING, '14-20:1', task_base + 13)}
+            assert await farm.allocations_in_db(job_id) == tree
+
+            await farm.scheduler.dispatch()
+            assert c1.allocation_id == stolen
+            await c1.render()
+            # frame 12 was given up but stayed with the allocation, it runs again on its own instead of being marked done
+            await c0.render()
+            assert farm.allocations_in_tree(job_id) == {running: (Status.PENDING, '1-13:1', task_base)}
+            await farm.scheduler.dispatch()
+            assert c0.task_list == [task_base + 11] or c1.task_list == [task_base + 11]
+            await c0.render()
+            await c1.render()
+            assert sorted(c0.rendered + c1.rendered) == list(range(task_base, task_base + 20))
+            assert await farm.frames_done(job_id) == 20
+            assert await farm.database.get_job_value(job_id, 'Status') == Status.DONE
+
+    asyncio.run(run())
+
+
+def test_frames_given_up_are_queued_again_when_the_split_fails(tmp_path, monkeypatch):
+    async def run():
+        async with Farm(monkeypatch, tmp_path, [FakeClient('c0'), FakeClient('c1')]) as farm:
+            [job_id] = await farm.scheduler.submit_jobs([make_job('render', 1, 20, 20)])
+            await farm.scheduler.dispatch()
+            c0, c1 = farm.clients['c0'], farm.clients['c1']
+            task_base = c0.task_list[0]
+
+            async def fail(allocation_id: int, index: int) -> None:
+                return None
+
+            monkeypatch.setattr(farm.scheduler.db_writer, 'split_allocation', fail)
+            await farm.reply()
+            assert c0.task_list[-1] == task_base + 10
+            await c0.render()
+            await farm.scheduler.dispatch()
+            await c0.render()
+            await c1.render()
+            assert sorted(c0.rendered + c1.rendered) == list(range(task_base, task_base + 20))
+            assert await farm.frames_done(job_id) == 20
+            assert await farm.database.get_job_value(job_id, 'Status') == Status.DONE
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize('client', [{'keeps_frames': True}, {'answers': False}], ids=['keeps frames', 'no answer'])
+def test_allocations_stay_whole_unless_their_client_gives_frames_up(tmp_path, monkeypatch, client):
+    async def run():
+        async with Farm(monkeypatch, tmp_path, [FakeClient('c0', **client), FakeClient('c1')]) as farm:
+            [job_id] = await farm.scheduler.submit_jobs([make_job('render', 1, 20, 20)])
+            await farm.scheduler.dispatch()
+            running = farm.clients['c0'].allocation_id
+            tree = farm.allocations_in_tree(job_id)
+            await farm.reply()
+
+            assert farm.allocations_in_tree(job_id) == tree == await farm.allocations_in_db(job_id)
+            assert farm.scheduler.job_tree.pick_allocation() is None
+            # the client is not asked again until it had time to answer
+            farm.clock += scheduler.STEAL_TIMEOUT
+            await farm.scheduler.dispatch()
+            assert len(farm.requests) == 1
+            farm.clock += 1
+            await farm.scheduler.dispatch()
+            assert [request[1] for request in farm.requests] == [running, running]
+
+            await farm.clients['c0'].render()
+            assert await farm.frames_done(job_id) == 20
+            assert (await farm.allocations_in_db(job_id))[running][0] == Status.DONE
+
+    asyncio.run(run())
+
+
+def test_rechunk_replaces_pending_allocations_in_tree_and_database(tmp_path, monkeypatch):
+    async def run():
+        async with Farm(monkeypatch, tmp_path, [FakeClient('c0')]) as farm:
+            [job_id] = await farm.scheduler.submit_jobs([make_job('render', 1, 40, 10)])
+            await farm.scheduler.dispatch()
+            c0 = farm.clients['c0']
+            running = c0.allocation_id
+            pending = [allocation_id for allocation_id in farm.allocations_in_tree(job_id) if allocation_id != running]
+
+            # 150s to start and 50s per frame fills 15 minutes with 15 frames
+            farm.scheduler.costs.observe((job_id,), 150.0, 50.0)
+            assert await farm.scheduler.rechunk_job(job_id)
+            tree = farm.allocations_in_tree(job_id)
+            rebuilt = [allocation_id for allocation_id in tree if allocation_id != running]
+            assert not set(rebuilt) & set(pending)
+            assert [tree[allocation_id][1:] for allocation_id in rebuilt] == [('11-25:1', c0.task_list[-1] + 1), ('26-40:1', c0.task_list[-1] + 16)]
+            assert await farm.allocations_in_db(job_id) == tree
+            # the plan is met so a second measurement changes nothing
+            assert not await farm.scheduler.rechunk_job(job_id)
+
+            await c0.render()
+            await farm.scheduler.dispatch()
+            assert c0.allocation_id == rebuilt[0] and len(c0.task_list) == 15
+            await c0.render()
+            await farm.scheduler.dispatch()
+            await c0.render()
+            assert await farm.frames_done(job_id) == 40
+
+    asyncio.run(run())
+
+
+def test_frames_release_the_allocations_depending_on_them(tmp_path, monkeypatch):
+    async def run():
+        async with Farm(monkeypatch, tmp_path, [FakeClient('c0')]) as farm:
+            job_tree = farm.scheduler.job_tree
+            assert isinstance(job_tree.ready, FairSharePolicy)
+            cache, render, comp = make_job('cache', 1, 8, 4), make_job('render', 1, 8, 2), make_job('comp', 1, 8, 8)
+            dependencies.chain([cache, render], mode=DependencyMode.FRAME)
+            dependencies.chain([render, comp])
+            await farm.scheduler.submit_jobs([cache, render, comp])
+            # every render allocation waits for its frames of the cache, the comp waits for the whole render
+            assert len(job_tree.frame_dependencies) == 4
+            assert job_tree.dependencies.is_waiting(comp.get_id())
+
+            await farm.scheduler.dispatch()
+            c0 = farm.clients['c0']
+            task_base = c0.task_list[0]
+            assert job_tree.allocations[c0.allocation_id].parent.name == cache.get_id()
+
+            # a frame of a compact allocation only gets a node once it changes state
+            assert task_base + 1 not in job_tree.tasks
+            task_node = job_tree.materialize_task(task_base + 1)
+            assert (task_node.frame, task_node.status) == (2, Status.PENDING) and job_tree.tasks[task_base + 1] is task_node
+            assert job_tree.materialize_task(task_base + 4) is not None and job_tree.materialize_task(task_base + 1000) is None
+
+            await c0.render(frames=2)
+            assert job_tree.materialize_task(task_base) is None
+            await farm.scheduler.db_writer.flush()
+            assert await farm.database.get_task_value(task_base + 1, 'Status') == Status.DONE
+            # frames 1 and 2 of the cache are all the first render allocation needs
+            assert len(job_tree.frame_dependencies) == 3
+            released = job_tree.pick_allocation()
+            assert released.parent.name == render.get_id() and released.frames.encode() == '1-2:1'
+
+            # the rest of the render allocations may be rebuilt from what the cache measured, so their number is not known here
+            for _ in range(10):
+                await c0.render()
+                await farm.scheduler.dispatch()
+                if job_tree.allocations[c0.allocation_id].parent.name == comp.get_id():
+                    break
+            await farm.scheduler.db_writer.flush()
+            assert await farm.database.get_job_value(render.get_id(), 'Status') == Status.DONE
+            assert job_tree.allocations[c0.allocation_id].parent.name == comp.get_id()
+            await c0.render()
+            assert [await farm.frames_done(new_job.get_id()) for new_job in (cache, render, comp)] == [8, 8, 8]
+            assert job_tree.number_of_jobs == 0
+
+    asyncio.run(run())
@@ -0,0 +1,43 @@
+import getpass
+import os
+import sqlite3
+
+import pytest
+
+from envy.lib.jobs import submit
+from envy.lib.jobs import job as j
+from envy.lib.jobs.enums import Purpose
+
+
+@pytest.fixture(autouse=True)
+def login(monkeypatch):
+    monkeypatch.setattr(os, 'getlogin', getpass.getuser, raising=False)
+
+
+def make_job(name: str) -> j.Job:
+    new_job = j.Job(name)
+    new_job.add_range(1, 10, 1)
+    new_job.set_allocation(5)
+    new_job.set_purpose(Purpose.RENDER)
+    new_job.set_type('PLUGIN_eMaya')
+    return new_job
+
+
+@pytest.mark.parametrize('error', [sqlite3.OperationalError('database is locked'), PermissionError('share is offline')])
+def test_jobs_are_written_when_the_server_cannot_be_looked_up(monkeypatch, error):
+    def get_server_ip():
+        raise error
+
+    monkeypatch.setattr(submit, 'get_server_ip', get_server_ip)
+    jobs = [make_job('render'), make_job('comp')]
+    written = []
+    for new_job in jobs:
+        monkeypatch.setattr(new_job, 'write', lambda new_job=new_job: written.append(new_job.name))
+
+    assert submit.submit_jobs(jobs) is None
+    assert written == ['render', 'comp']
+
+
+def test_large_batches_wait_longer_for_the_reply():
+    assert submit.reply_timeout([make_job('render')]) >= submit.TIMEOUT
+    assert submit.reply_timeout([make_job('render')] * 2000) > submit.reply_timeout([make_job('render')] * 10)